@@ -0,0 +1,106 @@
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+import pyarrow as pa
+
+DEFAULT_METRICS = ["answer_relevancy", "faithfulness", "context_recall", "context_precision"]
+
+
+def create_results(rows: int, metric_names: List[str], categories: int, applications: int, nan_rate: float,
+                   seed: int = 0) -> pa.Table:
+    """Results like read_results returns them, beta distributed scores with a share of failed, NaN, evaluations."""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for metric_name in metric_names:
+        scores = rng.beta(5, 2, rows)
+        scores[rng.random(rows) < nan_rate] = np.nan
+        columns[metric_name] = pa.array(scores, from_pandas=True)
+    category_names = pa.array([f"category{i}" for i in range(categories)])
+    columns["category"] = pa.DictionaryArray.from_arrays(rng.integers(0, categories, rows, dtype=np.int32),
+                                                         category_names)
+    application_ids = pa.array([f"application{i}" for i in range(applications)])
+    columns["application_id"] = pa.DictionaryArray.from_arrays(rng.integers(0, applications, rows, dtype=np.int32),
+                                                               application_ids)
+    return pa.table(columns)
+
+
+def summarize_with_row_loops(results: pa.Table, metric_names: List[str]) -> Dict:
+    """Per row grouping of the records, as the handler aggregates, with numpy only for the per group statistics."""
+    summaries = {}
+    categories = results.column("category").to_pylist()
+    for metric_name in metric_names:
+        groups = {}
+        for category, score in zip(categories, results.column(metric_name).to_pylist()):
+            groups.setdefault(category, []).append(np.nan if score is None else score)
+        summaries[metric_name] = {}
+        for category, scores in groups.items():
+            scores = np.array(scores)
+            valid_scores = scores[~np.isnan(scores)]
+            summaries[metric_name][category] = {"mean": float(valid_scores.mean()),
+                                                "p50": float(np.percentile(valid_scores, 50)),
+                                                "nan_rate": float(1 - len(valid_scores) / len(scores))}
+    return summaries
+
+
+def time_call(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_benchmark(rows: int, metric_names: List[str], categories: int, applications: int, bootstrap_samples: int,
+                  repeat: int = 3, include_row_loops: bool = True) -> Dict:
+    from utils.score_aggregation import summarize_results
+
+    results = create_results(rows, metric_names, categories, applications, nan_rate=0.03)
+    timings = {
+        "vectorized_seconds": time_call(lambda: summarize_results(results, metric_names,
+                                                                  bootstrap_samples=bootstrap_samples), repeat),
+        "vectorized_without_bootstrap_seconds": time_call(lambda: summarize_results(results, metric_names,
+                                                                                    bootstrap_samples=0), repeat)}
+    if include_row_loops:
+        timings["row_loops_without_bootstrap_seconds"] = time_call(
+            lambda: summarize_with_row_loops(results, metric_names), 1)
+    summaries = summarize_results(results, metric_names, bootstrap_samples=bootstrap_samples)
+    interval_widths = [summary["ci_high"] - summary["ci_low"] for metric_summaries in summaries.values()
+                       for summary in metric_summaries["by_category"].values()]
+    return {"rows": rows,
+            "metrics": len(metric_names),
+            "categories": categories,
+            "applications": applications,
+            "bootstrap_samples": bootstrap_samples,
+            **{name: round(seconds, 4) for name, seconds in timings.items()},
+            "mean_category_interval_width": round(float(np.mean(interval_widths)), 5)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time of the per category and application score summaries,"
+                                                 + " percentiles and bootstrap intervals, of synthetic results")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--metrics", nargs="+", default=DEFAULT_METRICS)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--applications", type=int, default=2)
+    parser.add_argument("--bootstrap-samples", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-row-loops", action="store_true", help="Do not time the per row baseline")
+    parser.add_argument("--output", default="aggregation_benchmark.json")
+    args = parser.parse_args()
+
+    benchmark_results = []
+    print(f"{'rows':>10} {'vectorized (s)':>15} {'no bootstrap (s)':>17} {'row loops (s)':>14}")
+    for rows_count in args.rows:
+        result = run_benchmark(rows_count, args.metrics, args.categories, args.applications, args.bootstrap_samples,
+                               args.repeat, not args.skip_row_loops)
+        benchmark_results.append(result)
+        print(f"{rows_count:>10} {result['vectorized_seconds']:>15.3f}"
+              + f" {result['vectorized_without_bootstrap_seconds']:>17.3f}"
+              + f" {result.get('row_loops_without_bootstrap_seconds', float('nan')):>14.3f}")
+    with open(args.output, "w") as output_file:
+        json.dump(benchmark_results, output_file, indent=2)
+    print(f"Results written to {args.output}")
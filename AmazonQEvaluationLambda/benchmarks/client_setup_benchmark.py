@@ -0,0 +1,54 @@
+import argparse
+import statistics
+import time
+
+from adapters.qbusiness_adapter import QbusinessAdapter
+from adapters.secret_manager_adapter import SecretManagerAdapter
+from adapters.ssooidc_adapter import SSOOIDCAdapter
+from adapters.sts_adapter import StsAdapter
+from utils.authentication_utils import AuthenticationUtils
+from utils.client_registry import client_registry
+
+from .qbusiness_fetch_benchmark import STUB_CREDENTIALS
+
+REGION = "us-east-1"
+
+
+def set_up_handler_clients():
+    # the same clients the lambda handler builds on every invocation
+    SecretManagerAdapter(REGION)
+    AuthenticationUtils(REGION, "111111111111", "userpoolid", "clientid", "identitypoolid")
+    SSOOIDCAdapter(REGION)
+    StsAdapter(REGION)
+    QbusinessAdapter(REGION, STUB_CREDENTIALS)
+    client_registry.get_client("bedrock-runtime", REGION)
+
+
+def time_invocations(invocations: int, use_pool: bool):
+    durations = []
+    for _ in range(invocations):
+        if not use_pool:
+            client_registry.clear()
+        start = time.perf_counter()
+        set_up_handler_clients()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def run_benchmark(invocations: int):
+    # warm up botocore's loaders so both runs pay the same one time service model cost
+    time_invocations(1, use_pool=False)
+    print(f"handler client setup over {invocations} invocations")
+    print(f"{'client pool':>12} {'first (ms)':>11} {'p50 (ms)':>9} {'mean (ms)':>10}")
+    for use_pool in (False, True):
+        client_registry.clear()
+        durations = time_invocations(invocations, use_pool)
+        print(f"{'enabled' if use_pool else 'disabled':>12} {durations[0]:>11.2f}"
+              + f" {statistics.median(durations):>9.2f} {statistics.mean(durations):>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Handler client setup time with and without the client pool")
+    parser.add_argument("--invocations", type=int, default=20)
+    args = parser.parse_args()
+    run_benchmark(args.invocations)
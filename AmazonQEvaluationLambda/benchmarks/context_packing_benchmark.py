@@ -0,0 +1,151 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+from typing import Dict, List, Optional
+from unittest.mock import patch
+
+from .fake_aws import FakeAws, FakeServiceProfile
+
+os.environ.setdefault("AWS_EMF_ENVIRONMENT", "local")
+
+DEFAULT_METRICS = ["faithfulness", "context_precision", "context_recall"]
+VOCABULARY = ["amazon", "business", "data", "index", "document", "answer", "user", "access", "source", "policy",
+              "retrieval", "connector", "application", "question", "content", "permission", "search", "plugin"]
+
+
+def create_records(questions_count: int, snippets_count: int, snippet_chars: int, duplicate_rate: float,
+                   seed: int = 0) -> List[Dict]:
+    """Answer records whose snippets repeat, as is or cut a few words short, like overlapping Q source attributions."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(questions_count):
+        snippets = []
+        for _ in range(snippets_count):
+            if snippets and rng.random() < duplicate_rate:
+                words = rng.choice(snippets).split(" ")
+                snippets.append(" ".join(words[:len(words) - rng.randrange(3)]))
+            else:
+                words = []
+                while sum(len(word) + 1 for word in words) < snippet_chars:
+                    words.append(rng.choice(VOCABULARY))
+                snippets.append(" ".join(words))
+        records.append({"question": f"benchmark question {i}",
+                        "ground_truth": f"benchmark ground truth {i}",
+                        "answer": f"benchmark answer {i}",
+                        "contexts": snippets})
+    return records
+
+
+def score_records(records: List[Dict], metric_names: List[str], region: str, bedrock_embedding_model_id: str,
+                  bedrock_text_model_id: str, context_packer=None, fake_aws: Optional[FakeAws] = None) -> Dict:
+    # imported here so the fakes are in place before the first client is created
+    from utils.client_registry import client_registry
+    from utils.dataset_utils import create_evaluation_dataset
+    from utils.metric_factory import create_metrics
+    from utils.ragas_utils import RagasUtils
+    from utils.token_accounting import TokenAccountant
+
+    token_accountant = TokenAccountant()
+    ragas_utils = RagasUtils(region, bedrock_embedding_model_id, bedrock_text_model_id,
+                             token_accountant=token_accountant, context_packer=context_packer)
+    evaluation_dataset = create_evaluation_dataset(questions=[record["question"] for record in records],
+                                                   ground_truth=[record["ground_truth"] for record in records],
+                                                   answers=[record["answer"] for record in records],
+                                                   contexts=[record["contexts"] for record in records])
+    with contextlib.ExitStack() as stack:
+        if fake_aws is not None:
+            stack.enter_context(patch("utils.client_registry.boto3.client", fake_aws.client))
+            stack.enter_context(contextlib.redirect_stderr(io.StringIO()))
+            client_registry.clear()
+        metrics = create_metrics(metric_names, ragas_utils.get_judge_llm(), ragas_utils.get_embeddings())
+        results = ragas_utils.evaluate_dataset(evaluation_dataset, metrics)
+        if fake_aws is not None:
+            client_registry.clear()
+    # the fakes do not go through the botocore token hooks, they count the prompt tokens themselves
+    if fake_aws is not None:
+        judge_input_tokens = fake_aws.recorder.input_tokens["bedrock-runtime.invoke_model.chat"]
+    else:
+        judge_input_tokens = token_accountant.get_summary()["by_model"].get(bedrock_text_model_id, {}).get(
+            "input_tokens", 0)
+    return {"scores": {name: list(results.scores[name]) for name in metric_names},
+            "judge_input_tokens": judge_input_tokens}
+
+
+def compare_scores(raw_scores: Dict[str, List[float]], packed_scores: Dict[str, List[float]]) -> Dict:
+    comparison = {}
+    for name, raw in raw_scores.items():
+        pairs = [(r, p) for r, p in zip(raw, packed_scores[name]) if not math.isnan(r) and not math.isnan(p)]
+        differences = [abs(r - p) for r, p in pairs]
+        comparison[name] = {"raw_mean": round(sum(r for r, _ in pairs) / len(pairs), 4) if pairs else None,
+                            "packed_mean": round(sum(p for _, p in pairs) / len(pairs), 4) if pairs else None,
+                            "mean_abs_difference": round(sum(differences) / len(differences), 4) if pairs else None,
+                            "max_abs_difference": round(max(differences), 4) if pairs else None}
+    return comparison
+
+
+def run_benchmark(records: List[Dict], metric_names: List[str], similarity_threshold: float, token_budget: int,
+                  region: str, bedrock_embedding_model_id: str, bedrock_text_model_id: str,
+                  fake_aws_settings: Optional[Dict] = None) -> Dict:
+    from utils.context_packing import ContextPacker
+
+    def create_fake_aws():
+        if fake_aws_settings is None:
+            return None
+        return FakeAws(FakeServiceProfile(), FakeServiceProfile(), FakeServiceProfile(), **fake_aws_settings)
+
+    models = (region, bedrock_embedding_model_id, bedrock_text_model_id)
+    raw = score_records(records, metric_names, *models, fake_aws=create_fake_aws())
+    context_packer = ContextPacker(similarity_threshold, token_budget)
+    packed = score_records(records, metric_names, *models, context_packer=context_packer, fake_aws=create_fake_aws())
+    tokens_saved = raw["judge_input_tokens"] - packed["judge_input_tokens"]
+    return {"questions": len(records),
+            "similarity_threshold": similarity_threshold,
+            "token_budget": token_budget,
+            "context_packing": context_packer.get_stats(),
+            "raw_judge_input_tokens": raw["judge_input_tokens"],
+            "packed_judge_input_tokens": packed["judge_input_tokens"],
+            "judge_input_tokens_saved_percent": round(100 * tokens_saved / max(1, raw["judge_input_tokens"]), 1),
+            "scores": compare_scores(raw["scores"], packed["scores"])}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Judge tokens saved by the context packing and the difference it makes"
+                                                 + " to the ragas scores, on an answers artifact or synthetic answers")
+    parser.add_argument("--artifact", help="Answers artifact of a retrieve phase, scored with the real Bedrock models")
+    parser.add_argument("--questions", type=int, default=20, help="Synthetic questions scored against fake Bedrock")
+    parser.add_argument("--snippets", type=int, default=6, help="Snippets per synthetic question")
+    parser.add_argument("--snippet-chars", type=int, default=300)
+    parser.add_argument("--duplicate-rate", type=float, default=0.5,
+                        help="Fraction of the synthetic snippets that repeat an earlier one")
+    parser.add_argument("--metrics", nargs="+", default=DEFAULT_METRICS)
+    parser.add_argument("--similarity-threshold", type=float, default=0.9)
+    parser.add_argument("--token-budget", type=int, default=0)
+    parser.add_argument("--region", default=os.environ.get("Region", "us-east-1"))
+    parser.add_argument("--bedrock-embedding-model-id", default="amazon.titan-embed-text-v1")
+    parser.add_argument("--bedrock-text-model-id", default="anthropic.claude-3-haiku-20240307-v1:0")
+    parser.add_argument("--output", default="context_packing_benchmark.json")
+    args = parser.parse_args()
+
+    if args.artifact:
+        from utils.answers_artifact import read_answers_artifact
+        benchmark_records, fake_settings = read_answers_artifact(args.artifact, args.region), None
+    else:
+        benchmark_records = create_records(args.questions, args.snippets, args.snippet_chars, args.duplicate_rate)
+        fake_settings = {"embedding_dimension": 64}
+    benchmark_results = run_benchmark(benchmark_records, args.metrics, args.similarity_threshold, args.token_budget,
+                                      args.region, args.bedrock_embedding_model_id, args.bedrock_text_model_id,
+                                      fake_settings)
+    print(f"judge input tokens {benchmark_results['raw_judge_input_tokens']} raw,"
+          + f" {benchmark_results['packed_judge_input_tokens']} packed,"
+          + f" {benchmark_results['judge_input_tokens_saved_percent']}% saved")
+    print(f"{'metric':>20} {'raw mean':>9} {'packed mean':>12} {'mean |diff|':>12} {'max |diff|':>11}")
+    for metric_name, comparison in benchmark_results["scores"].items():
+        print(f"{metric_name:>20} {comparison['raw_mean']!s:>9} {comparison['packed_mean']!s:>12}"
+              + f" {comparison['mean_abs_difference']!s:>12} {comparison['max_abs_difference']!s:>11}")
+    with open(args.output, "w") as output_file:
+        json.dump(benchmark_results, output_file, indent=2)
+    print(f"Results written to {args.output}")
@@ -0,0 +1,174 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from typing import Dict, List
+from unittest.mock import patch
+
+import numpy as np
+
+from .fake_aws import FakeAws, FakeServiceProfile
+
+os.environ.setdefault("AWS_EMF_ENVIRONMENT", "local")
+
+# Environment of the handler under benchmark, the values only have to be consistent with the fakes
+HANDLER_SETTINGS = {"REGION": "us-east-1",
+                    "ACCOUNT_ID": "111111111111",
+                    "APPLICATION_ID": "benchmark-application",
+                    "USER_POOL_ID": "benchmark-user-pool",
+                    "CLIENT_ID": "benchmark-client",
+                    "IDENTITY_POOL_ID": "benchmark-identity-pool",
+                    "Q_APP_ROLE_ARN": "arn:aws:iam::111111111111:role/benchmark",
+                    "USER_EMAIL": "benchmark@example.com",
+                    "USER_SECRET_ID": "benchmark-secret",
+                    "BEDROCK_EMBEDDING_MODEL_ID": "amazon.titan-embed-text-v1",
+                    "BEDROCK_TEXT_MODEL_ID": "anthropic.claude-3-haiku-20240307-v1:0"}
+
+# The fake operations each stage waits on
+STAGE_SERVICES = {"authenticate": ("secretsmanager", "cognito-idp", "cognito-identity", "sso-oidc", "sts"),
+                  "retrieve": ("qbusiness",),
+                  "score": ("bedrock-runtime",)}
+
+
+def create_testset(size: int) -> List[Dict]:
+    return [{"question": f"benchmark question {i}", "ground_truth": f"benchmark ground truth {i}"}
+            for i in range(size)]
+
+
+def summarize_latencies(latencies_millis: List[float]) -> Dict:
+    p50, p95, p99 = np.percentile(latencies_millis, [50, 95, 99])
+    return {"count": len(latencies_millis),
+            "p50_ms": round(float(p50), 2),
+            "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2)}
+
+
+def summarize_stage(stage: str, wall_seconds: float, questions: int, fake_aws: FakeAws) -> Dict:
+    calls = {}
+    for operation, latencies_millis in sorted(fake_aws.recorder.latencies_millis.items()):
+        if operation.split(".")[0] in STAGE_SERVICES[stage]:
+            calls[operation] = {**summarize_latencies(latencies_millis),
+                                "throttled": fake_aws.recorder.throttles[operation]}
+    return {"wall_seconds": round(wall_seconds, 3),
+            "questions_per_second": round(questions / wall_seconds, 2) if questions else None,
+            "calls": calls}
+
+
+def get_mean_scores(results_json: str) -> Dict[str, float]:
+    records = json.loads(results_json)
+    metric_names = [name for name in records[0] if name not in ("question", "answer", "contexts", "ground_truth")]
+    mean_scores = {}
+    for name in metric_names:
+        scores = [record[name] for record in records if record[name] is not None and not math.isnan(record[name])]
+        mean_scores[name] = round(sum(scores) / len(scores), 4) if scores else None
+    return mean_scores
+
+
+def run_testset_size(testset_size: int, fake_aws_settings: Dict, handler_settings: Dict) -> Dict:
+    # imported here so a spawned worker starts from a fresh interpreter
+    from handlers import q_evaluation_lambda_handler as handler
+    from utils.client_registry import client_registry
+
+    fake_aws = FakeAws(q_profile=FakeServiceProfile(**fake_aws_settings["q"]),
+                       bedrock_profile=FakeServiceProfile(**fake_aws_settings["bedrock"]),
+                       auth_profile=FakeServiceProfile(**fake_aws_settings["auth"]),
+                       **fake_aws_settings["responses"])
+    testset = create_testset(testset_size)
+    stages = {}
+    with tempfile.TemporaryDirectory() as work_dir, \
+            patch("utils.client_registry.boto3.client", fake_aws.client), \
+            patch.multiple(handler,
+                           EMBEDDINGS_CACHE_LOCATION=os.path.join(work_dir, "embeddings.sqlite3")
+                           if handler_settings["caches"] else "",
+                           LLM_CACHE_LOCATION=os.path.join(work_dir, "llm.sqlite3") if handler_settings["caches"] else "",
+                           ANSWERS_ARTIFACT_LOCATION=work_dir,
+                           Q_FETCH_MAX_IN_FLIGHT=handler_settings["q_max_in_flight"],
+                           Q_FETCH_MAX_QPS=handler_settings["q_max_qps"],
+                           **HANDLER_SETTINGS), \
+            contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        client_registry.clear()
+        handler.CREDENTIALS_CACHE.clear()
+
+        start = time.perf_counter()
+        handler.get_q_app_credentials()
+        stages["authenticate"] = summarize_stage("authenticate", time.perf_counter() - start, 0, fake_aws)
+
+        start = time.perf_counter()
+        retrieve_result = handler.lambda_handler({"phase": "retrieve", "testset": testset}, None)
+        stages["retrieve"] = summarize_stage("retrieve", time.perf_counter() - start, testset_size, fake_aws)
+
+        start = time.perf_counter()
+        score_result = handler.lambda_handler({"phase": "score",
+                                               "artifact_location": retrieve_result["artifact_location"]}, None)
+        stages["score"] = summarize_stage("score", time.perf_counter() - start,
+                                          retrieve_result["answered_questions"], fake_aws)
+        client_registry.clear()
+
+    total_seconds = sum(stage["wall_seconds"] for stage in stages.values())
+    return {"testset_size": testset_size,
+            "answered_questions": retrieve_result["answered_questions"],
+            "failed_questions": len(retrieve_result["failed_questions"]),
+            "questions_per_second": round(testset_size / total_seconds, 2),
+            "total_seconds": round(total_seconds, 3),
+            # ru_maxrss is in kilobytes on linux, each testset size runs in its own process
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "mean_scores": get_mean_scores(score_result["results"]),
+            "stages": stages}
+
+
+def run_benchmark(testset_sizes: List[int], fake_aws_settings: Dict, handler_settings: Dict) -> Dict:
+    runs = []
+    print(f"{'testset':>8} {'questions/s':>12} {'retrieve (s)':>13} {'score (s)':>10} {'peak rss (MB)':>14}")
+    for testset_size in testset_sizes:
+        # a fresh process per size so the peak memory is that of the size alone
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            run = pool.apply(run_testset_size, (testset_size, fake_aws_settings, handler_settings))
+        print(f"{testset_size:>8} {run['questions_per_second']:>12.2f} {run['stages']['retrieve']['wall_seconds']:>13.2f}"
+              + f" {run['stages']['score']['wall_seconds']:>10.2f} {run['peak_rss_mb']:>14.1f}")
+        runs.append(run)
+    return {"created_at": time.time(),
+            "fake_aws": fake_aws_settings,
+            "handler": handler_settings,
+            "runs": runs}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput of the evaluation lambda handler against latency"
+                                                 + " injecting fakes of Q Business, Bedrock and the auth services")
+    parser.add_argument("--testset-sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--q-latency-ms", type=float, default=200)
+    parser.add_argument("--q-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--bedrock-latency-ms", type=float, default=20)
+    parser.add_argument("--bedrock-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--auth-latency-ms", type=float, default=50)
+    parser.add_argument("--answer-chars", type=int, default=400)
+    parser.add_argument("--snippets", type=int, default=3, help="Source attributions per Q answer")
+    parser.add_argument("--snippet-chars", type=int, default=300)
+    parser.add_argument("--embedding-dimension", type=int, default=1536)
+    parser.add_argument("--q-max-in-flight", type=int, default=16)
+    parser.add_argument("--q-max-qps", type=float, default=0, help="0 disables the QPS limit")
+    parser.add_argument("--disable-caches", action="store_true", help="Run without the embeddings and llm caches")
+    parser.add_argument("--output", default="end_to_end_benchmark.json")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmark(
+        args.testset_sizes,
+        {"q": {"latency_ms": args.q_latency_ms, "throttle_rate": args.q_throttle_rate},
+         "bedrock": {"latency_ms": args.bedrock_latency_ms, "throttle_rate": args.bedrock_throttle_rate},
+         "auth": {"latency_ms": args.auth_latency_ms},
+         "responses": {"answer_chars": args.answer_chars,
+                       "snippets_count": args.snippets,
+                       "snippet_chars": args.snippet_chars,
+                       "embedding_dimension": args.embedding_dimension}},
+        {"q_max_in_flight": args.q_max_in_flight,
+         "q_max_qps": args.q_max_qps,
+         "caches": not args.disable_caches})
+    with open(args.output, "w") as output_file:
+        json.dump(benchmark_results, output_file, indent=2)
+    print(f"Results written to {args.output}")
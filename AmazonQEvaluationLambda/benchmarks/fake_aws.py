@@ -0,0 +1,215 @@
+import io
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+import jwt
+from botocore.exceptions import ClientError
+
+
+@dataclass
+class FakeServiceProfile:
+    # mean injected latency, every call waits between half and one and a half times as long
+    latency_ms: float = 0.0
+    # fraction of the calls that fail with a ThrottlingException after waiting
+    throttle_rate: float = 0.0
+
+
+class CallRecorder:
+    """Latency of every fake call by operation, as seen by the caller, and the input tokens of the Bedrock calls."""
+
+    def __init__(self):
+        self.latencies_millis: Dict[str, List[float]] = defaultdict(list)
+        self.throttles: Dict[str, int] = defaultdict(int)
+        self.input_tokens: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record_input_tokens(self, operation: str, input_tokens: int):
+        with self._lock:
+            self.input_tokens[operation] += input_tokens
+
+    def record(self, operation: str, millis: float, throttled: bool):
+        with self._lock:
+            self.latencies_millis[operation].append(millis)
+            if throttled:
+                self.throttles[operation] += 1
+
+
+class FakeClient:
+    def __init__(self, service_name: str, profile: FakeServiceProfile, recorder: CallRecorder, rng: random.Random):
+        self.service_name = service_name
+        self.profile = profile
+        self.recorder = recorder
+        self._rng = rng
+        self._rng_lock = threading.Lock()
+
+    def _call(self, operation: str, respond):
+        start = time.perf_counter()
+        with self._rng_lock:
+            latency_seconds = self.profile.latency_ms / 1000 * self._rng.uniform(0.5, 1.5)
+            throttled = self._rng.random() < self.profile.throttle_rate
+        # Event.wait releases the GIL like a socket read, unlike a busy loop
+        threading.Event().wait(latency_seconds)
+        self.recorder.record(f"{self.service_name}.{operation}", (time.perf_counter() - start) * 1000, throttled)
+        if throttled:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, operation)
+        return respond()
+
+
+class FakeQBusinessClient(FakeClient):
+    def __init__(self, *args, answer_chars: int, snippets_count: int, snippet_chars: int):
+        super().__init__(*args)
+        self.answer_chars = answer_chars
+        self.snippets_count = snippets_count
+        self.snippet_chars = snippet_chars
+
+    def chat_sync(self, applicationId: str, userMessage: str, **kwargs):
+        def respond():
+            return {"systemMessage": fill_text(f"Answer to {userMessage}.", self.answer_chars),
+                    "sourceAttributions": [{"snippet": fill_text(f"Snippet {i} about {userMessage}.",
+                                                                 self.snippet_chars)}
+                                           for i in range(self.snippets_count)]}
+        return self._call("chat_sync", respond)
+
+
+# Well formed answers for the ragas 0.1 judge prompts, told apart by their instructions
+JUDGE_ANSWERS = [
+    ("Generate a question for the given answer", {"question": "What is the benchmark question?", "noncommittal": 0}),
+    ("break down each sentence", [{"sentence_index": 0, "simpler_statements": ["The answer is a benchmark."]}]),
+    ("judge the faithfulness", [{"statement": "The answer is a benchmark.", "reason": "It is in the context.",
+                                 "verdict": 1}]),
+    ("classify if the sentence can be attributed", [{"statement": "The truth is a benchmark.", "attributed": 1,
+                                                     "reason": "It is in the context."}]),
+    ("verify if the context was useful", {"reason": "The context contains the answer.", "verdict": 1}),
+]
+
+
+class FakeBedrockRuntimeClient(FakeClient):
+    def __init__(self, *args, embedding_dimension: int, output_tokens: int):
+        super().__init__(*args)
+        self.embedding_dimension = embedding_dimension
+        self.output_tokens = output_tokens
+
+    def invoke_model(self, body: str, modelId: str, **kwargs):
+        request = json.loads(body)
+        if "inputText" in request:
+            return self._call("invoke_model.embeddings", lambda: self._embedding_response(request["inputText"]))
+        return self._call("invoke_model.chat", lambda: self._chat_response(get_prompt_text(request)))
+
+    def _embedding_response(self, text: str):
+        # same text, same vector, so the answer relevancy similarities stay deterministic
+        rng = random.Random(text)
+        embedding = [rng.uniform(-1, 1) for _ in range(self.embedding_dimension)]
+        return {"body": io.BytesIO(json.dumps({"embedding": embedding,
+                                               "inputTextTokenCount": len(text) // 4}).encode())}
+
+    def _chat_response(self, prompt: str):
+        self.recorder.record_input_tokens(f"{self.service_name}.invoke_model.chat", len(prompt) // 4)
+        answer = next((answer for marker, answer in JUDGE_ANSWERS if marker in prompt), {})
+        return {"body": io.BytesIO(json.dumps({"content": [{"type": "text", "text": json.dumps(answer)}],
+                                               "stop_reason": "end_turn"}).encode()),
+                "ResponseMetadata": {"HTTPHeaders": {"x-amzn-bedrock-input-token-count": str(len(prompt) // 4),
+                                                     "x-amzn-bedrock-output-token-count": str(self.output_tokens)}}}
+
+
+class FakeAuthClient(FakeClient):
+    """Secrets Manager, Cognito, SSO OIDC and STS, with the responses the handler authentication reads."""
+
+    def get_secret_value(self, SecretId: str):
+        return self._call("get_secret_value", lambda: {"SecretString": json.dumps({"password": "benchmark"})})
+
+    def describe_user_pool_client(self, **kwargs):
+        return self._call("describe_user_pool_client", lambda: {"UserPoolClient": {"ClientSecret": "benchmark"}})
+
+    def initiate_auth(self, **kwargs):
+        return self._call("initiate_auth", lambda: {"AuthenticationResult": {"IdToken": "id-token",
+                                                                             "ExpiresIn": 3600}})
+
+    def get_id(self, **kwargs):
+        return self._call("get_id", lambda: {"IdentityId": "identity-id"})
+
+    def get_open_id_token(self, **kwargs):
+        return self._call("get_open_id_token", lambda: {"Token": "open-id-token"})
+
+    def create_token_with_iam(self, **kwargs):
+        return self._call("create_token_with_iam", lambda: {"idToken": jwt.encode(
+            {"sts:identity_context": "benchmark-context"}, "benchmark-key", algorithm="HS256")})
+
+    def _credentials_response(self):
+        return {"Credentials": {"AccessKeyId": "BenchmarkAccessId",
+                                "SecretAccessKey": "BenchmarkSecretKey",
+                                "SessionToken": "BenchmarkSessionToken",
+                                "Expiration": datetime.now(timezone.utc) + timedelta(hours=1)}}
+
+    def assume_role_with_web_identity(self, **kwargs):
+        return self._call("assume_role_with_web_identity", self._credentials_response)
+
+    def assume_role(self, **kwargs):
+        return self._call("assume_role", self._credentials_response)
+
+
+class FakeAws:
+    """
+    Stands in for boto3.client, hands out latency injecting fakes of every service the handler calls.
+
+    Patch utils.client_registry.boto3.client with fake_aws.client so the adapters and ragas utils get the fakes
+    through the client registry, exactly like they get the real clients.
+    """
+
+    def __init__(self,
+                 q_profile: FakeServiceProfile,
+                 bedrock_profile: FakeServiceProfile,
+                 auth_profile: FakeServiceProfile,
+                 answer_chars: int = 400,
+                 snippets_count: int = 3,
+                 snippet_chars: int = 300,
+                 embedding_dimension: int = 1536,
+                 output_tokens: int = 100,
+                 seed: int = 0):
+        self.q_profile = q_profile
+        self.bedrock_profile = bedrock_profile
+        self.auth_profile = auth_profile
+        self.answer_chars = answer_chars
+        self.snippets_count = snippets_count
+        self.snippet_chars = snippet_chars
+        self.embedding_dimension = embedding_dimension
+        self.output_tokens = output_tokens
+        self.recorder = CallRecorder()
+        self._rng = random.Random(seed)
+
+    def client(self, service_name: str, **kwargs):
+        if service_name == "qbusiness":
+            return FakeQBusinessClient(service_name, self.q_profile, self.recorder, self._rng,
+                                       answer_chars=self.answer_chars,
+                                       snippets_count=self.snippets_count,
+                                       snippet_chars=self.snippet_chars)
+        if service_name == "bedrock-runtime":
+            return FakeBedrockRuntimeClient(service_name, self.bedrock_profile, self.recorder, self._rng,
+                                            embedding_dimension=self.embedding_dimension,
+                                            output_tokens=self.output_tokens)
+        if service_name in ("secretsmanager", "cognito-idp", "cognito-identity", "sso-oidc", "sts"):
+            return FakeAuthClient(service_name, self.auth_profile, self.recorder, self._rng)
+        raise Exception(f"No fake for the {service_name} service")
+
+
+# Repeats the text up to size characters, never cuts the text itself
+def fill_text(text: str, size: int) -> str:
+    return ((text + " ") * (size // (len(text) + 1) + 1))[:max(size, len(text))]
+
+
+def get_prompt_text(request: Dict) -> str:
+    if "prompt" in request:
+        return request["prompt"]
+    texts = []
+    for message in request.get("messages", []):
+        content = message["content"]
+        if isinstance(content, str):
+            texts.append(content)
+        else:
+            texts.extend(block.get("text", "") for block in content)
+    return "\n".join(texts)
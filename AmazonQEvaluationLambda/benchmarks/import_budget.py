@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+SOURCE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/amazonq_evaluation_lambda'))
+
+# Modules that must stay out of the cold start, they are imported on first use once the event is validated
+HEAVY_MODULES = ["ragas", "langchain_aws", "langchain_core", "datasets", "pyarrow", "pandas"]
+
+# Import time and RSS growth allowed per module, measured in a fresh interpreter
+IMPORT_BUDGETS = {
+    "handlers.q_evaluation_lambda_handler": {"max_seconds": 0.8, "max_rss_mb": 80, "lazy": HEAVY_MODULES},
+    "utils.answers_artifact": {"max_seconds": 0.6, "max_rss_mb": 100, "lazy": ["ragas", "datasets"]},
+    "utils.ragas_utils": {"max_seconds": 4.0, "max_rss_mb": 250, "lazy": []},
+}
+
+MEASURE_IMPORT_SCRIPT = """
+import importlib, json, resource, sys, time
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"seconds": seconds,
+                  "rss_mb": (rss_after - rss_before) / 1024,
+                  "loaded": [name for name in json.loads(sys.argv[2]) if name in sys.modules]}))
+"""
+
+
+def measure_import(module_name: str) -> Dict:
+    # a fresh interpreter per module, anything already imported would hide its cost
+    env = {**os.environ, "PYTHONPATH": SOURCE_DIR,
+           "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1")}
+    output = subprocess.run([sys.executable, "-c", MEASURE_IMPORT_SCRIPT, module_name, json.dumps(HEAVY_MODULES)],
+                            env=env, cwd=SOURCE_DIR, capture_output=True, text=True, check=True).stdout
+    return {"module": module_name, **json.loads(output)}
+
+
+def check_budget(measurement: Dict, budget: Dict) -> List[str]:
+    violations = []
+    if measurement["seconds"] > budget["max_seconds"]:
+        violations.append(f"{measurement['module']} took {measurement['seconds']:.2f}s to import,"
+                          + f" the budget is {budget['max_seconds']}s")
+    if measurement["rss_mb"] > budget["max_rss_mb"]:
+        violations.append(f"{measurement['module']} grew the RSS by {measurement['rss_mb']:.0f}MB,"
+                          + f" the budget is {budget['max_rss_mb']}MB")
+    eager_modules = [name for name in budget["lazy"] if name in measurement["loaded"]]
+    if eager_modules:
+        violations.append(f"{measurement['module']} imports {eager_modules} at module load")
+    return violations
+
+
+def run_benchmark(repeat: int) -> List[str]:
+    print(f"{'module':>38} {'import (s)':>11} {'rss (MB)':>9}  heavy modules loaded")
+    violations = []
+    for module_name, budget in IMPORT_BUDGETS.items():
+        # the fastest run is the least disturbed by the rest of the machine
+        measurement = min((measure_import(module_name) for _ in range(repeat)), key=lambda m: m["seconds"])
+        print(f"{module_name:>38} {measurement['seconds']:>11.2f} {measurement['rss_mb']:>9.0f}"
+              + f"  {', '.join(measurement['loaded']) or '-'}")
+        violations.extend(check_budget(measurement, budget))
+    return violations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time and RSS per module, fails past the import budgets")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    budget_violations = run_benchmark(args.repeat)
+    for violation in budget_violations:
+        print(f"BUDGET EXCEEDED: {violation}")
+    sys.exit(1 if budget_violations else 0)
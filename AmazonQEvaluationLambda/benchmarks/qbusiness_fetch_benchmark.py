@@ -0,0 +1,59 @@
+import argparse
+import threading
+import time
+from unittest.mock import patch
+
+from adapters.qbusiness_adapter import QbusinessAdapter
+from utils.client_registry import client_registry
+
+STUB_CREDENTIALS = {'AccessKeyId': 'BenchmarkAccessId',
+                    'SecretAccessKey': 'BenchmarkSecretKey',
+                    'SessionToken': 'BenchmarkSessionToken',
+                    }
+
+
+class StubQClient:
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+        self.max_observed_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def chat_sync(self, applicationId: str, userMessage: str):
+        with self._lock:
+            self._in_flight += 1
+            self.max_observed_in_flight = max(self.max_observed_in_flight, self._in_flight)
+        time.sleep(self.latency_seconds)
+        with self._lock:
+            self._in_flight -= 1
+        return {"systemMessage": f"answer to {userMessage}", "sourceAttributions": []}
+
+
+def run_benchmark(questions_count: int, latency_seconds: float, concurrency_levels, max_qps: float):
+    questions = [f"benchmark question {i}" for i in range(questions_count)]
+    print(f"{questions_count} questions, {latency_seconds * 1000:.0f} ms injected latency, max qps {max_qps}")
+    print(f"{'in-flight':>10} {'wall clock (s)':>15} {'questions/s':>12} {'speedup':>8}")
+    baseline = None
+    for max_in_flight in concurrency_levels:
+        stub_client = StubQClient(latency_seconds)
+        # every level gets its own stub client, not the registry's client of the previous level
+        client_registry.clear()
+        with patch("utils.client_registry.boto3.client", return_value=stub_client):
+            adapter = QbusinessAdapter("us-east-1", STUB_CREDENTIALS, max_in_flight=max_in_flight, max_qps=max_qps)
+        start = time.perf_counter()
+        fetch_result = adapter.fetch_q_application_responses(questions, "benchmark-app")
+        elapsed = time.perf_counter() - start
+        assert list(fetch_result.responses.keys()) == questions
+        baseline = baseline or elapsed
+        print(f"{max_in_flight:>10} {elapsed:>15.3f} {questions_count / elapsed:>12.1f} {baseline / elapsed:>7.1f}x")
+    client_registry.clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wall-clock scaling of the Q Business fetch engine")
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--max-qps", type=float, default=0, help="0 disables the QPS limit")
+    args = parser.parse_args()
+    run_benchmark(args.questions, args.latency_ms / 1000, args.concurrency, args.max_qps)
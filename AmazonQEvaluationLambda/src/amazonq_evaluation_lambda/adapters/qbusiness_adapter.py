@@ -1,31 +1,182 @@
-from typing import List, Dict
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dataclasses import dataclass, field
+from typing import List, Dict, Callable, Optional, Tuple
 
-import boto3
 from botocore.exceptions import ClientError
+from utils.client_registry import client_registry, get_client
+from utils.credentials_cache import is_auth_error
+from utils.instrumentation import get_instrumentation
 from utils.logging_utils import setup_logging
+from utils.rate_limiter import TokenBucketRateLimiter
 
 logger = setup_logging(__name__)
 
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "Throttling"}
+
+
+@dataclass
+class QAnswerRecord:
+    question: str
+    response: Optional[dict] = None
+    error: Optional[BaseException] = None
+    # wall-clock time of the answer, throttling retries included
+    latency_millis: Optional[float] = None
+
+    @property
+    def answered(self) -> bool:
+        return self.response is not None
+
+
+@dataclass
+class QFetchResult:
+    # one record per question of the testset, in the testset order, repeated questions included
+    records: List[QAnswerRecord] = field(default_factory=list)
+    # Q Business calls made, one per distinct question
+    q_calls: int = 0
+
+    @property
+    def responses(self) -> Dict[str, dict]:
+        return {record.question: record.response for record in self.records if record.response is not None}
+
+    @property
+    def failures(self) -> Dict[str, BaseException]:
+        return {record.question: record.error for record in self.records
+                if not record.answered and record.error is not None}
+
+    @property
+    def latencies_millis(self) -> Dict[str, float]:
+        return {record.question: record.latency_millis for record in self.records
+                if record.answered and record.latency_millis is not None}
+
+
+@dataclass
+class QCallCounters:
+    # throttling errors received and chat_sync calls sent again while answering one question
+    throttles: int = 0
+    retries: int = 0
+
+
+def is_throttling_error(error: Exception) -> bool:
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
 
 class QbusinessAdapter:
-    def __init__(self, region: str, credentials: Dict):
+    DEFAULT_MAX_IN_FLIGHT = 4
+    DEFAULT_MAX_QPS = 2.0
+    MAX_THROTTLING_RETRIES = 5
+    THROTTLING_BASE_DELAY_SECONDS = 1.0
+
+    def __init__(self, region: str, credentials: Dict,
+                 max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 max_qps: float = DEFAULT_MAX_QPS,
+                 sleep: Callable[[float], None] = time.sleep,
+                 credentials_provider: Optional[Callable[[], Dict]] = None):
         self.region = region
-        self.q_client = boto3.client('qbusiness',
-                                     aws_access_key_id=credentials["AccessKeyId"],
-                                     aws_secret_access_key=credentials["SecretAccessKey"],
-                                     aws_session_token=credentials["SessionToken"],
-                                     region_name=region)
-
-    def get_q_application_response(self, questions: List[str], application_id: str) -> dict:
-        questions_response = {}
+        self.max_in_flight = max(1, max_in_flight)
+        self.rate_limiter = TokenBucketRateLimiter(max_rate=max_qps, sleep=sleep)
+        self._sleep = sleep
+        # called for fresh credentials when Q Business rejects the current ones, each question is retried once
+        self._credentials_provider = credentials_provider
+        self._client_lock = threading.Lock()
+        self._client_generation = 0
+        self._set_credentials(credentials)
+
+    def _set_credentials(self, credentials: Dict):
+        self.credentials = credentials
+        # one pooled connection per in-flight request
+        self.q_client = get_client('qbusiness',
+                                   self.region,
+                                   credentials=credentials,
+                                   max_pool_connections=self.max_in_flight)
+
+    def _refresh_credentials(self, credentials_provider: Callable[[], Dict], generation: int):
+        with self._client_lock:
+            # the concurrent requests rejected with the same credentials refresh them once
+            if generation != self._client_generation:
+                return
+            client_registry.invalidate(self.credentials)
+            self._set_credentials(credentials_provider())
+            self._client_generation += 1
+
+    def get_q_application_response(self, questions: List[str], application_id: str) -> List[QAnswerRecord]:
+        fetch_result = self.fetch_q_application_responses(questions, application_id)
+        if fetch_result.failures:
+            question, error = next(iter(fetch_result.failures.items()))
+            logger.error(f"Failed to get responses for {len(fetch_result.failures)} questions"
+                         + f" from QBusiness app {application_id}, first failed question: {question}")
+            raise error
+        return fetch_result.records
+
+    def fetch_q_application_responses(self, questions: List[str], application_id: str) -> QFetchResult:
+        # identical questions are asked once and their answer is given to every position of the testset
+        unique_questions = list(dict.fromkeys(questions))
+        logger.info(f"Getting response from the Q Business application with Id={application_id}"
+                    + f" for {len(unique_questions)} distinct questions out of {len(questions)}"
+                    + f" using {self.max_in_flight} concurrent requests")
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            # the workers record their calls in the instrumentation of the calling invocation
+            futures = {q: executor.submit(copy_context().run, self._timed_chat_sync, q, application_id)
+                       for q in unique_questions}
+
+        unique_records = {}
+        for q, future in futures.items():
+            error = future.exception()
+            if error is None:
+                response, latency_millis = future.result()
+                unique_records[q] = QAnswerRecord(q, response=response, latency_millis=latency_millis)
+            else:
+                logger.error(f"Failed to get response for question '{q}' from QBusiness app {application_id}"
+                             + f" due to {error}")
+                unique_records[q] = QAnswerRecord(q, error=error)
+        return QFetchResult(records=[unique_records[q] for q in questions], q_calls=len(unique_questions))
+
+    def _timed_chat_sync(self, question: str, application_id: str) -> Tuple[dict, float]:
+        start = time.monotonic()
+        counters = QCallCounters()
         try:
-            logger.info(f"Getting response from the Q Business application with Id={application_id}")
-            for q in questions:
-                response = self.q_client.chat_sync(
-                    applicationId=application_id,
-                    userMessage=q)
-                questions_response[q] = response
-        except ClientError as e:
-            logger.exception(f"Failed to get responses from QBusiness app {application_id} due to {e}")
+            response = self._chat_sync_with_backoff(question, application_id, counters)
+        except Exception as e:
+            get_instrumentation().record("QuestionAnswer", (time.monotonic() - start) * 1000, error=True,
+                                         throttles=counters.throttles, retries=counters.retries)
             raise e
-        return questions_response
+        latency_millis = (time.monotonic() - start) * 1000
+        # rate limiting and backoff included, the chat_sync calls themselves are qbusiness.ChatSync
+        get_instrumentation().record("QuestionAnswer", latency_millis, throttles=counters.throttles,
+                                     retries=counters.retries)
+        return response, latency_millis
+
+    def _chat_sync_with_backoff(self, question: str, application_id: str, counters: QCallCounters) -> dict:
+        attempt = 0
+        auth_retried = False
+        while True:
+            self.rate_limiter.acquire()
+            generation, q_client = self._client_generation, self.q_client
+            try:
+                response = q_client.chat_sync(
+                    applicationId=application_id,
+                    userMessage=question)
+                self.rate_limiter.reward()
+                return response
+            except ClientError as e:
+                if is_auth_error(e) and not auth_retried and self._credentials_provider is not None:
+                    logger.warning(f"Q Business rejected the credentials due to {e}, retrying once with fresh ones")
+                    auth_retried = True
+                    counters.retries += 1
+                    self._refresh_credentials(self._credentials_provider, generation)
+                    continue
+                if not is_throttling_error(e):
+                    raise e
+                counters.throttles += 1
+                if attempt >= self.MAX_THROTTLING_RETRIES:
+                    raise e
+                counters.retries += 1
+                self.rate_limiter.penalize()
+                delay = self.THROTTLING_BASE_DELAY_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                logger.warning(f"Q Business throttled, retry {attempt} in {delay:.2f}s"
+                               + f" at {self.rate_limiter.rate:.2f} requests/second")
+                self._sleep(delay)
@@ -1,8 +1,8 @@
 import json
 
-import boto3
 from botocore.exceptions import ClientError
 
+from utils.client_registry import get_client
 from utils.logging_utils import setup_logging
 
 logger = setup_logging(__name__)
@@ -11,7 +11,7 @@ logger = setup_logging(__name__)
 class SecretManagerAdapter:
     def __init__(self, region: str):
         self.region = region
-        self.secret_client = boto3.client("secretsmanager", region_name=region)
+        self.secret_client = get_client("secretsmanager", region)
 
     def get_secret(self, secret_id: str):
         try:
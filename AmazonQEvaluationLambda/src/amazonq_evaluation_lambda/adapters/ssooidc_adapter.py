@@ -1,7 +1,7 @@
-import boto3
 import jwt
 from botocore.exceptions import ClientError
 
+from utils.client_registry import get_client
 from utils.logging_utils import setup_logging
 
 logger = setup_logging(__name__)
@@ -10,7 +10,7 @@ logger = setup_logging(__name__)
 class SSOOIDCAdapter:
     def __init__(self, region: str):
         self.region = region
-        self.ssooidc_client = boto3.client("sso-oidc", region_name=region)
+        self.ssooidc_client = get_client("sso-oidc", region)
 
     def create_token_with_iam(self, id_token: str, client_id: str):
         try:
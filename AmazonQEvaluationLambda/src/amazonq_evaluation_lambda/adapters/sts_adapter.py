@@ -1,6 +1,6 @@
-import boto3
 from botocore.exceptions import ClientError
 
+from utils.client_registry import get_client
 from utils.logging_utils import setup_logging
 
 logger = setup_logging(__name__)
@@ -9,7 +9,7 @@ logger = setup_logging(__name__)
 class StsAdapter:
     def __init__(self, region: str):
         self.region = region
-        self.sts_client = boto3.client("sts", region_name=region)
+        self.sts_client = get_client("sts", region)
 
     def assume_role_with_oidc_provider(self, roleArn: str, username: str, open_id_token: str):
         try:
@@ -0,0 +1,65 @@
+"""
+Runs the evaluation phases outside of lambda, with the same environment variables as the lambda function.
+
+    python -m handlers.local_entry_point retrieve --testset testset.json --artifact answers.parquet
+    python -m handlers.local_entry_point score --artifact answers.parquet --metrics faithfulness context_recall
+"""
+import argparse
+import json
+from typing import Dict, List, Optional
+
+from handlers.q_evaluation_lambda_handler import EVALUATION_PHASES, SCORING_MODES, lambda_handler
+
+
+def create_event(args: argparse.Namespace) -> Dict:
+    event = {"phase": args.phase}
+    if args.artifact:
+        event["artifact_location"] = args.artifact
+    if args.testset:
+        with open(args.testset, encoding="utf-8") as f:
+            event["testset"] = json.load(f)
+    if args.metrics:
+        event["metrics"] = args.metrics
+    if args.metric_preset:
+        event["metric_preset"] = args.metric_preset
+    if args.bedrock_text_model_id:
+        event["bedrock_text_model_id"] = args.bedrock_text_model_id
+    if args.bedrock_embedding_model_id:
+        event["bedrock_embedding_model_id"] = args.bedrock_embedding_model_id
+    if args.token_budget is not None:
+        event["token_budget"] = args.token_budget
+    if args.scoring_mode:
+        event["scoring_mode"] = args.scoring_mode
+    if args.results_location:
+        event["results_location"] = args.results_location
+    return event
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run a Q evaluation phase locally")
+    parser.add_argument("phase", choices=EVALUATION_PHASES)
+    parser.add_argument("--testset", help="JSON file with the testset entries, required by the retrieve phase")
+    parser.add_argument("--artifact", help="Local path or s3:// location of the answers artifact")
+    parser.add_argument("--metrics", nargs="+", help="Names of the ragas metrics used by the score phase")
+    parser.add_argument("--metric-preset", help="Preset of ragas metrics used when --metrics is not set")
+    parser.add_argument("--bedrock-text-model-id")
+    parser.add_argument("--bedrock-embedding-model-id")
+    parser.add_argument("--token-budget", type=int, help="Bedrock tokens the score phase may use, 0 for no budget")
+    parser.add_argument("--scoring-mode", choices=SCORING_MODES,
+                        help="batch scores with Bedrock batch inference jobs and waits for them, live by default")
+    parser.add_argument("--results-location",
+                        help="Directory or s3:// location where the results are written as partitioned parquet")
+    parser.add_argument("--output", help="File where the phase result is written, printed when not set")
+    args = parser.parse_args(argv)
+
+    result = lambda_handler(create_event(args), None)
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
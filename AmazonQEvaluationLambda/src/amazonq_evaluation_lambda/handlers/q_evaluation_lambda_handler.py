@@ -1,22 +1,41 @@
+from __future__ import annotations
+
 from enum import Enum
+import hashlib
+import json
+import math
 import os
-import jwt
-from typing import Dict, Any
+import time
+from typing import TYPE_CHECKING, Dict, Any, List, Mapping, Optional, Tuple
 
 from adapters.ssooidc_adapter import SSOOIDCAdapter
 from aws_embedded_metrics import metric_scope, MetricsLogger
-from ragas.metrics import (answer_relevancy, faithfulness, context_recall, context_precision)
 
 from adapters.qbusiness_adapter import QbusinessAdapter
 from adapters.secret_manager_adapter import SecretManagerAdapter
 from adapters.sts_adapter import StsAdapter
 from utils.authentication_utils import AuthenticationUtils
-from utils.dataset_utils import get_answers_from_q, create_evaluation_dataset, get_contexts_from_q
+from utils.checkpoint_store import create_checkpoint_store
+from utils.concurrency_controller import get_concurrency_limiter
+from utils.context_packing import ContextPacker
+from utils.credentials_cache import CredentialsCache, get_expiration_timestamp, is_auth_error
+from utils.instrumentation import Instrumentation, get_event_loop, get_sink, invocation_scope, span
 from utils.logging_utils import setup_logging
-from utils.ragas_utils import RagasUtils
+from utils.sharding_utils import split_into_shards, get_testset_fingerprint, merge_shard_records, \
+    aggregate_metric_scores
+from utils.token_accounting import TokenAccountant, get_price_table
 
 from aws_embedded_metrics.config import get_config
 
+# ragas, langchain, datasets and pyarrow take seconds to import, they are only loaded once the event is validated
+# and the Q application credentials are obtained, see benchmarks/import_budget.py
+if TYPE_CHECKING:
+    import pandas as pd
+    from ragas.evaluation import Result
+    from ragas.metrics.base import Metric
+    from utils.batch_scoring import BatchScorer
+    from utils.ragas_utils import RagasUtils
+
 Config = get_config()
 Config.namespace = "QEvaluationLambda"
 
@@ -44,7 +63,58 @@ Q_APP_IDENTITY_SOURCE = IdentitySource[
         default=IdentitySource.COGNITO.name)]
 IDC_APP_TRUSTED_IDENTITY_PROPAGATION_ARN = os.environ.get("IdcAppTrustedIdentityPropagationArn")
 
+Q_FETCH_MAX_IN_FLIGHT = int(os.environ.get("QFetchMaxInFlight", QbusinessAdapter.DEFAULT_MAX_IN_FLIGHT))
+Q_FETCH_MAX_QPS = float(os.environ.get("QFetchMaxQps", QbusinessAdapter.DEFAULT_MAX_QPS))
+
 MAX_ALLOWED_ENTRIES = 10
+# Checkpointed records of the questions Q Business failed to answer carry the error under this field
+Q_ERROR_FIELD = "q_error"
+
+# Sharded mode checkpoints every finished shard, use a s3://bucket/prefix location to resume across containers
+CHECKPOINT_LOCATION = os.environ.get("CheckpointLocation", "/tmp/q-evaluation-checkpoints")
+SHARD_MIN_REMAINING_TIME_MILLIS = 120_000
+SHARD_TIME_SAFETY_FACTOR = 1.5
+
+# Embeddings are cached by model id and text hash, use a s3://bucket/prefix location to share them across containers
+EMBEDDINGS_CACHE_LOCATION = os.environ.get("EmbeddingsCacheLocation", "/tmp/q-evaluation-cache/embeddings.sqlite3")
+# Judge llm answers are cached by model id, temperature and prompt, an empty location disables the cache
+LLM_CACHE_LOCATION = os.environ.get("LLMCacheLocation", "/tmp/q-evaluation-cache/llm.sqlite3")
+
+# Bedrock judge and embeddings concurrency adapts between these bounds, a max of 0 uses a fixed number of workers
+BEDROCK_MIN_CONCURRENCY = int(os.environ.get("BedrockMinConcurrency", 1))
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get("BedrockMaxConcurrency", 8))
+BEDROCK_INITIAL_CONCURRENCY = int(os.environ.get("BedrockInitialConcurrency", 2))
+
+# The retrieve phase writes its answers artifact under this location unless the event sets "artifact_location"
+ANSWERS_ARTIFACT_LOCATION = os.environ.get("AnswersArtifactLocation", "/tmp/q-evaluation-artifacts")
+EVALUATION_PHASES = ["retrieve", "score"]
+
+# Stage durations, errors, throttles and retries go to CloudWatch with EMF, or to this JSON lines file when set
+INSTRUMENTATION_LOCATION = os.environ.get("InstrumentationLocation")
+
+# Bedrock tokens are priced with the default price table, extended by this JSON {"model-id": [input, output]} of USD
+# prices per 1000 tokens. A budget above 0 stops scoring new metrics once the run used that many tokens
+BEDROCK_PRICE_TABLE = os.environ.get("BedrockPriceTable")
+BEDROCK_TOKEN_BUDGET = int(os.environ.get("BedrockTokenBudget", 0))
+
+# The Q snippets of a question more similar than this threshold are judged once, 0 judges every snippet. A budget
+# above 0 caps the snippets of every question at that many estimated tokens, in the Q attribution order
+CONTEXT_SIMILARITY_THRESHOLD = float(os.environ.get("ContextSimilarityThreshold", 0.9))
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("ContextTokenBudget", 0))
+
+# The score phase can send the judge prompts to Bedrock batch inference jobs instead of live calls, Bedrock assumes
+# this role to read the job inputs from and write the outputs to the batch location
+SCORING_MODES = ["live", "batch"]
+BATCH_SCORING_LOCATION = os.environ.get("BatchScoringLocation", "/tmp/q-evaluation-batch")
+BEDROCK_BATCH_ROLE_ARN = os.environ.get("BedrockBatchRoleArn")
+
+# When set, or when the event sets "results_location", the results are written as parquet partitioned by application,
+# run and category, and the handler returns a summary pointing to them instead of the records
+RESULTS_LOCATION = os.environ.get("ResultsLocation")
+
+# Shared by all invocations served by the same lambda container
+CREDENTIALS_CACHE = CredentialsCache()
+USER_SECRET_CACHE_TTL_SECONDS = 900
 
 
 def parse_field_from_event(field_name: str, event: Dict):
@@ -53,27 +123,54 @@ def parse_field_from_event(field_name: str, event: Dict):
     return event[field_name]
 
 
-@metric_scope
-def lambda_handler(event: Dict, context: Any, metrics: MetricsLogger):
-    testset = parse_field_from_event("testset", event)
-    if len(testset) > MAX_ALLOWED_ENTRIES:
-        raise Exception("Maximum allowed entries exceeded!")
+def get_required_setting(name: str, value: Optional[str]) -> str:
+    # the settings are read from the environment at import, each mode checks the ones it needs before using them
+    if value is None:
+        raise Exception(f"The {name} environment variable is required")
+    return value
 
-    questions: list[str] = [entry["question"] for entry in testset]
-    ground_truths: list[str] = [entry["ground_truth"] for entry in testset]
 
-    logger.info(f"Starting the QBusiness client authentication for the application {APPLICATION_ID}")
+def get_q_app_credentials() -> Dict:
+    # warm invocations reuse the credentials until shortly before they expire
+    cache_key = (Q_APP_IDENTITY_SOURCE.name, Q_APP_ROLE_ARN, USER_EMAIL)
+    with span("Authenticate"):
+        try:
+            return CREDENTIALS_CACHE.get(cache_key, assume_q_app_role)
+        except Exception as e:
+            if not is_auth_error(e):
+                raise e
+            # a rotated password or client secret, the cached secrets and tokens are read again once
+            logger.warning(f"Authentication failed due to {e}, retrying once with the cached secrets invalidated")
+            CREDENTIALS_CACHE.clear()
+            return CREDENTIALS_CACHE.get(cache_key, assume_q_app_role)
+
+
+def refresh_q_app_credentials() -> Dict:
+    # Q Business rejected the cached credentials, they are assumed again from freshly read secrets
+    CREDENTIALS_CACHE.clear()
+    return get_q_app_credentials()
+
+
+def get_user_password() -> str:
     secret_manager_adapter = SecretManagerAdapter(REGION)
     user_secret_dict = secret_manager_adapter.get_secret(USER_SECRET_ID)
     if "password" not in user_secret_dict:
         raise Exception("No 'password' key found in secret value!")
-    user_secret_value = user_secret_dict["password"]
+    return user_secret_dict["password"]
+
+
+def assume_q_app_role() -> Tuple[Dict, float]:
+    logger.info(f"Starting the QBusiness client authentication for the application {APPLICATION_ID}")
+    user_secret_value = CREDENTIALS_CACHE.get_with_ttl(("user-secret", USER_SECRET_ID),
+                                                       get_user_password,
+                                                       USER_SECRET_CACHE_TTL_SECONDS)
 
     auth_utils = AuthenticationUtils(REGION,
                                      ACCOUNT_ID,
                                      USER_POOL_ID,
                                      CLIENT_ID,
-                                     IDENTITY_POOL_ID)
+                                     IDENTITY_POOL_ID,
+                                     credentials_cache=CREDENTIALS_CACHE)
 
     id_token = auth_utils.get_token_id_for_cognito_user(USER_EMAIL, user_secret_value)
     ssooidc_adapter = SSOOIDCAdapter(REGION)
@@ -89,42 +186,597 @@ def lambda_handler(event: Dict, context: Any, metrics: MetricsLogger):
     else:
         raise Exception(f"Invalid identity source {Q_APP_IDENTITY_SOURCE}. Valid values are {IdentitySource.list()}")
 
-    qbusiness_adapter = QbusinessAdapter(REGION, credentials)
     logger.info(f"Finished the QBusiness client authentication for the application {APPLICATION_ID}")
+    return credentials, get_expiration_timestamp(credentials)
+
+
+def evaluate_testset(testset: List[Dict],
+                     qbusiness_adapter: QbusinessAdapter,
+                     ragas_utils: RagasUtils,
+                     evaluations_metrics: List[Metric]) -> Tuple[Result, Dict[str, str]]:
+    from utils.dataset_utils import get_answers_from_q, create_evaluation_dataset, get_contexts_from_q
+
+    questions: list[str] = [entry["question"] for entry in testset]
 
     logger.info(f"Getting answers and contexts from q application {APPLICATION_ID}")
-    q_app_responses = qbusiness_adapter.get_q_application_response(questions, APPLICATION_ID)
+    with span("RetrieveAnswers"):
+        fetch_result = qbusiness_adapter.fetch_q_application_responses(questions, APPLICATION_ID)
     logger.info(f"Done getting answers and contexts from q application {APPLICATION_ID}")
 
-    q_app_answers: list[str] = get_answers_from_q(q_app_responses)
-    q_app_contexts: list[str] = get_contexts_from_q(q_app_responses)
+    # the questions Q Business failed to answer are reported, the answered ones are still scored
+    failures = fetch_result.failures
+    if failures and len(failures) == len(set(questions)):
+        raise next(iter(failures.values()))
+    if failures:
+        logger.warning(f"Q Business failed to answer {len(failures)} of {len(set(questions))} questions,"
+                       + " they are not scored")
+    q_app_records = [record for record in fetch_result.records if record.answered]
+    ground_truths: list[str] = [entry["ground_truth"] for entry, record in zip(testset, fetch_result.records)
+                                if record.answered]
+
+    q_app_answers: list[str] = get_answers_from_q(q_app_records)
+    q_app_contexts: list[list[str]] = get_contexts_from_q(q_app_records)
 
-    evaluation_dataset = create_evaluation_dataset(questions=questions,
+    evaluation_dataset = create_evaluation_dataset(questions=[record.question for record in q_app_records],
                                                    ground_truth=ground_truths,
                                                    answers=q_app_answers,
                                                    contexts=q_app_contexts)
 
-    evaluations_metrics = [answer_relevancy,
-                           faithfulness,
-                           context_recall,
-                           context_precision]
-    ragas_utils = RagasUtils(region=REGION,
-                             bedrock_embedding_model_id=BEDROCK_EMBEDDING_MODEL_ID,
-                             bedrock_llm_model_id=BEDROCK_TEXT_MODEL_ID)
+    logger.info("Starting dataset evaluation with ragas")
+    evaluations_results = ragas_utils.evaluate_dataset(evaluation_dataset, evaluations_metrics)
+    logger.info("Evaluation Complete!")
+    return evaluations_results, {question: str(error) for question, error in failures.items()}
 
-    logger.info(f"Using metrics {str(evaluations_metrics)} to use {BEDROCK_EMBEDDING_MODEL_ID} embedding"
-                + f" and {BEDROCK_TEXT_MODEL_ID} llm models")
-    ragas_utils.configure_metrics_to_use_bedrock(evaluations_metrics)
 
-    logger.info("Starting dataset evaluation with ragas")
+def get_answered_entries(testset: List[Dict], failures: Dict[str, str]) -> List[Dict]:
+    return [entry for entry in testset if entry["question"] not in failures]
+
+
+def get_checkpoint_records(evaluations_results: Result, failures: Dict[str, str]) -> List[Dict]:
+    records = json.loads(evaluations_results.to_pandas().to_json(orient="records"))
+    return records + [{"question": question, Q_ERROR_FIELD: error} for question, error in failures.items()]
+
+
+def split_checkpoint_records(entries: List[Dict], records: List[Dict]) -> Tuple[List[Dict], List[Dict], Dict[str, str]]:
+    # scored records, the entries they score and the failed questions of a shard or round
+    failures = {record["question"]: record[Q_ERROR_FIELD] for record in records if Q_ERROR_FIELD in record}
+    return ([record for record in records if Q_ERROR_FIELD not in record],
+            get_answered_entries(entries, failures), failures)
+
+
+def get_failures_result(failures: Dict[str, str]) -> Dict:
+    return {"failed_questions": list(failures), "failed_question_count": len(failures)}
+
+
+def score_answer_records(records: List[Dict],
+                         ragas_utils: RagasUtils,
+                         evaluations_metrics: List[Metric]) -> Optional[Result]:
+    from utils.dataset_utils import create_evaluation_dataset
+
+    evaluation_dataset = create_evaluation_dataset(questions=[record["question"] for record in records],
+                                                   ground_truth=[record["ground_truth"] for record in records],
+                                                   answers=[record["answer"] for record in records],
+                                                   contexts=[record["contexts"] for record in records])
+
+    logger.info(f"Starting evaluation of {len(records)} answers with ragas")
     evaluations_results = ragas_utils.evaluate_dataset(evaluation_dataset, evaluations_metrics)
     logger.info("Evaluation Complete!")
+    return evaluations_results
+
+
+def retrieve_answers_artifact(event: Dict, testset: List[Dict], qbusiness_adapter: QbusinessAdapter) -> Dict:
+    from utils.answers_artifact import create_answer_records, write_answers_artifact
+
+    region = get_required_setting("Region", REGION)
+    application_id = get_required_setting("QBusinessApplicationId", APPLICATION_ID)
+    testset_fingerprint = get_testset_fingerprint(testset, len(testset))
+    artifact_location = event.get("artifact_location",
+                                  f"{ANSWERS_ARTIFACT_LOCATION.rstrip('/')}/{testset_fingerprint[:16]}.parquet")
+
+    logger.info(f"Getting answers and contexts from q application {application_id}")
+    with span("RetrieveAnswers"):
+        fetch_result = qbusiness_adapter.fetch_q_application_responses([entry["question"] for entry in testset],
+                                                                       application_id)
+    records = create_answer_records(testset, fetch_result)
+    with span("WriteAnswersArtifact"):
+        write_answers_artifact(records, artifact_location, region,
+                               metadata={"q_application_id": application_id,
+                                         "testset_fingerprint": testset_fingerprint,
+                                         "created_at": time.time()})
+    return {"phase": "retrieve",
+            "artifact_location": artifact_location,
+            "answered_questions": len(records),
+            "failed_questions": list(fetch_result.failures),
+            "q_calls": fetch_result.q_calls}
+
+
+def get_evaluation_metric_names(event: Dict) -> List[str]:
+    from utils.metric_factory import get_metric_names
+
+    # either the metric names or a preset such as "embeddings_only" for a fast smoke run, the default metrics otherwise
+    return get_metric_names(event.get("metrics"), event.get("metric_preset"))
+
+
+def create_token_accountant(event: Dict) -> TokenAccountant:
+    # the budget can be set per invocation
+    return TokenAccountant(get_price_table(BEDROCK_PRICE_TABLE),
+                           int(event.get("token_budget", BEDROCK_TOKEN_BUDGET)))
+
+
+def create_context_packer(event: Dict) -> ContextPacker:
+    # both can be set per invocation, e.g. to compare the scores with and without packing
+    return ContextPacker(float(event.get("context_similarity_threshold", CONTEXT_SIMILARITY_THRESHOLD)),
+                         int(event.get("context_token_budget", CONTEXT_TOKEN_BUDGET)))
+
+
+def get_scoring_config(event: Dict, metric_names: List[str]) -> Dict:
+    # everything besides the answers that changes the scores, a metric preset is resolved into the metric names
+    return {"metrics": metric_names,
+            "bedrock_embedding_model_id": event.get("bedrock_embedding_model_id", BEDROCK_EMBEDDING_MODEL_ID),
+            "bedrock_text_model_id": event.get("bedrock_text_model_id", BEDROCK_TEXT_MODEL_ID),
+            "context_similarity_threshold": event.get("context_similarity_threshold", CONTEXT_SIMILARITY_THRESHOLD),
+            "context_token_budget": event.get("context_token_budget", CONTEXT_TOKEN_BUDGET)}
+
+
+def get_score_run_id(event: Dict, metric_names: List[str]) -> str:
+    # the same artifact scored the same way is the same run, a batch run resumes and its results are replaced
+    run_fields = json.dumps([event.get("artifact_location"), get_scoring_config(event, metric_names)], sort_keys=True)
+    return event.get("run_id", hashlib.sha256(run_fields.encode("utf-8")).hexdigest()[:16])
+
 
-    evaluations_results_json = evaluations_results.to_pandas().to_json(orient="records")
+def create_batch_scorer(event: Dict, context: Any, metric_names: List[str]) -> Optional[BatchScorer]:
+    scoring_mode = event.get("scoring_mode", "live")
+    if scoring_mode not in SCORING_MODES:
+        raise Exception(f"Invalid scoring mode {scoring_mode}. Valid values are {SCORING_MODES}")
+    if scoring_mode == "live":
+        return None
+    batch_role_arn = BEDROCK_BATCH_ROLE_ARN
+    if not batch_role_arn:
+        raise Exception("The BedrockBatchRoleArn environment variable is required by the batch scoring mode")
+    region = get_required_setting("Region", REGION)
+    from utils.batch_scoring import BatchScorer, BedrockBatchJobRunner, create_batch_storage
 
+    # an invocation waits for the running job as long as it has time, the local entry point until the job is done
+    max_wait_seconds = None
+    if context is not None:
+        max_wait_seconds = max(0.0, (context.get_remaining_time_in_millis() - SHARD_MIN_REMAINING_TIME_MILLIS) / 1000)
+    return BatchScorer(create_batch_storage(event.get("batch_location", BATCH_SCORING_LOCATION), region),
+                       BedrockBatchJobRunner(region, batch_role_arn),
+                       get_score_run_id(event, metric_names),
+                       max_wait_seconds=max_wait_seconds)
+
+
+def create_ragas_utils(event: Dict, metric_names: List[str],
+                       token_accountant: Optional[TokenAccountant] = None,
+                       batch_scorer: Optional[BatchScorer] = None) -> Tuple[RagasUtils, List[Metric]]:
+    from utils.metric_factory import create_metrics
+    from utils.ragas_utils import RagasUtils
+
+    # the judge models can be overridden per invocation, e.g. to re-score an answers artifact with another model
+    bedrock_embedding_model_id = event.get("bedrock_embedding_model_id", BEDROCK_EMBEDDING_MODEL_ID)
+    bedrock_text_model_id = event.get("bedrock_text_model_id", BEDROCK_TEXT_MODEL_ID)
+    judge_concurrency_limiter, embeddings_concurrency_limiter = None, None
+    if BEDROCK_MAX_CONCURRENCY > 0:
+        concurrency_bounds = (BEDROCK_MIN_CONCURRENCY, BEDROCK_MAX_CONCURRENCY, BEDROCK_INITIAL_CONCURRENCY)
+        judge_concurrency_limiter = get_concurrency_limiter(bedrock_text_model_id, *concurrency_bounds)
+        embeddings_concurrency_limiter = get_concurrency_limiter(bedrock_embedding_model_id, *concurrency_bounds)
+    ragas_utils = RagasUtils(region=REGION,
+                             bedrock_embedding_model_id=bedrock_embedding_model_id,
+                             bedrock_llm_model_id=bedrock_text_model_id,
+                             embeddings_cache_location=EMBEDDINGS_CACHE_LOCATION,
+                             llm_cache_location=LLM_CACHE_LOCATION,
+                             judge_concurrency_limiter=judge_concurrency_limiter,
+                             embeddings_concurrency_limiter=embeddings_concurrency_limiter,
+                             token_accountant=token_accountant,
+                             context_packer=create_context_packer(event),
+                             batch_scorer=batch_scorer)
+
+    logger.info(f"Using metrics {metric_names} with the {bedrock_embedding_model_id} embedding"
+                + f" and {bedrock_text_model_id} llm models")
+    # the metrics of every invocation are separate instances, concurrent invocations may use other judges
+    return ragas_utils, create_metrics(metric_names, ragas_utils.get_judge_llm(), ragas_utils.get_embeddings())
+
+
+def get_attempt_run_id(run_id: str, attempt: int) -> str:
+    # the first attempt keeps the checkpoint names of the runs started before completed runs were evaluated again
+    return run_id if attempt == 0 else f"{run_id}/attempt-{attempt:03d}"
+
+
+def has_time_for_next_shard(context: Any, longest_shard_millis: float) -> bool:
+    if context is None:
+        return True
+    required_millis = max(SHARD_MIN_REMAINING_TIME_MILLIS, SHARD_TIME_SAFETY_FACTOR * longest_shard_millis)
+    return context.get_remaining_time_in_millis() > required_millis
+
+
+def evaluate_testset_in_shards(event: Dict,
+                               context: Any,
+                               testset: List[Dict],
+                               qbusiness_adapter: QbusinessAdapter,
+                               ragas_utils: RagasUtils,
+                               evaluations_metrics: List[Metric],
+                               token_accountant: TokenAccountant) -> Dict:
+    import pandas as pd
+
+    shard_size = int(event["shard_size"])
+    shards = split_into_shards(testset, shard_size)
+    metric_names = [metric.name for metric in evaluations_metrics]
+    testset_fingerprint = get_testset_fingerprint(testset, shard_size, get_scoring_config(event, metric_names))
+    run_id = event.get("run_id", testset_fingerprint[:16])
+    checkpoint_store = create_checkpoint_store(event.get("checkpoint_location", CHECKPOINT_LOCATION),
+                                               get_required_setting("Region", REGION))
+
+    manifest = checkpoint_store.load_manifest(run_id)
+    if manifest is not None and manifest["testset_fingerprint"] != testset_fingerprint:
+        raise Exception(f"Run {run_id} was started with a different testset, shard size or scoring configuration")
+    if manifest is None or manifest.get("completed"):
+        # a completed run is evaluated again from scratch, its shards are checkpointed apart from the earlier attempts
+        attempt = manifest.get("attempt", 0) + 1 if manifest is not None else 0
+        manifest = {"testset_fingerprint": testset_fingerprint,
+                    "shard_size": shard_size,
+                    "total_shards": len(shards),
+                    "attempt": attempt,
+                    "completed": False}
+        checkpoint_store.save_manifest(run_id, manifest)
+    shards_run_id = get_attempt_run_id(run_id, manifest.get("attempt", 0))
+
+    shards_records: List[List[Dict]] = []
+    answered_entries: List[Dict] = []
+    failures: Dict[str, str] = {}
+    longest_shard_millis = 0.0
+    for shard_index, shard in enumerate(shards):
+        shard_records = checkpoint_store.load_shard(shards_run_id, shard_index)
+        if shard_records is None:
+            if not has_time_for_next_shard(context, longest_shard_millis):
+                logger.info(f"Not enough time left to evaluate shard {shard_index} of run {run_id},"
+                            + " invoke again with the same run_id to resume")
+                return get_incomplete_result(run_id, shard_index, len(shards), token_accountant, failures)
+            if token_accountant.is_budget_exhausted():
+                logger.info(f"Token budget reached before shard {shard_index} of run {run_id},"
+                            + " invoke again with the same run_id to resume")
+                return get_incomplete_result(run_id, shard_index, len(shards), token_accountant, failures)
+            logger.info(f"Evaluating shard {shard_index + 1}/{len(shards)} of run {run_id}")
+            shard_start = time.monotonic()
+            refused_metric_runs = token_accountant.refused_metric_runs
+            shard_results, shard_failures = evaluate_testset(shard, qbusiness_adapter, ragas_utils,
+                                                             evaluations_metrics)
+            if token_accountant.refused_metric_runs > refused_metric_runs:
+                # the shard is not checkpointed so resuming scores its missing metrics, cached judge answers are reused
+                logger.info(f"Token budget reached during shard {shard_index} of run {run_id},"
+                            + " invoke again with the same run_id to resume")
+                return get_incomplete_result(run_id, shard_index, len(shards), token_accountant, failures)
+            shard_records = get_checkpoint_records(shard_results, shard_failures)
+            with span("SaveCheckpoint"):
+                checkpoint_store.save_shard(shards_run_id, shard_index, shard_records)
+            longest_shard_millis = max(longest_shard_millis, (time.monotonic() - shard_start) * 1000)
+        else:
+            logger.info(f"Shard {shard_index + 1}/{len(shards)} of run {run_id} was already evaluated, skipping")
+        scored_records, scored_entries, shard_failures = split_checkpoint_records(shard, shard_records)
+        shards_records.append(scored_records)
+        answered_entries.extend(scored_entries)
+        failures.update(shard_failures)
+
+    checkpoint_store.save_manifest(run_id, {**manifest, "completed": True})
+    records = merge_shard_records(shards_records)
+    sharded_results = {"status": "COMPLETE",
+                       "run_id": run_id,
+                       "completed_shards": len(shards),
+                       "total_shards": len(shards),
+                       "aggregates": aggregate_metric_scores(records, metric_names),
+                       "summary": get_score_summaries({metric_name: [record.get(metric_name) for record in records]
+                                                       for metric_name in metric_names},
+                                                      get_categories(answered_entries), metric_names),
+                       **get_failures_result(failures),
+                       "token_usage": token_accountant.get_summary()}
+    results_location = event.get("results_location", RESULTS_LOCATION)
+    if not results_location:
+        return {**sharded_results, "results": json.dumps(records)}
+    return {**sharded_results, **write_evaluation_results(pd.DataFrame.from_records(records),
+                                                          get_categories(answered_entries), results_location,
+                                                          run_id, metric_names)}
+
+
+def evaluate_testset_adaptively(event: Dict,
+                                context: Any,
+                                testset: List[Dict],
+                                qbusiness_adapter: QbusinessAdapter,
+                                ragas_utils: RagasUtils,
+                                evaluations_metrics: List[Metric],
+                                token_accountant: TokenAccountant) -> Dict:
+    import pandas as pd
+    from utils.adaptive_sampling import DEFAULT_MIN_QUESTIONS, DEFAULT_ROUND_SIZE, get_interval_widths, \
+        get_stratified_order, has_reached_target_width
+
+    # a stratified sample of the testset is scored in rounds, until the confidence interval of every target metric is
+    # narrower than the target width or a cap is hit
+    metric_names = [metric.name for metric in evaluations_metrics]
+    target_metric_names = event.get("target_metrics", metric_names)
+    for metric_name in target_metric_names:
+        if metric_name not in metric_names:
+            raise Exception(f"Invalid target metric {metric_name}. Valid values are {metric_names}")
+    target_width = float(event["target_interval_width"])
+    round_size = int(event.get("sampling_round_size", DEFAULT_ROUND_SIZE))
+    min_questions = int(event.get("sampling_min_questions", DEFAULT_MIN_QUESTIONS))
+    seed = int(event.get("sampling_seed", 0))
+    if target_width <= 0 or round_size < 1:
+        raise Exception("The target interval width and the sampling round size must be positive numbers")
+
+    # the rounds are checkpointed like shards, an interrupted run resumes with the same sample
+    testset_fingerprint = get_testset_fingerprint(testset, round_size, get_scoring_config(event, metric_names))
+    run_id = event.get("run_id", f"sampling-{testset_fingerprint[:16]}")
+    checkpoint_store = create_checkpoint_store(event.get("checkpoint_location", CHECKPOINT_LOCATION),
+                                               get_required_setting("Region", REGION))
+    manifest = checkpoint_store.load_manifest(run_id)
+    if manifest is None:
+        checkpoint_store.save_manifest(run_id, {"testset_fingerprint": testset_fingerprint,
+                                                "shard_size": round_size,
+                                                "sampling_seed": seed})
+    elif manifest["testset_fingerprint"] != testset_fingerprint or manifest.get("sampling_seed") != seed:
+        raise Exception(f"Run {run_id} was started with a different testset, round size, sampling seed"
+                        + " or scoring configuration")
+
+    order = get_stratified_order(get_categories(testset), seed)[:int(event.get("sampling_max_questions",
+                                                                               len(testset)))]
+    sampled_entries: List[Dict] = []
+    records: List[Dict] = []
+    failures: Dict[str, str] = {}
+    interval_widths = {metric_name: math.nan for metric_name in target_metric_names}
+    longest_round_millis = 0.0
+    for round_index, round_start in enumerate(range(0, len(order), round_size)):
+        round_entries = [testset[i] for i in order[round_start:round_start + round_size]]
+        round_records = checkpoint_store.load_shard(run_id, round_index)
+        if round_records is None:
+            if not has_time_for_next_shard(context, longest_round_millis):
+                logger.info(f"Not enough time left to score round {round_index} of run {run_id},"
+                            + " invoke again with the same run_id to resume")
+                return get_sampling_result("INCOMPLETE", "TIME_LIMIT", run_id, testset, records, interval_widths,
+                                           target_width, token_accountant, failures)
+            if token_accountant.is_budget_exhausted():
+                logger.info(f"Token budget reached before round {round_index} of run {run_id}")
+                return get_sampling_result("INCOMPLETE", "TOKEN_BUDGET", run_id, testset, records, interval_widths,
+                                           target_width, token_accountant, failures)
+            round_start_time = time.monotonic()
+            refused_metric_runs = token_accountant.refused_metric_runs
+            round_results, round_failures = evaluate_testset(round_entries, qbusiness_adapter, ragas_utils,
+                                                             evaluations_metrics)
+            if token_accountant.refused_metric_runs > refused_metric_runs:
+                # the refused metrics are NaN, the round is left out rather than counted as failed evaluations
+                logger.info(f"Token budget reached during round {round_index} of run {run_id}")
+                return get_sampling_result("INCOMPLETE", "TOKEN_BUDGET", run_id, testset, records, interval_widths,
+                                           target_width, token_accountant, failures)
+            round_records = get_checkpoint_records(round_results, round_failures)
+            with span("SaveCheckpoint"):
+                checkpoint_store.save_shard(run_id, round_index, round_records)
+            longest_round_millis = max(longest_round_millis, (time.monotonic() - round_start_time) * 1000)
+        scored_records, scored_entries, round_failures = split_checkpoint_records(round_entries, round_records)
+        sampled_entries.extend(scored_entries)
+        records.extend(scored_records)
+        failures.update(round_failures)
+        interval_widths = get_interval_widths(records, target_metric_names, len(testset), seed=seed)
+        logger.info(f"Scored {len(records)}/{len(testset)} questions of run {run_id},"
+                    + f" interval widths {interval_widths}")
+        if len(records) >= min_questions and has_reached_target_width(interval_widths, target_width):
+            stop_reason = "TARGET_REACHED"
+            break
+    else:
+        stop_reason = "MAX_QUESTIONS" if len(order) < len(testset) else "TESTSET_EXHAUSTED"
+
+    sampling_results = {**get_sampling_result("COMPLETE", stop_reason, run_id, testset, records, interval_widths,
+                                              target_width, token_accountant, failures),
+                        "aggregates": aggregate_metric_scores(records, metric_names),
+                        "summary": get_score_summaries({metric_name: [record.get(metric_name) for record in records]
+                                                        for metric_name in metric_names},
+                                                       get_categories(sampled_entries), metric_names)}
+    results_location = event.get("results_location", RESULTS_LOCATION)
+    if not results_location:
+        return {**sampling_results, "results": json.dumps(records)}
+    return {**sampling_results, **write_evaluation_results(pd.DataFrame.from_records(records),
+                                                           get_categories(sampled_entries), results_location,
+                                                           run_id, metric_names)}
+
+
+def get_sampling_result(status: str, stop_reason: str, run_id: str, testset: List[Dict], records: List[Dict],
+                        interval_widths: Dict[str, float], target_width: float,
+                        token_accountant: TokenAccountant, failures: Dict[str, str]) -> Dict:
+    return {"status": status,
+            "stop_reason": stop_reason,
+            "run_id": run_id,
+            "scored_questions": len(records),
+            "total_questions": len(testset),
+            "target_interval_width": target_width,
+            "interval_widths": interval_widths,
+            **get_failures_result(failures),
+            "token_usage": token_accountant.get_summary()}
+
+
+def get_incomplete_result(run_id: str, completed_shards: int, total_shards: int,
+                          token_accountant: TokenAccountant, failures: Dict[str, str]) -> Dict:
+    return {"status": "INCOMPLETE",
+            "run_id": run_id,
+            "completed_shards": completed_shards,
+            "total_shards": total_shards,
+            **get_failures_result(failures),
+            "token_usage": token_accountant.get_summary()}
+
+
+def put_ragas_utils_metrics(ragas_utils: RagasUtils, metrics: MetricsLogger):
+    cache_stats = ragas_utils.get_cache_stats()
+    logger.info(f"Cache stats: {cache_stats}")
+    for stat_name, value in cache_stats.items():
+        metrics.put_metric(stat_name, value, "Count")
+    # the setpoints the concurrency controllers reached by the end of the evaluation
+    for stat_name, value in ragas_utils.get_concurrency_stats().items():
+        metrics.put_metric(stat_name, value, "Count")
+    for stat_name, value in ragas_utils.get_context_packing_stats().items():
+        metrics.put_metric(stat_name, value, "Count")
+    for stat_name, value in ragas_utils.get_batch_stats().items():
+        metrics.put_metric(stat_name, value, "Count")
+    token_stats = ragas_utils.get_token_stats()
+    logger.info(f"Token usage: {token_stats}")
+    for stat_name, token_value in token_stats.items():
+        metrics.put_metric(stat_name, token_value, "None" if stat_name.endswith("CostUSD") else "Count")
+
+
+def flush_instrumentation(invocation_instrumentation: Instrumentation):
+    try:
+        invocation_instrumentation.flush(get_sink(INSTRUMENTATION_LOCATION, {"QApplicationId": APPLICATION_ID}))
+    except Exception as e:
+        # the evaluation results matter more than its timings
+        logger.error(f"Failed to flush the instrumentation due to {e}")
+
+
+@metric_scope
+def lambda_handler(event: Dict, context: Any, metrics: MetricsLogger):
+    # several invocations may share a warm process, each in its own thread, metric_scope flushes on the thread loop
+    get_event_loop()
+    with invocation_scope() as invocation_instrumentation:
+        try:
+            with span("Invocation", Phase=event.get("phase") or "evaluate"):
+                return handle_evaluation_event(event, context, metrics)
+        finally:
+            flush_instrumentation(invocation_instrumentation)
+
+
+def handle_evaluation_event(event: Dict, context: Any, metrics: MetricsLogger):
+    phase = event.get("phase")
+    if phase is not None and phase not in EVALUATION_PHASES:
+        raise Exception(f"Invalid phase {phase}. Valid values are {EVALUATION_PHASES}")
     metrics.put_dimensions({"QApplicationId": APPLICATION_ID})
+
+    if phase == "score":
+        return score_answers_artifact_phase(event, context, metrics)
+
+    testset = parse_field_from_event("testset", event)
+    sharded_mode = "shard_size" in event
+    sampling_mode = "target_interval_width" in event
+    if phase is None and not sharded_mode and not sampling_mode and len(testset) > MAX_ALLOWED_ENTRIES:
+        raise Exception("Maximum allowed entries exceeded! Set 'shard_size' in the event to evaluate"
+                        + " larger testsets in shards.")
+
+    credentials = get_q_app_credentials()
+    qbusiness_adapter = QbusinessAdapter(REGION,
+                                         credentials,
+                                         max_in_flight=Q_FETCH_MAX_IN_FLIGHT,
+                                         max_qps=Q_FETCH_MAX_QPS,
+                                         credentials_provider=refresh_q_app_credentials)
+    if phase == "retrieve":
+        return retrieve_answers_artifact(event, testset, qbusiness_adapter)
+
+    token_accountant = create_token_accountant(event)
+    ragas_utils, evaluations_metrics = create_ragas_utils(event, get_evaluation_metric_names(event), token_accountant)
+
+    if sampling_mode:
+        sampling_results = evaluate_testset_adaptively(event, context, testset, qbusiness_adapter,
+                                                       ragas_utils, evaluations_metrics, token_accountant)
+        if sampling_results["status"] == "COMPLETE":
+            for metric_name, metrics_score in sampling_results["aggregates"].items():
+                metrics.put_metric(metric_name, metrics_score)
+        metrics.put_metric("SampledQuestions", sampling_results["scored_questions"], "Count")
+        metrics.put_metric("FailedQuestions", sampling_results["failed_question_count"], "Count")
+        put_ragas_utils_metrics(ragas_utils, metrics)
+        return sampling_results
+
+    if sharded_mode:
+        sharded_results = evaluate_testset_in_shards(event, context, testset, qbusiness_adapter,
+                                                     ragas_utils, evaluations_metrics, token_accountant)
+        if sharded_results["status"] == "COMPLETE":
+            for metric_name, metrics_score in sharded_results["aggregates"].items():
+                metrics.put_metric(metric_name, metrics_score)
+        metrics.put_metric("FailedQuestions", sharded_results["failed_question_count"], "Count")
+        put_ragas_utils_metrics(ragas_utils, metrics)
+        return sharded_results
+
+    evaluations_results, failures = evaluate_testset(testset, qbusiness_adapter, ragas_utils, evaluations_metrics)
+    put_evaluation_results_metrics(evaluations_results, evaluations_metrics, ragas_utils, metrics)
+    metrics.put_metric("FailedQuestions", len(failures), "Count")
+    run_id = event.get("run_id", get_testset_fingerprint(testset, len(testset))[:16])
+    return get_evaluation_results(event, evaluations_results, evaluations_metrics,
+                                  get_categories(get_answered_entries(testset, failures)), run_id, failures)
+
+
+def score_answers_artifact_phase(event: Dict, context: Any, metrics: MetricsLogger):
+    from utils.answers_artifact import read_answers_artifact
+
+    artifact_location = parse_field_from_event("artifact_location", event)
+    metric_names = get_evaluation_metric_names(event)
+    batch_scorer = create_batch_scorer(event, context, metric_names)
+    with span("ReadAnswersArtifact"):
+        records = read_answers_artifact(artifact_location, get_required_setting("Region", REGION))
+
+    ragas_utils, evaluations_metrics = create_ragas_utils(event, metric_names, create_token_accountant(event),
+                                                          batch_scorer)
+    evaluations_results = score_answer_records(records, ragas_utils, evaluations_metrics)
+    if evaluations_results is None:
+        if batch_scorer is None:
+            raise Exception("Live scoring returned no results")
+        # the batch job of the current round is still running
+        put_ragas_utils_metrics(ragas_utils, metrics)
+        logger.info(f"Batch job {batch_scorer.running_job_id} of run {batch_scorer.run_id} is still running,"
+                    + " invoke again with the same event to resume")
+        return {"status": "INCOMPLETE",
+                "phase": "score",
+                "run_id": batch_scorer.run_id,
+                "batch_job_id": batch_scorer.running_job_id}
+    put_evaluation_results_metrics(evaluations_results, evaluations_metrics, ragas_utils, metrics)
+    return get_evaluation_results(event, evaluations_results, evaluations_metrics, get_categories(records),
+                                  get_score_run_id(event, metric_names))
+
+
+def put_evaluation_results_metrics(evaluations_results: Result,
+                                   evaluations_metrics: List[Metric],
+                                   ragas_utils: RagasUtils,
+                                   metrics: MetricsLogger):
     for metric in evaluations_metrics:
         metric_name = metric.name
         metrics_score = evaluations_results.get(metric_name)
         metrics.put_metric(metric_name, metrics_score)
-    return evaluations_results_json
+    put_ragas_utils_metrics(ragas_utils, metrics)
+
+
+def get_categories(entries: List[Dict]) -> List[Optional[str]]:
+    # testset entries and answer records may carry a category, the results are partitioned by it
+    return [entry.get("category") for entry in entries]
+
+
+def get_evaluation_results(event: Dict,
+                           evaluations_results: Result,
+                           evaluations_metrics: List[Metric],
+                           categories: List[Optional[str]],
+                           run_id: str,
+                           failures: Optional[Dict[str, str]] = None) -> Dict:
+    results_location = event.get("results_location", RESULTS_LOCATION)
+    failures = failures or {}
+    if not results_location:
+        # the records of the answered questions next to the failed questions, an empty list when none failed
+        return {"status": "COMPLETE",
+                "run_id": run_id,
+                "results": evaluations_results.to_pandas().to_json(orient="records"),
+                **get_failures_result(failures)}
+    metric_names = [metric.name for metric in evaluations_metrics]
+    frame = evaluations_results.to_pandas()
+    return {"status": "COMPLETE",
+            "run_id": run_id,
+            "aggregates": {metric_name: evaluations_results.get(metric_name) for metric_name in metric_names},
+            "summary": get_score_summaries(frame, categories, metric_names),
+            **get_failures_result(failures),
+            **write_evaluation_results(frame, categories, results_location, run_id, metric_names)}
+
+
+def get_score_summaries(scores: Mapping, categories: List[Optional[str]], metric_names: List[str]) -> Dict:
+    from utils.results_store import DEFAULT_CATEGORY
+    from utils.score_aggregation import summarize_results
+
+    # mean, percentiles, NaN rate and bootstrap interval of every metric, over all the questions and by category
+    results = {metric_name: scores[metric_name] for metric_name in metric_names if metric_name in scores}
+    results["category"] = [category or DEFAULT_CATEGORY for category in categories]
+    return summarize_results(results, metric_names, group_by=["category"])
+
+
+def write_evaluation_results(frame: pd.DataFrame, categories: List[Optional[str]], results_location: str,
+                             run_id: str, metric_names: List[str]) -> Dict:
+    from utils.results_store import write_results
+
+    region = get_required_setting("Region", REGION)
+    application_id = get_required_setting("QBusinessApplicationId", APPLICATION_ID)
+    with span("WriteResults"):
+        return write_results(frame, categories, results_location, region, application_id, run_id, metric_names)
@@ -0,0 +1,60 @@
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from utils.score_aggregation import DEFAULT_BOOTSTRAP_SAMPLES, DEFAULT_CONFIDENCE, encode_groups, summarize_scores
+
+# a 0.04 wide interval, the mean +-0.02, tells a 0.02 move of a metric apart from the sampling noise
+DEFAULT_TARGET_WIDTH = 0.04
+DEFAULT_ROUND_SIZE = 50
+# the intervals of a few questions are not reliable enough to stop on, a handful of perfect scores has a 0 wide one
+DEFAULT_MIN_QUESTIONS = 30
+
+
+def get_stratified_order(categories: Sequence[Optional[str]], seed: Optional[int] = 0) -> np.ndarray:
+    """
+    Order in which to score the testset entries, every prefix of it holds about the share of every category in the
+    testset, and the entries of a category come in a random order.
+    """
+    codes, names = encode_groups(list(categories))
+    if len(codes) == 0:
+        return np.array([], dtype=np.intp)
+    rng = np.random.default_rng(seed)
+    counts = np.bincount(codes, minlength=len(names))
+    shuffled = rng.permutation(len(codes))
+    by_category = shuffled[np.argsort(codes[shuffled], kind="stable")]
+    sorted_codes = codes[by_category]
+    ranks = np.arange(len(codes)) - (np.cumsum(counts) - counts)[sorted_codes]
+    # the k-th drawn entry of a category of n entries goes at (k + offset) / n of the order, systematic sampling
+    positions = (ranks + rng.random(len(names))[sorted_codes]) / counts[sorted_codes]
+    return by_category[np.argsort(positions, kind="stable")]
+
+
+def get_interval_widths(records: List[Dict[str, Any]],
+                        metric_names: Sequence[str],
+                        population_size: int,
+                        confidence: float = DEFAULT_CONFIDENCE,
+                        bootstrap_samples: int = DEFAULT_BOOTSTRAP_SAMPLES,
+                        seed: Optional[int] = 0) -> Dict[str, float]:
+    """
+    Width of the bootstrap confidence interval of the mean of every metric over the scored records, shrunk by the
+    finite population correction, so scoring the whole testset gives 0 wide intervals. NaN without any valid score.
+    """
+    widths = {}
+    scored_count = len(records)
+    correction = math.sqrt(max(population_size - scored_count, 0) / (population_size - 1)) \
+        if population_size > 1 else 0.0
+    for metric_name in metric_names:
+        summary = summarize_scores([record.get(metric_name) for record in records], confidence=confidence,
+                                   bootstrap_samples=bootstrap_samples, seed=seed).get("all")
+        if summary is None or math.isnan(summary["ci_low"]):
+            widths[metric_name] = math.nan
+        else:
+            widths[metric_name] = (summary["ci_high"] - summary["ci_low"]) * correction
+    return widths
+
+
+def has_reached_target_width(widths: Dict[str, float], target_width: float) -> bool:
+    # NaN widths, metrics that failed on every question so far, never reach the target
+    return all(width <= target_width for width in widths.values())
@@ -0,0 +1,87 @@
+import io
+import json
+import os
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+from adapters.qbusiness_adapter import QFetchResult
+from utils.client_registry import get_client
+from utils.dataset_utils import extract_text_snippets_from_sources_attributes
+from utils.logging_utils import setup_logging
+
+logger = setup_logging(__name__)
+
+ANSWERS_ARTIFACT_SCHEMA = pa.schema([
+    ("question", pa.string()),
+    ("ground_truth", pa.string()),
+    ("answer", pa.string()),
+    ("contexts", pa.list_(pa.string())),
+    ("latency_millis", pa.float64()),
+    ("category", pa.string()),
+])
+METADATA_KEY = b"q_evaluation"
+
+
+def create_answer_records(testset: List[Dict], fetch_result: QFetchResult) -> List[Dict]:
+    # questions Q Business failed to answer are left out of the artifact
+    records = []
+    for entry, q_record in zip(testset, fetch_result.records):
+        response = q_record.response
+        if response is None:
+            continue
+        records.append({"question": entry["question"],
+                        "ground_truth": entry["ground_truth"],
+                        "answer": response["systemMessage"],
+                        "contexts": extract_text_snippets_from_sources_attributes(response["sourceAttributions"]),
+                        "latency_millis": q_record.latency_millis,
+                        "category": entry.get("category")})
+    return records
+
+
+def _split_s3_location(location: str):
+    bucket, _, key = location[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def write_answers_artifact(records: List[Dict], location: str, region: str, metadata: Optional[Dict] = None):
+    """Writes the answer records as a zstd compressed parquet file to a local path or a s3:// location."""
+    table = pa.Table.from_pylist(records, schema=ANSWERS_ARTIFACT_SCHEMA)
+    table = table.replace_schema_metadata({METADATA_KEY: json.dumps(metadata or {})})
+    logger.info(f"Writing {len(records)} answers to {location}")
+    if not location.startswith("s3://"):
+        os.makedirs(os.path.dirname(os.path.abspath(location)), exist_ok=True)
+        pq.write_table(table, location, compression="zstd")
+        return
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd")
+    bucket, key = _split_s3_location(location)
+    try:
+        get_client("s3", region).put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+    except ClientError as e:
+        logger.error(f"Failed to write answers artifact to {location} due to {e}")
+        raise e
+
+
+def _read_table(location: str, region: str) -> pa.Table:
+    if not location.startswith("s3://"):
+        return pq.read_table(location)
+    bucket, key = _split_s3_location(location)
+    try:
+        response = get_client("s3", region).get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        logger.error(f"Failed to read answers artifact from {location} due to {e}")
+        raise e
+    return pq.read_table(io.BytesIO(response["Body"].read()))
+
+
+def read_answers_artifact(location: str, region: str) -> List[Dict]:
+    return _read_table(location, region).to_pylist()
+
+
+def read_answers_artifact_metadata(location: str, region: str) -> Dict:
+    schema_metadata = _read_table(location, region).schema.metadata or {}
+    return json.loads(schema_metadata.get(METADATA_KEY, b"{}"))
@@ -1,10 +1,13 @@
 import base64
 import hashlib
 import hmac
+import time
+from typing import Optional, Tuple
 
-import boto3
 from botocore.exceptions import ClientError
 
+from utils.client_registry import get_client
+from utils.credentials_cache import CredentialsCache
 from utils.logging_utils import setup_logging
 
 logger = setup_logging(__name__)
@@ -15,20 +18,28 @@ class AuthenticationUtils:
                  account_id: str,
                  user_pool_id: str,
                  client_id: str,
-                 identity_pool_id: str, ):
+                 identity_pool_id: str,
+                 credentials_cache: Optional[CredentialsCache] = None):
         self.region = region
         self.account_id = account_id
         self.user_pool_id = user_pool_id
         self.client_id = client_id
         self.identity_pool_id = identity_pool_id
+        self.credentials_cache = credentials_cache
 
-        self.cognito_idp_client = boto3.client('cognito-idp', region_name=region)
-        self.cognito_identity_client = boto3.client("cognito-identity", region_name=region)
+        self.cognito_idp_client = get_client('cognito-idp', region)
+        self.cognito_identity_client = get_client("cognito-identity", region)
 
     def get_token_id_for_cognito_user(self, username: str, password: str):
+        if self.credentials_cache is None:
+            return self._get_token_id_with_expiration(username, password)[0]
+        return self.credentials_cache.get(("cognito-id-token", self.user_pool_id, self.client_id, username),
+                                          lambda: self._get_token_id_with_expiration(username, password))
+
+    def _get_token_id_with_expiration(self, username: str, password: str) -> Tuple[str, float]:
         response = self._sign_in_cognito_user(username, password)
         if "IdToken" in response:
-            return response["IdToken"]
+            return response["IdToken"], time.time() + response.get("ExpiresIn", 0)
         raise Exception("Failed to get IdToken!")
 
     def _sign_in_cognito_user(self, username: str, password: str):
@@ -77,6 +88,13 @@ class AuthenticationUtils:
         return get_open_id_response["Token"]
 
     def _get_client_secret(self):
+        if self.credentials_cache is None:
+            return self._describe_client_secret()
+        # the client secret does not expire, it is read once per warm container
+        return self.credentials_cache.get_with_ttl(("cognito-client-secret", self.user_pool_id, self.client_id),
+                                                   self._describe_client_secret)
+
+    def _describe_client_secret(self):
         try:
             response = self.cognito_idp_client.describe_user_pool_client(
                 UserPoolId=self.user_pool_id,
@@ -0,0 +1,358 @@
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from langchain_core.callbacks import Callbacks
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.outputs import LLMResult
+from ragas.evaluation import Result
+from ragas.llms.prompt import PromptValue
+
+from utils.client_registry import get_client
+from utils.llm_cache import CachedLLMWrapper, InMemoryLLMResponseStore
+from utils.logging_utils import setup_logging
+
+logger = setup_logging(__name__)
+
+MANIFEST_NAME = "manifest.json"
+OUTPUT_SUFFIX = ".jsonl.out"
+# Bedrock batch inference job statuses after which the job writes no more outputs
+TERMINAL_JOB_STATUSES = {"Completed", "PartiallyCompleted", "Failed", "Stopped", "Expired"}
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+# same default as ChatBedrock, so batch and live judges answer the same prompts alike
+DEFAULT_MAX_TOKENS = 1024
+
+
+class BatchStorage(ABC):
+    """Where the batch job inputs, outputs and manifests live, Bedrock batch inference only reads and writes S3."""
+
+    @abstractmethod
+    def read(self, name: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def write(self, name: str, content: str):
+        ...
+
+    @abstractmethod
+    def list_names(self, prefix: str) -> List[str]:
+        ...
+
+    @abstractmethod
+    def get_uri(self, name: str) -> str:
+        ...
+
+
+class LocalBatchStorage(BatchStorage):
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def read(self, name: str) -> Optional[str]:
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def write(self, name: str, content: str):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    def list_names(self, prefix: str) -> List[str]:
+        names = []
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                name = os.path.relpath(os.path.join(root, file_name), self.directory).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    names.append(name)
+        return sorted(names)
+
+    def get_uri(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+
+class S3BatchStorage(BatchStorage):
+    def __init__(self, region: str, bucket: str, prefix: str = ""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.s3_client = get_client("s3", region)
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def read(self, name: str) -> Optional[str]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(name))
+            return response["Body"].read().decode("utf-8")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            logger.error(f"Failed to read batch file {name} from bucket {self.bucket} due to {e}")
+            raise e
+
+    def write(self, name: str, content: str):
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self._key(name), Body=content.encode("utf-8"))
+        except ClientError as e:
+            logger.error(f"Failed to write batch file {name} to bucket {self.bucket} due to {e}")
+            raise e
+
+    def list_names(self, prefix: str) -> List[str]:
+        names: List[str] = []
+        key_prefix = self._key("")
+        for page in self.s3_client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket,
+                                                                             Prefix=self._key(prefix)):
+            names.extend(item["Key"][len(key_prefix):] for item in page.get("Contents", []))
+        return sorted(names)
+
+    def get_uri(self, name: str) -> str:
+        return f"s3://{self.bucket}/{self._key(name)}"
+
+
+def create_batch_storage(location: str, region: str) -> BatchStorage:
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://"):].partition("/")
+        return S3BatchStorage(region, bucket, prefix)
+    return LocalBatchStorage(location)
+
+
+class BatchJobRunner(ABC):
+    @abstractmethod
+    def submit(self, job_name: str, model_id: str, input_uri: str, output_uri: str) -> str:
+        ...
+
+    @abstractmethod
+    def get_status(self, job_id: str) -> str:
+        ...
+
+
+class BedrockBatchJobRunner(BatchJobRunner):
+    def __init__(self, region: str, role_arn: str):
+        # the role Bedrock assumes to read the inputs and write the outputs
+        self.role_arn = role_arn
+        # built from the bundled Bedrock service model, which has the batch inference operations
+        self.bedrock_client = get_client("bedrock", region)
+
+    def submit(self, job_name: str, model_id: str, input_uri: str, output_uri: str) -> str:
+        try:
+            response = self.bedrock_client.create_model_invocation_job(
+                jobName=job_name,
+                roleArn=self.role_arn,
+                modelId=model_id,
+                inputDataConfig={"s3InputDataConfig": {"s3Uri": input_uri}},
+                outputDataConfig={"s3OutputDataConfig": {"s3Uri": output_uri}})
+        except ClientError as e:
+            logger.error(f"Failed to create the batch inference job {job_name} due to {e}")
+            raise e
+        return response["jobArn"]
+
+    def get_status(self, job_id: str) -> str:
+        try:
+            return self.bedrock_client.get_model_invocation_job(jobIdentifier=job_id)["status"]
+        except ClientError as e:
+            logger.error(f"Failed to get the status of the batch inference job {job_id} due to {e}")
+            raise e
+
+
+class PendingBatchPrompt(Exception):
+    """The judge prompt has no answer yet, ragas scores the metric as NaN until a batch job answers it."""
+
+
+def create_model_input(prompt: str, temperature: float, stop: Optional[List[str]] = None,
+                       max_tokens: int = DEFAULT_MAX_TOKENS) -> Dict:
+    model_input = {"anthropic_version": ANTHROPIC_VERSION,
+                   "max_tokens": max_tokens,
+                   "temperature": temperature,
+                   "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}]}
+    if stop:
+        model_input["stop_sequences"] = stop
+    return model_input
+
+
+def get_output_text(model_output: Dict) -> str:
+    return "".join(block.get("text", "") for block in model_output.get("content", []))
+
+
+class BatchLLMWrapper(CachedLLMWrapper):
+    """
+    Answers the judge prompts from the outputs of the finished batch jobs only, the prompts without an answer are
+    collected for the next job.
+    """
+
+    def __init__(self, langchain_llm: BaseLanguageModel, model_id: str):
+        if "anthropic." not in model_id:
+            raise Exception(f"Batch scoring renders Anthropic messages requests, {model_id} is not supported")
+        # sampling calls are answered from the batch outputs too, there is no live model to fall back to
+        super().__init__(langchain_llm, model_id, InMemoryLLMResponseStore(), max_cached_temperature=float("inf"))
+        self.pending: Dict[str, Dict] = {}
+
+    def _get_batch_answer(self, prompt: PromptValue, n: int, temperature: Optional[float],
+                          stop: Optional[List[str]]) -> LLMResult:
+        key = self._get_cache_key(prompt, n, temperature, stop)
+        if key is None:
+            raise Exception("Every judge prompt of a batch run has a cache key, none bypass the batch outputs")
+        result = self._get_cached_result(key)
+        if result is not None:
+            return result
+        with self._stats_lock:
+            self.pending[key] = {"prompt": prompt.to_string(), "n": n, "stop": stop,
+                                 "temperature": self.get_temperature(n=n) if temperature is None else temperature}
+        raise PendingBatchPrompt(key)
+
+    def generate_text(self, prompt: PromptValue, n: int = 1, temperature: Optional[float] = None,
+                      stop: Optional[List[str]] = None, callbacks: Callbacks = None) -> LLMResult:
+        return self._get_batch_answer(prompt, n, temperature, stop)
+
+    async def agenerate_text(self, prompt: PromptValue, n: int = 1, temperature: Optional[float] = None,
+                             stop: Optional[List[str]] = None, callbacks: Callbacks = None) -> LLMResult:
+        return self._get_batch_answer(prompt, n, temperature, stop)
+
+    async def generate(self, prompt: PromptValue, n: int = 1, temperature: Optional[float] = None,
+                       stop: Optional[List[str]] = None, callbacks: Callbacks = None,
+                       is_async: bool = True) -> LLMResult:
+        # no ragas retries, a pending prompt only gets its answer from the next batch job
+        if temperature is None:
+            temperature = 1e-8
+        return self._get_batch_answer(prompt, n, temperature, stop)
+
+    def create_batch_records(self, max_tokens: int = DEFAULT_MAX_TOKENS) -> List[Dict]:
+        # one record per generation, Bedrock answers every record once
+        records: List[Dict] = []
+        for key, request in sorted(self.pending.items()):
+            model_input = create_model_input(request["prompt"], request["temperature"], request["stop"], max_tokens)
+            records.extend({"recordId": f"{key}#{i}", "modelInput": model_input} for i in range(request["n"]))
+        return records
+
+
+class BatchScorer:
+    """
+    Scores a dataset with Bedrock batch inference, in rounds. Every round evaluates the dataset with the answers of the
+    finished batch jobs and submits the prompts still without an answer as the next job, the prompts that depend on
+    earlier answers, like the faithfulness verdicts of the extracted statements, are found by the following round.
+
+    The jobs of a run are recorded in its manifest, so a run resumes from its finished and running jobs, and the prompts
+    a failed or partially completed job did not answer go to the next job.
+    """
+    DEFAULT_MAX_ROUNDS = 4
+    DEFAULT_POLL_INTERVAL_SECONDS = 60.0
+
+    def __init__(self, storage: BatchStorage, job_runner: BatchJobRunner, run_id: str,
+                 max_rounds: int = DEFAULT_MAX_ROUNDS,
+                 poll_interval_seconds: float = DEFAULT_POLL_INTERVAL_SECONDS,
+                 max_wait_seconds: Optional[float] = None,
+                 max_tokens: int = DEFAULT_MAX_TOKENS,
+                 sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic):
+        self.storage = storage
+        self.job_runner = job_runner
+        self.run_id = run_id
+        self.max_rounds = max_rounds
+        self.poll_interval_seconds = poll_interval_seconds
+        # how long a call waits for the running job, None waits until it is done
+        self.max_wait_seconds = max_wait_seconds
+        self.max_tokens = max_tokens
+        self._sleep = sleep
+        self._clock = clock
+        self.running_job_id: Optional[str] = None
+        self.submitted_jobs = 0
+
+    def _load_manifest(self, model_id: str) -> Dict:
+        content = self.storage.read(f"{self.run_id}/{MANIFEST_NAME}")
+        if content is None:
+            return {"model_id": model_id, "jobs": []}
+        manifest = json.loads(content)
+        if manifest["model_id"] != model_id:
+            raise Exception(f"Batch run {self.run_id} was started with the {manifest['model_id']} judge model")
+        return manifest
+
+    def _save_manifest(self, manifest: Dict):
+        self.storage.write(f"{self.run_id}/{MANIFEST_NAME}", json.dumps(manifest))
+
+    def _wait_for_job(self, job: Dict, deadline: Optional[float]) -> bool:
+        while True:
+            job["status"] = self.job_runner.get_status(job["job_id"])
+            if job["status"] in TERMINAL_JOB_STATUSES:
+                logger.info(f"Batch job {job['job_id']} of run {self.run_id} finished as {job['status']}")
+                return True
+            if deadline is not None and self._clock() + self.poll_interval_seconds > deadline:
+                return False
+            self._sleep(self.poll_interval_seconds)
+
+    def _load_job_outputs(self, job: Dict, llm_wrapper: BatchLLMWrapper) -> int:
+        generations: Dict[str, Dict[int, str]] = defaultdict(dict)
+        for name in self.storage.list_names(job["output_prefix"]):
+            if not name.endswith(OUTPUT_SUFFIX):
+                continue
+            content = self.storage.read(name)
+            if content is None:
+                continue
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if "modelOutput" not in record:
+                    # failed records are asked again by the next job
+                    continue
+                key, _, index = record["recordId"].rpartition("#")
+                generations[key][int(index)] = get_output_text(record["modelOutput"])
+        answered = 0
+        for key, texts in generations.items():
+            n = job["generations"].get(key)
+            if n is not None and all(i in texts for i in range(n)):
+                llm_wrapper.store.put(key, [texts[i] for i in range(n)])
+                answered += 1
+        return answered
+
+    def _submit_job(self, manifest: Dict, llm_wrapper: BatchLLMWrapper):
+        job_round = len(manifest["jobs"])
+        round_prefix = f"{self.run_id}/round-{job_round:02d}"
+        records = llm_wrapper.create_batch_records(self.max_tokens)
+        input_name = f"{round_prefix}/input.jsonl"
+        self.storage.write(input_name, "\n".join(json.dumps(record) for record in records) + "\n")
+        job_id = self.job_runner.submit(f"q-evaluation-{self.run_id[:32]}-{job_round}", llm_wrapper.model_id,
+                                        self.storage.get_uri(input_name),
+                                        self.storage.get_uri(f"{round_prefix}/output/"))
+        self.submitted_jobs += 1
+        logger.info(f"Submitted batch job {job_id} with {len(records)} records for round {job_round}"
+                    + f" of run {self.run_id}")
+        manifest["jobs"].append({"job_id": job_id,
+                                 "status": "Submitted",
+                                 "output_prefix": f"{round_prefix}/output/",
+                                 "generations": {key: request["n"] for key, request in llm_wrapper.pending.items()}})
+        self._save_manifest(manifest)
+
+    def score(self, evaluate: Callable[[], Result], llm_wrapper: BatchLLMWrapper) -> Optional[Result]:
+        """Returns the results once no prompt is pending or after max_rounds jobs, None while a job is running."""
+        deadline = None if self.max_wait_seconds is None else self._clock() + self.max_wait_seconds
+        manifest = self._load_manifest(llm_wrapper.model_id)
+        while True:
+            for job in manifest["jobs"]:
+                if job["status"] not in TERMINAL_JOB_STATUSES and not self._wait_for_job(job, deadline):
+                    self._save_manifest(manifest)
+                    self.running_job_id = job["job_id"]
+                    logger.info(f"Batch job {job['job_id']} of run {self.run_id} is still {job['status']}")
+                    return None
+            self._save_manifest(manifest)
+            self.running_job_id = None
+            answered = sum(self._load_job_outputs(job, llm_wrapper) for job in manifest["jobs"])
+
+            llm_wrapper.pending.clear()
+            evaluation_results = evaluate()
+            logger.info(f"Round {len(manifest['jobs'])} of batch run {self.run_id}: {answered} prompts answered,"
+                        + f" {len(llm_wrapper.pending)} pending")
+            if not llm_wrapper.pending:
+                return evaluation_results
+            if len(manifest["jobs"]) >= self.max_rounds:
+                logger.warning(f"Batch run {self.run_id} still has {len(llm_wrapper.pending)} prompts without an"
+                               + f" answer after {self.max_rounds} jobs, their metrics are left empty")
+                return evaluation_results
+            self._submit_job(manifest, llm_wrapper)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"BatchJobsSubmitted": self.submitted_jobs}
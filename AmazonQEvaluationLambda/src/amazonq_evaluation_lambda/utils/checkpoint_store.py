@@ -0,0 +1,97 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+from utils.client_registry import get_client
+from utils.logging_utils import setup_logging
+
+logger = setup_logging(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+
+class CheckpointStore(ABC):
+    @abstractmethod
+    def _read(self, name: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def _write(self, name: str, content: str):
+        ...
+
+    @staticmethod
+    def _shard_name(run_id: str, shard_index: int) -> str:
+        return f"{run_id}/shard-{shard_index:05d}.json"
+
+    def load_manifest(self, run_id: str) -> Optional[Dict]:
+        content = self._read(f"{run_id}/{MANIFEST_NAME}")
+        return json.loads(content) if content is not None else None
+
+    def save_manifest(self, run_id: str, manifest: Dict):
+        self._write(f"{run_id}/{MANIFEST_NAME}", json.dumps(manifest))
+
+    def load_shard(self, run_id: str, shard_index: int) -> Optional[List[Dict]]:
+        content = self._read(self._shard_name(run_id, shard_index))
+        return json.loads(content) if content is not None else None
+
+    def save_shard(self, run_id: str, shard_index: int, records: List[Dict]):
+        logger.info(f"Saving checkpoint for shard {shard_index} of run {run_id}")
+        self._write(self._shard_name(run_id, shard_index), json.dumps(records))
+
+
+class LocalCheckpointStore(CheckpointStore):
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _read(self, name: str) -> Optional[str]:
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+
+    def _write(self, name: str, content: str):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename so an interrupted run never leaves a half written checkpoint behind
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+class S3CheckpointStore(CheckpointStore):
+    def __init__(self, region: str, bucket: str, prefix: str = ""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.s3_client = get_client("s3", region)
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def _read(self, name: str) -> Optional[str]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(name))
+            return response["Body"].read().decode("utf-8")
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            logger.error(f"Failed to read checkpoint {name} from bucket {self.bucket} due to {e}")
+            raise e
+
+    def _write(self, name: str, content: str):
+        try:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self._key(name), Body=content.encode("utf-8"))
+        except ClientError as e:
+            logger.error(f"Failed to write checkpoint {name} to bucket {self.bucket} due to {e}")
+            raise e
+
+
+def create_checkpoint_store(location: str, region: str) -> CheckpointStore:
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://"):].partition("/")
+        return S3CheckpointStore(region, bucket, prefix)
+    return LocalCheckpointStore(location)
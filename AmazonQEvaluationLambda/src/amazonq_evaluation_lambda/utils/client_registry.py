@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import boto3
+import botocore.session
+from botocore.config import Config
+
+from utils.instrumentation import instrument_client
+from utils.logging_utils import setup_logging
+from utils.token_accounting import account_client_tokens
+
+logger = setup_logging(__name__)
+
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+# service models shipped with the function, the Bedrock batch inference operations are missing from the boto3
+# releases langchain-aws 0.1 allows
+BOTOCORE_DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "botocore_data")
+BUNDLED_SERVICE_MODELS = {"bedrock"}
+
+
+def create_boto3_client(service_name: str, **client_kwargs):
+    if service_name not in BUNDLED_SERVICE_MODELS:
+        return boto3.client(service_name, **client_kwargs)
+    botocore_session = botocore.session.get_session()
+    botocore_session.get_component("data_loader").search_paths.insert(0, BOTOCORE_DATA_PATH)
+    return boto3.Session(botocore_session=botocore_session).client(service_name, **client_kwargs)
+
+
+class ClientRegistry:
+    """
+    Caches boto3 clients by (service, region, credential identity, pool size) so the adapters reuse
+    clients, and their warm HTTP connections, across lambda invocations.
+
+    Clients built from temporary credentials are dropped once those credentials expire, so rotated
+    credentials always get a fresh client.
+    """
+
+    def __init__(self, max_clients: int = 32):
+        self.max_clients = max_clients
+        self._clients: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _expiration_timestamp(credentials: Optional[Dict]) -> Optional[float]:
+        expiration = credentials.get("Expiration") if credentials else None
+        return expiration.timestamp() if isinstance(expiration, datetime) else None
+
+    def _evict_expired_clients(self):
+        now = time.time()
+        expired_keys = [key for key, entry in self._clients.items()
+                        if entry["expires_at"] is not None and entry["expires_at"] <= now]
+        for key in expired_keys:
+            logger.info(f"Dropping {key[0]} client built from expired credentials")
+            del self._clients[key]
+
+    def get_client(self,
+                   service_name: str,
+                   region: str,
+                   credentials: Optional[Dict] = None,
+                   max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS):
+        credential_identity = credentials["AccessKeyId"] if credentials else None
+        key = (service_name, region, credential_identity, max_pool_connections)
+        with self._lock:
+            self._evict_expired_clients()
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients.move_to_end(key)
+                return entry["client"]
+
+            client_kwargs = {"region_name": region,
+                             "config": Config(max_pool_connections=max_pool_connections)}
+            if credentials:
+                client_kwargs.update(aws_access_key_id=credentials["AccessKeyId"],
+                                     aws_secret_access_key=credentials["SecretAccessKey"],
+                                     aws_session_token=credentials["SessionToken"])
+            client = create_boto3_client(service_name, **client_kwargs)
+            instrument_client(client)
+            account_client_tokens(client)
+            self._clients[key] = {"client": client, "expires_at": self._expiration_timestamp(credentials)}
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return client
+
+    def invalidate(self, credentials: Dict):
+        with self._lock:
+            for key in [key for key in self._clients if key[2] == credentials["AccessKeyId"]]:
+                del self._clients[key]
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+
+client_registry = ClientRegistry()
+
+
+def get_client(service_name: str,
+               region: str,
+               credentials: Optional[Dict] = None,
+               max_pool_connections: int = DEFAULT_MAX_POOL_CONNECTIONS):
+    return client_registry.get_client(service_name, region, credentials, max_pool_connections)
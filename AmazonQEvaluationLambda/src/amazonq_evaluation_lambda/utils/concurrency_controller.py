@@ -0,0 +1,144 @@
+import functools
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from botocore.exceptions import ClientError
+
+from utils.logging_utils import setup_logging
+
+logger = setup_logging(__name__)
+
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "Throttling",
+                          "ServiceUnavailableException", "ModelNotReadyException"}
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+class AIMDConcurrencyController:
+    """
+    Additive increase, multiplicative decrease of a concurrency setpoint between `min_concurrency` and
+    `max_concurrency`.
+
+    Every successful call grows the limit by `additive_increase / limit`, about `additive_increase` per round of
+    calls. A throttle, or a smoothed latency above `latency_spike_factor` times the baseline latency, multiplies the
+    limit by `backoff_factor`, at most once per round so a burst of throttles from the same round only counts once.
+    """
+
+    def __init__(self,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 16,
+                 initial_concurrency: Optional[int] = None,
+                 additive_increase: float = 1.0,
+                 backoff_factor: float = 0.7,
+                 latency_spike_factor: float = 2.0,
+                 latency_smoothing: float = 0.2,
+                 baseline_decay: float = 0.05):
+        if not 1 <= min_concurrency <= max_concurrency:
+            raise Exception(f"Invalid concurrency bounds [{min_concurrency}, {max_concurrency}]")
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        initial_concurrency = initial_concurrency if initial_concurrency is not None else min_concurrency
+        self.limit = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.additive_increase = additive_increase
+        self.backoff_factor = backoff_factor
+        self.latency_spike_factor = latency_spike_factor
+        self.latency_smoothing = latency_smoothing
+        self.baseline_decay = baseline_decay
+        # judge latencies vary with the answer length, so spikes are detected on a moving average
+        self.smoothed_latency: Optional[float] = None
+        # lowest smoothed latency, it only drifts up at the minimum concurrency, where the slowness is not ours
+        self.baseline_latency: Optional[float] = None
+        self.throttles = 0
+        self.latency_spikes = 0
+        self._calls_since_decrease = 0
+        self._lock = threading.Lock()
+
+    @property
+    def setpoint(self) -> int:
+        return int(self.limit)
+
+    def _decrease(self):
+        if self._calls_since_decrease < self.setpoint:
+            return
+        self._calls_since_decrease = 0
+        self.limit = max(float(self.min_concurrency), self.limit * self.backoff_factor)
+
+    def on_success(self, latency_seconds: float):
+        with self._lock:
+            self._calls_since_decrease += 1
+            if self.smoothed_latency is None:
+                self.smoothed_latency = latency_seconds
+            self.smoothed_latency += (latency_seconds - self.smoothed_latency) * self.latency_smoothing
+            if self.baseline_latency is None or self.smoothed_latency < self.baseline_latency:
+                self.baseline_latency = self.smoothed_latency
+            elif self.setpoint <= self.min_concurrency:
+                self.baseline_latency += (self.smoothed_latency - self.baseline_latency) * self.baseline_decay
+            if self.smoothed_latency > self.latency_spike_factor * self.baseline_latency:
+                self.latency_spikes += 1
+                self._decrease()
+                return
+            self.limit = min(float(self.max_concurrency), self.limit + self.additive_increase / self.limit)
+
+    def on_throttle(self):
+        with self._lock:
+            self._calls_since_decrease += 1
+            self.throttles += 1
+            self._decrease()
+
+
+class AdaptiveConcurrencyLimiter:
+    """Blocks callers past the controller setpoint and feeds the outcome of every call back to the controller."""
+
+    def __init__(self, controller: AIMDConcurrencyController, clock: Callable[[], float] = time.monotonic):
+        self.controller = controller
+        self.in_flight = 0
+        self._clock = clock
+        self._condition = threading.Condition()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        with self._condition:
+            while self.in_flight >= self.controller.setpoint:
+                self._condition.wait()
+            self.in_flight += 1
+        start = self._clock()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if is_throttling_error(e):
+                self.controller.on_throttle()
+            raise e
+        else:
+            self.controller.on_success(self._clock() - start)
+            return result
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                # the setpoint may have grown, wake every waiter rather than one
+                self._condition.notify_all()
+
+
+class ConcurrencyLimitedBedrockClient:
+    """Passes the bedrock-runtime model invocations through the limiter, anything else goes straight to the client."""
+
+    def __init__(self, client: Any, limiter: AdaptiveConcurrencyLimiter):
+        self._client = client
+        self.limiter = limiter
+
+    def invoke_model(self, **kwargs):
+        return self.limiter.call(self._client.invoke_model, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_concurrency_limiter(model_id: str,
+                            min_concurrency: int,
+                            max_concurrency: int,
+                            initial_concurrency: int) -> AdaptiveConcurrencyLimiter:
+    # one limiter per model and container, so warm invocations start from the setpoint the last one reached
+    logger.info(f"Creating concurrency limiter for {model_id} between {min_concurrency} and {max_concurrency}")
+    return AdaptiveConcurrencyLimiter(AIMDConcurrencyController(min_concurrency, max_concurrency, initial_concurrency))
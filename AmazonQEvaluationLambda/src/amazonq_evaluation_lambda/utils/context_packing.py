@@ -0,0 +1,96 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List
+
+from utils.logging_utils import setup_logging
+
+logger = setup_logging(__name__)
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+SHINGLE_SIZE = 3
+# the judge tokenizers are not available in the lambda, about 4 characters per token for english text
+CHARACTERS_PER_TOKEN = 4
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARACTERS_PER_TOKEN)
+
+
+def get_shingles(text: str, size: int = SHINGLE_SIZE) -> FrozenSet:
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return frozenset([tuple(words)])
+    return frozenset(tuple(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def get_similarity(shingles: FrozenSet, other_shingles: FrozenSet) -> float:
+    if not shingles or not other_shingles:
+        return float(shingles == other_shingles)
+    return len(shingles & other_shingles) / len(shingles | other_shingles)
+
+
+@dataclass
+class ContextPackingStats:
+    questions: int = 0
+    snippets: int = 0
+    duplicate_snippets: int = 0
+    over_budget_snippets: int = 0
+    input_tokens: int = 0
+    packed_tokens: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.input_tokens - self.packed_tokens
+
+
+class ContextPacker:
+    """
+    Removes the exact and near duplicate snippets of every question, by the Jaccard similarity of their word shingles,
+    and keeps the snippets in the Q attribution order up to a token budget per question.
+    """
+
+    def __init__(self, similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD, token_budget: int = 0):
+        # 0 keeps the duplicates, 1 only removes the snippets with the same words
+        self.similarity_threshold = similarity_threshold
+        # 0 for no budget, the first snippet is always kept
+        self.token_budget = token_budget
+        self.stats = ContextPackingStats()
+
+    def pack(self, snippets: List[str]) -> List[str]:
+        packed_snippets: List[str] = []
+        kept_shingles: List[FrozenSet] = []
+        packed_tokens = 0
+        for snippet in snippets:
+            snippet_tokens = estimate_tokens(snippet)
+            self.stats.input_tokens += snippet_tokens
+            if self.similarity_threshold > 0:
+                shingles = get_shingles(snippet)
+                if any(get_similarity(shingles, kept) >= self.similarity_threshold for kept in kept_shingles):
+                    self.stats.duplicate_snippets += 1
+                    continue
+                kept_shingles.append(shingles)
+            if self.token_budget > 0 and packed_snippets and packed_tokens + snippet_tokens > self.token_budget:
+                self.stats.over_budget_snippets += 1
+                continue
+            packed_snippets.append(snippet)
+            packed_tokens += snippet_tokens
+        self.stats.questions += 1
+        self.stats.snippets += len(snippets)
+        self.stats.packed_tokens += packed_tokens
+        return packed_snippets
+
+    def pack_all(self, contexts: List[List[str]]) -> List[List[str]]:
+        packed_contexts = [self.pack(snippets) for snippets in contexts]
+        logger.info(f"Packed the contexts of {len(contexts)} questions, {self.stats.duplicate_snippets} duplicate and"
+                    + f" {self.stats.over_budget_snippets} over budget snippets removed,"
+                    + f" about {self.stats.tokens_saved} context tokens saved so far")
+        return packed_contexts
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"ContextSnippets": self.stats.snippets,
+                "ContextDuplicateSnippets": self.stats.duplicate_snippets,
+                "ContextOverBudgetSnippets": self.stats.over_budget_snippets,
+                "ContextInputTokens": self.stats.input_tokens,
+                "ContextTokensSaved": self.stats.tokens_saved}
@@ -0,0 +1,83 @@
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from botocore.exceptions import ClientError
+
+from utils.logging_utils import setup_logging
+
+logger = setup_logging(__name__)
+
+# errors of a rotated secret or of credentials that expired or lost their permissions
+AUTH_ERROR_CODES = {"ExpiredToken", "ExpiredTokenException", "AccessDenied", "AccessDeniedException",
+                    "NotAuthorizedException", "UnrecognizedClientException", "InvalidClientTokenId"}
+
+
+def is_auth_error(error: BaseException) -> bool:
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get("Code") in AUTH_ERROR_CODES
+
+
+def get_expiration_timestamp(credentials: Dict) -> float:
+    # STS credentials carry their Expiration as a datetime, anything else is not cached
+    expiration = credentials.get("Expiration")
+    if isinstance(expiration, datetime):
+        return expiration.timestamp()
+    return 0.0
+
+
+class CredentialsCache:
+    """
+    Thread-safe cache for credentials and tokens that outlives a single lambda invocation.
+
+    Entries are refreshed by the first get within `refresh_margin_seconds` of their expiration, so a
+    warm invocation never starts working with credentials that are about to expire. Only one caller
+    refreshes a given key at a time, the others wait for the refreshed value. Entries rejected by an
+    auth error are invalidated by the caller and loaded again.
+    """
+    DEFAULT_REFRESH_MARGIN_SECONDS = 300
+
+    def __init__(self,
+                 refresh_margin_seconds: float = DEFAULT_REFRESH_MARGIN_SECONDS,
+                 clock: Callable[[], float] = time.time):
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._clock = clock
+        self._entries: Dict[Hashable, Tuple[Any, float]] = {}
+        self._key_locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _get_key_lock(self, key: Hashable) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _get_valid_entry(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is not None and self._clock() < entry[1] - self.refresh_margin_seconds:
+            return entry
+        return None
+
+    def get(self, key: Hashable, loader: Callable[[], Tuple[Any, float]]) -> Any:
+        """Returns the cached value for key, calling loader for a (value, expiration timestamp) when needed."""
+        entry = self._get_valid_entry(key)
+        if entry is not None:
+            return entry[0]
+        with self._get_key_lock(key):
+            entry = self._get_valid_entry(key)
+            if entry is not None:
+                return entry[0]
+            logger.info(f"Refreshing cached credentials for {key[0] if isinstance(key, tuple) else key}")
+            value, expires_at = loader()
+            self._entries[key] = (value, expires_at)
+            return value
+
+    def get_with_ttl(self, key: Hashable, loader: Callable[[], Any], ttl_seconds: float = math.inf) -> Any:
+        return self.get(key, lambda: (loader(), self._clock() + ttl_seconds))
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,11 +1,19 @@
-from datasets import Dataset
-from typing import List, Dict
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Dict
+
+if TYPE_CHECKING:
+    from datasets import Dataset
+    from adapters.qbusiness_adapter import QAnswerRecord
 
 
 def create_evaluation_dataset(questions: List[str],
                               answers: List[str],
                               ground_truth: List[str],
                               contexts: List[List[str]]) -> Dataset:
+    # the answers artifact only needs the snippet helpers, datasets is loaded for the evaluation alone
+    from datasets import Dataset
+
     testcases = {
         'question': questions,
         'answer': answers,
@@ -15,20 +23,26 @@ def create_evaluation_dataset(questions: List[str],
     return Dataset.from_dict(testcases)
 
 
-def get_answers_from_q(q_app_responses: Dict) -> List[str]:
+def get_answers_from_q(q_app_records: List[QAnswerRecord]) -> List[str]:
     answers = []
-    for q, resp in q_app_responses.items():
-        answers.append(resp["systemMessage"])
+    for record in q_app_records:
+        answers.append(_get_response(record)["systemMessage"])
     return answers
 
 
-def get_contexts_from_q(q_app_responses: Dict) -> List[List[str]]:
+def get_contexts_from_q(q_app_records: List[QAnswerRecord]) -> List[List[str]]:
     contexts = []
-    for q, resp in q_app_responses.items():
-        contexts.append(extract_text_snippets_from_sources_attributes(resp["sourceAttributions"]))
+    for record in q_app_records:
+        contexts.append(extract_text_snippets_from_sources_attributes(_get_response(record)["sourceAttributions"]))
     return contexts
 
 
+def _get_response(record: QAnswerRecord) -> Dict:
+    if record.response is None:
+        raise Exception(f"Question '{record.question}' was not answered by Q Business")
+    return record.response
+
+
 def extract_text_snippets_from_sources_attributes(source_attributions: Dict) -> List[str]:
     snippets = []
     for snippet in source_attributions:
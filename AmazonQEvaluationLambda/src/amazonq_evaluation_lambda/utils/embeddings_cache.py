@@ -0,0 +1,206 @@
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from langchain_core.embeddings import Embeddings
+
+from utils.client_registry import get_client
+from utils.logging_utils import setup_logging
+
+logger = setup_logging(__name__)
+
+DEFAULT_MEMORY_CACHE_SIZE = 10_000
+
+
+def get_embedding_key(model_id: str, text: str, kind: str = "document") -> str:
+    return f"{model_id}/{kind}/{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+class EmbeddingStore(ABC):
+    @abstractmethod
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        ...
+
+    @abstractmethod
+    def put_many(self, vectors: Dict[str, List[float]]):
+        ...
+
+
+class SqliteEmbeddingStore(EmbeddingStore):
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._connection.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        vectors = {}
+        with self._lock:
+            # stay below sqlite's bound parameters limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                for key, blob in rows:
+                    vectors[key] = array("d", blob).tolist()
+        return vectors
+
+    def put_many(self, vectors: Dict[str, List[float]]):
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                         [(key, array("d", vector).tobytes()) for key, vector in vectors.items()])
+            self._connection.commit()
+
+
+class S3EmbeddingStore(EmbeddingStore):
+    MAX_CONCURRENT_REQUESTS = 8
+
+    def __init__(self, region: str, bucket: str, prefix: str = ""):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.s3_client = get_client("s3", region, max_pool_connections=self.MAX_CONCURRENT_REQUESTS)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}.json" if self.prefix else f"{key}.json"
+
+    def _get(self, key: str) -> Optional[List[float]]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+            return json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise e
+
+    def _put(self, key: str, vector: List[float]):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=json.dumps(vector))
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        # the S3 calls are recorded in the instrumentation of the calling invocation
+        with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_REQUESTS) as executor:
+            futures = [executor.submit(copy_context().run, self._get, key) for key in keys]
+            vectors = [future.result() for future in futures]
+        return {key: vector for key, vector in zip(keys, vectors) if vector is not None}
+
+    def put_many(self, vectors: Dict[str, List[float]]):
+        with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_REQUESTS) as executor:
+            futures = [executor.submit(copy_context().run, self._put, key, vector) for key, vector in vectors.items()]
+            for future in futures:
+                future.result()
+
+
+class EmbeddingCache:
+    """In-memory LRU tier in front of a persistent EmbeddingStore."""
+
+    def __init__(self, store: Optional[EmbeddingStore], max_memory_entries: int = DEFAULT_MEMORY_CACHE_SIZE):
+        self.store = store
+        self.max_memory_entries = max_memory_entries
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, vectors: Dict[str, List[float]]):
+        with self._lock:
+            for key, vector in vectors.items():
+                self._memory[key] = vector
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, List[float]]]:
+        """Returns the cached vectors split by the tier that served them."""
+        memory_hits = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    memory_hits[key] = self._memory[key]
+        missing_keys = [key for key in keys if key not in memory_hits]
+        store_hits = self.store.get_many(missing_keys) if self.store is not None and missing_keys else {}
+        self._remember(store_hits)
+        return {"memory": memory_hits, "store": store_hits}
+
+    def put_many(self, vectors: Dict[str, List[float]]):
+        self._remember(vectors)
+        if self.store is not None and vectors:
+            self.store.put_many(vectors)
+
+
+def create_embedding_store(location: str, region: str) -> EmbeddingStore:
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://"):].partition("/")
+        return S3EmbeddingStore(region, bucket, prefix)
+    return SqliteEmbeddingStore(location)
+
+
+@functools.lru_cache(maxsize=None)
+def get_embedding_cache(location: str, region: str, max_memory_entries: int = DEFAULT_MEMORY_CACHE_SIZE) -> EmbeddingCache:
+    # one cache per location and container, so warm invocations keep the in-memory tier
+    return EmbeddingCache(create_embedding_store(location, region), max_memory_entries)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper keyed by (model id, sha256 of the text).
+
+    Only the distinct texts missing from both cache tiers are sent to the wrapped embeddings. Bedrock embeds every
+    text with its own InvokeModel call, so each of them counts as an embedding call.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_id: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.cache = cache
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.embedding_calls = 0
+        self._stats_lock = threading.Lock()
+
+    def _embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        keys = [get_embedding_key(self.model_id, text, kind) for text in texts]
+        unique_keys = list(dict.fromkeys(keys))
+        cached = self.cache.get_many(unique_keys)
+        vectors = {**cached["memory"], **cached["store"]}
+
+        missing_texts = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if missing_texts:
+            if kind == "query":
+                new_vectors = [self.embeddings.embed_query(text) for text in missing_texts.values()]
+            else:
+                new_vectors = self.embeddings.embed_documents(list(missing_texts.values()))
+            computed = dict(zip(missing_texts.keys(), new_vectors))
+            self.cache.put_many(computed)
+            vectors.update(computed)
+
+        with self._stats_lock:
+            self.memory_hits += len(cached["memory"])
+            self.store_hits += len(cached["store"])
+            self.misses += len(missing_texts)
+            self.embedding_calls += len(missing_texts)
+        return [vectors[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, "document")
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text], "query")[0]
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {"EmbeddingCacheHits": self.memory_hits + self.store_hits,
+                    "EmbeddingCacheMemoryHits": self.memory_hits,
+                    "EmbeddingCacheStoreHits": self.store_hits,
+                    "EmbeddingCacheMisses": self.misses,
+                    "EmbeddingCalls": self.embedding_calls}
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.concurrency_controller import THROTTLING_ERROR_CODES, is_throttling_error
+
+
+class LatencyHistogram:
+    """Log-scale buckets, each about 19% wider than the previous one, so percentiles stay within 19% at any scale."""
+
+    BUCKETS_PER_DOUBLING = 4
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+
+    def _bucket(self, millis: float) -> int:
+        return math.ceil(math.log2(millis) * self.BUCKETS_PER_DOUBLING) if millis > 1 else 0
+
+    def _upper_bound(self, bucket: int) -> float:
+        return 2 ** (bucket / self.BUCKETS_PER_DOUBLING)
+
+    def add(self, millis: float):
+        bucket = self._bucket(millis)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+
+    def percentile(self, percent: float) -> float:
+        if not self.total:
+            return 0.0
+        rank = math.ceil(self.total * percent / 100)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return self._upper_bound(bucket)
+        return self._upper_bound(max(self.counts))
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.total_millis = 0.0
+        self.max_millis = 0.0
+        self.histogram = LatencyHistogram()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count,
+                "errors": self.errors,
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "total_millis": round(self.total_millis, 3),
+                "p50_millis": min(self.histogram.percentile(50), self.max_millis),
+                "p95_millis": min(self.histogram.percentile(95), self.max_millis),
+                "p99_millis": min(self.histogram.percentile(99), self.max_millis),
+                "max_millis": round(self.max_millis, 3)}
+
+
+class Instrumentation:
+    """
+    Aggregates the durations, errors, throttles and retries of every stage in memory, so recording a span only costs a
+    lock and a few additions, and `flush` writes one summary per stage and dimensions to the sink.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self._stages: Dict[tuple, StageStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, duration_millis: float, error: bool = False, throttles: int = 0, retries: int = 0,
+               **dimensions: str):
+        self.record_stage(stage, duration_millis, error, throttles, retries, dimensions)
+
+    def record_stage(self, stage: str, duration_millis: float, error: bool, throttles: int, retries: int,
+                     dimensions: Dict[str, str]):
+        key = (stage, tuple(sorted(dimensions.items())))
+        with self._lock:
+            stats = self._stages.get(key)
+            if stats is None:
+                stats = self._stages[key] = StageStats()
+            stats.count += 1
+            stats.errors += int(error)
+            stats.throttles += throttles
+            stats.retries += retries
+            stats.total_millis += duration_millis
+            stats.max_millis = max(stats.max_millis, duration_millis)
+            stats.histogram.add(duration_millis)
+
+    @contextmanager
+    def span(self, stage: str, **dimensions: str):
+        start = self._clock()
+        try:
+            yield
+        except Exception as e:
+            self.record_stage(stage, (self._clock() - start) * 1000, True, int(is_throttling_error(e)), 0, dimensions)
+            raise e
+        self.record_stage(stage, (self._clock() - start) * 1000, False, 0, 0, dimensions)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"stage": stage, "dimensions": dict(dimensions), **stats.to_dict()}
+                    for (stage, dimensions), stats in sorted(self._stages.items())]
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def flush(self, sink):
+        stages = self.snapshot()
+        self.reset()
+        if stages:
+            sink.write(stages)
+        return stages
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    # the embedded metrics loggers flush on the thread event loop, threads other than the main one have none by default
+    try:
+        return asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        return loop
+
+
+class EmfSink:
+    """One embedded metrics event per stage, with the stage and its dimensions as CloudWatch dimensions."""
+
+    def __init__(self, dimensions: Dict[str, str]):
+        self.dimensions = dimensions
+
+    def write(self, stages: List[Dict[str, Any]]):
+        from aws_embedded_metrics.logger.metrics_logger_factory import create_metrics_logger
+
+        for stage in stages:
+            metrics = create_metrics_logger()
+            metrics.set_dimensions({**self.dimensions, "Stage": stage["stage"], **stage["dimensions"]})
+            for name in ("count", "errors", "throttles", "retries"):
+                metrics.put_metric(name.capitalize(), stage[name], "Count")
+            for name in ("p50", "p95", "p99", "max"):
+                metrics.put_metric(f"Latency{name.capitalize()}", stage[f"{name}_millis"], "Milliseconds")
+            get_event_loop().run_until_complete(metrics.flush())
+
+
+class JsonLinesSink:
+    """Appends the stages of every flush as a JSON line, for offline runs."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write(self, stages: List[Dict[str, Any]]):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"timestamp": time.time(), "stages": stages}) + "\n")
+
+
+def get_sink(json_location: Optional[str], dimensions: Dict[str, str]):
+    return JsonLinesSink(json_location) if json_location else EmfSink(dimensions)
+
+
+# Records the stages of the work done outside of an invocation scope
+instrumentation = Instrumentation()
+
+# Set for every invocation, concurrent invocations of a warm process each record and flush their own stages. Threads
+# started by the invocation copy the context, the Q fetch and cache executors submit their work with copy_context
+_current_instrumentation: ContextVar[Optional[Instrumentation]] = ContextVar("instrumentation", default=None)
+
+
+def get_instrumentation() -> Instrumentation:
+    current_instrumentation = _current_instrumentation.get()
+    return current_instrumentation if current_instrumentation is not None else instrumentation
+
+
+@contextmanager
+def invocation_scope() -> Iterator[Instrumentation]:
+    invocation_instrumentation = Instrumentation()
+    token = _current_instrumentation.set(invocation_instrumentation)
+    try:
+        yield invocation_instrumentation
+    finally:
+        _current_instrumentation.reset(token)
+
+
+# boto3 client events, every AWS call is a span named after its service and operation
+def _on_before_call(event_name: str, params: Dict, context: Dict, **kwargs):
+    context["instrumentation_start"] = time.perf_counter()
+    # the invocation making the call, the client itself is shared by the invocations
+    context["instrumentation"] = get_instrumentation()
+    # judge and embeddings models are both invoked with InvokeModel
+    if "modelId" in params:
+        context["instrumentation_dimensions"] = {"ModelId": params["modelId"]}
+
+
+def _on_after_call(event_name: str, parsed: Dict, context: Dict, http_response: Any = None, **kwargs):
+    start = context.pop("instrumentation_start", None)
+    if start is None:
+        return
+    error_code = parsed.get("Error", {}).get("Code")
+    status_code = getattr(http_response, "status_code", 200)
+    context.pop("instrumentation").record_stage(event_name.split(".", 1)[1],
+                                                (time.perf_counter() - start) * 1000,
+                                                error_code is not None or status_code >= 300,
+                                                int(error_code in THROTTLING_ERROR_CODES),
+                                                parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+                                                context.pop("instrumentation_dimensions", {}))
+
+
+def _on_after_call_error(event_name: str, context: Dict, **kwargs):
+    start = context.pop("instrumentation_start", None)
+    if start is not None:
+        context.pop("instrumentation").record_stage(event_name.split(".", 1)[1], (time.perf_counter() - start) * 1000,
+                                                    True, 0, 0, context.pop("instrumentation_dimensions", {}))
+
+
+def instrument_client(client: Any):
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is None:
+        return
+    events.register("before-parameter-build", _on_before_call)
+    events.register("after-call", _on_after_call)
+    events.register("after-call-error", _on_after_call_error)
+
+
+def span(stage: str, **dimensions: str):
+    return get_instrumentation().span(stage, **dimensions)
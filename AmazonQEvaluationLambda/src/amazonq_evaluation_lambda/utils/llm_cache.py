@@ -0,0 +1,226 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+from langchain_core.callbacks import Callbacks
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.outputs import Generation, LLMResult
+from ragas.llms import LangchainLLMWrapper
+from ragas.llms.prompt import PromptValue
+from ragas.run_config import RunConfig
+
+from utils.client_registry import get_client
+from utils.logging_utils import setup_logging
+
+logger = setup_logging(__name__)
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 100_000
+# ragas asks for 1e-8 when it wants deterministic answers
+DEFAULT_MAX_CACHED_TEMPERATURE = 1e-6
+
+
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def get_llm_cache_key(model_id: str, temperature: float, n: int, stop: Optional[List[str]], prompt: str) -> str:
+    prompt_hash = hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+    key_fields = json.dumps([model_id, round(temperature, 6), n, stop or [], prompt_hash])
+    return f"{model_id}/{hashlib.sha256(key_fields.encode('utf-8')).hexdigest()}"
+
+
+class LLMResponseStore(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[List[str]]:
+        ...
+
+    @abstractmethod
+    def put(self, key: str, generations: List[str]):
+        ...
+
+
+class InMemoryLLMResponseStore(LLMResponseStore):
+    def __init__(self):
+        self._generations: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            return self._generations.get(key)
+
+    def put(self, key: str, generations: List[str]):
+        with self._lock:
+            self._generations[key] = generations
+
+
+class SqliteLLMResponseStore(LLMResponseStore):
+    """Evicts entries older than ttl_seconds, then the least recently used ones above max_entries."""
+
+    def __init__(self, path: str,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._clock = clock
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS llm_responses (key TEXT PRIMARY KEY,"
+                                 + " generations TEXT NOT NULL, created_at REAL NOT NULL, last_accessed REAL NOT NULL)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS llm_responses_last_accessed"
+                                 + " ON llm_responses (last_accessed)")
+        self._connection.commit()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        now = self._clock()
+        with self._lock:
+            row = self._connection.execute("SELECT generations, created_at FROM llm_responses WHERE key = ?",
+                                           (key,)).fetchone()
+            if row is None or row[1] + self.ttl_seconds <= now:
+                return None
+            self._connection.execute("UPDATE llm_responses SET last_accessed = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, generations: List[str]):
+        now = self._clock()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?)",
+                                     (key, json.dumps(generations), now, now))
+            self._evict(now)
+            self._connection.commit()
+
+    def _evict(self, now: float):
+        self._connection.execute("DELETE FROM llm_responses WHERE created_at <= ?", (now - self.ttl_seconds,))
+        excess = self._connection.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._connection.execute("DELETE FROM llm_responses WHERE key IN"
+                                     + " (SELECT key FROM llm_responses ORDER BY last_accessed LIMIT ?)", (excess,))
+
+
+class S3LLMResponseStore(LLMResponseStore):
+    """Entries expire after ttl_seconds, size limits are left to a lifecycle rule on the bucket."""
+
+    def __init__(self, region: str, bucket: str, prefix: str = "",
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS,
+                 clock: Callable[[], float] = time.time):
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self.s3_client = get_client("s3", region)
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}.json" if self.prefix else f"{key}.json"
+
+    def get(self, key: str) -> Optional[List[str]]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None
+            raise e
+        entry = json.loads(response["Body"].read())
+        if entry["created_at"] + self.ttl_seconds <= self._clock():
+            return None
+        return entry["generations"]
+
+    def put(self, key: str, generations: List[str]):
+        entry = {"generations": generations, "created_at": self._clock()}
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=json.dumps(entry))
+
+
+def create_llm_response_store(location: str, region: str) -> LLMResponseStore:
+    if location.startswith("s3://"):
+        bucket, _, prefix = location[len("s3://"):].partition("/")
+        return S3LLMResponseStore(region, bucket, prefix)
+    return SqliteLLMResponseStore(location)
+
+
+@functools.lru_cache(maxsize=None)
+def get_llm_response_store(location: str, region: str) -> LLMResponseStore:
+    return create_llm_response_store(location, region)
+
+
+class CachedLLMWrapper(LangchainLLMWrapper):
+    """
+    LangchainLLMWrapper that memoizes the judge model answers by model id, temperature and normalized prompt.
+
+    Calls made with a temperature above max_cached_temperature are sampling calls and always reach the model.
+    """
+
+    def __init__(self, langchain_llm: BaseLanguageModel, model_id: str, store: LLMResponseStore,
+                 max_cached_temperature: float = DEFAULT_MAX_CACHED_TEMPERATURE,
+                 run_config: Optional[RunConfig] = None):
+        super().__init__(langchain_llm, run_config)
+        self.model_id = model_id
+        self.store = store
+        self.max_cached_temperature = max_cached_temperature
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, stat_name: str):
+        with self._stats_lock:
+            setattr(self, stat_name, getattr(self, stat_name) + 1)
+
+    def _get_cache_key(self, prompt: PromptValue, n: int, temperature: Optional[float],
+                       stop: Optional[List[str]]) -> Optional[str]:
+        if temperature is None:
+            temperature = self.get_temperature(n=n)
+        if temperature > self.max_cached_temperature:
+            self._count("bypassed")
+            return None
+        return get_llm_cache_key(self.model_id, temperature, n, stop, prompt.to_string())
+
+    def _get_cached_result(self, key: Optional[str]) -> Optional[LLMResult]:
+        if key is None:
+            return None
+        generations = self.store.get(key)
+        if generations is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return LLMResult(generations=[[Generation(text=text) for text in generations]])
+
+    def _save_result(self, key: Optional[str], result: LLMResult):
+        if key is not None:
+            self.store.put(key, [generation.text for generation in result.generations[0]])
+
+    def generate_text(self, prompt: PromptValue, n: int = 1, temperature: Optional[float] = None,
+                      stop: Optional[List[str]] = None, callbacks: Callbacks = None) -> LLMResult:
+        key = self._get_cache_key(prompt, n, temperature, stop)
+        cached_result = self._get_cached_result(key)
+        if cached_result is not None:
+            return cached_result
+        result = super().generate_text(prompt, n, temperature, stop, callbacks)
+        self._save_result(key, result)
+        return result
+
+    async def agenerate_text(self, prompt: PromptValue, n: int = 1, temperature: Optional[float] = None,
+                             stop: Optional[List[str]] = None, callbacks: Callbacks = None) -> LLMResult:
+        key = self._get_cache_key(prompt, n, temperature, stop)
+        # the stores block on a sqlite commit or an S3 request, the other judge calls of the event loop go on meanwhile
+        cached_result = await asyncio.to_thread(self._get_cached_result, key)
+        if cached_result is not None:
+            return cached_result
+        result = await super().agenerate_text(prompt, n, temperature, stop, callbacks)
+        await asyncio.to_thread(self._save_result, key, result)
+        return result
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {"LLMCacheHits": self.hits, "LLMCacheMisses": self.misses, "LLMCacheBypassed": self.bypassed}
@@ -0,0 +1,54 @@
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from ragas.llms import BaseRagasLLM
+from ragas.metrics import AnswerCorrectness, AnswerRelevancy, AnswerSimilarity, ContextEntityRecall, \
+    ContextPrecision, ContextRecall, ContextUtilization, Faithfulness
+from ragas.metrics.base import Metric, MetricWithEmbeddings, MetricWithLLM
+
+# ragas also exports one module-level instance of every metric, they are never used so concurrent evaluations with
+# different judges do not overwrite each other's llm and embeddings
+METRIC_CLASSES: Dict[str, Callable[[], Metric]] = {
+    "answer_relevancy": AnswerRelevancy,
+    "faithfulness": Faithfulness,
+    "context_recall": ContextRecall,
+    "context_precision": ContextPrecision,
+    "answer_similarity": AnswerSimilarity,
+    "answer_correctness": AnswerCorrectness,
+    "context_utilization": ContextUtilization,
+    "context_entity_recall": ContextEntityRecall,
+}
+
+DEFAULT_METRIC_PRESET = "default"
+METRIC_PRESETS: Dict[str, List[str]] = {
+    DEFAULT_METRIC_PRESET: ["answer_relevancy", "faithfulness", "context_recall", "context_precision"],
+    # no judge call, only the embeddings of the answers and ground truths, for fast smoke runs
+    "embeddings_only": ["answer_similarity"],
+    "retrieval": ["context_recall", "context_precision"],
+}
+
+
+def get_metric_names(metric_names: Optional[List[str]] = None, metric_preset: Optional[str] = None) -> List[str]:
+    if metric_names is None:
+        metric_preset = metric_preset or DEFAULT_METRIC_PRESET
+        if metric_preset not in METRIC_PRESETS:
+            raise Exception(f"Unknown metric preset {metric_preset}. Valid values are {list(METRIC_PRESETS)}")
+        return list(METRIC_PRESETS[metric_preset])
+    unknown_metrics = [name for name in metric_names if name not in METRIC_CLASSES]
+    if unknown_metrics:
+        raise Exception(f"Unknown metrics {unknown_metrics}. Valid values are {list(METRIC_CLASSES)}")
+    return list(metric_names)
+
+
+def create_metrics(metric_names: List[str],
+                   llm: Optional[BaseRagasLLM] = None,
+                   embeddings: Optional[Embeddings] = None) -> List[Metric]:
+    metrics = []
+    for name in get_metric_names(metric_names):
+        metric = METRIC_CLASSES[name]()
+        if isinstance(metric, MetricWithLLM):
+            metric.llm = llm
+        if isinstance(metric, MetricWithEmbeddings):
+            metric.embeddings = embeddings
+        metrics.append(metric)
+    return metrics
@@ -1,49 +1,294 @@
+import re
+import time
+from contextvars import Token
+
 import nest_asyncio
 from datasets import Dataset
 from langchain_aws import BedrockEmbeddings
 from langchain_aws import ChatBedrock
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
 from ragas.evaluation import Result
 from ragas.llms import LangchainLLMWrapper
 from ragas import evaluate, RunConfig
 from ragas.metrics.base import Metric
 
-from typing import List
+from typing import Dict, List, Optional
+from uuid import UUID
+
+from utils.batch_scoring import BatchLLMWrapper, BatchScorer, PendingBatchPrompt
+from utils.client_registry import get_client
+from utils.concurrency_controller import AdaptiveConcurrencyLimiter, ConcurrencyLimitedBedrockClient, \
+    is_throttling_error
+from utils.context_packing import ContextPacker
+from utils.embeddings_cache import CachedEmbeddings, get_embedding_cache
+from utils.instrumentation import Instrumentation, get_instrumentation, span
+from utils.llm_cache import CachedLLMWrapper, get_llm_response_store
+from utils.token_accounting import TokenAccountant, TokenScope, TokenUsage, enter_scope, exit_scope
+
+
+class MetricSpanCallbackHandler(BaseCallbackHandler):
+    """
+    Times every metric scoring a row (stage MetricScore) and the judge calls it makes (stage JudgeCall), ragas runs each
+    metric of a row as a chain named after the metric.
+    """
+    # called from the event loop, not from an executor, the handler only updates dicts
+    run_inline = True
+
+    def __init__(self, metric_names: List[str], stage_instrumentation: Optional[Instrumentation] = None):
+        self.metric_names = set(metric_names)
+        # the instrumentation of the invocation evaluating the dataset
+        self.instrumentation = stage_instrumentation or get_instrumentation()
+        self._parent_runs: Dict[UUID, Optional[UUID]] = {}
+        self._metric_runs: Dict[UUID, str] = {}
+        self._started_at: Dict[UUID, float] = {}
+
+    def _get_metric_name(self, run_id: Optional[UUID]) -> Optional[str]:
+        while run_id is not None and run_id not in self._metric_runs:
+            run_id = self._parent_runs.get(run_id)
+        return self._metric_runs.get(run_id) if run_id is not None else None
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID]):
+        self._parent_runs[run_id] = parent_run_id
+        self._started_at[run_id] = time.perf_counter()
+
+    def _end(self, stage: str, run_id: UUID, metric_name: Optional[str], error: Optional[BaseException] = None):
+        started_at = self._started_at.pop(run_id, None)
+        self._parent_runs.pop(run_id, None)
+        self._metric_runs.pop(run_id, None)
+        if metric_name is None or started_at is None:
+            return
+        if isinstance(error, PendingBatchPrompt):
+            # scored by a later batch round, not an error
+            error = None
+        self.instrumentation.record(stage, (time.perf_counter() - started_at) * 1000, error=error is not None,
+                                    throttles=int(error is not None and is_throttling_error(error)),
+                                    Metric=metric_name)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id)
+        if (serialized or {}).get("name") in self.metric_names:
+            self._metric_runs[run_id] = serialized["name"]
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end("MetricScore", run_id, self._metric_runs.get(run_id))
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end("MetricScore", run_id, self._metric_runs.get(run_id), error)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._end("JudgeCall", run_id, self._get_metric_name(run_id))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end("JudgeCall", run_id, self._get_metric_name(run_id), error)
+
+
+class TokenAccountingCallbackHandler(BaseCallbackHandler):
+    """
+    Attributes the Bedrock tokens of every metric scoring a row to that metric and row, and refuses to start scoring
+    once the token budget is reached, ragas then scores the metric as NaN.
+    """
+    run_inline = True
+    # lets TokenBudgetExceeded reach ragas instead of being logged by langchain
+    raise_error = True
+    ROW_RUN_NAME = re.compile(r"row (\d+)")
+
+    def __init__(self, metric_names: List[str], accountant: TokenAccountant):
+        self.metric_names = set(metric_names)
+        self.accountant = accountant
+        self.row_usage: Dict[int, TokenUsage] = {}
+        self._row_runs: Dict[UUID, int] = {}
+        self._scopes: Dict[UUID, Token] = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        name = (serialized or {}).get("name")
+        row_run_name = self.ROW_RUN_NAME.fullmatch(name or "")
+        if row_run_name:
+            self._row_runs[run_id] = int(row_run_name.group(1))
+        elif name in self.metric_names:
+            self.accountant.check_budget(name)
+            row_usage = None
+            if parent_run_id in self._row_runs:
+                row_usage = self.row_usage.setdefault(self._row_runs[parent_run_id], TokenUsage())
+            # the metric chain starts and ends in the task scoring the metric, the scope does not leak to other rows
+            self._scopes[run_id] = enter_scope(TokenScope(self.accountant, name, row_usage))
+
+    def _end(self, run_id: UUID):
+        self._row_runs.pop(run_id, None)
+        token = self._scopes.pop(run_id, None)
+        if token is not None:
+            exit_scope(token)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
 
 
 class RagasUtils:
     MAX_WORKERS_COUNT = 2
 
-    def __init__(self, region: str, bedrock_embedding_model_id: str, bedrock_llm_model_id: str):
+    def __init__(self, region: str, bedrock_embedding_model_id: str, bedrock_llm_model_id: str,
+                 embeddings_cache_location: Optional[str] = None,
+                 llm_cache_location: Optional[str] = None,
+                 judge_concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+                 embeddings_concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+                 token_accountant: Optional[TokenAccountant] = None,
+                 context_packer: Optional[ContextPacker] = None,
+                 batch_scorer: Optional[BatchScorer] = None):
         self.region = region
         self.bedrock_embedding_model_id = bedrock_embedding_model_id
         self.bedrock_llm_model_id = bedrock_llm_model_id
+        # a local sqlite file or an s3:// prefix, embeddings are not cached when unset
+        self.embeddings_cache_location = embeddings_cache_location
+        self.cached_embeddings: Optional[CachedEmbeddings] = None
+        # same for the judge llm answers
+        self.llm_cache_location = llm_cache_location
+        self.cached_llm_wrapper: Optional[CachedLLMWrapper] = None
+        # the Bedrock calls adapt their concurrency to throttling, MAX_WORKERS_COUNT is used when unset
+        self.judge_concurrency_limiter = judge_concurrency_limiter
+        self.embeddings_concurrency_limiter = embeddings_concurrency_limiter
+        # the Bedrock token usage of every evaluation, by model, metric and question, tokens are not counted when unset
+        self.token_accountant = token_accountant
+        # the Q snippets are scored as returned when unset
+        self.context_packer = context_packer
+        # the judge prompts go to Bedrock batch inference jobs instead of live calls when set
+        self.batch_scorer = batch_scorer
+        self.judge_llm: Optional[LangchainLLMWrapper] = None
+        self.embeddings: Optional[Embeddings] = None
+
+    # shared by the embeddings and the llm so both reuse the same connections
+    def _get_bedrock_runtime_client(self, concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None):
+        bedrock_runtime_client = get_client("bedrock-runtime", self.region)
+        if concurrency_limiter is None:
+            return bedrock_runtime_client
+        return ConcurrencyLimitedBedrockClient(bedrock_runtime_client, concurrency_limiter)
 
     # turning test into numerical vector
     def _get_bedrock_embeddings(self):
-        return BedrockEmbeddings(
+        bedrock_embeddings = BedrockEmbeddings(
+            client=self._get_bedrock_runtime_client(self.embeddings_concurrency_limiter),
             model_id=self.bedrock_embedding_model_id,
             region_name=self.region)
+        if not self.embeddings_cache_location:
+            return bedrock_embeddings
+        self.cached_embeddings = CachedEmbeddings(
+            bedrock_embeddings,
+            self.bedrock_embedding_model_id,
+            get_embedding_cache(self.embeddings_cache_location, self.region))
+        return self.cached_embeddings
+
+    def get_cache_stats(self) -> Dict[str, int]:
+        cache_stats = {}
+        if self.cached_embeddings is not None:
+            cache_stats.update(self.cached_embeddings.get_stats())
+        if self.cached_llm_wrapper is not None:
+            cache_stats.update(self.cached_llm_wrapper.get_stats())
+        return cache_stats
+
+    def get_concurrency_stats(self) -> Dict[str, int]:
+        concurrency_stats = {}
+        if self.judge_concurrency_limiter is not None:
+            concurrency_stats["JudgeConcurrencySetpoint"] = self.judge_concurrency_limiter.controller.setpoint
+        if self.embeddings_concurrency_limiter is not None:
+            concurrency_stats["EmbeddingsConcurrencySetpoint"] = \
+                self.embeddings_concurrency_limiter.controller.setpoint
+        return concurrency_stats
+
+    def _get_max_workers(self) -> int:
+        # enough ragas workers for the limiters to reach their upper bound, they hold back the calls past the setpoint
+        max_workers = [limiter.controller.max_concurrency
+                       for limiter in (self.judge_concurrency_limiter, self.embeddings_concurrency_limiter)
+                       if limiter is not None]
+        return max(max_workers, default=self.MAX_WORKERS_COUNT)
 
     # used for metrics evaluation
     def _get_bedrock_llm_model_wrapper(self):
         bedrock_model = ChatBedrock(
+            client=self._get_bedrock_runtime_client(self.judge_concurrency_limiter),
             region_name=self.region,
             endpoint_url=f"https://bedrock-runtime.{self.region}.amazonaws.com",
             model_id=self.bedrock_llm_model_id)
-        return LangchainLLMWrapper(bedrock_model)
+        if self.batch_scorer is not None:
+            return BatchLLMWrapper(bedrock_model, self.bedrock_llm_model_id)
+        if not self.llm_cache_location:
+            return LangchainLLMWrapper(bedrock_model)
+        self.cached_llm_wrapper = CachedLLMWrapper(
+            bedrock_model,
+            self.bedrock_llm_model_id,
+            get_llm_response_store(self.llm_cache_location, self.region))
+        return self.cached_llm_wrapper
 
-    def configure_metrics_to_use_bedrock(self, metrics: List[Metric]):
-        bedrock_llm_wrapper = self._get_bedrock_llm_model_wrapper()
-        bedrock_embeddings = self._get_bedrock_embeddings()
-        for m in metrics:
-            m.__setattr__("llm", bedrock_llm_wrapper)
-            m.__setattr__("embeddings", bedrock_embeddings)
+    # built once and shared by the metrics of this evaluation, see utils.metric_factory.create_metrics
+    def get_judge_llm(self):
+        if self.judge_llm is None:
+            self.judge_llm = self._get_bedrock_llm_model_wrapper()
+        return self.judge_llm
 
-    def evaluate_dataset(self, evaluation_dataset: Dataset, metrics: List[Metric]) -> Result:
+    def get_embeddings(self):
+        if self.embeddings is None:
+            self.embeddings = self._get_bedrock_embeddings()
+        return self.embeddings
+
+    def get_token_stats(self) -> Dict[str, float]:
+        if self.token_accountant is None:
+            return {}
+        return self.token_accountant.get_stats()
+
+    def get_context_packing_stats(self) -> Dict[str, int]:
+        if self.context_packer is None:
+            return {}
+        return self.context_packer.get_stats()
+
+    def pack_contexts(self, evaluation_dataset: Dataset) -> Dataset:
+        if self.context_packer is None or "contexts" not in evaluation_dataset.column_names:
+            return evaluation_dataset
+        # the results keep the column order of the dataset
+        columns = evaluation_dataset.to_dict()
+        columns["contexts"] = self.context_packer.pack_all(columns["contexts"])
+        return Dataset.from_dict(columns)
+
+    def get_batch_stats(self) -> Dict[str, int]:
+        if self.batch_scorer is None:
+            return {}
+        return self.batch_scorer.get_stats()
+
+    def evaluate_dataset(self, evaluation_dataset: Dataset, metrics: List[Metric]) -> Optional[Result]:
+        """In batch mode returns None while a batch job is still running, evaluate again to resume."""
         nest_asyncio.apply()
-        evaluation_results = evaluate(
-            evaluation_dataset,
-            metrics=metrics,
-            run_config=RunConfig(max_workers=self.MAX_WORKERS_COUNT),
-        )
+        evaluation_dataset = self.pack_contexts(evaluation_dataset)
+        if self.batch_scorer is None:
+            return self._evaluate(evaluation_dataset, metrics)
+        return self.batch_scorer.score(lambda: self._evaluate(evaluation_dataset, metrics), self.get_judge_llm())
+
+    def _evaluate(self, evaluation_dataset: Dataset, metrics: List[Metric]) -> Result:
+        metric_names = [metric.name for metric in metrics]
+        callbacks: List[BaseCallbackHandler] = [MetricSpanCallbackHandler(metric_names)]
+        if self.token_accountant is not None:
+            token_callback_handler = TokenAccountingCallbackHandler(metric_names, self.token_accountant)
+            callbacks.append(token_callback_handler)
+        with span("RagasEvaluate"):
+            evaluation_results = evaluate(
+                evaluation_dataset,
+                metrics=metrics,
+                run_config=RunConfig(max_workers=self._get_max_workers()),
+                callbacks=callbacks,
+            )
+        if self.token_accountant is not None:
+            add_token_usage_columns(evaluation_results, token_callback_handler.row_usage)
         return evaluation_results
+
+
+def add_token_usage_columns(evaluation_results: Result, row_usage: Dict[int, TokenUsage]):
+    # to_pandas joins the dataset and the scores, so every result record carries the tokens spent scoring it
+    usages = [row_usage.get(i, TokenUsage()) for i in range(len(evaluation_results.scores))]
+    for column in ("input_tokens", "output_tokens", "estimated_cost_usd"):
+        evaluation_results.scores = evaluation_results.scores.add_column(
+            column, [getattr(usage, column) for usage in usages])
@@ -0,0 +1,73 @@
+import threading
+import time
+from typing import Callable, Optional
+
+
+class TokenBucketRateLimiter:
+    """
+    Thread-safe token bucket shared by concurrent callers.
+
+    The refill rate drops multiplicatively on `penalize()` (e.g. after a throttling error)
+    and recovers additively on `reward()` until it is back to `max_rate`.
+    A `max_rate` of 0 or less disables rate limiting.
+    """
+
+    def __init__(self,
+                 max_rate: float,
+                 capacity: Optional[float] = None,
+                 min_rate: float = 0.1,
+                 backoff_factor: float = 0.5,
+                 recovery_step: float = 0.1,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.capacity = capacity if capacity is not None else max(max_rate, 1.0)
+        self.min_rate = min(min_rate, max_rate) if max_rate > 0 else min_rate
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_rate > 0
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Takes the tokens if available and returns 0, otherwise returns the seconds to wait."""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        wait_time = self.try_acquire(tokens)
+        while wait_time > 0:
+            self._sleep(wait_time)
+            wait_time = self.try_acquire(tokens)
+
+    def penalize(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+
+    def reward(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._refill()
+            self.rate = min(self.max_rate, self.rate + self.recovery_step * self.max_rate)
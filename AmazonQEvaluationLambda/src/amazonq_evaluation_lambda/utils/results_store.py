@@ -0,0 +1,199 @@
+import io
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import quote, unquote
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+from utils.client_registry import get_client
+from utils.logging_utils import setup_logging
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = setup_logging(__name__)
+
+# hive style directories, application_id=.../run_id=.../category=..., readable by athena and pyarrow datasets too
+PARTITION_COLUMNS = ["application_id", "run_id", "category"]
+TEXT_COLUMNS = ["question", "ground_truth", "answer"]
+DEFAULT_CATEGORY = "uncategorized"
+# one file per partition, writing the same run again replaces its files
+PART_NAME = "part-00000.parquet"
+
+
+def get_results_schema(metric_names: List[str]) -> pa.Schema:
+    return pa.schema([(column, pa.string()) for column in TEXT_COLUMNS]
+                     + [("contexts", pa.list_(pa.string()))]
+                     + [(metric_name, pa.float64()) for metric_name in metric_names])
+
+
+def create_results_table(frame: "pd.DataFrame", metric_names: List[str]) -> pa.Table:
+    schema = get_results_schema(metric_names)
+    # a metric without scores, e.g. refused by the token budget, is a column of nulls
+    frame = frame.reindex(columns=schema.names)
+    return pa.Table.from_pandas(frame, schema=schema, preserve_index=False).replace_schema_metadata(None)
+
+
+def _split_s3_location(location: str) -> Tuple[str, str]:
+    bucket, _, prefix = location[len("s3://"):].partition("/")
+    return bucket, prefix.strip("/")
+
+
+def get_partition_location(location: str, partitions: Dict[str, str]) -> str:
+    return "/".join([location.rstrip("/")]
+                    + [f"{column}={quote(str(partitions[column]), safe='')}" for column in PARTITION_COLUMNS
+                       if column in partitions])
+
+
+def _write_part(table: pa.Table, location: str, region: str):
+    if not location.startswith("s3://"):
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        pq.write_table(table, location, compression="zstd", use_dictionary=TEXT_COLUMNS)
+        return
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd", use_dictionary=TEXT_COLUMNS)
+    bucket, key = _split_s3_location(location)
+    try:
+        get_client("s3", region).put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+    except ClientError as e:
+        logger.error(f"Failed to write results to {location} due to {e}")
+        raise e
+
+
+def write_results(frame: "pd.DataFrame", categories: Sequence[Optional[str]], location: str, region: str,
+                  application_id: str, run_id: str, metric_names: List[str]) -> Dict:
+    """
+    Writes the evaluation results as zstd compressed parquet files, one per category of the run, with float score
+    columns and dictionary encoded text columns. Returns a summary pointing to the run.
+    """
+    table = create_results_table(frame, metric_names)
+    categories_array = pa.array([category or DEFAULT_CATEGORY for category in categories], pa.string())
+    run_location = get_partition_location(location, {"application_id": application_id, "run_id": run_id})
+    category_rows = {}
+    for category in categories_array.unique().to_pylist():
+        category_table = table.filter(pc.equal(categories_array, category))
+        category_rows[category] = category_table.num_rows
+        _write_part(category_table, f"{get_partition_location(run_location, {'category': category})}/{PART_NAME}",
+                    region)
+    logger.info(f"Wrote {table.num_rows} results of run {run_id} in {len(category_rows)} categories to {run_location}")
+    return {"results_location": run_location, "rows": table.num_rows, "category_rows": category_rows}
+
+
+class S3RangeReader(io.RawIOBase):
+    """Seekable file over a S3 object that only downloads the byte ranges read, the parquet footer and columns."""
+
+    def __init__(self, s3_client, bucket: str, key: str, size: int):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.size if size is None or size < 0 else min(self.size, self.position + size)
+        if end <= self.position:
+            return b""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key,
+                                                 Range=f"bytes={self.position}-{end - 1}")
+        except ClientError as e:
+            logger.error(f"Failed to read results from s3://{self.bucket}/{self.key} due to {e}")
+            raise e
+        data = response["Body"].read()
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _list_parts(location: str, region: str) -> List[Tuple[str, int]]:
+    """Path or s3:// location and size of every parquet file under the location."""
+    if not location.startswith("s3://"):
+        return sorted((os.path.join(directory, name), os.path.getsize(os.path.join(directory, name)))
+                      for directory, _, names in os.walk(location) for name in names if name.endswith(".parquet"))
+    bucket, prefix = _split_s3_location(location)
+    parts: List[Tuple[str, int]] = []
+    try:
+        paginator = get_client("s3", region).get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/" if prefix else ""):
+            parts.extend((f"s3://{bucket}/{item['Key']}", item["Size"]) for item in page.get("Contents", [])
+                         if item["Key"].endswith(".parquet"))
+    except ClientError as e:
+        logger.error(f"Failed to list results under {location} due to {e}")
+        raise e
+    return parts
+
+
+def get_partitions(part_location: str) -> Dict[str, str]:
+    partitions = {}
+    for segment in part_location.split("/")[:-1]:
+        column, separator, value = segment.partition("=")
+        if separator and column in PARTITION_COLUMNS:
+            partitions[column] = unquote(value)
+    return partitions
+
+
+def _open_part(part_location: str, size: int, region: str):
+    if not part_location.startswith("s3://"):
+        return part_location
+    bucket, key = _split_s3_location(part_location)
+    return S3RangeReader(get_client("s3", region), bucket, key, size)
+
+
+def read_results(location: str, region: str, columns: Optional[List[str]] = None,
+                 filters: Optional[Dict[str, Sequence[str]]] = None) -> pa.Table:
+    """
+    Reads the results under a location, only the columns asked for, the partition columns included, and only the
+    partitions whose values are in the filters, e.g. {"run_id": ["a1b2"], "category": ["billing"]}.
+    """
+    filters = filters or {}
+    for column in filters:
+        if column not in PARTITION_COLUMNS:
+            raise Exception(f"Invalid filter {column}. Valid values are {PARTITION_COLUMNS}")
+    data_columns = None if columns is None else [column for column in columns if column not in PARTITION_COLUMNS]
+
+    tables = []
+    for part_location, size in _list_parts(location, region):
+        partitions = get_partitions(part_location)
+        if any(partitions.get(column) not in values for column, values in filters.items()):
+            continue
+        read_dictionary = [column for column in TEXT_COLUMNS if data_columns is None or column in data_columns]
+        with pq.ParquetFile(_open_part(part_location, size, region), read_dictionary=read_dictionary) as parquet_file:
+            file_columns = None if data_columns is None else [column for column in data_columns
+                                                              if column in parquet_file.schema_arrow.names]
+            table = parquet_file.read(columns=file_columns)
+        for column in PARTITION_COLUMNS:
+            if column in partitions and (columns is None or column in columns):
+                values = pa.array([partitions[column]] * table.num_rows, pa.string()).dictionary_encode()
+                table = table.append_column(column, values)
+        tables.append(table)
+    if not tables:
+        return pa.table({column: pa.array([], pa.string()) for column in columns or []})
+    # runs scored with other metrics have other score columns, missing ones are read as nulls
+    results = pa.concat_tables(tables, promote_options="permissive")
+    return results.select([column for column in columns if column in results.column_names]) if columns else results
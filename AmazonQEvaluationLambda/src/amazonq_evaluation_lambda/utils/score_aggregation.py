@@ -0,0 +1,155 @@
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_BOOTSTRAP_SAMPLES = 1000
+# the bootstrap resamples a histogram of every group instead of its rows, so its cost does not grow with the rows.
+# 101 bins of [0, 1] scores move a score by 0.005 at most, and the intervals are centered back on the exact mean
+BOOTSTRAP_BINS = 101
+# multinomial draws held in memory at once, bootstrap_samples x groups x bins
+MAX_BOOTSTRAP_DRAWS = 4_000_000
+
+
+def encode_groups(labels: Any) -> Tuple[np.ndarray, List[str]]:
+    """Group code of every row and the label of every code, hashed by arrow rather than sorted."""
+    if isinstance(labels, pa.ChunkedArray):
+        labels = labels.combine_chunks()
+    elif not isinstance(labels, pa.Array):
+        labels = pa.array(labels)
+    if not pa.types.is_dictionary(labels.type):
+        labels = labels.dictionary_encode()
+    # rows without a label are grouped under "None"
+    codes = pc.fill_null(labels.indices, len(labels.dictionary)).to_numpy(zero_copy_only=False)
+    return codes.astype(np.intp), [str(name) for name in labels.dictionary.to_pylist()] + ["None"]
+
+
+def to_scores(values: Any) -> np.ndarray:
+    if isinstance(values, (pa.Array, pa.ChunkedArray)):
+        # arrow float columns read their nulls as NaN
+        return values.to_numpy(zero_copy_only=False).astype(np.float64)
+    return np.asarray(values, dtype=np.float64)
+
+
+def _get_percentiles(scores: np.ndarray, codes: np.ndarray, valid_counts: np.ndarray,
+                     percentiles: Sequence[float]) -> np.ndarray:
+    """Linearly interpolated percentiles of every group, like np.percentile, from a single sort of all the rows."""
+    if len(scores) == 0:
+        return np.full((len(valid_counts), len(percentiles)), np.nan)
+    # every group is shifted past the scores of the previous one, so sorting the values sorts by group then score
+    low, offset = scores.min(), scores.max() - scores.min() + 1
+    sorted_scores = np.sort(codes * offset + (scores - low)) - np.repeat(np.arange(len(valid_counts)) * offset,
+                                                                         valid_counts) + low
+    starts = np.cumsum(valid_counts) - valid_counts
+    positions = (np.maximum(valid_counts, 1)[:, None] - 1) * (np.asarray(percentiles, dtype=float)[None, :] / 100)
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.ceil(positions).astype(np.intp)
+    lower_scores = sorted_scores[np.minimum(starts[:, None] + lower, len(sorted_scores) - 1)]
+    upper_scores = sorted_scores[np.minimum(starts[:, None] + upper, len(sorted_scores) - 1)]
+    values = lower_scores + (upper_scores - lower_scores) * (positions - lower)
+    values[valid_counts == 0] = np.nan
+    return values
+
+
+def _get_bootstrap_intervals(scores: np.ndarray, codes: np.ndarray, valid_counts: np.ndarray, means: np.ndarray,
+                             confidence: float, bootstrap_samples: int, rng: np.random.Generator) -> np.ndarray:
+    """Percentile bootstrap interval of the mean of every group, drawn from the group histograms."""
+    groups_count = len(valid_counts)
+    intervals = np.full((groups_count, 2), np.nan)
+    if len(scores) == 0 or bootstrap_samples <= 0:
+        return intervals
+    low, high = scores.min(), scores.max()
+    if high == low:
+        intervals[valid_counts > 0] = low
+        return intervals
+    bins = np.rint((scores - low) / (high - low) * (BOOTSTRAP_BINS - 1)).astype(np.intp)
+    bin_values = low + (high - low) * np.arange(BOOTSTRAP_BINS) / (BOOTSTRAP_BINS - 1)
+    histograms = np.bincount(codes * BOOTSTRAP_BINS + bins,
+                             minlength=groups_count * BOOTSTRAP_BINS).reshape(groups_count, BOOTSTRAP_BINS)
+    groups = np.flatnonzero(valid_counts)
+    chunk_size = max(1, MAX_BOOTSTRAP_DRAWS // (bootstrap_samples * BOOTSTRAP_BINS))
+    alpha = (1 - confidence) / 2
+    for chunk_start in range(0, len(groups), chunk_size):
+        chunk = groups[chunk_start:chunk_start + chunk_size]
+        counts = valid_counts[chunk]
+        draws = rng.multinomial(counts, histograms[chunk] / counts[:, None], size=(bootstrap_samples, len(chunk)))
+        bootstrap_means = draws @ bin_values / counts
+        binned_means = histograms[chunk] @ bin_values / counts
+        quantiles = np.quantile(bootstrap_means, [alpha, 1 - alpha], axis=0).T
+        # the binning shifts the bootstrap distribution a little, it is centered back on the exact mean
+        intervals[chunk] = quantiles + (means[chunk] - binned_means)[:, None]
+    return intervals
+
+
+def summarize_scores(scores: Any,
+                     groups: Any = None,
+                     percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+                     confidence: float = DEFAULT_CONFIDENCE,
+                     bootstrap_samples: int = DEFAULT_BOOTSTRAP_SAMPLES,
+                     seed: Optional[int] = 0) -> Dict[str, Dict[str, float]]:
+    """
+    Count, NaN rate, mean, percentiles and bootstrap confidence interval of the mean of the scores of every group, or
+    of all the scores under "all" without groups. NaN scores are evaluations that failed, they only count in the rate.
+    The bootstrap takes most of the time, 0 bootstrap_samples leaves the intervals NaN.
+    """
+    scores = to_scores(scores)
+    if groups is None:
+        codes, names = np.zeros(len(scores), dtype=np.intp), ["all"]
+    else:
+        codes, names = encode_groups(groups)
+    return summarize_encoded_scores(scores, codes, names, percentiles, confidence, bootstrap_samples, seed)
+
+
+def summarize_encoded_scores(scores: np.ndarray,
+                             codes: np.ndarray,
+                             names: List[str],
+                             percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+                             confidence: float = DEFAULT_CONFIDENCE,
+                             bootstrap_samples: int = DEFAULT_BOOTSTRAP_SAMPLES,
+                             seed: Optional[int] = 0) -> Dict[str, Dict[str, float]]:
+    groups_count = len(names)
+
+    valid = ~np.isnan(scores)
+    valid_scores, valid_codes = scores[valid], codes[valid]
+    counts = np.bincount(codes, minlength=groups_count)
+    valid_counts = np.bincount(valid_codes, minlength=groups_count)
+    sums = np.bincount(valid_codes, weights=valid_scores, minlength=groups_count)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / valid_counts
+        nan_rates = (counts - valid_counts) / counts
+    percentile_values = _get_percentiles(valid_scores, valid_codes, valid_counts, percentiles)
+    intervals = _get_bootstrap_intervals(valid_scores, valid_codes, valid_counts, means, confidence,
+                                         bootstrap_samples, np.random.default_rng(seed))
+
+    summaries = {}
+    for code in np.flatnonzero(counts):
+        summary = {"count": int(counts[code]),
+                   "nan_rate": float(nan_rates[code]),
+                   "mean": float(means[code])}
+        summary.update({f"p{percentile:g}": float(value)
+                        for percentile, value in zip(percentiles, percentile_values[code])})
+        summary["ci_low"], summary["ci_high"] = float(intervals[code, 0]), float(intervals[code, 1])
+        summaries[names[code]] = summary
+    return summaries
+
+
+def summarize_results(results: Mapping[str, Any], metric_names: Sequence[str],
+                      group_by: Sequence[str] = ("category", "application_id"), **kwargs) -> Dict[str, Dict]:
+    """
+    Summaries of every metric over all the results and by every group_by column the results have. The results are any
+    mapping of column names to arrays, a dict, a pandas DataFrame or a pyarrow Table of read_results.
+    """
+    column_names = set(results.column_names if hasattr(results, "column_names") else results.keys())
+    group_codes = {column: encode_groups(results[column]) for column in group_by if column in column_names}
+    summaries: Dict[str, Dict] = {}
+    for metric_name in metric_names:
+        if metric_name not in column_names:
+            continue
+        scores = to_scores(results[metric_name])
+        summaries[metric_name] = {"all": summarize_scores(scores, **kwargs)["all"]}
+        for column, (codes, names) in group_codes.items():
+            summaries[metric_name][f"by_{column}"] = summarize_encoded_scores(scores, codes, names, **kwargs)
+    return summaries
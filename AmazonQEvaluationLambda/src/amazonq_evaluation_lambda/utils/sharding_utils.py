@@ -0,0 +1,35 @@
+import hashlib
+import json
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+def split_into_shards(testset: List[Dict], shard_size: int) -> List[List[Dict]]:
+    if shard_size < 1:
+        raise Exception(f"Invalid shard size {shard_size}, it must be a positive number")
+    return [testset[i:i + shard_size] for i in range(0, len(testset), shard_size)]
+
+
+def get_testset_fingerprint(testset: List[Dict], shard_size: int, scoring_config: Optional[Dict] = None) -> str:
+    fingerprint_fields = {"testset": testset, "shard_size": shard_size}
+    if scoring_config is not None:
+        # checkpointed scores are only reused by a run that scores the same way
+        fingerprint_fields["scoring_config"] = scoring_config
+    content = json.dumps(fingerprint_fields, sort_keys=True)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def merge_shard_records(shards_records: List[List[Dict]]) -> List[Dict]:
+    return [record for shard_records in shards_records for record in shard_records]
+
+
+def aggregate_metric_scores(records: List[Dict], metric_names: List[str]) -> Dict[str, float]:
+    # same as ragas Result: NaN aware mean, NaN when a metric has no valid score at all
+    aggregates = {}
+    for metric_name in metric_names:
+        scores = np.array([record.get(metric_name) for record in records], dtype=float)
+        valid_scores = scores[~np.isnan(scores)]
+        aggregates[metric_name] = float(valid_scores.mean()) if len(valid_scores) else math.nan
+    return aggregates
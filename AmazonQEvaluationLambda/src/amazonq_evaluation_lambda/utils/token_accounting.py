@@ -0,0 +1,192 @@
+import json
+import threading
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Set, Tuple
+
+from utils.logging_utils import setup_logging
+
+logger = setup_logging(__name__)
+
+# On-demand USD prices per 1000 input and output tokens, override or extend them with the BedrockPriceTable variable
+DEFAULT_PRICES_PER_1000_TOKENS: Dict[str, Tuple[float, float]] = {
+    "anthropic.claude-v2": (0.008, 0.024),
+    "anthropic.claude-v2:1": (0.008, 0.024),
+    "anthropic.claude-instant-v1": (0.0008, 0.0024),
+    "anthropic.claude-3-haiku-20240307-v1:0": (0.00025, 0.00125),
+    "anthropic.claude-3-sonnet-20240229-v1:0": (0.003, 0.015),
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": (0.003, 0.015),
+    "amazon.titan-embed-text-v1": (0.0001, 0.0),
+    "amazon.titan-embed-text-v2:0": (0.00002, 0.0),
+    "cohere.embed-english-v3": (0.0001, 0.0),
+    "cohere.embed-multilingual-v3": (0.0001, 0.0),
+}
+
+INPUT_TOKEN_COUNT_HEADER = "x-amzn-bedrock-input-token-count"
+OUTPUT_TOKEN_COUNT_HEADER = "x-amzn-bedrock-output-token-count"
+
+
+class TokenBudgetExceeded(Exception):
+    pass
+
+
+@dataclass
+class TokenUsage:
+    input_tokens: int = 0
+    output_tokens: int = 0
+    calls: int = 0
+    estimated_cost_usd: float = 0.0
+
+    def add(self, input_tokens: int, output_tokens: int, cost_usd: float):
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.calls += 1
+        self.estimated_cost_usd += cost_usd
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "calls": self.calls,
+                "estimated_cost_usd": round(self.estimated_cost_usd, 6)}
+
+
+def get_price_table(price_table_json: Optional[str] = None) -> Dict[str, Tuple[float, float]]:
+    price_table = dict(DEFAULT_PRICES_PER_1000_TOKENS)
+    if price_table_json:
+        # {"model-id": [input price, output price]} in USD per 1000 tokens
+        price_table.update({model_id: (float(prices[0]), float(prices[1]))
+                            for model_id, prices in json.loads(price_table_json).items()})
+    return price_table
+
+
+class TokenAccountant:
+    """
+    Sums the Bedrock tokens of an evaluation by model and by metric, and prices them with the price table. The budget
+    bounds the input and output tokens of the run, in-flight calls still complete once it is reached.
+    """
+
+    def __init__(self, price_table: Optional[Dict[str, Tuple[float, float]]] = None,
+                 token_budget: Optional[int] = None):
+        self.price_table = price_table if price_table is not None else get_price_table()
+        # 0 or None means no budget
+        self.token_budget = token_budget or None
+        self.total = TokenUsage()
+        self.by_model: Dict[str, TokenUsage] = {}
+        self.by_metric: Dict[str, TokenUsage] = {}
+        # metric scores skipped because the budget was reached
+        self.refused_metric_runs = 0
+        self._unpriced_models: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def _get_prices(self, model_id: str) -> Tuple[float, float]:
+        prices = self.price_table.get(model_id)
+        # cross-region inference profiles prefix the model id with a geography, e.g. us.anthropic.claude-...
+        if prices is None and "." in model_id:
+            prices = self.price_table.get(model_id.split(".", 1)[1])
+        if prices is None:
+            if model_id not in self._unpriced_models:
+                self._unpriced_models.add(model_id)
+                logger.warning(f"No price for model {model_id}, its tokens are counted at no cost")
+            return 0.0, 0.0
+        return prices
+
+    def get_cost(self, model_id: str, input_tokens: int, output_tokens: int) -> float:
+        input_price, output_price = self._get_prices(model_id)
+        return (input_tokens * input_price + output_tokens * output_price) / 1000
+
+    def record(self, model_id: str, input_tokens: int, output_tokens: int, metric: Optional[str] = None,
+               row_usage: Optional[TokenUsage] = None):
+        with self._lock:
+            cost_usd = self.get_cost(model_id, input_tokens, output_tokens)
+            self.total.add(input_tokens, output_tokens, cost_usd)
+            self.by_model.setdefault(model_id, TokenUsage()).add(input_tokens, output_tokens, cost_usd)
+            if metric is not None:
+                self.by_metric.setdefault(metric, TokenUsage()).add(input_tokens, output_tokens, cost_usd)
+            if row_usage is not None:
+                row_usage.add(input_tokens, output_tokens, cost_usd)
+
+    def is_budget_exhausted(self) -> bool:
+        return self.token_budget is not None and \
+            self.total.input_tokens + self.total.output_tokens >= self.token_budget
+
+    def check_budget(self, metric: str):
+        if self.is_budget_exhausted():
+            with self._lock:
+                self.refused_metric_runs += 1
+                if self.refused_metric_runs == 1:
+                    logger.warning(f"Token budget of {self.token_budget} reached, the remaining metrics are not scored")
+            raise TokenBudgetExceeded(f"Token budget of {self.token_budget} reached, {metric} was not scored")
+
+    def get_summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.total.to_dict(),
+                    "token_budget": self.token_budget,
+                    "budget_exhausted": self.is_budget_exhausted(),
+                    "refused_metric_runs": self.refused_metric_runs,
+                    "by_model": {model_id: usage.to_dict() for model_id, usage in self.by_model.items()},
+                    "by_metric": {metric: usage.to_dict() for metric, usage in self.by_metric.items()}}
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = {"InputTokens": self.total.input_tokens,
+                     "OutputTokens": self.total.output_tokens,
+                     "EstimatedCostUSD": round(self.total.estimated_cost_usd, 6)}
+            for metric, usage in self.by_metric.items():
+                stats[f"{metric}InputTokens"] = usage.input_tokens
+                stats[f"{metric}OutputTokens"] = usage.output_tokens
+                stats[f"{metric}EstimatedCostUSD"] = round(usage.estimated_cost_usd, 6)
+            return stats
+
+
+@dataclass
+class TokenScope:
+    accountant: TokenAccountant
+    metric: Optional[str] = None
+    row_usage: Optional[TokenUsage] = field(default=None)
+
+
+# Set while a metric scores a row, the Bedrock calls it makes run in executor threads that copy the context
+_current_scope: ContextVar[Optional[TokenScope]] = ContextVar("token_scope", default=None)
+
+
+def enter_scope(scope: TokenScope) -> Token:
+    return _current_scope.set(scope)
+
+
+def exit_scope(token: Token):
+    _current_scope.reset(token)
+
+
+def get_token_counts(parsed: Dict) -> Optional[Tuple[int, int]]:
+    headers = parsed.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+    if INPUT_TOKEN_COUNT_HEADER in headers:
+        return int(headers[INPUT_TOKEN_COUNT_HEADER]), int(headers.get(OUTPUT_TOKEN_COUNT_HEADER, 0))
+    # the Converse API returns the usage in the body
+    usage = parsed.get("usage")
+    if usage:
+        return usage.get("inputTokens", 0), usage.get("outputTokens", 0)
+    return None
+
+
+# bedrock-runtime client events, InvokeModel and Converse responses carry the token counts Bedrock bills
+def _on_before_model_call(params: Dict, context: Dict, **kwargs):
+    if "modelId" in params and _current_scope.get() is not None:
+        context["token_accounting_model_id"] = params["modelId"]
+
+
+def _on_after_model_call(parsed: Dict, context: Dict, **kwargs):
+    model_id = context.pop("token_accounting_model_id", None)
+    scope = _current_scope.get()
+    if model_id is None or scope is None:
+        return
+    token_counts = get_token_counts(parsed)
+    if token_counts is not None:
+        scope.accountant.record(model_id, *token_counts, metric=scope.metric, row_usage=scope.row_usage)
+
+
+def account_client_tokens(client: Any):
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is None:
+        return
+    events.register("before-parameter-build.bedrock-runtime", _on_before_model_call)
+    events.register("after-call.bedrock-runtime", _on_after_model_call)
@@ -0,0 +1,11 @@
+import pytest
+
+from utils.client_registry import client_registry
+
+
+@pytest.fixture(autouse=True)
+def clear_client_registry():
+    # every test gets its own (mocked) boto3 clients
+    client_registry.clear()
+    yield
+    client_registry.clear()
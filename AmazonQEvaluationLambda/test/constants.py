@@ -83,3 +83,23 @@ TEST_CREDENTIALS = {'AccessKeyId': 'TestAccessId',
                     'SecretAccessKey': 'TestSecretKey',
                     'SessionToken': 'TestSessionToken',
                     }
+
+TEST_THROTTLING_ERROR_RESPONSE = {
+    "Error": {
+        "Code": "ThrottlingException",
+        "Message": "Rate exceeded",
+    },
+}
+
+
+class FakeClock:
+    """Clock the tests move by hand, its sleep advances the time instead of waiting."""
+
+    def __init__(self, now: float = 0.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
@@ -0,0 +1,44 @@
+import math
+import unittest
+
+import numpy as np
+
+from utils.adaptive_sampling import get_interval_widths, get_stratified_order, has_reached_target_width
+
+
+class TestAdaptiveSampling(unittest.TestCase):
+
+    def test_every_prefix_of_the_order_is_stratified(self):
+        categories = ["billing"] * 600 + ["index"] * 300 + [None] * 100
+
+        order = get_stratified_order(categories, seed=3)
+
+        self.assertEqual(sorted(order), list(range(len(categories))))
+        for prefix_size in (10, 50, 200):
+            prefix_categories = [categories[i] for i in order[:prefix_size]]
+            self.assertAlmostEqual(prefix_categories.count("billing"), 0.6 * prefix_size, delta=1)
+            self.assertAlmostEqual(prefix_categories.count(None), 0.1 * prefix_size, delta=1)
+        # the entries of a category are drawn at random, the same seed draws them the same way
+        self.assertNotEqual(list(order[:10]), sorted(order[:10]))
+        self.assertEqual(list(get_stratified_order(categories, seed=3)), list(order))
+        self.assertEqual(len(get_stratified_order([])), 0)
+
+    def test_interval_widths_shrink_with_the_scored_share_of_the_testset(self):
+        rng = np.random.default_rng(5)
+        records = [{"faithfulness": score, "context_recall": math.nan} for score in rng.beta(5, 2, 400)]
+
+        widths = get_interval_widths(records, ["faithfulness", "context_recall"], population_size=100_000)
+        half_scored_widths = get_interval_widths(records, ["faithfulness"], population_size=800)
+        fully_scored_widths = get_interval_widths(records, ["faithfulness"], population_size=400)
+
+        normal_width = 2 * 1.96 * np.std([record["faithfulness"] for record in records]) / math.sqrt(400)
+        self.assertAlmostEqual(widths["faithfulness"], normal_width, delta=0.2 * normal_width)
+        self.assertTrue(math.isnan(widths["context_recall"]))
+        self.assertAlmostEqual(half_scored_widths["faithfulness"], widths["faithfulness"] * math.sqrt(400 / 799),
+                               delta=0.01 * normal_width)
+        self.assertEqual(fully_scored_widths["faithfulness"], 0.0)
+
+    def test_target_is_reached_once_every_metric_is_narrow_enough(self):
+        self.assertTrue(has_reached_target_width({"faithfulness": 0.03, "context_recall": 0.04}, 0.04))
+        self.assertFalse(has_reached_target_width({"faithfulness": 0.03, "context_recall": 0.05}, 0.04))
+        self.assertFalse(has_reached_target_width({"faithfulness": math.nan}, 0.04))
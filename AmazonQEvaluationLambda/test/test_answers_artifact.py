@@ -0,0 +1,49 @@
+import io
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from adapters.qbusiness_adapter import QAnswerRecord, QFetchResult
+from utils.answers_artifact import create_answer_records, read_answers_artifact, read_answers_artifact_metadata, \
+    write_answers_artifact
+from .constants import REGION, TEST_Q_CHAT_RESPONSE, TEST_ERROR_RESPONSE
+
+TEST_TESTSET = [{"question": "what is Q?", "ground_truth": "Q is an AWS service"},
+                {"question": "bad question", "ground_truth": "no answer"}]
+
+
+class TestAnswersArtifact(unittest.TestCase):
+    fetch_result = QFetchResult(records=[QAnswerRecord("what is Q?", TEST_Q_CHAT_RESPONSE, latency_millis=120.5),
+                                         QAnswerRecord("bad question", error=Exception(TEST_ERROR_RESPONSE))])
+
+    def test_failed_questions_are_left_out_of_the_records(self):
+        records = create_answer_records(TEST_TESTSET, self.fetch_result)
+
+        self.assertEqual(records, [{"question": "what is Q?",
+                                    "ground_truth": "Q is an AWS service",
+                                    "answer": "test message",
+                                    "contexts": ["data snippet"],
+                                    "latency_millis": 120.5,
+                                    "category": None}])
+
+    def test_local_artifact_is_read_back(self):
+        records = create_answer_records(TEST_TESTSET, self.fetch_result)
+        with tempfile.TemporaryDirectory() as directory:
+            location = os.path.join(directory, "answers", "run1.parquet")
+            write_answers_artifact(records, location, REGION, metadata={"q_application_id": "app1"})
+
+            self.assertEqual(read_answers_artifact(location, REGION), records)
+            self.assertEqual(read_answers_artifact_metadata(location, REGION), {"q_application_id": "app1"})
+
+    @patch("utils.client_registry.boto3.client")
+    def test_s3_artifact_is_read_back(self, boto3_client_mock):
+        mock_s3_client = boto3_client_mock.return_value
+        records = create_answer_records(TEST_TESTSET, self.fetch_result)
+        write_answers_artifact(records, "s3://test-bucket/artifacts/run1.parquet", REGION)
+
+        put_object_kwargs = mock_s3_client.put_object.call_args[1]
+        self.assertEqual(put_object_kwargs["Bucket"], "test-bucket")
+        self.assertEqual(put_object_kwargs["Key"], "artifacts/run1.parquet")
+        mock_s3_client.get_object.return_value = {"Body": io.BytesIO(put_object_kwargs["Body"])}
+        self.assertEqual(read_answers_artifact("s3://test-bucket/artifacts/run1.parquet", REGION), records)
@@ -0,0 +1,158 @@
+import json
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+import boto3
+from botocore.stub import Stubber
+from datasets import Dataset
+from moto import mock_aws
+
+from benchmarks.fake_aws import JUDGE_ANSWERS
+from utils.batch_scoring import BatchJobRunner, BatchLLMWrapper, BatchScorer, BedrockBatchJobRunner, S3BatchStorage, \
+    create_batch_storage
+from utils.client_registry import client_registry
+from utils.metric_factory import create_metrics
+from utils.ragas_utils import RagasUtils
+from .constants import REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID
+from .test_token_accounting import AWS_ENVIRONMENT
+
+TEST_BUCKET = "test-batch-bucket"
+TEST_DATASET = Dataset.from_dict({"question": ["What is Q?", "What is Amazon Q Business used for?"],
+                                  "answer": ["Q is an AWS service", "Answering questions about your data"],
+                                  "ground_truth": ["Q is an AWS service", "Enterprise search"],
+                                  "contexts": [["Q is an AWS service"], ["Q Business answers questions"]]})
+
+
+class FakeBatchJobRunner(BatchJobRunner):
+    """Answers the judge prompts like the benchmark fake Bedrock, once a job was polled polls_until_done times."""
+
+    def __init__(self, storage: S3BatchStorage, polls_until_done: int = 1, failed_records: int = 0):
+        self.storage = storage
+        self.polls_until_done = polls_until_done
+        # the first records of the first job fail, like a partially completed job
+        self.failed_records = failed_records
+        self.jobs = {}
+
+    def submit(self, job_name, model_id, input_uri, output_uri):
+        job_id = f"arn:aws:bedrock:{REGION}:111111111111:model-invocation-job/job{len(self.jobs)}"
+        self.jobs[job_id] = {"input_uri": input_uri, "output_uri": output_uri, "polls": 0}
+        return job_id
+
+    def _get_name(self, uri: str) -> str:
+        return uri[len(self.storage.get_uri("")):]
+
+    def get_status(self, job_id):
+        job = self.jobs[job_id]
+        job["polls"] += 1
+        if job["polls"] < self.polls_until_done:
+            return "InProgress"
+        input_name = self._get_name(job["input_uri"])
+        records = [json.loads(line) for line in self.storage.read(input_name).splitlines()]
+        failed_records = self.failed_records if job_id.endswith("job0") else 0
+        outputs = [{"recordId": record["recordId"], "error": {"errorMessage": "failed"}} for record in
+                   records[:failed_records]]
+        for record in records[failed_records:]:
+            prompt = record["modelInput"]["messages"][0]["content"][0]["text"]
+            answer = next((answer for marker, answer in JUDGE_ANSWERS if marker in prompt), {})
+            outputs.append({"recordId": record["recordId"],
+                            "modelOutput": {"content": [{"type": "text", "text": json.dumps(answer)}]}})
+        # Bedrock writes the outputs under the job id, named after the input file
+        output_name = f"{self._get_name(job['output_uri'])}{job_id.rsplit('/', 1)[1]}/input.jsonl.out"
+        self.storage.write(output_name, "\n".join(json.dumps(output) for output in outputs))
+        return "PartiallyCompleted" if failed_records else "Completed"
+
+
+@mock_aws
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestBatchScoring(unittest.TestCase):
+
+    def setUp(self):
+        boto3.client("s3", region_name=REGION).create_bucket(Bucket=TEST_BUCKET)
+        self.storage = create_batch_storage(f"s3://{TEST_BUCKET}/q-evaluation-batch", REGION)
+
+    def _evaluate(self, batch_scorer: BatchScorer):
+        ragas_utils = RagasUtils(REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID, batch_scorer=batch_scorer)
+        metrics = create_metrics(["faithfulness", "context_recall"], ragas_utils.get_judge_llm(),
+                                 ragas_utils.get_embeddings())
+        return ragas_utils.evaluate_dataset(TEST_DATASET, metrics)
+
+    def test_dataset_is_scored_with_rounds_of_batch_jobs(self):
+        job_runner = FakeBatchJobRunner(self.storage)
+
+        results = self._evaluate(BatchScorer(self.storage, job_runner, "run1", sleep=lambda seconds: None))
+
+        self.assertEqual(list(results.scores["faithfulness"]), [1.0, 1.0])
+        self.assertEqual(list(results.scores["context_recall"]), [1.0, 1.0])
+        # the faithfulness verdicts need the statements extracted by the first job
+        self.assertEqual(len(job_runner.jobs), 2)
+        self.assertIn("q-evaluation-batch/run1/round-01/output/job1/input.jsonl.out",
+                      [item["Key"] for item in boto3.client("s3", region_name=REGION).list_objects_v2(
+                          Bucket=TEST_BUCKET)["Contents"]])
+
+    def test_running_job_is_resumed_by_a_later_invocation(self):
+        job_runner = FakeBatchJobRunner(self.storage, polls_until_done=3)
+        batch_scorer = BatchScorer(self.storage, job_runner, "run1", max_wait_seconds=0)
+
+        self.assertIsNone(self._evaluate(batch_scorer))
+        self.assertEqual(batch_scorer.running_job_id, next(iter(job_runner.jobs)))
+
+        results = self._evaluate(BatchScorer(self.storage, job_runner, "run1", sleep=lambda seconds: None))
+        self.assertEqual(list(results.scores["faithfulness"]), [1.0, 1.0])
+        self.assertEqual(len(job_runner.jobs), 2)
+
+    def test_prompts_a_partial_job_did_not_answer_go_to_the_next_job(self):
+        job_runner = FakeBatchJobRunner(self.storage, failed_records=1)
+
+        results = self._evaluate(BatchScorer(self.storage, job_runner, "run1", sleep=lambda seconds: None))
+
+        self.assertEqual(list(results.scores["context_recall"]), [1.0, 1.0])
+        self.assertEqual(list(results.scores["faithfulness"]), [1.0, 1.0])
+        second_job_input = self.storage.read("run1/round-01/input.jsonl")
+        first_job_input = self.storage.read("run1/round-00/input.jsonl")
+        self.assertIn(first_job_input.splitlines()[0], second_job_input.splitlines())
+
+    def test_unanswered_prompts_are_left_empty_after_max_rounds(self):
+        job_runner = FakeBatchJobRunner(self.storage)
+
+        results = self._evaluate(BatchScorer(self.storage, job_runner, "run1", max_rounds=1,
+                                             sleep=lambda seconds: None))
+
+        self.assertEqual(list(results.scores["context_recall"]), [1.0, 1.0])
+        self.assertTrue(all(score != score for score in results.scores["faithfulness"]))
+
+
+class TestBatchLLMWrapper(unittest.TestCase):
+
+    def test_only_anthropic_judges_are_supported(self):
+        with self.assertRaises(Exception):
+            BatchLLMWrapper(MagicMock(), "meta.llama3-70b-instruct-v1:0")
+
+
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestBedrockBatchJobRunner(unittest.TestCase):
+
+    def setUp(self):
+        client_registry.clear()
+
+    def test_jobs_are_submitted_with_the_bundled_bedrock_model(self):
+        runner = BedrockBatchJobRunner(REGION, "arn:aws:iam::111111111111:role/batch")
+        job_arn = "arn:aws:bedrock:us-east-1:111111111111:model-invocation-job/job1"
+
+        with Stubber(runner.bedrock_client) as stubber:
+            stubber.add_response("create_model_invocation_job", {"jobArn": job_arn},
+                                 {"jobName": "run1-round0",
+                                  "roleArn": "arn:aws:iam::111111111111:role/batch",
+                                  "modelId": BEDROCK_TEXT_MODEL_ID,
+                                  "inputDataConfig": {"s3InputDataConfig": {"s3Uri": "s3://bucket/input.jsonl"}},
+                                  "outputDataConfig": {"s3OutputDataConfig": {"s3Uri": "s3://bucket/output/"}}})
+            stubber.add_response("get_model_invocation_job",
+                                 {"jobArn": job_arn, "modelId": BEDROCK_TEXT_MODEL_ID, "status": "InProgress",
+                                  "roleArn": "arn:aws:iam::111111111111:role/batch", "submitTime": "2024-10-01",
+                                  "inputDataConfig": {"s3InputDataConfig": {"s3Uri": "s3://bucket/input.jsonl"}},
+                                  "outputDataConfig": {"s3OutputDataConfig": {"s3Uri": "s3://bucket/output/"}}},
+                                 {"jobIdentifier": job_arn})
+
+            self.assertEqual(runner.submit("run1-round0", BEDROCK_TEXT_MODEL_ID, "s3://bucket/input.jsonl",
+                                           "s3://bucket/output/"), job_arn)
+            self.assertEqual(runner.get_status(job_arn), "InProgress")
@@ -0,0 +1,60 @@
+import io
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+
+from utils.checkpoint_store import LocalCheckpointStore, S3CheckpointStore, create_checkpoint_store
+from .constants import REGION, TEST_ERROR_RESPONSE
+
+TEST_SHARD_RECORDS = [{"question": "what is Q?", "answer_relevancy": 0.9}]
+TEST_NO_SUCH_KEY_RESPONSE = {"Error": {"Code": "NoSuchKey", "Message": "not found"}}
+
+
+class TestLocalCheckpointStore(unittest.TestCase):
+    def test_saved_shards_and_manifest_are_loaded_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint_store = LocalCheckpointStore(directory)
+            self.assertIsNone(checkpoint_store.load_manifest("run1"))
+            self.assertIsNone(checkpoint_store.load_shard("run1", 0))
+
+            checkpoint_store.save_manifest("run1", {"total_shards": 2})
+            checkpoint_store.save_shard("run1", 0, TEST_SHARD_RECORDS)
+
+            self.assertEqual(checkpoint_store.load_manifest("run1"), {"total_shards": 2})
+            self.assertEqual(checkpoint_store.load_shard("run1", 0), TEST_SHARD_RECORDS)
+            self.assertIsNone(checkpoint_store.load_shard("run1", 1))
+
+
+class TestS3CheckpointStore(unittest.TestCase):
+    @patch("utils.client_registry.boto3.client")
+    def test_shards_are_written_under_prefix(self, boto3_client_mock):
+        mock_s3_client = boto3_client_mock.return_value
+        mock_s3_client.get_object.return_value = {"Body": io.BytesIO(b'[{"answer_relevancy": 0.9}]')}
+
+        checkpoint_store = create_checkpoint_store("s3://test-bucket/checkpoints", REGION)
+        self.assertIsInstance(checkpoint_store, S3CheckpointStore)
+        checkpoint_store.save_shard("run1", 3, TEST_SHARD_RECORDS)
+
+        put_object_kwargs = mock_s3_client.put_object.call_args[1]
+        self.assertEqual(put_object_kwargs["Bucket"], "test-bucket")
+        self.assertEqual(put_object_kwargs["Key"], "checkpoints/run1/shard-00003.json")
+        self.assertEqual(checkpoint_store.load_shard("run1", 3), [{"answer_relevancy": 0.9}])
+
+    @patch("utils.client_registry.boto3.client")
+    def test_missing_checkpoint_returns_none(self, boto3_client_mock):
+        mock_s3_client = boto3_client_mock.return_value
+        mock_s3_client.get_object.side_effect = ClientError(TEST_NO_SUCH_KEY_RESPONSE, "get_object")
+
+        checkpoint_store = S3CheckpointStore(REGION, "test-bucket")
+        self.assertIsNone(checkpoint_store.load_shard("run1", 0))
+
+    @patch("utils.client_registry.boto3.client")
+    def test_read_failure_raises_exception(self, boto3_client_mock):
+        mock_s3_client = boto3_client_mock.return_value
+        mock_s3_client.get_object.side_effect = ClientError(TEST_ERROR_RESPONSE, "get_object")
+
+        checkpoint_store = S3CheckpointStore(REGION, "test-bucket")
+        with self.assertRaises(ClientError):
+            checkpoint_store.load_manifest("run1")
@@ -0,0 +1,64 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from utils.client_registry import ClientRegistry
+from .constants import REGION, TEST_CREDENTIALS
+
+TEST_ROTATED_CREDENTIALS = {'AccessKeyId': 'RotatedAccessId',
+                            'SecretAccessKey': 'RotatedSecretKey',
+                            'SessionToken': 'RotatedSessionToken',
+                            }
+
+
+class TestClientRegistry(unittest.TestCase):
+    @patch("utils.client_registry.boto3.client")
+    def test_clients_are_reused_per_service_region_and_identity(self, boto3_client_mock):
+        boto3_client_mock.side_effect = lambda service_name, **kwargs: object()
+        registry = ClientRegistry()
+
+        sts_client = registry.get_client("sts", REGION)
+        self.assertIs(registry.get_client("sts", REGION), sts_client)
+        self.assertIsNot(registry.get_client("sts", "eu-west-1"), sts_client)
+        self.assertIsNot(registry.get_client("secretsmanager", REGION), sts_client)
+
+        q_client = registry.get_client("qbusiness", REGION, TEST_CREDENTIALS)
+        self.assertIs(registry.get_client("qbusiness", REGION, TEST_CREDENTIALS), q_client)
+        self.assertIsNot(registry.get_client("qbusiness", REGION, TEST_ROTATED_CREDENTIALS), q_client)
+        self.assertEqual(boto3_client_mock.call_count, 5)
+
+    @patch("utils.client_registry.boto3.client")
+    def test_connection_pool_is_sized_and_credentials_are_passed(self, boto3_client_mock):
+        registry = ClientRegistry()
+        registry.get_client("qbusiness", REGION, TEST_CREDENTIALS, max_pool_connections=16)
+
+        client_kwargs = boto3_client_mock.call_args[1]
+        self.assertEqual(client_kwargs["config"].max_pool_connections, 16)
+        self.assertEqual(client_kwargs["aws_access_key_id"], TEST_CREDENTIALS["AccessKeyId"])
+        self.assertEqual(client_kwargs["region_name"], REGION)
+
+    @patch("utils.client_registry.boto3.client")
+    def test_clients_of_expired_or_invalidated_credentials_are_dropped(self, boto3_client_mock):
+        boto3_client_mock.side_effect = lambda service_name, **kwargs: object()
+        registry = ClientRegistry()
+        expired_credentials = dict(TEST_CREDENTIALS, Expiration=datetime.now(timezone.utc) - timedelta(seconds=1))
+
+        expired_client = registry.get_client("qbusiness", REGION, expired_credentials)
+        self.assertIsNot(registry.get_client("qbusiness", REGION, expired_credentials), expired_client)
+
+        rotated_client = registry.get_client("qbusiness", REGION, TEST_ROTATED_CREDENTIALS)
+        registry.invalidate(TEST_ROTATED_CREDENTIALS)
+        self.assertIsNot(registry.get_client("qbusiness", REGION, TEST_ROTATED_CREDENTIALS), rotated_client)
+
+    @patch("utils.client_registry.boto3.client")
+    def test_least_recently_used_client_is_evicted(self, boto3_client_mock):
+        boto3_client_mock.side_effect = lambda service_name, **kwargs: object()
+        registry = ClientRegistry(max_clients=2)
+
+        sts_client = registry.get_client("sts", REGION)
+        registry.get_client("s3", REGION)
+        registry.get_client("sts", REGION)
+        registry.get_client("qbusiness", REGION)
+
+        self.assertIs(registry.get_client("sts", REGION), sts_client)
+        self.assertEqual(boto3_client_mock.call_count, 3)
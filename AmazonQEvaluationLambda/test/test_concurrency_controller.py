@@ -0,0 +1,149 @@
+import random
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from botocore.exceptions import ClientError
+
+from utils.concurrency_controller import AIMDConcurrencyController, AdaptiveConcurrencyLimiter, \
+    ConcurrencyLimitedBedrockClient
+
+THROTTLING_ERROR = ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}},
+                               "InvokeModel")
+
+
+class QuotaLimitedBackend:
+    """
+    Simulated Bedrock quota: every round each of the `setpoint` in-flight calls completes, past `capacity` concurrent
+    calls they are either throttled or queued behind the others, so no setpoint beats `capacity` calls per round.
+    """
+
+    def __init__(self, capacity: int, overload: str, seed: int = 0):
+        self.capacity = capacity
+        self.overload = overload
+        self._rng = random.Random(seed)
+
+    def run_round(self, controller: AIMDConcurrencyController) -> float:
+        concurrency = controller.setpoint
+        if self.overload == "throttle":
+            outcomes = [True] * min(concurrency, self.capacity) + [False] * max(0, concurrency - self.capacity)
+            self._rng.shuffle(outcomes)
+            for succeeded in outcomes:
+                if succeeded:
+                    controller.on_success(self._rng.uniform(0.5, 1.5))
+                else:
+                    controller.on_throttle()
+            return min(concurrency, self.capacity)
+        latency = max(1.0, concurrency / self.capacity)
+        for _ in range(concurrency):
+            controller.on_success(latency * self._rng.uniform(0.5, 1.5))
+        return concurrency / latency
+
+
+def get_throughput_ratio(backend: QuotaLimitedBackend, controller: AIMDConcurrencyController, rounds: int = 400):
+    throughputs = [backend.run_round(controller) for _ in range(rounds)]
+    # skip the ramp up, the steady state is what matters
+    steady_state = throughputs[rounds // 2:]
+    return sum(steady_state) / len(steady_state) / backend.capacity
+
+
+class TestAIMDConcurrencyController(unittest.TestCase):
+
+    def test_concurrency_grows_additively_up_to_max(self):
+        controller = AIMDConcurrencyController(min_concurrency=1, max_concurrency=4, initial_concurrency=1)
+        controller.on_success(1.0)
+        self.assertEqual(controller.setpoint, 2)
+        # about one more per round of calls at the current concurrency
+        for _ in range(3):
+            controller.on_success(1.0)
+        self.assertEqual(controller.setpoint, 3)
+        for _ in range(50):
+            controller.on_success(1.0)
+        self.assertEqual(controller.setpoint, 4)
+
+    def test_throttles_of_the_same_round_cut_concurrency_once(self):
+        controller = AIMDConcurrencyController(min_concurrency=2, max_concurrency=16, initial_concurrency=10,
+                                               backoff_factor=0.5)
+        for _ in range(10):
+            controller.on_success(1.0)
+        for _ in range(5):
+            controller.on_throttle()
+        self.assertEqual(controller.setpoint, 5)
+        self.assertEqual(controller.throttles, 5)
+
+        for _ in range(20):
+            controller.on_throttle()
+        self.assertEqual(controller.setpoint, 2)
+
+    def test_latency_spike_cuts_concurrency(self):
+        controller = AIMDConcurrencyController(min_concurrency=1, max_concurrency=16, initial_concurrency=8,
+                                               additive_increase=0, backoff_factor=0.5)
+        for _ in range(10):
+            controller.on_success(1.0)
+        # the first slow answers already lift the moving average past twice the baseline
+        for _ in range(3):
+            controller.on_success(10.0)
+        self.assertEqual(controller.setpoint, 4)
+        self.assertGreater(controller.latency_spikes, 0)
+
+    def test_invalid_bounds_raise_exception(self):
+        with self.assertRaises(Exception):
+            AIMDConcurrencyController(min_concurrency=4, max_concurrency=2)
+
+    def test_converges_near_optimal_throughput_of_throttling_backend(self):
+        for capacity in (4, 10, 30):
+            controller = AIMDConcurrencyController(min_concurrency=1, max_concurrency=64, initial_concurrency=1)
+            self.assertGreater(get_throughput_ratio(QuotaLimitedBackend(capacity, "throttle"), controller), 0.85)
+            self.assertLessEqual(controller.setpoint, capacity * 1.5)
+
+    def test_converges_near_optimal_throughput_of_queueing_backend(self):
+        for capacity in (4, 10, 30):
+            controller = AIMDConcurrencyController(min_concurrency=1, max_concurrency=64, initial_concurrency=1)
+            self.assertGreater(get_throughput_ratio(QuotaLimitedBackend(capacity, "queue"), controller), 0.9)
+            # queueing past twice the capacity doubles the latency, the controller backs off before
+            self.assertLessEqual(controller.setpoint, capacity * 2.5)
+
+
+class TestAdaptiveConcurrencyLimiter(unittest.TestCase):
+
+    def test_in_flight_calls_never_exceed_setpoint(self):
+        limiter = AdaptiveConcurrencyLimiter(AIMDConcurrencyController(min_concurrency=3, max_concurrency=3))
+        lock = threading.Lock()
+        in_flight = [0, 0]
+
+        def call():
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            time.sleep(0.01)
+            with lock:
+                in_flight[0] -= 1
+
+        threads = [threading.Thread(target=limiter.call, args=(call,)) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(in_flight[1], 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_throttling_errors_are_reported_and_raised(self):
+        controller = AIMDConcurrencyController(min_concurrency=1, max_concurrency=8, initial_concurrency=1)
+        limiter = AdaptiveConcurrencyLimiter(controller)
+        with self.assertRaises(ClientError):
+            limiter.call(MagicMock(side_effect=THROTTLING_ERROR))
+        with self.assertRaises(ValueError):
+            limiter.call(MagicMock(side_effect=ValueError("not a throttle")))
+        self.assertEqual(controller.throttles, 1)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_bedrock_client_invocations_go_through_limiter(self):
+        controller = AIMDConcurrencyController(min_concurrency=1, max_concurrency=8, initial_concurrency=1)
+        bedrock_client = MagicMock()
+        limited_client = ConcurrencyLimitedBedrockClient(bedrock_client, AdaptiveConcurrencyLimiter(controller))
+
+        limited_client.invoke_model(body="{}", modelId="model")
+        bedrock_client.invoke_model.assert_called_once_with(body="{}", modelId="model")
+        self.assertEqual(controller.setpoint, 2)
+        self.assertIs(limited_client.meta, bedrock_client.meta)
@@ -0,0 +1,36 @@
+import unittest
+
+from utils.context_packing import ContextPacker, estimate_tokens, get_shingles, get_similarity
+
+SNIPPET = "Amazon Q Business is a generative AI assistant that answers questions about enterprise data."
+
+
+class TestContextPacker(unittest.TestCase):
+
+    def test_exact_and_near_duplicate_snippets_are_removed(self):
+        near_duplicate = SNIPPET.replace("enterprise", "company")
+        other_snippet = "Ragas scores the faithfulness of an answer to its retrieved contexts."
+        context_packer = ContextPacker(similarity_threshold=0.6)
+
+        packed = context_packer.pack([SNIPPET, other_snippet, SNIPPET, near_duplicate])
+
+        self.assertEqual(packed, [SNIPPET, other_snippet])
+        self.assertEqual(context_packer.stats.duplicate_snippets, 2)
+        self.assertEqual(context_packer.get_stats()["ContextTokensSaved"],
+                         estimate_tokens(SNIPPET) + estimate_tokens(near_duplicate))
+
+    def test_threshold_of_zero_keeps_every_snippet(self):
+        self.assertEqual(ContextPacker(similarity_threshold=0).pack([SNIPPET, SNIPPET]), [SNIPPET, SNIPPET])
+
+    def test_snippets_are_kept_in_attribution_order_up_to_the_token_budget(self):
+        snippets = [f"snippet number {i} " + "x" * 36 for i in range(5)]
+        context_packer = ContextPacker(token_budget=2 * estimate_tokens(snippets[0]))
+
+        self.assertEqual(context_packer.pack(snippets), snippets[:2])
+        self.assertEqual(context_packer.stats.over_budget_snippets, 3)
+        # the first snippet is kept even when it alone exceeds the budget
+        self.assertEqual(ContextPacker(token_budget=1).pack(snippets[:1]), snippets[:1])
+
+    def test_shingle_similarity(self):
+        self.assertEqual(get_similarity(get_shingles(SNIPPET), get_shingles(SNIPPET.upper())), 1.0)
+        self.assertEqual(get_similarity(get_shingles("one two"), get_shingles("three four")), 0.0)
@@ -0,0 +1,59 @@
+import threading
+import time
+import unittest
+
+from utils.credentials_cache import CredentialsCache
+from .constants import FakeClock
+
+
+class TestCredentialsCache(unittest.TestCase):
+    def test_value_is_reused_until_refresh_margin(self):
+        clock = FakeClock(1000.0)
+        credentials_cache = CredentialsCache(refresh_margin_seconds=300, clock=clock)
+        loaded_values = []
+
+        def loader():
+            loaded_values.append(f"credentials{len(loaded_values)}")
+            return loaded_values[-1], clock.now + 3600
+
+        self.assertEqual(credentials_cache.get("key", loader), "credentials0")
+        clock.now += 3000
+        self.assertEqual(credentials_cache.get("key", loader), "credentials0")
+        # within the refresh margin the next get refreshes the credentials
+        clock.now += 301
+        self.assertEqual(credentials_cache.get("key", loader), "credentials1")
+        self.assertEqual(len(loaded_values), 2)
+
+    def test_keys_are_cached_independently_and_can_be_invalidated(self):
+        clock = FakeClock(1000.0)
+        credentials_cache = CredentialsCache(clock=clock)
+
+        credentials_cache.get_with_ttl(("COGNITO", "role1", "user"), lambda: "role1 credentials")
+        credentials_cache.get_with_ttl(("COGNITO", "role2", "user"), lambda: "role2 credentials")
+        self.assertEqual(credentials_cache.get_with_ttl(("COGNITO", "role1", "user"), lambda: "new"),
+                         "role1 credentials")
+
+        credentials_cache.invalidate(("COGNITO", "role1", "user"))
+        self.assertEqual(credentials_cache.get_with_ttl(("COGNITO", "role1", "user"), lambda: "new"), "new")
+        self.assertEqual(credentials_cache.get_with_ttl(("COGNITO", "role2", "user"), lambda: "new"),
+                         "role2 credentials")
+
+    def test_concurrent_callers_share_a_single_refresh(self):
+        credentials_cache = CredentialsCache()
+        loader_calls = []
+
+        def slow_loader():
+            loader_calls.append(1)
+            time.sleep(0.05)
+            return "credentials", time.time() + 3600
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(credentials_cache.get("key", slow_loader)))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ["credentials"] * 10)
+        self.assertEqual(len(loader_calls), 1)
@@ -1,19 +1,22 @@
 import unittest
 
+from adapters.qbusiness_adapter import QAnswerRecord
 from .constants import TEST_Q_CHAT_RESPONSE
 from utils.dataset_utils import get_answers_from_q, get_contexts_from_q, create_evaluation_dataset
 
 
 class TestDatasetUtils(unittest.TestCase):
-    q_app_responses: dict = {"what is Q?": TEST_Q_CHAT_RESPONSE}
+    q_app_responses = [QAnswerRecord("what is Q?", TEST_Q_CHAT_RESPONSE),
+                       QAnswerRecord("what is Q?", TEST_Q_CHAT_RESPONSE)]
 
     def test_answers_is_extracted_successfully(self):
-        expected_answers = ["test message"]
+        # a repeated question keeps its own row
+        expected_answers = ["test message", "test message"]
         answers = get_answers_from_q(self.q_app_responses)
         self.assertEqual(expected_answers, answers)
 
     def test_contexts_are_extracted_successfully(self):
-        expected_contexts = [["data snippet"]]
+        expected_contexts = [["data snippet"], ["data snippet"]]
         contexts = get_contexts_from_q(self.q_app_responses)
         self.assertEqual(expected_contexts, contexts)
 
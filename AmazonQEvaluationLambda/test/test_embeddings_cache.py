@@ -0,0 +1,114 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from typing import List
+from unittest.mock import patch
+
+from botocore.exceptions import ClientError
+from langchain_core.embeddings import Embeddings
+
+from utils.embeddings_cache import (CachedEmbeddings, EmbeddingCache, S3EmbeddingStore, SqliteEmbeddingStore,
+                                    create_embedding_store, get_embedding_key)
+from .constants import REGION, BEDROCK_EMBEDDING_MODEL_ID
+
+TEST_NO_SUCH_KEY_RESPONSE = {"Error": {"Code": "NoSuchKey", "Message": "not found"}}
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self):
+        self.embedded_documents: List[List[str]] = []
+        self.embedded_queries: List[str] = []
+
+    @staticmethod
+    def _vector(text: str) -> List[float]:
+        return [float(len(text)), 0.5]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded_documents.append(list(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.embedded_queries.append(text)
+        return self._vector(text)
+
+
+class TestCachedEmbeddings(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, "embeddings.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _cached_embeddings(self, embeddings: Embeddings, max_memory_entries: int = 100) -> CachedEmbeddings:
+        cache = EmbeddingCache(SqliteEmbeddingStore(self.cache_path), max_memory_entries)
+        return CachedEmbeddings(embeddings, BEDROCK_EMBEDDING_MODEL_ID, cache)
+
+    def test_only_distinct_misses_are_embedded(self):
+        embeddings = CountingEmbeddings()
+        cached_embeddings = self._cached_embeddings(embeddings)
+        cached_embeddings.embed_documents(["a", "bb"])
+
+        vectors = cached_embeddings.embed_documents(["a", "ccc", "bb", "ccc", "dddd"])
+
+        self.assertEqual(vectors, [[1.0, 0.5], [3.0, 0.5], [2.0, 0.5], [3.0, 0.5], [4.0, 0.5]])
+        self.assertEqual(embeddings.embedded_documents, [["a", "bb"], ["ccc", "dddd"]])
+        self.assertEqual(cached_embeddings.get_stats()["EmbeddingCacheHits"], 2)
+        self.assertEqual(cached_embeddings.get_stats()["EmbeddingCacheMisses"], 4)
+        # BedrockEmbeddings.embed_documents invokes the model once per text
+        self.assertEqual(cached_embeddings.get_stats()["EmbeddingCalls"], 4)
+
+    def test_rerun_from_persistent_store_makes_no_embedding_calls(self):
+        self._cached_embeddings(CountingEmbeddings()).embed_documents(["a", "bb"])
+        self._cached_embeddings(CountingEmbeddings()).embed_query("question")
+
+        embeddings = CountingEmbeddings()
+        cached_embeddings = self._cached_embeddings(embeddings)
+        self.assertEqual(cached_embeddings.embed_documents(["bb", "a"]), [[2.0, 0.5], [1.0, 0.5]])
+        self.assertEqual(cached_embeddings.embed_query("question"), [8.0, 0.5])
+
+        self.assertEqual(embeddings.embedded_documents, [])
+        self.assertEqual(embeddings.embedded_queries, [])
+        self.assertEqual(cached_embeddings.get_stats()["EmbeddingCacheStoreHits"], 3)
+        self.assertEqual(cached_embeddings.get_stats()["EmbeddingCalls"], 0)
+
+    def test_queries_and_documents_are_cached_separately(self):
+        embeddings = CountingEmbeddings()
+        cached_embeddings = self._cached_embeddings(embeddings)
+        cached_embeddings.embed_documents(["text"])
+        cached_embeddings.embed_query("text")
+
+        self.assertEqual(embeddings.embedded_queries, ["text"])
+        self.assertNotEqual(get_embedding_key(BEDROCK_EMBEDDING_MODEL_ID, "text", "query"),
+                            get_embedding_key(BEDROCK_EMBEDDING_MODEL_ID, "text"))
+        self.assertNotEqual(get_embedding_key("another-model", "text"),
+                            get_embedding_key(BEDROCK_EMBEDDING_MODEL_ID, "text"))
+
+    def test_memory_tier_evicts_least_recently_used_entries(self):
+        cache = EmbeddingCache(None, max_memory_entries=2)
+        cache.put_many({"a": [1.0], "b": [2.0]})
+        cache.get_many(["a"])
+        cache.put_many({"c": [3.0]})
+
+        self.assertEqual(cache.get_many(["a", "b", "c"])["memory"], {"a": [1.0], "c": [3.0]})
+
+
+class TestS3EmbeddingStore(unittest.TestCase):
+    @patch("utils.client_registry.boto3.client")
+    def test_vectors_are_stored_under_prefix(self, boto3_client_mock):
+        mock_s3_client = boto3_client_mock.return_value
+        mock_s3_client.get_object.side_effect = [{"Body": io.BytesIO(b"[1.0, 2.0]")},
+                                                 ClientError(TEST_NO_SUCH_KEY_RESPONSE, "get_object")]
+
+        embedding_store = create_embedding_store("s3://test-bucket/embeddings", REGION)
+        self.assertIsInstance(embedding_store, S3EmbeddingStore)
+        embedding_store.put_many({"model/document/abc": [1.0, 2.0]})
+
+        put_object_kwargs = mock_s3_client.put_object.call_args[1]
+        self.assertEqual(put_object_kwargs["Bucket"], "test-bucket")
+        self.assertEqual(put_object_kwargs["Key"], "embeddings/model/document/abc.json")
+        self.assertEqual(json.loads(put_object_kwargs["Body"]), [1.0, 2.0])
+        self.assertEqual(embedding_store.get_many(["model/document/abc"]), {"model/document/abc": [1.0, 2.0]})
+        self.assertEqual(embedding_store.get_many(["model/document/missing"]), {})
@@ -0,0 +1,84 @@
+import unittest
+
+from benchmarks.end_to_end_benchmark import run_testset_size
+from benchmarks.fake_aws import FakeAws, FakeServiceProfile, fill_text, get_prompt_text
+from botocore.exceptions import ClientError
+
+FAKE_AWS_SETTINGS = {"q": {"latency_ms": 0},
+                     "bedrock": {"latency_ms": 0},
+                     "auth": {"latency_ms": 0},
+                     "responses": {"answer_chars": 100, "snippets_count": 2, "snippet_chars": 80,
+                                   "embedding_dimension": 8}}
+
+
+class TestFakeAws(unittest.TestCase):
+
+    def test_q_answers_have_the_configured_size(self):
+        fake_aws = FakeAws(FakeServiceProfile(), FakeServiceProfile(), FakeServiceProfile(),
+                           answer_chars=100, snippets_count=2, snippet_chars=80)
+        response = fake_aws.client("qbusiness").chat_sync(applicationId="app", userMessage="question")
+        self.assertEqual(len(response["systemMessage"]), 100)
+        self.assertEqual([len(attribution["snippet"]) for attribution in response["sourceAttributions"]], [80, 80])
+        self.assertEqual(fake_aws.recorder.latencies_millis.keys(), {"qbusiness.chat_sync"})
+
+    def test_throttled_calls_raise_throttling_exception(self):
+        fake_aws = FakeAws(FakeServiceProfile(throttle_rate=1.0), FakeServiceProfile(), FakeServiceProfile())
+        with self.assertRaises(ClientError) as raised:
+            fake_aws.client("qbusiness").chat_sync(applicationId="app", userMessage="question")
+        self.assertEqual(raised.exception.response["Error"]["Code"], "ThrottlingException")
+        self.assertEqual(fake_aws.recorder.throttles["qbusiness.chat_sync"], 1)
+
+    def test_prompt_text_is_read_from_messages(self):
+        request = {"messages": [{"role": "user", "content": [{"type": "text", "text": "judge the faithfulness"}]}]}
+        self.assertEqual(get_prompt_text(request), "judge the faithfulness")
+        self.assertEqual(fill_text("short text", 4), "short text")
+
+
+class TestEndToEndBenchmark(unittest.TestCase):
+
+    def test_handler_runs_against_the_fakes(self):
+        run = run_testset_size(4, FAKE_AWS_SETTINGS, {"q_max_in_flight": 4, "q_max_qps": 0, "caches": True})
+
+        self.assertEqual(run["answered_questions"], 4)
+        self.assertEqual(run["failed_questions"], 0)
+        self.assertEqual(run["stages"]["retrieve"]["calls"]["qbusiness.chat_sync"]["count"], 4)
+        self.assertIn("bedrock-runtime.invoke_model.chat", run["stages"]["score"]["calls"])
+        self.assertIn("sts.assume_role_with_web_identity", run["stages"]["authenticate"]["calls"])
+        # the fake judge answers parse, so every metric gets a score
+        self.assertEqual(run["mean_scores"]["faithfulness"], 1.0)
+        self.assertTrue(all(score is not None for score in run["mean_scores"].values()))
+
+
+class TestContextPackingBenchmark(unittest.TestCase):
+
+    def test_packing_saves_judge_tokens_on_duplicate_snippets(self):
+        from benchmarks.context_packing_benchmark import create_records, run_benchmark
+
+        records = create_records(questions_count=3, snippets_count=4, snippet_chars=120, duplicate_rate=0.5)
+        results = run_benchmark(records, ["faithfulness", "context_precision"], 0.9, 0, "us-east-1",
+                                "amazon.titan-embed-text-v1", "anthropic.claude-3-haiku-20240307-v1:0",
+                                {"embedding_dimension": 8})
+
+        self.assertGreater(results["context_packing"]["ContextDuplicateSnippets"], 0)
+        self.assertLess(results["packed_judge_input_tokens"], results["raw_judge_input_tokens"])
+        self.assertEqual(results["scores"]["faithfulness"]["max_abs_difference"], 0.0)
+
+
+class TestAggregationBenchmark(unittest.TestCase):
+
+    def test_vectorized_summaries_match_the_row_loops(self):
+        from benchmarks.aggregation_benchmark import DEFAULT_METRICS, create_results, run_benchmark, \
+            summarize_with_row_loops
+        from utils.score_aggregation import summarize_results
+
+        results = create_results(2000, DEFAULT_METRICS, categories=3, applications=2, nan_rate=0.1)
+        summaries = summarize_results(results, DEFAULT_METRICS, bootstrap_samples=0)
+        for metric_name, category_summaries in summarize_with_row_loops(results, DEFAULT_METRICS).items():
+            for category, summary in category_summaries.items():
+                for statistic in ("mean", "p50", "nan_rate"):
+                    self.assertAlmostEqual(summaries[metric_name]["by_category"][category][statistic],
+                                           summary[statistic])
+
+        benchmark_results = run_benchmark(2000, DEFAULT_METRICS, 3, 2, bootstrap_samples=100, repeat=1)
+        self.assertEqual(benchmark_results["rows"], 2000)
+        self.assertGreater(benchmark_results["mean_category_interval_width"], 0)
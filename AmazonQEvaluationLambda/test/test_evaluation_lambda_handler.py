@@ -1,16 +1,28 @@
+import copy
+import json
+import tempfile
 import unittest
-from unittest.mock import patch
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, MagicMock
 
+from botocore.exceptions import ClientError
 from datasets import Dataset
 from ragas.evaluation import Result
 
 from ragas.metrics import answer_relevancy, faithfulness, context_recall, context_precision
 
+from adapters.qbusiness_adapter import QAnswerRecord, QFetchResult
 from .constants import TEST_Q_CHAT_RESPONSE, REGION, Q_APPLICATION_ID, BEDROCK_EMBEDDING_MODEL_ID, \
-    BEDROCK_TEXT_MODEL_ID, IDENTITY_POOL_ID, USER_POOL_ID, CLIENT_ID, Q_APP_ROLE_ARN, USER_EMAIL, USER_SECRET_ID
+    BEDROCK_TEXT_MODEL_ID, IDENTITY_POOL_ID, USER_POOL_ID, CLIENT_ID, Q_APP_ROLE_ARN, USER_EMAIL, USER_SECRET_ID, \
+    GET_SECRET_RESPONSE, TEST_DESCRIBE_USER_POOL_CLIENT_RESPONSE, TEST_INITIATE_AUTH_RESPONSE, TEST_GET_ID_RESPONSE, \
+    TEST_GET_OPEN_ID_TOKEN, TEST_ASSUME_ROLE_WITH_WEB_IDENTITY_RESPONSE
 
 
 class TestEvaluationLambdaHandler(unittest.TestCase):
+    def setUp(self):
+        from handlers import q_evaluation_lambda_handler
+        q_evaluation_lambda_handler.CREDENTIALS_CACHE.clear()
+
     @patch.dict("os.environ", {"Region": REGION,
                                "QBusinessApplicationId": Q_APPLICATION_ID,
                                "BedrockEmbeddingModelId": BEDROCK_EMBEDDING_MODEL_ID,
@@ -21,8 +33,9 @@ class TestEvaluationLambdaHandler(unittest.TestCase):
                                "Q_APP_ROLE_ARN": Q_APP_ROLE_ARN,
                                "USER_EMAIL": USER_EMAIL,
                                "USER_SECRET_ID": USER_SECRET_ID})
+    @patch("handlers.q_evaluation_lambda_handler.APPLICATION_ID", Q_APPLICATION_ID)
     @patch("handlers.q_evaluation_lambda_handler.QbusinessAdapter")
-    @patch("handlers.q_evaluation_lambda_handler.RagasUtils")
+    @patch("utils.ragas_utils.RagasUtils")
     @patch("handlers.q_evaluation_lambda_handler.SecretManagerAdapter")
     @patch("handlers.q_evaluation_lambda_handler.AuthenticationUtils")
     @patch("handlers.q_evaluation_lambda_handler.StsAdapter")
@@ -32,7 +45,8 @@ class TestEvaluationLambdaHandler(unittest.TestCase):
                                                      mock_secret_manager_adapter,
                                                      mock_ragas_utils, mock_qbusiness_adapter):
         qbusiness_adapter_mock = mock_qbusiness_adapter.return_value
-        qbusiness_adapter_mock.get_q_application_response.return_value = {"what is Q?": TEST_Q_CHAT_RESPONSE}
+        qbusiness_adapter_mock.fetch_q_application_responses.return_value = QFetchResult(
+            records=[QAnswerRecord("what is Q?", TEST_Q_CHAT_RESPONSE)], q_calls=1)
         sts_adapter_mock = mock_sts_adapter.return_value
         auth_utils_mock = mock_auth_utils.return_value
         secret_manager_adapter_mock = mock_secret_manager_adapter.return_value
@@ -62,12 +76,7 @@ class TestEvaluationLambdaHandler(unittest.TestCase):
         mock_results = Result(scores=test_scores, dataset=dataset)
         ragas_utils_mock = mock_ragas_utils.return_value
         ragas_utils_mock.evaluate_dataset.return_value = mock_results
-        ragas_utils_mock.configure_metrics_to_use_bedrock.return_value = None
 
-        expected_evaluation_metrics = [answer_relevancy,
-                                       faithfulness,
-                                       context_recall,
-                                       context_precision]
         testset = [{
             "question": "what is Q?",
             "ground_truth": "Q is an AWS service"
@@ -76,8 +85,7 @@ class TestEvaluationLambdaHandler(unittest.TestCase):
         from handlers import q_evaluation_lambda_handler
         q_evaluation_lambda_handler.lambda_handler({"testset": testset}, None)
 
-        qbusiness_adapter_mock.get_q_application_response.assert_called_with(['what is Q?'], Q_APPLICATION_ID)
-        ragas_utils_mock.configure_metrics_to_use_bedrock.assert_called_with(expected_evaluation_metrics)
+        qbusiness_adapter_mock.fetch_q_application_responses.assert_called_with(['what is Q?'], Q_APPLICATION_ID)
         ragas_utils_mock.evaluate_dataset.assert_called_once()
         sts_adapter_mock.assume_role_with_oidc_provider.assert_called_once()
         auth_utils_mock.get_token_id_for_cognito_user.assert_called_once()
@@ -86,7 +94,12 @@ class TestEvaluationLambdaHandler(unittest.TestCase):
 
         evaluate_call_args = ragas_utils_mock.evaluate_dataset.call_args
         self.assertIsInstance(evaluate_call_args[0][0], Dataset)
-        self.assertEqual(evaluate_call_args[0][1], expected_evaluation_metrics)
+        evaluation_metrics = evaluate_call_args[0][1]
+        self.assertEqual([metric.name for metric in evaluation_metrics],
+                         ["answer_relevancy", "faithfulness", "context_recall", "context_precision"])
+        # new instances bound to this invocation judge, the ragas module-level metrics are left untouched
+        self.assertIsNot(evaluation_metrics[0], answer_relevancy)
+        self.assertIs(evaluation_metrics[1].llm, ragas_utils_mock.get_judge_llm.return_value)
 
     def test_when_testset_exceeds_limits_handler_raises_exception(self):
         testset = [{
@@ -96,3 +109,493 @@ class TestEvaluationLambdaHandler(unittest.TestCase):
         with self.assertRaises(Exception):
             from handlers import q_evaluation_lambda_handler
             q_evaluation_lambda_handler.lambda_handler({"testset": testset}, None)
+
+    @patch("handlers.q_evaluation_lambda_handler.SecretManagerAdapter")
+    @patch("handlers.q_evaluation_lambda_handler.AuthenticationUtils")
+    @patch("handlers.q_evaluation_lambda_handler.StsAdapter")
+    def test_auth_error_invalidates_the_cached_secret_and_retries_once(self, mock_sts_adapter, mock_auth_utils,
+                                                                       mock_secret_manager_adapter):
+        secret_manager_adapter_mock = mock_secret_manager_adapter.return_value
+        secret_manager_adapter_mock.get_secret.side_effect = [{"password": "rotated_password"},
+                                                              {"password": "new_password"}]
+        sts_adapter_mock = mock_sts_adapter.return_value
+        access_denied = ClientError({"Error": {"Code": "AccessDenied", "Message": "denied"}}, "AssumeRoleWithWebIdentity")
+        sts_adapter_mock.assume_role_with_oidc_provider.side_effect = [access_denied, {"AccessKeyId": "key"}]
+
+        from handlers import q_evaluation_lambda_handler
+        self.assertEqual(q_evaluation_lambda_handler.get_q_app_credentials(), {"AccessKeyId": "key"})
+        self.assertEqual(secret_manager_adapter_mock.get_secret.call_count, 2)
+        self.assertEqual(mock_auth_utils.return_value.get_token_id_for_cognito_user.call_args.args[1], "new_password")
+
+        # a second auth error is not retried again
+        q_evaluation_lambda_handler.CREDENTIALS_CACHE.clear()
+        secret_manager_adapter_mock.get_secret.side_effect = None
+        secret_manager_adapter_mock.get_secret.return_value = {"password": "new_password"}
+        sts_adapter_mock.assume_role_with_oidc_provider.side_effect = access_denied
+        with self.assertRaises(ClientError):
+            q_evaluation_lambda_handler.get_q_app_credentials()
+        self.assertEqual(sts_adapter_mock.assume_role_with_oidc_provider.call_count, 4)
+
+
+def fetch_q_application_responses_stub(questions, application_id):
+    return QFetchResult(records=[QAnswerRecord(q, TEST_Q_CHAT_RESPONSE, latency_millis=100.0) for q in questions],
+                        q_calls=len(set(questions)))
+
+
+def failing_fetch_q_application_responses_stub(failed_questions):
+    def fetch_q_application_responses(questions, application_id):
+        return QFetchResult(records=[QAnswerRecord(q, error=Exception("ThrottlingException")) if q in failed_questions
+                                     else QAnswerRecord(q, TEST_Q_CHAT_RESPONSE) for q in questions],
+                            q_calls=len(set(questions)))
+    return fetch_q_application_responses
+
+
+def evaluate_dataset_stub(evaluation_dataset, metrics):
+    scores = {metric.name: [float(len(q) % 3) / 2 for q in evaluation_dataset["question"]] for metric in metrics}
+    return Result(scores=Dataset.from_dict(scores), dataset=evaluation_dataset)
+
+
+@patch("handlers.q_evaluation_lambda_handler.REGION", REGION)
+@patch("handlers.q_evaluation_lambda_handler.APPLICATION_ID", Q_APPLICATION_ID)
+@patch("handlers.q_evaluation_lambda_handler.QbusinessAdapter")
+@patch("utils.ragas_utils.RagasUtils")
+@patch("handlers.q_evaluation_lambda_handler.SecretManagerAdapter")
+@patch("handlers.q_evaluation_lambda_handler.AuthenticationUtils")
+@patch("handlers.q_evaluation_lambda_handler.StsAdapter")
+@patch("handlers.q_evaluation_lambda_handler.SSOOIDCAdapter")
+class TestShardedEvaluationLambdaHandler(unittest.TestCase):
+    testset = [{"question": f"what is Q{'?' * i}", "ground_truth": "Q is an AWS service"} for i in range(25)]
+
+    def setUp(self):
+        from handlers import q_evaluation_lambda_handler
+        q_evaluation_lambda_handler.CREDENTIALS_CACHE.clear()
+
+    def _setup_mocks(self, mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter):
+        mock_secret_manager_adapter.return_value.get_secret.return_value = {"password": "some_test_password"}
+        mock_qbusiness_adapter.return_value.fetch_q_application_responses.side_effect = \
+            fetch_q_application_responses_stub
+        ragas_utils_mock = mock_ragas_utils.return_value
+        ragas_utils_mock.evaluate_dataset.side_effect = evaluate_dataset_stub
+        return ragas_utils_mock
+
+    def test_large_testset_is_evaluated_in_shards(self, mock_ssooidc_adapter, mock_sts_adapter, mock_auth_utils,
+                                                  mock_secret_manager_adapter, mock_ragas_utils,
+                                                  mock_qbusiness_adapter):
+        ragas_utils_mock = self._setup_mocks(mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter)
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as checkpoint_location:
+            results = q_evaluation_lambda_handler.lambda_handler({"testset": self.testset,
+                                                                  "shard_size": 10,
+                                                                  "checkpoint_location": checkpoint_location},
+                                                                 None)
+
+        self.assertEqual(results["status"], "COMPLETE")
+        self.assertEqual(results["total_shards"], 3)
+        self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 3)
+
+        # same aggregates as a single evaluation of the whole testset
+        full_results = evaluate_dataset_stub(Dataset.from_dict({"question": [e["question"] for e in self.testset]}),
+                                             [answer_relevancy, faithfulness, context_recall, context_precision])
+        for metric_name, score in results["aggregates"].items():
+            self.assertAlmostEqual(score, full_results[metric_name])
+            self.assertAlmostEqual(results["summary"][metric_name]["all"]["mean"], full_results[metric_name])
+            self.assertEqual(results["summary"][metric_name]["by_category"]["uncategorized"]["count"],
+                             len(self.testset))
+        self.assertEqual(len(json.loads(results["results"])), len(self.testset))
+
+    def test_interrupted_run_resumes_from_last_finished_shard(self, mock_ssooidc_adapter, mock_sts_adapter,
+                                                              mock_auth_utils, mock_secret_manager_adapter,
+                                                              mock_ragas_utils, mock_qbusiness_adapter):
+        ragas_utils_mock = self._setup_mocks(mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter)
+        context = MagicMock()
+        # enough time for the first shard only
+        context.get_remaining_time_in_millis.side_effect = [600_000, 1_000]
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as checkpoint_location:
+            event = {"testset": self.testset, "shard_size": 10, "checkpoint_location": checkpoint_location}
+            first_results = q_evaluation_lambda_handler.lambda_handler(event, context)
+            self.assertEqual(first_results["status"], "INCOMPLETE")
+            self.assertEqual(first_results["completed_shards"], 1)
+            self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 1)
+
+            second_results = q_evaluation_lambda_handler.lambda_handler(event, None)
+
+        self.assertEqual(second_results["status"], "COMPLETE")
+        self.assertEqual(second_results["run_id"], first_results["run_id"])
+        self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 3)
+        self.assertEqual(len(json.loads(second_results["results"])), len(self.testset))
+
+    def test_run_stops_at_the_token_budget_and_resumes(self, mock_ssooidc_adapter, mock_sts_adapter,
+                                                       mock_auth_utils, mock_secret_manager_adapter,
+                                                       mock_ragas_utils, mock_qbusiness_adapter):
+        ragas_utils_mock = self._setup_mocks(mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter)
+
+        def evaluate_dataset_spending_tokens(evaluation_dataset, metrics):
+            mock_ragas_utils.call_args[1]["token_accountant"].record(BEDROCK_TEXT_MODEL_ID, 800, 200)
+            return evaluate_dataset_stub(evaluation_dataset, metrics)
+
+        ragas_utils_mock.evaluate_dataset.side_effect = evaluate_dataset_spending_tokens
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as checkpoint_location:
+            event = {"testset": self.testset, "shard_size": 10, "checkpoint_location": checkpoint_location,
+                     "token_budget": 2000}
+            first_results = q_evaluation_lambda_handler.lambda_handler(event, None)
+            self.assertEqual(first_results["status"], "INCOMPLETE")
+            self.assertEqual(first_results["completed_shards"], 2)
+            self.assertEqual(first_results["token_usage"]["input_tokens"], 1600)
+            self.assertTrue(first_results["token_usage"]["budget_exhausted"])
+
+            second_results = q_evaluation_lambda_handler.lambda_handler(event, None)
+
+        self.assertEqual(second_results["status"], "COMPLETE")
+        self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 3)
+        self.assertEqual(second_results["token_usage"]["output_tokens"], 200)
+
+    def test_failed_questions_are_reported_and_the_answered_ones_scored(self, mock_ssooidc_adapter, mock_sts_adapter,
+                                                                        mock_auth_utils, mock_secret_manager_adapter,
+                                                                        mock_ragas_utils, mock_qbusiness_adapter):
+        ragas_utils_mock = self._setup_mocks(mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter)
+        failed_questions = [self.testset[1]["question"], self.testset[12]["question"]]
+        mock_qbusiness_adapter.return_value.fetch_q_application_responses.side_effect = \
+            failing_fetch_q_application_responses_stub(failed_questions)
+
+        from handlers import q_evaluation_lambda_handler
+        results = q_evaluation_lambda_handler.lambda_handler({"testset": self.testset[:5]}, None)
+
+        self.assertEqual(results["failed_questions"], failed_questions[:1])
+        self.assertEqual(results["failed_question_count"], 1)
+        self.assertEqual([record["question"] for record in json.loads(results["results"])],
+                         [entry["question"] for entry in self.testset[:5] if entry["question"] not in failed_questions])
+
+        context = MagicMock()
+        # enough time for the first two shards only
+        context.get_remaining_time_in_millis.side_effect = [600_000, 600_000, 1_000]
+        with tempfile.TemporaryDirectory() as checkpoint_location:
+            event = {"testset": self.testset, "shard_size": 10, "checkpoint_location": checkpoint_location}
+            first_results = q_evaluation_lambda_handler.lambda_handler(event, context)
+            second_results = q_evaluation_lambda_handler.lambda_handler(event, None)
+
+        self.assertEqual(first_results["status"], "INCOMPLETE")
+        self.assertEqual(first_results["failed_question_count"], 2)
+        self.assertEqual(second_results["status"], "COMPLETE")
+        # the failures of the checkpointed shards are still reported once the run resumes
+        self.assertEqual(second_results["failed_questions"], failed_questions)
+        self.assertEqual(len(json.loads(second_results["results"])), len(self.testset) - 2)
+        self.assertEqual(second_results["summary"]["faithfulness"]["by_category"]["uncategorized"]["count"],
+                         len(self.testset) - 2)
+        self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 4)
+
+    def test_resuming_with_a_different_testset_raises_exception(self, mock_ssooidc_adapter, mock_sts_adapter,
+                                                                mock_auth_utils, mock_secret_manager_adapter,
+                                                                mock_ragas_utils, mock_qbusiness_adapter):
+        self._setup_mocks(mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter)
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as checkpoint_location:
+            q_evaluation_lambda_handler.lambda_handler({"testset": self.testset, "shard_size": 10, "run_id": "run1",
+                                                        "checkpoint_location": checkpoint_location}, None)
+            with self.assertRaises(Exception):
+                q_evaluation_lambda_handler.lambda_handler({"testset": self.testset[:5], "shard_size": 10,
+                                                            "run_id": "run1",
+                                                            "checkpoint_location": checkpoint_location}, None)
+
+    def test_other_scoring_settings_do_not_reuse_the_checkpoints(self, mock_ssooidc_adapter, mock_sts_adapter,
+                                                                 mock_auth_utils, mock_secret_manager_adapter,
+                                                                 mock_ragas_utils, mock_qbusiness_adapter):
+        ragas_utils_mock = self._setup_mocks(mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter)
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as checkpoint_location:
+            event = {"testset": self.testset, "shard_size": 10, "checkpoint_location": checkpoint_location}
+            first_results = q_evaluation_lambda_handler.lambda_handler(event, None)
+            second_results = q_evaluation_lambda_handler.lambda_handler({**event, "metrics": ["faithfulness"]}, None)
+            with self.assertRaises(Exception):
+                q_evaluation_lambda_handler.lambda_handler({**event, "run_id": first_results["run_id"],
+                                                            "bedrock_text_model_id": "anthropic.claude-v2"}, None)
+
+        self.assertNotEqual(second_results["run_id"], first_results["run_id"])
+        self.assertEqual(list(second_results["aggregates"]), ["faithfulness"])
+        self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 6)
+
+    def test_completed_run_is_evaluated_again(self, mock_ssooidc_adapter, mock_sts_adapter, mock_auth_utils,
+                                              mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter):
+        ragas_utils_mock = self._setup_mocks(mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter)
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as checkpoint_location:
+            event = {"testset": self.testset, "shard_size": 10, "checkpoint_location": checkpoint_location}
+            self.assertEqual(q_evaluation_lambda_handler.lambda_handler(event, None)["status"], "COMPLETE")
+            self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 3)
+
+            rerun_results = q_evaluation_lambda_handler.lambda_handler(event, None)
+            self.assertEqual(rerun_results["status"], "COMPLETE")
+            self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 6)
+
+            # an interrupted attempt resumes from its own checkpoints, not the ones of the completed attempts
+            context = MagicMock()
+            context.get_remaining_time_in_millis.side_effect = [600_000, 1_000]
+            self.assertEqual(q_evaluation_lambda_handler.lambda_handler(event, context)["status"], "INCOMPLETE")
+            self.assertEqual(q_evaluation_lambda_handler.lambda_handler(event, None)["status"], "COMPLETE")
+            self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 9)
+
+
+@patch("handlers.q_evaluation_lambda_handler.REGION", REGION)
+@patch("handlers.q_evaluation_lambda_handler.APPLICATION_ID", Q_APPLICATION_ID)
+@patch("handlers.q_evaluation_lambda_handler.QbusinessAdapter")
+@patch("utils.ragas_utils.RagasUtils")
+@patch("handlers.q_evaluation_lambda_handler.SecretManagerAdapter")
+@patch("handlers.q_evaluation_lambda_handler.AuthenticationUtils")
+@patch("handlers.q_evaluation_lambda_handler.StsAdapter")
+@patch("handlers.q_evaluation_lambda_handler.SSOOIDCAdapter")
+class TestAdaptiveSamplingEvaluationLambdaHandler(unittest.TestCase):
+    testset = [{"question": f"question {i}", "ground_truth": "Q is an AWS service",
+                "category": "billing" if i % 4 else "index"} for i in range(1000)]
+
+    def setUp(self):
+        from handlers import q_evaluation_lambda_handler
+        q_evaluation_lambda_handler.CREDENTIALS_CACHE.clear()
+
+    def _setup_mocks(self, mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter):
+        mock_secret_manager_adapter.return_value.get_secret.return_value = {"password": "some_test_password"}
+        mock_qbusiness_adapter.return_value.fetch_q_application_responses.side_effect = \
+            fetch_q_application_responses_stub
+        ragas_utils_mock = mock_ragas_utils.return_value
+        ragas_utils_mock.evaluate_dataset.side_effect = evaluate_dataset_stub
+        return ragas_utils_mock
+
+    def test_sampling_stops_once_the_intervals_are_narrow_enough(self, mock_ssooidc_adapter, mock_sts_adapter,
+                                                                 mock_auth_utils, mock_secret_manager_adapter,
+                                                                 mock_ragas_utils, mock_qbusiness_adapter):
+        ragas_utils_mock = self._setup_mocks(mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter)
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as checkpoint_location:
+            results = q_evaluation_lambda_handler.lambda_handler({"testset": self.testset,
+                                                                  "target_interval_width": 0.15,
+                                                                  "target_metrics": ["faithfulness"],
+                                                                  "checkpoint_location": checkpoint_location},
+                                                                 None)
+
+        self.assertEqual(results["status"], "COMPLETE")
+        self.assertEqual(results["stop_reason"], "TARGET_REACHED")
+        self.assertLess(results["scored_questions"], 300)
+        self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, results["scored_questions"] // 50)
+        self.assertLessEqual(results["interval_widths"]["faithfulness"], 0.15)
+        self.assertEqual(list(results["interval_widths"]), ["faithfulness"])
+        category_counts = {category: summary["count"]
+                           for category, summary in results["summary"]["faithfulness"]["by_category"].items()}
+        self.assertEqual(category_counts, {"billing": 0.75 * results["scored_questions"],
+                                           "index": 0.25 * results["scored_questions"]})
+        self.assertEqual(len(json.loads(results["results"])), results["scored_questions"])
+
+    def test_interrupted_sampling_resumes_with_the_same_sample(self, mock_ssooidc_adapter, mock_sts_adapter,
+                                                               mock_auth_utils, mock_secret_manager_adapter,
+                                                               mock_ragas_utils, mock_qbusiness_adapter):
+        ragas_utils_mock = self._setup_mocks(mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter)
+        context = MagicMock()
+        # enough time for the first round only
+        context.get_remaining_time_in_millis.side_effect = [600_000, 1_000]
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as checkpoint_location:
+            event = {"testset": self.testset, "target_interval_width": 0.001, "sampling_round_size": 40,
+                     "sampling_max_questions": 100, "checkpoint_location": checkpoint_location}
+            first_results = q_evaluation_lambda_handler.lambda_handler(event, context)
+            self.assertEqual(first_results["status"], "INCOMPLETE")
+            self.assertEqual(first_results["stop_reason"], "TIME_LIMIT")
+            self.assertEqual(first_results["scored_questions"], 40)
+
+            second_results = q_evaluation_lambda_handler.lambda_handler(event, None)
+
+            with self.assertRaises(Exception):
+                q_evaluation_lambda_handler.lambda_handler({**event, "sampling_seed": 1}, None)
+
+        self.assertEqual(second_results["status"], "COMPLETE")
+        self.assertEqual(second_results["stop_reason"], "MAX_QUESTIONS")
+        self.assertEqual(second_results["run_id"], first_results["run_id"])
+        self.assertEqual(second_results["scored_questions"], 100)
+        self.assertEqual(ragas_utils_mock.evaluate_dataset.call_count, 3)
+        self.assertGreater(second_results["interval_widths"]["context_recall"], 0.001)
+
+
+@patch("handlers.q_evaluation_lambda_handler.REGION", REGION)
+@patch("handlers.q_evaluation_lambda_handler.APPLICATION_ID", Q_APPLICATION_ID)
+@patch("handlers.q_evaluation_lambda_handler.QbusinessAdapter")
+@patch("utils.ragas_utils.RagasUtils")
+@patch("handlers.q_evaluation_lambda_handler.SecretManagerAdapter")
+@patch("handlers.q_evaluation_lambda_handler.AuthenticationUtils")
+@patch("handlers.q_evaluation_lambda_handler.StsAdapter")
+@patch("handlers.q_evaluation_lambda_handler.SSOOIDCAdapter")
+class TestTwoPhaseEvaluationLambdaHandler(unittest.TestCase):
+    testset = [{"question": f"what is Q{'?' * i}", "ground_truth": "Q is an AWS service"} for i in range(15)]
+
+    def setUp(self):
+        from handlers import q_evaluation_lambda_handler
+        q_evaluation_lambda_handler.CREDENTIALS_CACHE.clear()
+
+    def test_one_retrieval_feeds_many_scoring_passes(self, mock_ssooidc_adapter, mock_sts_adapter, mock_auth_utils,
+                                                     mock_secret_manager_adapter, mock_ragas_utils,
+                                                     mock_qbusiness_adapter):
+        mock_secret_manager_adapter.return_value.get_secret.return_value = {"password": "some_test_password"}
+        mock_qbusiness_adapter.return_value.fetch_q_application_responses.side_effect = \
+            fetch_q_application_responses_stub
+        ragas_utils_mock = mock_ragas_utils.return_value
+        ragas_utils_mock.evaluate_dataset.side_effect = evaluate_dataset_stub
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as directory:
+            artifact_location = f"{directory}/answers.parquet"
+            retrieve_results = q_evaluation_lambda_handler.lambda_handler({"phase": "retrieve",
+                                                                           "testset": self.testset,
+                                                                           "artifact_location": artifact_location},
+                                                                          None)
+            self.assertEqual(retrieve_results["answered_questions"], len(self.testset))
+            ragas_utils_mock.evaluate_dataset.assert_not_called()
+
+            first_results = q_evaluation_lambda_handler.lambda_handler(
+                {"phase": "score", "artifact_location": artifact_location}, None)
+            second_scores = json.loads(q_evaluation_lambda_handler.lambda_handler(
+                {"phase": "score", "artifact_location": artifact_location, "metrics": ["faithfulness"],
+                 "bedrock_text_model_id": "another-model"}, None)["results"])
+            first_scores = json.loads(first_results["results"])
+
+        mock_qbusiness_adapter.return_value.fetch_q_application_responses.assert_called_once()
+        self.assertEqual(len(first_scores), len(self.testset))
+        # the same shape as with failed questions
+        self.assertEqual(first_results["failed_questions"], [])
+        self.assertIn("context_precision", first_scores[0])
+        self.assertNotIn("context_precision", second_scores[0])
+        self.assertEqual(mock_ragas_utils.call_args[1]["bedrock_llm_model_id"], "another-model")
+        evaluation_dataset = ragas_utils_mock.evaluate_dataset.call_args[0][0]
+        self.assertEqual(evaluation_dataset["contexts"][0], ["data snippet"])
+
+    def test_results_location_gets_the_results_and_a_summary_is_returned(self, mock_ssooidc_adapter,
+                                                                         mock_sts_adapter, mock_auth_utils,
+                                                                         mock_secret_manager_adapter, mock_ragas_utils,
+                                                                         mock_qbusiness_adapter):
+        mock_secret_manager_adapter.return_value.get_secret.return_value = {"password": "some_test_password"}
+        mock_qbusiness_adapter.return_value.fetch_q_application_responses.side_effect = \
+            fetch_q_application_responses_stub
+        mock_ragas_utils.return_value.evaluate_dataset.side_effect = evaluate_dataset_stub
+        testset = [{**entry, "category": "billing" if i % 3 else "index"} for i, entry in enumerate(self.testset)]
+
+        from handlers import q_evaluation_lambda_handler
+        from utils.results_store import read_results
+        with tempfile.TemporaryDirectory() as directory:
+            artifact_location = f"{directory}/answers.parquet"
+            q_evaluation_lambda_handler.lambda_handler({"phase": "retrieve", "testset": testset,
+                                                        "artifact_location": artifact_location}, None)
+            results = q_evaluation_lambda_handler.lambda_handler(
+                {"phase": "score", "artifact_location": artifact_location, "metrics": ["faithfulness"],
+                 "results_location": f"{directory}/results"}, None)
+            stored_results = read_results(f"{directory}/results", REGION, columns=["category", "faithfulness"],
+                                          filters={"run_id": [results["run_id"]]})
+
+        self.assertEqual(results["rows"], len(testset))
+        self.assertEqual(results["category_rows"], {"index": 5, "billing": 10})
+        self.assertNotIn("results", results)
+        self.assertAlmostEqual(results["aggregates"]["faithfulness"],
+                               sum(stored_results.column("faithfulness").to_pylist()) / len(testset))
+
+    @patch("handlers.q_evaluation_lambda_handler.BEDROCK_BATCH_ROLE_ARN", "arn:aws:iam::111111111111:role/batch")
+    @patch("utils.batch_scoring.BedrockBatchJobRunner")
+    def test_batch_scoring_returns_incomplete_while_the_job_runs(self, mock_batch_job_runner, mock_ssooidc_adapter,
+                                                                 mock_sts_adapter, mock_auth_utils,
+                                                                 mock_secret_manager_adapter, mock_ragas_utils,
+                                                                 mock_qbusiness_adapter):
+        mock_ragas_utils.return_value.evaluate_dataset.return_value = None
+        mock_qbusiness_adapter.return_value.fetch_q_application_responses.side_effect = \
+            fetch_q_application_responses_stub
+        mock_secret_manager_adapter.return_value.get_secret.return_value = {"password": "some_test_password"}
+
+        from handlers import q_evaluation_lambda_handler
+        with tempfile.TemporaryDirectory() as directory:
+            artifact_location = f"{directory}/answers.parquet"
+            q_evaluation_lambda_handler.lambda_handler({"phase": "retrieve", "testset": self.testset,
+                                                        "artifact_location": artifact_location}, None)
+            score_event = {"phase": "score", "artifact_location": artifact_location, "scoring_mode": "batch",
+                           "batch_location": f"{directory}/batch"}
+            first_results = q_evaluation_lambda_handler.lambda_handler(score_event, None)
+            second_results = q_evaluation_lambda_handler.lambda_handler(score_event, None)
+
+            with self.assertRaises(Exception):
+                q_evaluation_lambda_handler.lambda_handler({**score_event, "scoring_mode": "overnight"}, None)
+
+        self.assertEqual(first_results["status"], "INCOMPLETE")
+        self.assertEqual(first_results["run_id"], second_results["run_id"])
+        batch_scorer = mock_ragas_utils.call_args[1]["batch_scorer"]
+        self.assertIs(batch_scorer.job_runner, mock_batch_job_runner.return_value)
+
+    @patch("handlers.q_evaluation_lambda_handler.BEDROCK_BATCH_ROLE_ARN", "arn:aws:iam::111111111111:role/batch")
+    def test_batch_scoring_without_a_region_raises_exception(self, mock_ssooidc_adapter, mock_sts_adapter,
+                                                             mock_auth_utils, mock_secret_manager_adapter,
+                                                             mock_ragas_utils, mock_qbusiness_adapter):
+        from handlers import q_evaluation_lambda_handler
+        # the class patches the region, they are applied after the method patches
+        with patch("handlers.q_evaluation_lambda_handler.REGION", None), self.assertRaisesRegex(Exception, "Region"):
+            q_evaluation_lambda_handler.create_batch_scorer({"scoring_mode": "batch"}, None, ["faithfulness"])
+
+    def test_unknown_phase_raises_exception(self, mock_ssooidc_adapter, mock_sts_adapter, mock_auth_utils,
+                                            mock_secret_manager_adapter, mock_ragas_utils, mock_qbusiness_adapter):
+        from handlers import q_evaluation_lambda_handler
+        with self.assertRaises(Exception):
+            q_evaluation_lambda_handler.lambda_handler({"phase": "publish", "testset": self.testset}, None)
+
+
+@patch("handlers.q_evaluation_lambda_handler.APPLICATION_ID", Q_APPLICATION_ID)
+@patch("handlers.q_evaluation_lambda_handler.USER_EMAIL", USER_EMAIL)
+@patch("handlers.q_evaluation_lambda_handler.Q_APP_ROLE_ARN", Q_APP_ROLE_ARN)
+@patch("utils.ragas_utils.RagasUtils")
+@patch("boto3.client")
+class TestEvaluationLambdaHandlerCredentialsCache(unittest.TestCase):
+    testset = [{"question": "what is Q?", "ground_truth": "Q is an AWS service"}]
+
+    def setUp(self):
+        from handlers import q_evaluation_lambda_handler
+        q_evaluation_lambda_handler.CREDENTIALS_CACHE.clear()
+
+    def _setup_clients(self, boto3_client_mock, mock_ragas_utils, credentials_lifetime: timedelta):
+        mock_client = boto3_client_mock.return_value
+        mock_client.get_secret_value.return_value = GET_SECRET_RESPONSE
+        mock_client.describe_user_pool_client.return_value = TEST_DESCRIBE_USER_POOL_CLIENT_RESPONSE
+        mock_client.initiate_auth.return_value = TEST_INITIATE_AUTH_RESPONSE
+        mock_client.get_id.return_value = TEST_GET_ID_RESPONSE
+        mock_client.get_open_id_token.return_value = TEST_GET_OPEN_ID_TOKEN
+        assume_role_response = copy.deepcopy(TEST_ASSUME_ROLE_WITH_WEB_IDENTITY_RESPONSE)
+        assume_role_response["Credentials"]["Expiration"] = datetime.now(timezone.utc) + credentials_lifetime
+        mock_client.assume_role_with_web_identity.return_value = assume_role_response
+        mock_client.chat_sync.return_value = TEST_Q_CHAT_RESPONSE
+        mock_ragas_utils.return_value.evaluate_dataset.side_effect = evaluate_dataset_stub
+        return mock_client
+
+    def test_warm_invocations_skip_authentication(self, boto3_client_mock, mock_ragas_utils):
+        mock_client = self._setup_clients(boto3_client_mock, mock_ragas_utils, timedelta(hours=1))
+
+        from handlers import q_evaluation_lambda_handler
+        invocations_count = 5
+        for _ in range(invocations_count):
+            q_evaluation_lambda_handler.lambda_handler({"testset": self.testset}, None)
+
+        self.assertEqual(mock_client.chat_sync.call_count, invocations_count)
+        for auth_call in [mock_client.get_secret_value,
+                          mock_client.describe_user_pool_client,
+                          mock_client.initiate_auth,
+                          mock_client.get_id,
+                          mock_client.get_open_id_token,
+                          mock_client.assume_role_with_web_identity]:
+            self.assertEqual(auth_call.call_count, 1)
+
+    def test_credentials_close_to_expiration_are_refreshed(self, boto3_client_mock, mock_ragas_utils):
+        mock_client = self._setup_clients(boto3_client_mock, mock_ragas_utils, timedelta(minutes=2))
+
+        from handlers import q_evaluation_lambda_handler
+        for _ in range(3):
+            q_evaluation_lambda_handler.lambda_handler({"testset": self.testset}, None)
+
+        self.assertEqual(mock_client.assume_role_with_web_identity.call_count, 3)
+        # the password and the client secret are still reused
+        self.assertEqual(mock_client.get_secret_value.call_count, 1)
+        self.assertEqual(mock_client.describe_user_pool_client.call_count, 1)
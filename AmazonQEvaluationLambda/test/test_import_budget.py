@@ -0,0 +1,42 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from benchmarks.import_budget import HEAVY_MODULES, IMPORT_BUDGETS, SOURCE_DIR, check_budget, measure_import
+
+
+class TestImportBudget(unittest.TestCase):
+
+    def test_handler_import_stays_within_budget(self):
+        module_name = "handlers.q_evaluation_lambda_handler"
+        measurement = measure_import(module_name)
+        self.assertEqual(measurement["loaded"], [])
+        self.assertEqual(check_budget(measurement, IMPORT_BUDGETS[module_name]), [])
+
+    def test_answers_artifact_does_not_load_ragas(self):
+        measurement = measure_import("utils.answers_artifact")
+        self.assertNotIn("ragas", measurement["loaded"])
+        self.assertNotIn("datasets", measurement["loaded"])
+
+    def test_check_budget_reports_regressions(self):
+        measurement = {"module": "slow_module", "seconds": 2.0, "rss_mb": 10, "loaded": ["ragas"]}
+        violations = check_budget(measurement, {"max_seconds": 1.0, "max_rss_mb": 50, "lazy": ["ragas"]})
+        self.assertEqual(len(violations), 2)
+        self.assertIn("2.00s", violations[0])
+        self.assertIn("['ragas']", violations[1])
+
+    def test_invalid_event_is_rejected_before_ragas_loads(self):
+        script = ("import json, sys\n"
+                  "from handlers.q_evaluation_lambda_handler import lambda_handler\n"
+                  "try:\n"
+                  "    lambda_handler({'phase': 'unknown'}, None)\n"
+                  "except Exception:\n"
+                  "    pass\n"
+                  "print(json.dumps([name for name in json.loads(sys.argv[1]) if name in sys.modules]))\n")
+        env = {**os.environ, "PYTHONPATH": SOURCE_DIR, "AWS_EMF_ENVIRONMENT": "local",
+               "AWS_DEFAULT_REGION": "us-east-1"}
+        output = subprocess.run([sys.executable, "-c", script, json.dumps(HEAVY_MODULES)], env=env, cwd=SOURCE_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(json.loads(output.splitlines()[-1]), [])
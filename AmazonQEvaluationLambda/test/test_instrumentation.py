@@ -0,0 +1,219 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from utils.client_registry import get_client
+from utils.instrumentation import EmfSink, Instrumentation, JsonLinesSink, LatencyHistogram, instrumentation, \
+    invocation_scope, span
+from .constants import REGION
+
+THROTTLING_ERROR = ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}},
+                               "InvokeModel")
+
+
+def get_stage(stages, stage_name, **dimensions):
+    return next(stage for stage in stages if stage["stage"] == stage_name and stage["dimensions"] == dimensions)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_histogram_percentiles_are_within_a_bucket(self):
+        histogram = LatencyHistogram()
+        for millis in range(1, 1001):
+            histogram.add(millis)
+
+        for percent in (50, 95, 99):
+            self.assertGreaterEqual(histogram.percentile(percent), percent * 10)
+            self.assertLessEqual(histogram.percentile(percent), percent * 10 * 1.19)
+
+    def test_spans_record_errors_and_throttles_per_dimensions(self):
+        stage_instrumentation = Instrumentation()
+        with stage_instrumentation.span("JudgeCall", Metric="faithfulness"):
+            pass
+        with self.assertRaises(ClientError):
+            with stage_instrumentation.span("JudgeCall", Metric="faithfulness"):
+                raise THROTTLING_ERROR
+        with self.assertRaises(ValueError):
+            with stage_instrumentation.span("JudgeCall", Metric="context_recall"):
+                raise ValueError("unexpected")
+
+        stages = stage_instrumentation.snapshot()
+        faithfulness = get_stage(stages, "JudgeCall", Metric="faithfulness")
+        self.assertEqual((faithfulness["count"], faithfulness["errors"], faithfulness["throttles"]), (2, 1, 1))
+        context_recall = get_stage(stages, "JudgeCall", Metric="context_recall")
+        self.assertEqual((context_recall["count"], context_recall["errors"], context_recall["throttles"]), (1, 1, 0))
+
+    def test_concurrent_records_are_all_counted(self):
+        stage_instrumentation = Instrumentation()
+
+        def record():
+            for _ in range(1000):
+                stage_instrumentation.record("QuestionAnswer", 5.0, retries=1)
+
+        threads = [threading.Thread(target=record) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stage = get_stage(stage_instrumentation.snapshot(), "QuestionAnswer")
+        self.assertEqual((stage["count"], stage["retries"]), (8000, 8000))
+
+    def test_span_overhead_is_a_few_microseconds(self):
+        stage_instrumentation = Instrumentation()
+        start = time.perf_counter()
+        for _ in range(20_000):
+            with stage_instrumentation.span("MetricScore", Metric="faithfulness"):
+                pass
+        # a Bedrock call takes hundreds of milliseconds, leave plenty of margin for slow CI machines
+        self.assertLess((time.perf_counter() - start) / 20_000, 50e-6)
+
+    def test_flush_writes_the_stages_once(self):
+        stage_instrumentation = Instrumentation()
+        stage_instrumentation.record("Authenticate", 120.0)
+        sink = MagicMock()
+
+        stage_instrumentation.flush(sink)
+        stage_instrumentation.flush(sink)
+
+        sink.write.assert_called_once()
+        self.assertEqual(sink.write.call_args[0][0][0]["stage"], "Authenticate")
+
+    def test_concurrent_invocations_flush_their_own_stages(self):
+        both_recording = threading.Barrier(2)
+        flushed = {}
+
+        def invoke(phase):
+            with invocation_scope() as invocation_instrumentation:
+                with span("Invocation", Phase=phase):
+                    both_recording.wait()
+                both_recording.wait()
+                flushed[phase] = invocation_instrumentation.flush(MagicMock())
+
+        threads = [threading.Thread(target=invoke, args=(phase,)) for phase in ("retrieve", "score")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([stage["dimensions"] for stage in flushed["retrieve"]], [{"Phase": "retrieve"}])
+        self.assertEqual([stage["dimensions"] for stage in flushed["score"]], [{"Phase": "score"}])
+
+
+class TestAwsCallInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.reset()
+        self.addCleanup(instrumentation.reset)
+
+    def test_registry_clients_record_every_call(self):
+        sts_client = get_client("sts", REGION)
+        with Stubber(sts_client) as stubber:
+            stubber.add_response("get_caller_identity", {"UserId": "user", "Account": "111111111111",
+                                                         "Arn": "arn:aws:iam::111111111111:user/user"})
+            stubber.add_client_error("get_caller_identity", service_error_code="Throttling", http_status_code=400)
+            sts_client.get_caller_identity()
+            with self.assertRaises(ClientError):
+                sts_client.get_caller_identity()
+
+        stage = get_stage(instrumentation.snapshot(), "sts.GetCallerIdentity")
+        self.assertEqual((stage["count"], stage["errors"], stage["throttles"]), (2, 1, 1))
+
+    def test_calls_are_recorded_by_the_invocation_making_them(self):
+        sts_client = get_client("sts", REGION)
+        with Stubber(sts_client) as stubber:
+            stubber.add_response("get_caller_identity", {"UserId": "user", "Account": "111111111111",
+                                                         "Arn": "arn:aws:iam::111111111111:user/user"})
+            with invocation_scope() as invocation_instrumentation:
+                sts_client.get_caller_identity()
+
+        self.assertEqual(get_stage(invocation_instrumentation.snapshot(), "sts.GetCallerIdentity")["count"], 1)
+        self.assertEqual(instrumentation.snapshot(), [])
+
+    def test_model_invocations_are_split_by_model(self):
+        bedrock_client = get_client("bedrock-runtime", REGION)
+        with Stubber(bedrock_client) as stubber:
+            for model_id in ("amazon.titan-embed-text-v1", "anthropic.claude-v2", "anthropic.claude-v2"):
+                stubber.add_response("invoke_model", {"body": MagicMock(), "contentType": "application/json"})
+                bedrock_client.invoke_model(modelId=model_id, body=b"{}")
+
+        stages = instrumentation.snapshot()
+        self.assertEqual(get_stage(stages, "bedrock-runtime.InvokeModel", ModelId="anthropic.claude-v2")["count"], 2)
+        self.assertEqual(
+            get_stage(stages, "bedrock-runtime.InvokeModel", ModelId="amazon.titan-embed-text-v1")["count"], 1)
+
+
+class TestSinks(unittest.TestCase):
+    STAGES = [{"stage": "MetricScore", "dimensions": {"Metric": "faithfulness"}, "count": 4, "errors": 1,
+               "throttles": 1, "retries": 2, "total_millis": 40.0, "p50_millis": 9.5, "p95_millis": 11.3,
+               "p99_millis": 11.3, "max_millis": 11.0}]
+
+    @patch("aws_embedded_metrics.logger.metrics_logger_factory.create_metrics_logger")
+    def test_emf_sink_puts_one_event_per_stage(self, create_metrics_logger_mock):
+        metrics = create_metrics_logger_mock.return_value
+        metrics.flush = AsyncMock()
+
+        EmfSink({"QApplicationId": "app"}).write(self.STAGES)
+
+        metrics.set_dimensions.assert_called_once_with({"QApplicationId": "app", "Stage": "MetricScore",
+                                                        "Metric": "faithfulness"})
+        metrics.put_metric.assert_any_call("Throttles", 1, "Count")
+        metrics.put_metric.assert_any_call("LatencyP95", 11.3, "Milliseconds")
+        metrics.flush.assert_awaited_once()
+
+    def test_json_lines_sink_appends_a_line_per_flush(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "runs", "instrumentation.jsonl")
+            JsonLinesSink(path).write(self.STAGES)
+            JsonLinesSink(path).write(self.STAGES)
+            with open(path, encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]["stages"], self.STAGES)
+
+
+class TestMetricSpanCallbackHandler(unittest.TestCase):
+
+    def test_judge_calls_are_attributed_to_their_metric(self):
+        from utils.ragas_utils import MetricSpanCallbackHandler
+
+        stage_instrumentation = Instrumentation()
+        handler = MetricSpanCallbackHandler(["faithfulness"], stage_instrumentation)
+        row_run, metric_run, prompt_run, llm_run = (uuid.uuid4() for _ in range(4))
+        handler.on_chain_start({"name": "row 0"}, {}, run_id=row_run)
+        handler.on_chain_start({"name": "faithfulness"}, {}, run_id=metric_run, parent_run_id=row_run)
+        handler.on_chain_start({"name": "statements"}, {}, run_id=prompt_run, parent_run_id=metric_run)
+        handler.on_chat_model_start({}, [], run_id=llm_run, parent_run_id=prompt_run)
+        handler.on_llm_error(THROTTLING_ERROR, run_id=llm_run)
+        handler.on_chain_end({}, run_id=prompt_run)
+        handler.on_chain_end({}, run_id=metric_run)
+        handler.on_chain_end({}, run_id=row_run)
+
+        stages = stage_instrumentation.snapshot()
+        self.assertEqual([(stage["stage"], stage["dimensions"]) for stage in stages],
+                         [("JudgeCall", {"Metric": "faithfulness"}), ("MetricScore", {"Metric": "faithfulness"})])
+        self.assertEqual(get_stage(stages, "JudgeCall", Metric="faithfulness")["throttles"], 1)
+
+
+class TestHandlerInstrumentation(unittest.TestCase):
+
+    def test_failed_invocation_is_flushed_to_the_json_sink(self):
+        from handlers import q_evaluation_lambda_handler
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "instrumentation.jsonl")
+            with patch("handlers.q_evaluation_lambda_handler.INSTRUMENTATION_LOCATION", path), \
+                    self.assertRaises(Exception):
+                q_evaluation_lambda_handler.lambda_handler({"phase": "publish"}, None)
+            with open(path, encoding="utf-8") as f:
+                stages = json.loads(f.readline())["stages"]
+
+        invocation = get_stage(stages, "Invocation", Phase="publish")
+        self.assertEqual((invocation["count"], invocation["errors"]), (1, 1))
@@ -0,0 +1,135 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from langchain_core.language_models.fake import FakeListLLM
+from ragas.llms.prompt import PromptValue
+
+from utils.llm_cache import (CachedLLMWrapper, InMemoryLLMResponseStore, S3LLMResponseStore, SqliteLLMResponseStore,
+                             create_llm_response_store, get_llm_cache_key)
+from .constants import REGION, BEDROCK_TEXT_MODEL_ID, FakeClock
+
+TEST_PROMPT = PromptValue(prompt_str="Given the context, is the answer faithful?\n  answer: Q is an AWS service")
+
+
+class TestCachedLLMWrapper(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, "llm.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _cached_llm_wrapper(self, fake_llm: FakeListLLM) -> CachedLLMWrapper:
+        return CachedLLMWrapper(fake_llm, BEDROCK_TEXT_MODEL_ID, SqliteLLMResponseStore(self.cache_path))
+
+    def test_rerun_is_served_from_persistent_cache(self):
+        first_llm = FakeListLLM(responses=["yes", "no"])
+        first_result = asyncio.run(self._cached_llm_wrapper(first_llm).generate(TEST_PROMPT))
+
+        second_llm = FakeListLLM(responses=["different"])
+        cached_llm_wrapper = self._cached_llm_wrapper(second_llm)
+        reworded_prompt = PromptValue(prompt_str=" Given the context, is the answer faithful?  answer: Q is an AWS service")
+        second_result = asyncio.run(cached_llm_wrapper.generate(reworded_prompt))
+
+        self.assertEqual(first_result.generations[0][0].text, "yes")
+        self.assertEqual(second_result.generations[0][0].text, "yes")
+        self.assertEqual(second_llm.i, 0)
+        self.assertEqual(cached_llm_wrapper.get_stats(), {"LLMCacheHits": 1, "LLMCacheMisses": 0,
+                                                          "LLMCacheBypassed": 0})
+
+    def test_multiple_completions_are_cached_together(self):
+        fake_llm = FakeListLLM(responses=["q1", "q2", "q3", "q4"])
+        cached_llm_wrapper = self._cached_llm_wrapper(fake_llm)
+        cached_llm_wrapper.generate_text(TEST_PROMPT, n=3, temperature=1e-8)
+        result = cached_llm_wrapper.generate_text(TEST_PROMPT, n=3, temperature=1e-8)
+
+        self.assertEqual([generation.text for generation in result.generations[0]], ["q1", "q2", "q3"])
+        self.assertEqual(cached_llm_wrapper.get_stats()["LLMCacheHits"], 1)
+
+    def test_sampling_temperatures_bypass_the_cache(self):
+        fake_llm = FakeListLLM(responses=["a", "b", "c"])
+        cached_llm_wrapper = self._cached_llm_wrapper(fake_llm)
+        cached_llm_wrapper.generate_text(TEST_PROMPT, temperature=0.7)
+        result = cached_llm_wrapper.generate_text(TEST_PROMPT, temperature=0.7)
+
+        self.assertEqual(result.generations[0][0].text, "b")
+        self.assertEqual(cached_llm_wrapper.get_stats()["LLMCacheBypassed"], 2)
+
+    def test_store_calls_run_off_the_event_loop(self):
+        store_threads = []
+
+        class ThreadRecordingStore(InMemoryLLMResponseStore):
+            def get(self, key):
+                store_threads.append(threading.get_ident())
+                return super().get(key)
+
+            def put(self, key, generations):
+                store_threads.append(threading.get_ident())
+                super().put(key, generations)
+
+        cached_llm_wrapper = CachedLLMWrapper(FakeListLLM(responses=["yes"]), BEDROCK_TEXT_MODEL_ID,
+                                              ThreadRecordingStore())
+
+        async def generate_twice():
+            await cached_llm_wrapper.generate(TEST_PROMPT)
+            result = await cached_llm_wrapper.generate(TEST_PROMPT)
+            return result, threading.get_ident()
+
+        result, event_loop_thread = asyncio.run(generate_twice())
+
+        self.assertEqual(result.generations[0][0].text, "yes")
+        self.assertEqual(len(store_threads), 3)
+        self.assertNotIn(event_loop_thread, store_threads)
+
+    def test_cache_key_depends_on_model_and_temperature(self):
+        prompt = TEST_PROMPT.to_string()
+        key = get_llm_cache_key(BEDROCK_TEXT_MODEL_ID, 1e-8, 1, None, prompt)
+        self.assertEqual(key, get_llm_cache_key(BEDROCK_TEXT_MODEL_ID, 1e-8, 1, None, f"  {prompt}\n"))
+        self.assertNotEqual(key, get_llm_cache_key("another-model", 1e-8, 1, None, prompt))
+        self.assertNotEqual(key, get_llm_cache_key(BEDROCK_TEXT_MODEL_ID, 0.3, 1, None, prompt))
+
+
+class TestSqliteLLMResponseStore(unittest.TestCase):
+    def test_expired_and_least_recently_used_entries_are_evicted(self):
+        clock = FakeClock(1_000.0)
+        with tempfile.TemporaryDirectory() as directory:
+            store = SqliteLLMResponseStore(os.path.join(directory, "llm.sqlite3"),
+                                           ttl_seconds=100, max_entries=2, clock=clock)
+            store.put("a", ["answer a"])
+            clock.now += 1
+            store.put("b", ["answer b"])
+            clock.now += 1
+            self.assertEqual(store.get("a"), ["answer a"])
+            clock.now += 1
+            store.put("c", ["answer c"])
+
+            self.assertIsNone(store.get("b"))
+            self.assertEqual(store.get("a"), ["answer a"])
+            clock.now += 100
+            self.assertIsNone(store.get("c"))
+
+
+class TestS3LLMResponseStore(unittest.TestCase):
+    @patch("utils.client_registry.boto3.client")
+    def test_expired_entries_are_ignored(self, boto3_client_mock):
+        clock = FakeClock(1_000.0)
+        mock_s3_client = boto3_client_mock.return_value
+        store = create_llm_response_store("s3://test-bucket/llm", REGION)
+        self.assertIsInstance(store, S3LLMResponseStore)
+        store = S3LLMResponseStore(REGION, "test-bucket", "llm", ttl_seconds=100, clock=clock)
+        store.put("model/abc", ["answer"])
+
+        put_object_kwargs = mock_s3_client.put_object.call_args[1]
+        self.assertEqual(put_object_kwargs["Key"], "llm/model/abc.json")
+        body = put_object_kwargs["Body"]
+        mock_s3_client.get_object.side_effect = lambda **kwargs: {"Body": io.BytesIO(body.encode("utf-8"))}
+        self.assertEqual(store.get("model/abc"), ["answer"])
+        clock.now += 100
+        self.assertIsNone(store.get("model/abc"))
+        self.assertEqual(json.loads(body)["created_at"], 1_000.0)
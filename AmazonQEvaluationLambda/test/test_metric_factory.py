@@ -0,0 +1,83 @@
+import os
+import threading
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from datasets import Dataset
+from ragas.metrics import answer_relevancy
+
+from utils.client_registry import get_client
+from utils.metric_factory import create_metrics, get_metric_names
+from utils.ragas_utils import RagasUtils
+from utils.token_accounting import TokenAccountant
+from .constants import REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID
+from .test_token_accounting import AWS_ENVIRONMENT, respond_like_bedrock
+
+
+class TestMetricFactory(unittest.TestCase):
+
+    def test_metric_names_come_from_the_event_or_a_preset(self):
+        self.assertEqual(get_metric_names(),
+                         ["answer_relevancy", "faithfulness", "context_recall", "context_precision"])
+        self.assertEqual(get_metric_names(metric_preset="embeddings_only"), ["answer_similarity"])
+        self.assertEqual(get_metric_names(["faithfulness"], "embeddings_only"), ["faithfulness"])
+        with self.assertRaises(Exception):
+            get_metric_names(["faithfulness", "toxicity"])
+        with self.assertRaises(Exception):
+            get_metric_names(metric_preset="everything")
+
+    def test_every_call_creates_new_metrics(self):
+        first_llm, second_llm, embeddings = MagicMock(), MagicMock(), MagicMock()
+
+        first_metrics = create_metrics(["answer_relevancy", "faithfulness"], first_llm, embeddings)
+        second_metrics = create_metrics(["answer_relevancy", "faithfulness"], second_llm, embeddings)
+
+        self.assertTrue(all(metric.llm is first_llm for metric in first_metrics))
+        self.assertTrue(all(metric.llm is second_llm for metric in second_metrics))
+        self.assertIs(first_metrics[0].embeddings, embeddings)
+        self.assertIsNot(first_metrics[0], answer_relevancy)
+        self.assertIsNot(answer_relevancy.llm, first_llm)
+
+    def test_embeddings_only_metrics_make_no_judge_call(self):
+        llm, embeddings = MagicMock(), MagicMock()
+        embeddings.embed_text = AsyncMock(side_effect=[[1.0, 0.0], [0.8, 0.6]])
+        metric = create_metrics(get_metric_names(metric_preset="embeddings_only"), llm, embeddings)[0]
+
+        score = metric.score({"question": "What is Q?", "answer": "Q is an AWS service",
+                              "ground_truth": "Q is an assistant"})
+
+        self.assertAlmostEqual(score, 0.8)
+        llm.generate.assert_not_called()
+
+
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestConcurrentEvaluations(unittest.TestCase):
+
+    def test_concurrent_evaluations_keep_their_own_judge(self):
+        get_client("bedrock-runtime", REGION).meta.events.register("before-send.bedrock-runtime",
+                                                                   respond_like_bedrock)
+        dataset = Dataset.from_dict({"question": ["What is Q?"], "answer": ["Q is an AWS service"],
+                                     "ground_truth": ["Q is an AWS service"], "contexts": [["Q is an AWS service"]]})
+        judge_model_ids = [BEDROCK_TEXT_MODEL_ID, "anthropic.claude-instant-v1"]
+        accountants = {model_id: TokenAccountant() for model_id in judge_model_ids}
+        errors = []
+
+        def evaluate(model_id):
+            try:
+                ragas_utils = RagasUtils(REGION, BEDROCK_EMBEDDING_MODEL_ID, model_id,
+                                         token_accountant=accountants[model_id])
+                metrics = create_metrics(["answer_relevancy"], ragas_utils.get_judge_llm(),
+                                         ragas_utils.get_embeddings())
+                ragas_utils.evaluate_dataset(dataset, metrics)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=evaluate, args=(model_id,)) for model_id in judge_model_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        for model_id, accountant in accountants.items():
+            self.assertEqual(set(accountant.by_model), {model_id, BEDROCK_EMBEDDING_MODEL_ID})
@@ -1,26 +1,30 @@
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 from botocore.exceptions import ClientError
 
-from .constants import TEST_Q_CHAT_RESPONSE, REGION, Q_APPLICATION_ID, TEST_CREDENTIALS, TEST_ERROR_RESPONSE
+from .constants import TEST_Q_CHAT_RESPONSE, REGION, Q_APPLICATION_ID, TEST_CREDENTIALS, TEST_ERROR_RESPONSE, \
+    TEST_THROTTLING_ERROR_RESPONSE
 from adapters.qbusiness_adapter import QbusinessAdapter
+from utils.client_registry import client_registry
+from utils.instrumentation import invocation_scope
 
 
 class TestQbusinessAdapter(TestCase):
-    @patch("adapters.qbusiness_adapter.boto3.client")
+    @patch("utils.client_registry.boto3.client")
     def test_get_response_from_q_is_successful(self, boto3_client_mock):
         mock_qbusiness_client = boto3_client_mock.return_value
         mock_qbusiness_client.chat_sync.return_value = TEST_Q_CHAT_RESPONSE
         test_qbusiness_adapter = QbusinessAdapter(region=REGION, credentials=TEST_CREDENTIALS)
 
         sample_questions = ["what is qbusiness?"]
-        expected_results = dict.fromkeys(sample_questions, TEST_Q_CHAT_RESPONSE)
 
-        self.assertEqual(test_qbusiness_adapter.get_q_application_response(sample_questions, Q_APPLICATION_ID),
-                         expected_results)
+        records = test_qbusiness_adapter.get_q_application_response(sample_questions, Q_APPLICATION_ID)
 
-    @patch("adapters.qbusiness_adapter.boto3.client")
+        self.assertEqual([(record.question, record.response) for record in records],
+                         [("what is qbusiness?", TEST_Q_CHAT_RESPONSE)])
+
+    @patch("utils.client_registry.boto3.client")
     def test_get_response_from_q_raises_exception(self, boto3_client_mock):
         mock_qbusiness_client = boto3_client_mock.return_value
         mock_qbusiness_client.chat_sync.side_effect = ClientError(TEST_ERROR_RESPONSE, "qbusiness")
@@ -30,3 +34,126 @@ class TestQbusinessAdapter(TestCase):
 
         with self.assertRaises(ClientError):
             test_qbusiness_adapter.get_q_application_response(sample_questions, Q_APPLICATION_ID)
+
+    @patch("utils.client_registry.boto3.client")
+    def test_fetch_keeps_testset_order_with_concurrent_requests(self, boto3_client_mock):
+        mock_qbusiness_client = boto3_client_mock.return_value
+        mock_qbusiness_client.chat_sync.side_effect = lambda applicationId, userMessage: {"systemMessage": userMessage}
+        test_qbusiness_adapter = QbusinessAdapter(region=REGION, credentials=TEST_CREDENTIALS,
+                                                  max_in_flight=8, max_qps=0)
+
+        sample_questions = [f"question {i}" for i in range(50)]
+        fetch_result = test_qbusiness_adapter.fetch_q_application_responses(sample_questions, Q_APPLICATION_ID)
+
+        self.assertEqual(list(fetch_result.responses.keys()), sample_questions)
+        self.assertEqual([r["systemMessage"] for r in fetch_result.responses.values()], sample_questions)
+        self.assertEqual(fetch_result.failures, {})
+        self.assertEqual(list(fetch_result.latencies_millis.keys()), sample_questions)
+
+    @patch("utils.client_registry.boto3.client")
+    def test_concurrent_answers_are_recorded_by_the_calling_invocation(self, boto3_client_mock):
+        mock_qbusiness_client = boto3_client_mock.return_value
+        mock_qbusiness_client.chat_sync.side_effect = lambda applicationId, userMessage: {"systemMessage": userMessage}
+        test_qbusiness_adapter = QbusinessAdapter(region=REGION, credentials=TEST_CREDENTIALS,
+                                                  max_in_flight=4, max_qps=0)
+
+        with invocation_scope() as invocation_instrumentation:
+            test_qbusiness_adapter.fetch_q_application_responses([f"question {i}" for i in range(10)],
+                                                                 Q_APPLICATION_ID)
+
+        stages = invocation_instrumentation.snapshot()
+        self.assertEqual([(stage["stage"], stage["count"]) for stage in stages], [("QuestionAnswer", 10)])
+
+    @patch("utils.client_registry.boto3.client")
+    def test_repeated_questions_are_asked_once_and_keep_their_positions(self, boto3_client_mock):
+        mock_qbusiness_client = boto3_client_mock.return_value
+        mock_qbusiness_client.chat_sync.side_effect = lambda applicationId, userMessage: {"systemMessage": userMessage}
+        test_qbusiness_adapter = QbusinessAdapter(region=REGION, credentials=TEST_CREDENTIALS,
+                                                  max_in_flight=4, max_qps=0)
+
+        sample_questions = [f"question {i % 5}" for i in range(40)]
+        fetch_result = test_qbusiness_adapter.fetch_q_application_responses(sample_questions, Q_APPLICATION_ID)
+
+        self.assertEqual(mock_qbusiness_client.chat_sync.call_count, 5)
+        self.assertEqual(fetch_result.q_calls, 5)
+        self.assertEqual([record.question for record in fetch_result.records], sample_questions)
+        self.assertEqual([record.response["systemMessage"] for record in fetch_result.records], sample_questions)
+
+    @patch("utils.client_registry.boto3.client")
+    def test_fetch_reports_failures_and_keeps_successful_answers(self, boto3_client_mock):
+        def chat_sync(applicationId, userMessage):
+            if userMessage == "bad question":
+                raise ClientError(TEST_ERROR_RESPONSE, "chat_sync")
+            return TEST_Q_CHAT_RESPONSE
+
+        mock_qbusiness_client = boto3_client_mock.return_value
+        mock_qbusiness_client.chat_sync.side_effect = chat_sync
+        test_qbusiness_adapter = QbusinessAdapter(region=REGION, credentials=TEST_CREDENTIALS, max_qps=0)
+
+        fetch_result = test_qbusiness_adapter.fetch_q_application_responses(
+            ["first question", "bad question", "last question"], Q_APPLICATION_ID)
+
+        self.assertEqual(list(fetch_result.responses.keys()), ["first question", "last question"])
+        self.assertEqual(list(fetch_result.failures.keys()), ["bad question"])
+        self.assertIsInstance(fetch_result.failures["bad question"], ClientError)
+
+    @patch("utils.client_registry.boto3.client")
+    def test_fetch_backs_off_and_retries_on_throttling(self, boto3_client_mock):
+        mock_qbusiness_client = boto3_client_mock.return_value
+        mock_qbusiness_client.chat_sync.side_effect = [ClientError(TEST_THROTTLING_ERROR_RESPONSE, "chat_sync"),
+                                                       ClientError(TEST_THROTTLING_ERROR_RESPONSE, "chat_sync"),
+                                                       TEST_Q_CHAT_RESPONSE]
+        sleeps = []
+        test_qbusiness_adapter = QbusinessAdapter(region=REGION, credentials=TEST_CREDENTIALS,
+                                                  max_qps=10, sleep=sleeps.append)
+
+        records = test_qbusiness_adapter.get_q_application_response(["what is qbusiness?"], Q_APPLICATION_ID)
+
+        self.assertEqual(records[0].response, TEST_Q_CHAT_RESPONSE)
+        self.assertEqual(mock_qbusiness_client.chat_sync.call_count, 3)
+        self.assertGreaterEqual(len(sleeps), 2)
+        self.assertLess(test_qbusiness_adapter.rate_limiter.rate, 10)
+
+    @patch("utils.client_registry.boto3.client")
+    def test_fetch_gives_up_after_max_throttling_retries(self, boto3_client_mock):
+        mock_qbusiness_client = boto3_client_mock.return_value
+        mock_qbusiness_client.chat_sync.side_effect = ClientError(TEST_THROTTLING_ERROR_RESPONSE, "chat_sync")
+        test_qbusiness_adapter = QbusinessAdapter(region=REGION, credentials=TEST_CREDENTIALS,
+                                                  max_qps=0, sleep=lambda seconds: None)
+
+        with invocation_scope() as invocation_instrumentation:
+            fetch_result = test_qbusiness_adapter.fetch_q_application_responses(["what is qbusiness?"],
+                                                                                Q_APPLICATION_ID)
+
+        self.assertEqual(fetch_result.responses, {})
+        self.assertIn("what is qbusiness?", fetch_result.failures)
+        self.assertEqual(mock_qbusiness_client.chat_sync.call_count, QbusinessAdapter.MAX_THROTTLING_RETRIES + 1)
+        # every call was throttled, all but the first were retries
+        stage = next(stage for stage in invocation_instrumentation.snapshot() if stage["stage"] == "QuestionAnswer")
+        self.assertEqual((stage["errors"], stage["throttles"], stage["retries"]),
+                         (1, QbusinessAdapter.MAX_THROTTLING_RETRIES + 1, QbusinessAdapter.MAX_THROTTLING_RETRIES))
+
+    @patch("utils.client_registry.boto3.client")
+    def test_rejected_credentials_are_refreshed_and_the_question_retried_once(self, boto3_client_mock):
+        expired_token = ClientError({"Error": {"Code": "ExpiredTokenException", "Message": "expired"}}, "ChatSync")
+        stale_client, fresh_client = MagicMock(), MagicMock()
+        stale_client.chat_sync.side_effect = expired_token
+        fresh_client.chat_sync.side_effect = [TEST_Q_CHAT_RESPONSE, expired_token, expired_token]
+        boto3_client_mock.side_effect = [stale_client, fresh_client, fresh_client]
+        fresh_credentials = {**TEST_CREDENTIALS, "AccessKeyId": "fresh_access_key"}
+        credentials_provider = MagicMock(return_value=fresh_credentials)
+        client_registry.clear()
+        test_qbusiness_adapter = QbusinessAdapter(region=REGION, credentials=TEST_CREDENTIALS, max_qps=0,
+                                                  credentials_provider=credentials_provider)
+
+        fetch_result = test_qbusiness_adapter.fetch_q_application_responses(["what is qbusiness?"], Q_APPLICATION_ID)
+
+        self.assertEqual(fetch_result.responses, {"what is qbusiness?": TEST_Q_CHAT_RESPONSE})
+        self.assertEqual(test_qbusiness_adapter.credentials, fresh_credentials)
+        credentials_provider.assert_called_once()
+
+        # a question rejected again after the refresh fails
+        fetch_result = test_qbusiness_adapter.fetch_q_application_responses(["what is Q?"], Q_APPLICATION_ID)
+        self.assertIn("what is Q?", fetch_result.failures)
+        self.assertEqual(fresh_client.chat_sync.call_count, 3)
+        self.assertEqual(credentials_provider.call_count, 2)
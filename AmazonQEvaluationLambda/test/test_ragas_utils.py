@@ -1,3 +1,5 @@
+import os
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch
 
@@ -10,6 +12,10 @@ from ragas.metrics import (
     faithfulness
 )
 
+from utils.concurrency_controller import AIMDConcurrencyController, AdaptiveConcurrencyLimiter
+from utils.embeddings_cache import CachedEmbeddings
+from utils.llm_cache import CachedLLMWrapper
+from utils.metric_factory import create_metrics
 from utils.ragas_utils import RagasUtils
 from .constants import REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID
 
@@ -18,12 +24,13 @@ class TestRagasUtils(TestCase):
     test_ragas_utils = RagasUtils(REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID)
     metrics = [answer_relevancy, faithfulness,]
 
-    def test_metric_configuration_is_set_correctly(self):
-        self.test_ragas_utils.configure_metrics_to_use_bedrock(self.metrics)
+    def test_metrics_are_bound_to_bedrock(self):
+        metrics = create_metrics(["answer_relevancy", "faithfulness"], self.test_ragas_utils.get_judge_llm(),
+                                 self.test_ragas_utils.get_embeddings())
 
-        for metric in self.metrics:
-            self.assertIsInstance(metric.embeddings, BedrockEmbeddings)
-            self.assertEqual(metric.embeddings.model_id, BEDROCK_EMBEDDING_MODEL_ID)
+        self.assertIsInstance(metrics[0].embeddings, BedrockEmbeddings)
+        self.assertEqual(metrics[0].embeddings.model_id, BEDROCK_EMBEDDING_MODEL_ID)
+        for metric in metrics:
             self.assertIsInstance(metric.llm, LangchainLLMWrapper)
             self.assertEqual(metric.llm.langchain_llm.model_id, BEDROCK_TEXT_MODEL_ID)
 
@@ -57,3 +64,36 @@ class TestRagasUtils(TestCase):
 
         self.assertEqual(evaluate_call_args[0][0], dataset)
         self.assertEqual(evaluate_call_args[1]["metrics"], self.metrics)
+
+    def test_embeddings_are_cached_when_cache_location_is_set(self):
+        with tempfile.TemporaryDirectory() as directory:
+            ragas_utils = RagasUtils(REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID,
+                                     embeddings_cache_location=os.path.join(directory, "embeddings.sqlite3"))
+            embeddings = ragas_utils._get_bedrock_embeddings()
+
+            self.assertIsInstance(embeddings, CachedEmbeddings)
+            self.assertIsInstance(embeddings.embeddings, BedrockEmbeddings)
+            self.assertEqual(ragas_utils.get_cache_stats()["EmbeddingCacheMisses"], 0)
+
+    def test_llm_answers_are_cached_when_cache_location_is_set(self):
+        with tempfile.TemporaryDirectory() as directory:
+            ragas_utils = RagasUtils(REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID,
+                                     llm_cache_location=os.path.join(directory, "llm.sqlite3"))
+            llm_wrapper = ragas_utils._get_bedrock_llm_model_wrapper()
+
+            self.assertIsInstance(llm_wrapper, CachedLLMWrapper)
+            self.assertEqual(llm_wrapper.langchain_llm.model_id, BEDROCK_TEXT_MODEL_ID)
+            self.assertEqual(ragas_utils.get_cache_stats()["LLMCacheHits"], 0)
+
+    def test_bedrock_calls_go_through_concurrency_limiters(self):
+        judge_limiter = AdaptiveConcurrencyLimiter(AIMDConcurrencyController(1, 8, 2))
+        embeddings_limiter = AdaptiveConcurrencyLimiter(AIMDConcurrencyController(1, 4, 3))
+        ragas_utils = RagasUtils(REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID,
+                                 judge_concurrency_limiter=judge_limiter,
+                                 embeddings_concurrency_limiter=embeddings_limiter)
+
+        self.assertIs(ragas_utils._get_bedrock_llm_model_wrapper().langchain_llm.client.limiter, judge_limiter)
+        self.assertIs(ragas_utils._get_bedrock_embeddings().client.limiter, embeddings_limiter)
+        self.assertEqual(ragas_utils._get_max_workers(), 8)
+        self.assertEqual(ragas_utils.get_concurrency_stats(), {"JudgeConcurrencySetpoint": 2,
+                                                               "EmbeddingsConcurrencySetpoint": 3})
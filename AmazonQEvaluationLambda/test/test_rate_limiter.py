@@ -0,0 +1,38 @@
+import unittest
+
+from utils.rate_limiter import TokenBucketRateLimiter
+from .constants import FakeClock
+
+
+class TestTokenBucketRateLimiter(unittest.TestCase):
+    def test_acquire_waits_for_tokens_at_configured_rate(self):
+        clock = FakeClock()
+        rate_limiter = TokenBucketRateLimiter(max_rate=2, capacity=1, clock=clock, sleep=clock.sleep)
+
+        for _ in range(5):
+            rate_limiter.acquire()
+
+        self.assertAlmostEqual(clock.now, 2.0)
+
+    def test_penalize_and_reward_adjust_rate_within_bounds(self):
+        clock = FakeClock()
+        rate_limiter = TokenBucketRateLimiter(max_rate=4, min_rate=1, clock=clock, sleep=clock.sleep)
+
+        rate_limiter.penalize()
+        self.assertEqual(rate_limiter.rate, 2)
+        rate_limiter.penalize()
+        rate_limiter.penalize()
+        self.assertEqual(rate_limiter.rate, 1)
+
+        for _ in range(20):
+            rate_limiter.reward()
+        self.assertEqual(rate_limiter.rate, 4)
+
+    def test_disabled_rate_limiter_never_waits(self):
+        clock = FakeClock()
+        rate_limiter = TokenBucketRateLimiter(max_rate=0, clock=clock, sleep=clock.sleep)
+
+        for _ in range(100):
+            rate_limiter.acquire()
+
+        self.assertEqual(clock.now, 0.0)
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+from moto import mock_aws
+
+from utils.results_store import read_results, write_results
+from .constants import REGION, Q_APPLICATION_ID
+from .test_token_accounting import AWS_ENVIRONMENT
+
+TEST_BUCKET = "test-results-bucket"
+TEST_RESULTS = pd.DataFrame({"question": [f"question {i}" for i in range(6)],
+                             "ground_truth": ["Q is an AWS service"] * 6,
+                             "answer": ["Q is an AWS service", "I don't know"] * 3,
+                             "contexts": [["Q is an AWS service", "Q Business answers questions"]] * 6,
+                             "faithfulness": [1.0, 0.5, float("nan"), 1.0, 0.0, 0.25]})
+TEST_CATEGORIES = ["billing", "index", None, "billing", "index", "billing"]
+
+
+class TestResultsStore(unittest.TestCase):
+
+    def test_results_are_partitioned_by_application_run_and_category(self):
+        with tempfile.TemporaryDirectory() as location:
+            summary = write_results(TEST_RESULTS, TEST_CATEGORIES, location, REGION, Q_APPLICATION_ID, "run1",
+                                    ["faithfulness", "context_recall"])
+
+            self.assertEqual(summary["results_location"], f"{location}/application_id={Q_APPLICATION_ID}/run_id=run1")
+            self.assertEqual(summary["category_rows"], {"billing": 3, "index": 2, "uncategorized": 1})
+            self.assertTrue(os.path.exists(f"{summary['results_location']}/category=billing/part-00000.parquet"))
+            results = read_results(location, REGION)
+
+        self.assertEqual(results.num_rows, 6)
+        self.assertEqual(results.schema.field("faithfulness").type, pa.float64())
+        self.assertTrue(pa.types.is_dictionary(results.schema.field("answer").type))
+        # a metric without scores is kept as a column of nulls
+        self.assertEqual(results.column("context_recall").null_count, 6)
+
+    def test_only_the_requested_columns_and_partitions_are_read(self):
+        with tempfile.TemporaryDirectory() as location:
+            write_results(TEST_RESULTS, TEST_CATEGORIES, location, REGION, Q_APPLICATION_ID, "run1", ["faithfulness"])
+            write_results(TEST_RESULTS, TEST_CATEGORIES, location, REGION, Q_APPLICATION_ID, "run2", ["faithfulness"])
+
+            results = read_results(location, REGION, columns=["category", "faithfulness"],
+                                   filters={"run_id": ["run2"], "category": ["billing"]})
+            with self.assertRaises(Exception):
+                read_results(location, REGION, filters={"answer": ["I don't know"]})
+
+        self.assertEqual(results.column_names, ["category", "faithfulness"])
+        self.assertEqual(results.column("faithfulness").to_pylist(), [1.0, 1.0, 0.25])
+        self.assertEqual(set(results.column("category").to_pylist()), {"billing"})
+
+
+@mock_aws
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestS3ResultsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.s3_client = boto3.client("s3", region_name=REGION)
+        self.s3_client.create_bucket(Bucket=TEST_BUCKET)
+
+    def test_s3_reader_downloads_only_the_requested_columns(self):
+        location = f"s3://{TEST_BUCKET}/q-evaluation-results"
+        # the contexts make most of the file, like the snippets of real Q answers
+        results = TEST_RESULTS.assign(contexts=[[os.urandom(5000).hex() for _ in range(5)] for _ in range(6)])
+        write_results(results, ["billing"] * 6, location, REGION, Q_APPLICATION_ID, "run1", ["faithfulness"])
+        object_size = self.s3_client.list_objects_v2(Bucket=TEST_BUCKET)["Contents"][0]["Size"]
+        downloaded_bytes = []
+
+        def count_bytes(**kwargs):
+            response = original_get_object(**kwargs)
+            downloaded_bytes.append(response["ContentLength"])
+            return response
+
+        from utils.client_registry import get_client
+        s3_client = get_client("s3", REGION)
+        original_get_object = s3_client.get_object
+        with patch.object(s3_client, "get_object", side_effect=count_bytes):
+            results = read_results(location, REGION, columns=["faithfulness"])
+
+        self.assertEqual(results.column("faithfulness").to_pylist(), [1.0, 0.5, None, 1.0, 0.0, 0.25])
+        self.assertLess(sum(downloaded_bytes), object_size)
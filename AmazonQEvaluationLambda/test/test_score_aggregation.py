@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+import pyarrow as pa
+
+from utils.score_aggregation import summarize_results, summarize_scores
+
+
+class TestScoreAggregation(unittest.TestCase):
+    rng = np.random.default_rng(7)
+    scores = rng.beta(5, 2, 5000)
+    scores[rng.random(5000) < 0.05] = np.nan
+    categories = np.array(["billing", "index", "subscription"])[rng.integers(0, 3, 5000)]
+
+    def test_group_statistics_match_numpy(self):
+        summaries = summarize_scores(self.scores, self.categories, bootstrap_samples=0)
+
+        self.assertEqual(sorted(summaries), ["billing", "index", "subscription"])
+        for category, summary in summaries.items():
+            category_scores = self.scores[self.categories == category]
+            valid_scores = category_scores[~np.isnan(category_scores)]
+            self.assertEqual(summary["count"], len(category_scores))
+            self.assertAlmostEqual(summary["nan_rate"], 1 - len(valid_scores) / len(category_scores))
+            self.assertAlmostEqual(summary["mean"], valid_scores.mean())
+            np.testing.assert_allclose([summary[f"p{p}"] for p in (5, 25, 50, 75, 95)],
+                                       np.percentile(valid_scores, [5, 25, 50, 75, 95]))
+            self.assertTrue(np.isnan(summary["ci_low"]))
+
+    def test_bootstrap_interval_is_close_to_the_normal_interval(self):
+        summary = summarize_scores(self.scores)["all"]
+        valid_scores = self.scores[~np.isnan(self.scores)]
+        half_width = 1.96 * valid_scores.std() / np.sqrt(len(valid_scores))
+
+        self.assertLess(summary["ci_low"], summary["mean"])
+        self.assertGreater(summary["ci_high"], summary["mean"])
+        self.assertAlmostEqual(summary["ci_high"] - summary["ci_low"], 2 * half_width, delta=0.2 * half_width)
+        # the same seed gives the same interval
+        self.assertEqual(summarize_scores(self.scores)["all"]["ci_low"], summary["ci_low"])
+
+    def test_failed_and_constant_groups(self):
+        summaries = summarize_scores([np.nan, np.nan, 0.5, 0.5], ["failed", "failed", "constant", "constant"])
+
+        self.assertEqual(summaries["failed"]["nan_rate"], 1.0)
+        self.assertTrue(np.isnan(summaries["failed"]["mean"]))
+        self.assertEqual(summaries["constant"]["p95"], 0.5)
+        self.assertEqual((summaries["constant"]["ci_low"], summaries["constant"]["ci_high"]), (0.5, 0.5))
+        self.assertEqual(summarize_scores([]), {})
+
+    def test_arrow_tables_are_summarized_by_every_group_column(self):
+        results = pa.table({"faithfulness": pa.array(self.scores, from_pandas=True),
+                            "category": pa.array(self.categories).dictionary_encode(),
+                            "application_id": pa.array(["app1"] * len(self.scores))})
+
+        summaries = summarize_results(results, ["faithfulness", "context_recall"], bootstrap_samples=100)
+
+        self.assertEqual(list(summaries), ["faithfulness"])
+        self.assertEqual(set(summaries["faithfulness"]), {"all", "by_category", "by_application_id"})
+        self.assertEqual(summaries["faithfulness"]["by_category"],
+                         summarize_scores(self.scores, list(self.categories), bootstrap_samples=100))
+        self.assertEqual(summaries["faithfulness"]["by_application_id"]["app1"]["mean"],
+                         summaries["faithfulness"]["all"]["mean"])
@@ -8,7 +8,7 @@ from .constants import GET_SECRET_RESPONSE, REGION, USER_SECRET_ID, TEST_ERROR_R
 
 
 class TestSecretManagerAdapter(unittest.TestCase):
-    @patch("adapters.secret_manager_adapter.boto3.client")
+    @patch("utils.client_registry.boto3.client")
     def test_get_secret_value_is_successful(self, boto3_client_mock):
         mock_secret_manager_client = boto3_client_mock.return_value
         mock_secret_manager_client.get_secret_value.return_value = GET_SECRET_RESPONSE
@@ -19,7 +19,7 @@ class TestSecretManagerAdapter(unittest.TestCase):
         expected_password_value = "sometestPassword"
         self.assertEqual(results.get("password"), expected_password_value)
 
-    @patch("adapters.secret_manager_adapter.boto3.client")
+    @patch("utils.client_registry.boto3.client")
     def test_get_secret_value_raises_exception(self, boto3_client_mock):
         mock_secret_manager_client = boto3_client_mock.return_value
         mock_secret_manager_client.get_secret_value.side_effect = ClientError(TEST_ERROR_RESPONSE, "secretsmanager")
@@ -0,0 +1,32 @@
+import math
+import unittest
+
+from utils.sharding_utils import split_into_shards, get_testset_fingerprint, merge_shard_records, \
+    aggregate_metric_scores
+
+
+class TestShardingUtils(unittest.TestCase):
+    testset = [{"question": f"question {i}", "ground_truth": f"truth {i}"} for i in range(25)]
+
+    def test_testset_is_split_into_fixed_size_shards(self):
+        shards = split_into_shards(self.testset, 10)
+        self.assertEqual([len(shard) for shard in shards], [10, 10, 5])
+        self.assertEqual(merge_shard_records(shards), self.testset)
+
+    def test_invalid_shard_size_raises_exception(self):
+        with self.assertRaises(Exception):
+            split_into_shards(self.testset, 0)
+
+    def test_fingerprint_depends_on_testset_and_shard_size(self):
+        fingerprint = get_testset_fingerprint(self.testset, 10)
+        self.assertEqual(fingerprint, get_testset_fingerprint(list(self.testset), 10))
+        self.assertNotEqual(fingerprint, get_testset_fingerprint(self.testset, 5))
+        self.assertNotEqual(fingerprint, get_testset_fingerprint(self.testset[:-1], 10))
+
+    def test_aggregates_ignore_missing_scores(self):
+        records = [{"faithfulness": 1.0, "context_recall": None},
+                   {"faithfulness": 0.5, "context_recall": None},
+                   {"faithfulness": None, "context_recall": None}]
+        aggregates = aggregate_metric_scores(records, ["faithfulness", "context_recall"])
+        self.assertEqual(aggregates["faithfulness"], 0.75)
+        self.assertTrue(math.isnan(aggregates["context_recall"]))
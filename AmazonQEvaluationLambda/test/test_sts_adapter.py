@@ -8,7 +8,7 @@ from .constants import TEST_ASSUME_ROLE_WITH_WEB_IDENTITY_RESPONSE, REGION, Q_AP
 
 
 class TestStsAdapter(unittest.TestCase):
-    @patch("adapters.sts_adapter.boto3.client")
+    @patch("utils.client_registry.boto3.client")
     def test_assume_role_with_oidc_provider_is_successful(self, boto3_client_mock):
         mock_sts_client = boto3_client_mock.return_value
         mock_sts_client.assume_role_with_web_identity.return_value = TEST_ASSUME_ROLE_WITH_WEB_IDENTITY_RESPONSE
@@ -21,7 +21,7 @@ class TestStsAdapter(unittest.TestCase):
         self.assertTrue("SecretAccessKey" in results)
         self.assertTrue("SessionToken" in results)
 
-    @patch("adapters.sts_adapter.boto3.client")
+    @patch("utils.client_registry.boto3.client")
     def test_assume_role_with_oidc_provider_raises_exception(self, boto3_client_mock):
 
         mock_sts_client = boto3_client_mock.return_value
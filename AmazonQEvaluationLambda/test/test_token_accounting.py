@@ -0,0 +1,147 @@
+import io
+import json
+import os
+import unittest
+import uuid
+from unittest.mock import patch
+
+from botocore.awsrequest import AWSResponse
+from botocore.stub import Stubber
+
+from utils.client_registry import get_client
+from utils.token_accounting import TokenAccountant, TokenBudgetExceeded, TokenScope, TokenUsage, enter_scope, \
+    exit_scope, get_price_table
+from .constants import REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID
+
+AWS_ENVIRONMENT = {"AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing"}
+
+
+def create_invoke_model_response(input_tokens, output_tokens=0):
+    return {"body": io.BytesIO(b"{}"), "contentType": "application/json",
+            "ResponseMetadata": {"HTTPHeaders": {"x-amzn-bedrock-input-token-count": str(input_tokens),
+                                                 "x-amzn-bedrock-output-token-count": str(output_tokens)}}}
+
+
+class RawBody(io.BytesIO):
+    def stream(self, **kwargs):
+        yield self.getvalue()
+
+
+def respond_like_bedrock(request, **kwargs):
+    """Answers the judge prompts and embeddings requests without network, with Bedrock token count headers."""
+    body = json.loads(request.body)
+    if "inputText" in body:
+        input_tokens, output_tokens = len(body["inputText"]) // 4, 0
+        response_body = {"embedding": [1.0, 0.5, 0.25], "inputTextTokenCount": input_tokens}
+    else:
+        prompt = " ".join(message["content"] if isinstance(message["content"], str)
+                          else message["content"][0]["text"] for message in body["messages"])
+        input_tokens, output_tokens = len(prompt) // 4, 10
+        answer = {"question": "What is Q?", "noncommittal": 0}
+        response_body = {"content": [{"type": "text", "text": json.dumps(answer)}], "stop_reason": "end_turn"}
+    headers = {"content-type": "application/json",
+               "x-amzn-bedrock-input-token-count": str(input_tokens),
+               "x-amzn-bedrock-output-token-count": str(output_tokens)}
+    return AWSResponse(request.url, 200, headers, RawBody(json.dumps(response_body).encode()))
+
+
+class TestTokenAccountant(unittest.TestCase):
+
+    def test_usage_is_priced_by_model_and_summed_by_metric(self):
+        accountant = TokenAccountant(get_price_table(json.dumps({"custom.judge": [1.0, 2.0]})))
+        row_usage = TokenUsage()
+        accountant.record("custom.judge", 1000, 500, metric="faithfulness", row_usage=row_usage)
+        accountant.record(BEDROCK_EMBEDDING_MODEL_ID, 2000, 0, metric="answer_relevancy")
+        # cross-region inference profile of a known model
+        accountant.record(f"us.{BEDROCK_TEXT_MODEL_ID}", 1000, 1000, metric="faithfulness")
+
+        summary = accountant.get_summary()
+        self.assertEqual((summary["input_tokens"], summary["output_tokens"], summary["calls"]), (4000, 1500, 3))
+        self.assertAlmostEqual(summary["by_model"]["custom.judge"]["estimated_cost_usd"], 2.0)
+        self.assertAlmostEqual(summary["by_metric"]["answer_relevancy"]["estimated_cost_usd"], 0.0002)
+        self.assertAlmostEqual(summary["by_metric"]["faithfulness"]["estimated_cost_usd"], 2.032)
+        self.assertEqual(row_usage.to_dict(), {"input_tokens": 1000, "output_tokens": 500, "calls": 1,
+                                               "estimated_cost_usd": 2.0})
+        self.assertEqual(accountant.get_stats()["faithfulnessInputTokens"], 2000)
+
+    def test_unknown_models_are_counted_at_no_cost(self):
+        accountant = TokenAccountant()
+        accountant.record("unknown.model", 100, 100)
+        self.assertEqual(accountant.total.input_tokens, 100)
+        self.assertEqual(accountant.total.estimated_cost_usd, 0.0)
+
+    def test_metrics_are_refused_once_the_budget_is_reached(self):
+        accountant = TokenAccountant(token_budget=1000)
+        accountant.record(BEDROCK_TEXT_MODEL_ID, 600, 300)
+        accountant.check_budget("faithfulness")
+
+        accountant.record(BEDROCK_TEXT_MODEL_ID, 100, 0)
+        with self.assertRaises(TokenBudgetExceeded):
+            accountant.check_budget("faithfulness")
+        self.assertEqual(accountant.refused_metric_runs, 1)
+
+
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestBedrockTokenHooks(unittest.TestCase):
+
+    def test_model_calls_are_recorded_in_the_current_scope_only(self):
+        accountant = TokenAccountant()
+        bedrock_client = get_client("bedrock-runtime", REGION)
+        with Stubber(bedrock_client) as stubber:
+            stubber.add_response("invoke_model", create_invoke_model_response(500))
+            stubber.add_response("invoke_model", create_invoke_model_response(1200, 300))
+            bedrock_client.invoke_model(modelId=BEDROCK_TEXT_MODEL_ID, body=b"{}")
+            token = enter_scope(TokenScope(accountant, "faithfulness"))
+            try:
+                bedrock_client.invoke_model(modelId=BEDROCK_TEXT_MODEL_ID, body=b"{}")
+            finally:
+                exit_scope(token)
+
+        self.assertEqual(accountant.total.calls, 1)
+        self.assertEqual(accountant.by_metric["faithfulness"].to_dict(),
+                         {"input_tokens": 1200, "output_tokens": 300, "calls": 1, "estimated_cost_usd": 0.0168})
+
+
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestRagasTokenAccounting(unittest.TestCase):
+
+    def test_judge_and_embeddings_tokens_are_attributed_to_metric_and_question(self):
+        from datasets import Dataset
+        from utils.metric_factory import create_metrics
+        from utils.ragas_utils import RagasUtils
+
+        get_client("bedrock-runtime", REGION).meta.events.register("before-send.bedrock-runtime",
+                                                                   respond_like_bedrock)
+        accountant = TokenAccountant()
+        ragas_utils = RagasUtils(REGION, BEDROCK_EMBEDDING_MODEL_ID, BEDROCK_TEXT_MODEL_ID, token_accountant=accountant)
+        metrics = create_metrics(["answer_relevancy"], ragas_utils.get_judge_llm(), ragas_utils.get_embeddings())
+        dataset = Dataset.from_dict({"question": ["What is Q?", "What is Amazon Q Business used for?"],
+                                     "answer": ["Q is an AWS service", "Answering questions about your data"],
+                                     "ground_truth": ["Q is an AWS service", "Enterprise search"],
+                                     "contexts": [["Q is an AWS service"], ["Q Business answers questions"]]})
+
+        results = ragas_utils.evaluate_dataset(dataset, metrics)
+
+        summary = accountant.get_summary()
+        self.assertEqual(set(summary["by_model"]), {BEDROCK_TEXT_MODEL_ID, BEDROCK_EMBEDDING_MODEL_ID})
+        self.assertEqual(summary["by_metric"]["answer_relevancy"]["calls"], summary["calls"])
+        records = results.to_pandas().to_dict(orient="records")
+        self.assertEqual(sum(record["input_tokens"] for record in records), summary["input_tokens"])
+        self.assertGreater(records[1]["input_tokens"], records[0]["input_tokens"])
+        self.assertAlmostEqual(sum(record["estimated_cost_usd"] for record in records),
+                               summary["estimated_cost_usd"], places=5)
+
+    def test_metrics_are_not_scored_once_the_budget_is_reached(self):
+        from utils.ragas_utils import TokenAccountingCallbackHandler
+
+        accountant = TokenAccountant(token_budget=100)
+        handler = TokenAccountingCallbackHandler(["faithfulness"], accountant)
+        row_run, metric_run = uuid.uuid4(), uuid.uuid4()
+        handler.on_chain_start({"name": "row 3"}, {}, run_id=row_run)
+        handler.on_chain_start({"name": "faithfulness"}, {}, run_id=metric_run, parent_run_id=row_run)
+        accountant.record(BEDROCK_TEXT_MODEL_ID, 80, 20, "faithfulness", handler.row_usage[3])
+        handler.on_chain_end({}, run_id=metric_run)
+
+        with self.assertRaises(TokenBudgetExceeded):
+            handler.on_chain_start({"name": "faithfulness"}, {}, run_id=uuid.uuid4(), parent_run_id=row_run)
+        self.assertEqual(handler.row_usage[3].input_tokens, 80)
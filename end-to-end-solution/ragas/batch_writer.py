@@ -0,0 +1,111 @@
+import logging
+import math
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+from instrumentation import span
+
+logger = logging.getLogger()
+
+# DynamoDB rejects BatchWriteItem requests of more than 25 items
+MAX_BATCH_SIZE = 25
+RETRYABLE_ERROR_CODES = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded",
+                         "InternalServerError", "ServiceUnavailable"}
+
+
+class BufferedBatchWriter:
+    """
+    Buffers put requests for a table and writes them with BatchWriteItem, 25 items per call.
+
+    The buffer is written once it holds flush_size items or its oldest item waited flush_interval_seconds. Unprocessed
+    items are sent again with full-jitter exponential backoff, the ones still unprocessed after max_attempts calls are
+    reported in failed_tags. Use it as a context manager so the buffer is always flushed before the handler returns.
+    """
+
+    def __init__(self, dynamodb_resource, table_name, key_attributes=('id',), flush_size=MAX_BATCH_SIZE,
+                 flush_interval_seconds=5.0, max_attempts=8, base_delay_seconds=0.05, max_delay_seconds=5.0,
+                 clock=time.monotonic, sleep=time.sleep, random_uniform=random.uniform):
+        self.dynamodb_resource = dynamodb_resource
+        self.table_name = table_name
+        self.key_attributes = key_attributes
+        self.flush_size = min(flush_size, MAX_BATCH_SIZE)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._random_uniform = random_uniform
+        # key -> (item, tags), a key put twice keeps the last item and the tags of every put, BatchWriteItem
+        # rejects duplicate keys
+        self._buffer = {}
+        self._oldest_put_at = None
+        self.calls = 0
+        self.written_items = 0
+        self.failed_tags = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def _get_key(self, item):
+        return tuple(item[attribute] for attribute in self.key_attributes)
+
+    def put(self, item, tag=None):
+        """Buffers the item, tag is reported back in failed_tags when the item cannot be written."""
+        if not self._buffer:
+            self._oldest_put_at = self._clock()
+        key = self._get_key(item)
+        tags = self._buffer[key][1] if key in self._buffer else []
+        self._buffer[key] = (item, tags + [tag])
+        if len(self._buffer) >= self.flush_size \
+                or self._clock() - self._oldest_put_at >= self.flush_interval_seconds:
+            self.flush()
+
+    def flush(self):
+        entries = list(self._buffer.values())
+        self._buffer = {}
+        self._oldest_put_at = None
+        if not entries:
+            return
+        with span('BatchWriterFlush', Table=self.table_name) as counters:
+            calls = self.calls
+            for start in range(0, len(entries), MAX_BATCH_SIZE):
+                self._write_batch(entries[start:start + MAX_BATCH_SIZE])
+            # the calls beyond one per batch resent unprocessed items
+            counters['retries'] = self.calls - calls - math.ceil(len(entries) / MAX_BATCH_SIZE)
+
+    def _write_batch(self, entries):
+        pending = {self._get_key(item): (item, tags) for item, tags in entries}
+        attempt = 0
+        while pending:
+            request_items = [{'PutRequest': {'Item': item}} for item, _ in pending.values()]
+            self.calls += 1
+            try:
+                response = self.dynamodb_resource.batch_write_item(RequestItems={self.table_name: request_items})
+                unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                unprocessed_keys = {self._get_key(request['PutRequest']['Item']) for request in unprocessed}
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in RETRYABLE_ERROR_CODES:
+                    logger.error(f"Failed to write {len(pending)} items to {self.table_name}: {e}")
+                    self._fail(pending)
+                    return
+                unprocessed_keys = set(pending)
+            self.written_items += len(pending) - len(unprocessed_keys)
+            pending = {key: entry for key, entry in pending.items() if key in unprocessed_keys}
+            attempt += 1
+            if pending and attempt >= self.max_attempts:
+                logger.error(f"{len(pending)} items still unprocessed by {self.table_name} after {attempt} attempts")
+                self._fail(pending)
+                return
+            if pending:
+                delay = self._random_uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** attempt))
+                logger.warning(f"{len(pending)} unprocessed items for {self.table_name}, resending in {delay:.2f}s")
+                self._sleep(delay)
+
+    def _fail(self, pending):
+        self.failed_tags.extend(tag for _, tags in pending.values() for tag in tags)
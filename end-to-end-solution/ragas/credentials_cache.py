@@ -0,0 +1,57 @@
+import threading
+import time
+from datetime import datetime
+
+# Credentials are refreshed this long before they expire, so an invocation never starts with credentials about to expire
+DEFAULT_REFRESH_MARGIN_SECONDS = 300
+
+
+def get_expiration_timestamp(credentials):
+    # STS credentials carry their Expiration as a datetime, anything else is not cached
+    expiration = (credentials or {}).get('Expiration')
+    if isinstance(expiration, datetime):
+        return expiration.timestamp()
+    return 0.0
+
+
+class CredentialsCache:
+    """
+    Thread-safe cache for credentials that outlives a single Lambda invocation.
+
+    Entries are refreshed by the first get within refresh_margin_seconds of their expiration. Only one caller
+    refreshes a given key at a time, the others wait for the refreshed value.
+    """
+
+    def __init__(self, refresh_margin_seconds=DEFAULT_REFRESH_MARGIN_SECONDS, clock=time.time):
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self._clock = clock
+        self._entries = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+
+    def _get_key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _get_valid_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and self._clock() < entry[1] - self.refresh_margin_seconds:
+            return entry
+        return None
+
+    def get(self, key, loader):
+        """Returns the cached value for key, calling loader for a (value, expiration timestamp) when needed."""
+        entry = self._get_valid_entry(key)
+        if entry is not None:
+            return entry[0]
+        with self._get_key_lock(key):
+            entry = self._get_valid_entry(key)
+            if entry is not None:
+                return entry[0]
+            value, expires_at = loader()
+            self._entries[key] = (value, expires_at)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
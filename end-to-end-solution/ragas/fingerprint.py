@@ -0,0 +1,64 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import time
+
+logger = logging.getLogger()
+
+# the metrics of ragas_evaluation.get_evaluation_metrics, by the column name of their scores
+EVALUATION_METRICS = ('answer_relevancy', 'faithfulness', 'context_recall', 'context_precision')
+# bump it when the scoring changes in a way the model ids do not show, so every prompt is evaluated again
+METRIC_CONFIG_VERSION = '1'
+# DynamoDB rejects BatchGetItem requests of more than 100 keys
+MAX_BATCH_GET_SIZE = 100
+
+
+def get_metric_config():
+    return {
+        'metrics': list(EVALUATION_METRICS),
+        'llm_model_id': os.environ.get('BedrockTextModelId'),
+        'embedding_model_id': os.environ.get('BedrockEmbeddingModelId'),
+        'version': METRIC_CONFIG_VERSION
+    }
+
+
+def compute_fingerprint(prompt, ground_truth, q_app_id, metric_config):
+    """Identifies an evaluation, a result with the same fingerprint does not need to be computed again."""
+    payload = json.dumps({'prompt': prompt, 'ground_truth': ground_truth, 'q_app_id': q_app_id,
+                          'metric_config': metric_config}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def has_valid_scores(row):
+    for metric in EVALUATION_METRICS:
+        score = row.get(metric)
+        if score is None or (isinstance(score, float) and math.isnan(score)):
+            return False
+    return True
+
+
+def get_result_fingerprints(dynamodb_resource, table_name, ids, max_attempts=8, base_delay_seconds=0.05,
+                            max_delay_seconds=5.0, sleep=time.sleep):
+    """Returns {id: fingerprint} of the results of ids holding a fingerprint, 100 keys per BatchGetItem call."""
+    fingerprints = {}
+    ids = list(dict.fromkeys(ids))
+    for start in range(0, len(ids), MAX_BATCH_GET_SIZE):
+        request = {'Keys': [{'id': item_id} for item_id in ids[start:start + MAX_BATCH_GET_SIZE]],
+                   'ProjectionExpression': 'id, fingerprint'}
+        for attempt in range(1, max_attempts + 1):
+            response = dynamodb_resource.batch_get_item(RequestItems={table_name: request})
+            for result in response.get('Responses', {}).get(table_name, []):
+                if 'fingerprint' in result:
+                    fingerprints[result['id']] = result['fingerprint']
+            request = response.get('UnprocessedKeys', {}).get(table_name)
+            if not request:
+                break
+            if attempt == max_attempts:
+                # unknown fingerprints only cost an evaluation that could have been skipped
+                logger.warning(f"{len(request['Keys'])} keys still unprocessed by {table_name}, evaluating them")
+                break
+            sleep(random.uniform(0, min(max_delay_seconds, base_delay_seconds * 2 ** attempt)))
+    return fingerprints
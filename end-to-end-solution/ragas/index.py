@@ -1,23 +1,20 @@
 import os
 import json
 import logging
+import functools
+import threading
+import uuid
 import boto3
-import jwt
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 
-import nest_asyncio
-from langchain_aws import BedrockEmbeddings, ChatBedrock
-from ragas.evaluation import Result
-#from ragas_lambda.index import evaluate, RunConfig
-from ragas import evaluate, RunConfig
-from ragas.llms import LangchainLLMWrapper
-from ragas.metrics.base import Metric
-from ragas.metrics import (answer_relevancy, faithfulness, context_recall, context_precision)  # Import necessary metrics
-from datasets import Dataset
-from typing import List
+from batch_writer import BufferedBatchWriter
+from credentials_cache import CredentialsCache, get_expiration_timestamp
+from fingerprint import compute_fingerprint, get_metric_config, get_result_fingerprints, has_valid_scores
+from instrumentation import get_sink, instrument_client, instrumentation, span
+from rate_limiter import BedrockRateLimiter, DynamoDBCounterStore, is_throttling_error
+from retry_policy import Deadline, DeadlineExceeded, RetryPolicy, get_adaptive_retry_config
 from decimal import Decimal
-import time
-import random
 
 # Initialize logger
 logger = logging.getLogger()
@@ -30,6 +27,10 @@ BEDROCK_REGION = os.environ.get('AwsRegion')
 IDC_APPLICATION_ID = os.environ.get('IDC_APPLICATION_ID')
 AMAZON_Q_APP_ID = os.environ.get('AMAZON_Q_APP_ID')
 
+# Stage durations, errors, throttles and retries go to CloudWatch with EMF, or to this JSON lines file when set
+INSTRUMENTATION_LOCATION = os.environ.get('InstrumentationLocation')
+METRICS_NAMESPACE = os.environ.get('MetricsNamespace', 'QEvaluationRagas')
+
 UserPoolId = os.environ.get('UserPoolId')
 ClientId = os.environ.get('ClientId')
 OAUTH_CONFIG = {
@@ -38,9 +39,14 @@ OAUTH_CONFIG = {
 }
 
 
+# Clients using the lambda execution role, created once per container
+@functools.lru_cache(maxsize=None)
+def get_default_client(service_name):
+    return instrument_client(boto3.client(service_name, region_name=REGION, config=get_adaptive_retry_config()))
+
 # Authenticate user using AdminInitiateAuth
 def authenticate_user(username, password):
-    client = boto3.client('cognito-idp', region_name=REGION)
+    client = get_default_client('cognito-idp')
     try:
         response = client.admin_initiate_auth(
             UserPoolId=OAUTH_CONFIG["UserPoolId"],
@@ -63,7 +69,7 @@ def authenticate_user(username, password):
         
 # Get IAM OIDC token using the ID token retrieved from Cognito
 def get_iam_oidc_token(id_token):
-    client = boto3.client("sso-oidc", region_name=REGION)
+    client = get_default_client("sso-oidc")
     try:
         response = client.create_token_with_iam(
             clientId=IDC_APPLICATION_ID,
@@ -77,8 +83,10 @@ def get_iam_oidc_token(id_token):
     
 # Assume IAM role with the IAM OIDC idToken
 def assume_role_with_token(iam_token):
-    decoded_token = jwt.decode(iam_token, options={"verify_signature": False})
-    sts_client = boto3.client("sts", region_name=REGION)
+    import jwt
+    with span('DecodeToken'):
+        decoded_token = jwt.decode(iam_token, options={"verify_signature": False})
+    sts_client = get_default_client("sts")
     try:
         response = sts_client.assume_role(
             RoleArn=IAM_ROLE,
@@ -97,25 +105,49 @@ def assume_role_with_token(iam_token):
         logger.error(f"Failed to assume role: {e.response['Error']['Message']}")
         return None
     
+# The assumed role credentials are reused by warm invocations until shortly before they expire
+CREDENTIALS_CACHE = CredentialsCache()
+
+# Sessions and clients are cached per credential identity so warm invocations reuse them,
+# and their HTTP connections, until the assumed role credentials rotate
+MAX_POOL_CONNECTIONS = int(os.environ.get('MaxPoolConnections', '10'))
+_sessions = {}
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_session(credentials):
+    access_key_id = credentials["AccessKeyId"]
+    with _clients_lock:
+        if access_key_id not in _sessions:
+            # new credentials, drop sessions and clients built from the previous ones
+            _sessions.clear()
+            _clients.clear()
+            _sessions[access_key_id] = boto3.Session(
+                aws_access_key_id=credentials["AccessKeyId"],
+                aws_secret_access_key=credentials["SecretAccessKey"],
+                aws_session_token=credentials["SessionToken"],
+            )
+        return _sessions[access_key_id]
+
+def get_cached_client(credentials, service_name, resource=False):
+    session = get_session(credentials)
+    key = (credentials["AccessKeyId"], service_name, resource)
+    with _clients_lock:
+        if key not in _clients:
+            config = get_adaptive_retry_config(MAX_POOL_CONNECTIONS)
+            factory = session.resource if resource else session.client
+            _clients[key] = factory(service_name, region_name=REGION, config=config)
+            instrument_client(_clients[key].meta.client if resource else _clients[key])
+        return _clients[key]
+
 # Create the Q client using the assumed role credentials
 def get_qclient(credentials):
-    session = boto3.Session(
-        aws_access_key_id=credentials["AccessKeyId"],
-        aws_secret_access_key=credentials["SecretAccessKey"],
-        aws_session_token=credentials["SessionToken"],
-    )
-    amazon_q = session.client("qbusiness", region_name=REGION)
-    return amazon_q
+    return get_cached_client(credentials, "qbusiness")
 
 # Create the DynamoDB client using the assumed role credentials
 def get_DynamodbCli(credentials):
-    session = boto3.Session(
-        aws_access_key_id=credentials["AccessKeyId"],
-        aws_secret_access_key=credentials["SecretAccessKey"],
-        aws_session_token=credentials["SessionToken"],
-    )
-    DynamodbCli = session.client("dynamodb", region_name=REGION)
-    DynamodbRes = session.resource("dynamodb", region_name=REGION)
+    DynamodbCli = get_cached_client(credentials, "dynamodb")
+    DynamodbRes = get_cached_client(credentials, "dynamodb", resource=True)
     return DynamodbCli, DynamodbRes
 
 # Process the prompt and get the answer from Amazon Q
@@ -136,21 +168,6 @@ def process_prompt(prompt_input, conversation_id, parent_message_id, qclient):
     logger.info(answer)
     return answer
 
-# Formatting functions using Dataset.from_dict
-def create_evaluation_dataset(questions: List[str],
-                              answers: List[str],
-                              ground_truth: List[str],
-                              contexts: List[List[str]]) -> Dataset:
-
-    testcases = {
-        'question': questions,
-        'answer': answers,
-        'ground_truth': ground_truth,
-        'contexts': contexts,
-    }
-    print(testcases)
-    return Dataset.from_dict(testcases)
-
 def get_answers_from_q(q_app_responses):
     answers = []
     if 'systemMessage' in q_app_responses:
@@ -181,79 +198,186 @@ def extract_text_snippets_from_sources_attributes(q_app_response):
         contexts.append([])
         logger.error("q_app_response is not a dictionary. Appending empty list.")
     return contexts
-class RagasUtils:
-    MAX_WORKERS_COUNT = 4
-    def __init__(self, region: str, bedrock_embedding_model_id: str, bedrock_llm_model_id: str):
-        self.region = region
-        self.bedrock_embedding_model_id = bedrock_embedding_model_id
-        self.bedrock_llm_model_id = bedrock_llm_model_id
-    
-    def _get_bedrock_embeddings(self):
 
-        retry_delay = 1
-        i = 1
-        for i in range(25):  # Retries
+# Bedrock quotas shared by every ragas worker of the container, and by every Lambda when RateLimitTable is set
+BEDROCK_REQUESTS_PER_MINUTE = int(os.environ.get('BedrockRequestsPerMinute', '60'))
+BEDROCK_TOKENS_PER_MINUTE = int(os.environ.get('BedrockTokensPerMinute', '100000'))
+RATE_LIMIT_TABLE = os.environ.get('RateLimitTable')
+
+@functools.lru_cache(maxsize=None)
+def get_bedrock_rate_limiter():
+    counter_store = None
+    if RATE_LIMIT_TABLE:
+        counter_store = DynamoDBCounterStore(RATE_LIMIT_TABLE, get_default_client('dynamodb'))
+    return BedrockRateLimiter(BEDROCK_REQUESTS_PER_MINUTE, BEDROCK_TOKENS_PER_MINUTE, counter_store)
+
+# Number of prompts of a SQS batch sent to Amazon Q at the same time
+Q_FETCH_MAX_WORKERS = int(os.environ.get('QFetchMaxWorkers', '8'))
+
+# Evaluations are only started with at least this much time left, else the messages go back to the queue
+EVALUATION_TIME_BUDGET_SECONDS = int(os.environ.get('EvaluationTimeBudgetSeconds', '300'))
+# Messages handed back to the queue become visible again after this delay
+RELEASE_VISIBILITY_TIMEOUT_SECONDS = int(os.environ.get('ReleaseVisibilityTimeoutSeconds', '60'))
+
+# When set, s3://bucket/prefix, the results are also written as parquet with numeric scores, partitioned by
+# application, ingestion run and category, for queries over many runs
+RESULTS_LOCATION = os.environ.get('ResultsLocation')
+
+# Get the answer from Amazon Q, retrying throttling and transient errors while the invocation has time left
+def get_answer_with_retries(prompt_input, qclient, retry_policy):
+    with span('QuestionAnswer') as counters:
+        errors = []
+
+        # every attempt after the first is a retry of the previous error
+        def process_prompt_attempt():
+            if errors:
+                counters['retries'] += 1
+                counters['throttles'] += int(is_throttling_error(errors[-1]))
             try:
-                result= BedrockEmbeddings(
-                    model_id=self.bedrock_embedding_model_id,
-                    region_name=self.region)
-                break  # If successful, break the loop
+                return process_prompt(prompt_input, None, None, qclient)
             except Exception as e:
-                logger.error(f"Error processing BedrockEmbeddings: {e}")
-                time.sleep(retry_delay)  # Wait before retrying
-                retry_delay *= 3  # Exponential backoff
-                retry_delay += random.uniform(0,10)
-        return result
-    
-    def _get_bedrock_llm_model_wrapper(self):
-        bedrock_model = ChatBedrock(
-            region_name=self.region,
-            endpoint_url=f"https://bedrock-runtime.{self.region}.amazonaws.com",
-            model_id=self.bedrock_llm_model_id)
-        
-        retry_delay = 1
-        i = 1
-        for i in range(25):  # Retries
-            try:
-                result= LangchainLLMWrapper(bedrock_model)
-                break  # If successful, break the loop
-            except Exception as e:
-                logger.error(f"Error processing LangchainLLMWrapper: {e}")
-                time.sleep(retry_delay)  # Wait before retrying
-                retry_delay *= 3  # Exponential backoff
-                retry_delay += random.uniform(0,10)
-        return result
-
-    def configure_metrics_to_use_bedrock(self, metrics):
-        bedrock_llm_wrapper = self._get_bedrock_llm_model_wrapper()
-        bedrock_embeddings = self._get_bedrock_embeddings()
-        for m in metrics:
-            setattr(m, 'llm', bedrock_llm_wrapper)
-            setattr(m, 'embeddings', bedrock_embeddings)
-    def evaluate_dataset(self, evaluation_dataset:Dataset, metrics:List[Metric]) -> Result:
-        nest_asyncio.apply()
-
-        delay = 30 
-        delay += random.uniform(1,10)
-        time.sleep(delay)  # Wait before eval
-        runconfig = RunConfig(max_workers=self.MAX_WORKERS_COUNT, max_retries=25, max_wait=60, timeout=600)
-
-        evaluation_results = evaluate(
-            evaluation_dataset,
-            metrics=metrics,
-            run_config=runconfig,
-        )
-        return evaluation_results
-    
-# Main Lambda handler
+                errors.append(e)
+                raise e
+
+        answer = retry_policy.call(process_prompt_attempt)
+    logger.info("Q prompt exec successfully")
+    return answer
+
+# arn:aws:sqs:region:account:name -> https://sqs.region.amazonaws.com/account/name
+def get_queue_url(event_source_arn):
+    _, _, _, region, account_id, queue_name = event_source_arn.split(':')
+    return f"https://sqs.{region}.amazonaws.com/{account_id}/{queue_name}"
+
+# Hand the messages back to the queue instead of sleeping until the invocation times out
+def release_messages(items):
+    sqs = get_default_client('sqs')
+    for item in items:
+        try:
+            sqs.change_message_visibility(
+                QueueUrl=get_queue_url(item['event_source_arn']),
+                ReceiptHandle=item['receipt_handle'],
+                VisibilityTimeout=RELEASE_VISIBILITY_TIMEOUT_SECONDS
+            )
+        except Exception as e:
+            logger.error(f"Error releasing message for item id {item['item_id']}: {e}")
+    return [item['message_id'] for item in items]
+
+# Parse the SQS record body (the original DynamoDB event)
+def parse_record(record):
+    new_image = json.loads(record['body'])
+    logger.debug(f"Processing DynamoDB event: {new_image}")
+    item_id = new_image['id']['S']
+
+    if 'ground_truth' in new_image:
+        ground_truth_value = new_image['ground_truth']['S']
+    else:
+        logger.warning(f"No ground truth found for item id {item_id}. Skipping this item.")
+        ground_truth_value = ''
+    return {
+        'message_id': record['messageId'],
+        'receipt_handle': record.get('receiptHandle'),
+        'event_source_arn': record.get('eventSourceARN'),
+        'item_id': item_id,
+        'prompt': new_image['prompt']['S'],
+        'ground_truth': ground_truth_value,
+        'fingerprint': compute_fingerprint(new_image['prompt']['S'], ground_truth_value, AMAZON_Q_APP_ID,
+                                           get_metric_config()),
+        'force_evaluation': new_image.get('force_evaluation', {}).get('BOOL', False),
+        'run_id': new_image.get('ingestion_id', {}).get('S')
+    }
+
+# Drop the items whose result already has the same fingerprint, SQS redeliveries and unchanged re-uploads
+def skip_evaluated_items(items, dynamodb_resource, table_name_results):
+    checked_ids = [item['item_id'] for item in items if not item['force_evaluation']]
+    if not checked_ids:
+        return items
+    result_fingerprints = get_result_fingerprints(dynamodb_resource, table_name_results, checked_ids)
+    pending_items = []
+    for item in items:
+        if not item['force_evaluation'] and result_fingerprints.get(item['item_id']) == item['fingerprint']:
+            logger.info(f"Item with id {item['item_id']} already evaluated. Skipping.")
+            continue
+        pending_items.append(item)
+    return pending_items
+
+# Fetch the answers of all the prompts of the batch concurrently
+def fetch_answers(pending_items, qclient, retry_policy):
+    answered_items = []
+    failed_message_ids = []
+    out_of_time_items = []
+    if not pending_items:
+        return answered_items, failed_message_ids, out_of_time_items
+    with ThreadPoolExecutor(max_workers=min(Q_FETCH_MAX_WORKERS, len(pending_items))) as executor:
+        futures = [executor.submit(get_answer_with_retries, item['prompt'], qclient, retry_policy)
+                   for item in pending_items]
+    for item, future in zip(pending_items, futures):
+        error = future.exception()
+        if isinstance(error, DeadlineExceeded):
+            out_of_time_items.append(item)
+        elif error is not None:
+            logger.error(f"Error getting answer for item id {item['item_id']}: {error}")
+            failed_message_ids.append(item['message_id'])
+        else:
+            answered_items.append({**item, 'answer': future.result()})
+    return answered_items, failed_message_ids, out_of_time_items
+
+def create_result_item(item_id, row, fingerprint=None):
+    result_item = {
+        'id': f"{item_id}",
+        'question': f"{row['question']}",
+        'answer': f"{row['answer']}",
+        'ground_truth': f"{row['ground_truth']}",
+        'contexts': f"{row['contexts']}",
+        'answer_relevancy': f"{row['answer_relevancy']}",
+        'truthfulness': f"{row['faithfulness']}",
+        'context_recall': f"{row['context_recall']}",
+        'context_precision': f"{row['context_precision']}"
+    }
+    # only a complete result spares the next evaluation of the prompt
+    if fingerprint and has_valid_scores(row):
+        result_item['fingerprint'] = fingerprint
+    return result_item
+
+# Write the scored rows to the parquet results, one file per run and category of the batch
+def write_parquet_results(answered_items, rows, context):
+    from results_sink import write_results
+    part_name = f"part-{getattr(context, 'aws_request_id', None) or uuid.uuid4().hex}.parquet"
+    try:
+        write_results(get_default_client('s3'), RESULTS_LOCATION, AMAZON_Q_APP_ID, answered_items, rows, part_name)
+    except Exception as e:
+        # the results are in DynamoDB, evaluating the batch again for the parquet files is not worth its cost
+        logger.error(f"Error writing the parquet results: {e}")
+
+# Only the failed messages are redelivered by SQS, the event source mapping reports batch item failures
+def batch_response(failed_message_ids, status_code=200, body='Successfully processed the DynamoDB stream.'):
+    return {
+        'statusCode': status_code,
+        'body': json.dumps(body),
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+    }
+
+def flush_instrumentation():
+    try:
+        instrumentation.flush(get_sink(INSTRUMENTATION_LOCATION, METRICS_NAMESPACE, {"QApplicationId": AMAZON_Q_APP_ID}))
+    except Exception as e:
+        # the evaluation results matter more than its timings
+        logger.error(f"Failed to flush the instrumentation due to {e}")
+
+# Main Lambda handler, the stages of every SQS batch are flushed once it is processed
 def lambda_handler(event, context):
-    logger.info(f"Received event: {json.dumps(event)}")
+    try:
+        with span('Invocation'):
+            return process_batch(event, context)
+    finally:
+        flush_instrumentation()
 
+def authenticate_q_user():
+    """Returns the credentials of the Q user, or the status code and message of the failure."""
     # Get secret
     # Extract username and password from the environment variables
     UserCredentialsSecret = os.environ.get('UserCredentialsSecret')
     
-    secrets_manager = boto3.client('secretsmanager')
+    secrets_manager = get_default_client('secretsmanager')
     secret = secrets_manager.get_secret_value(SecretId=UserCredentialsSecret)
     secret_dict = json.loads(secret['SecretString'])
 
@@ -262,33 +386,41 @@ def lambda_handler(event, context):
     
     if not username or not password:
         logger.error("Username or password not provided.")
-        return {
-            'statusCode': 400,
-            'body': json.dumps('Username or password not provided.')
-        }
+        return None, (400, 'Username or password not provided.')
     # Authenticate user
     auth_tokens = authenticate_user(username, password)
     if not auth_tokens:
-        return {
-            'statusCode': 401,
-            'body': json.dumps('Authentication failed.')
-        }
+        return None, (401, 'Authentication failed.')
     id_token = auth_tokens['IdToken']
     # Get IAM OIDC token
     iam_oidc_response = get_iam_oidc_token(id_token)
     if not iam_oidc_response:
-        return {
-            'statusCode': 500,
-            'body': json.dumps('Failed to get IAM OIDC token.')
-        }
+        return None, (500, 'Failed to get IAM OIDC token.')
     iam_token = iam_oidc_response["idToken"] 
     # Assume role with the IAM OIDC token
     credentials = assume_role_with_token(iam_token)
     if not credentials:
-        return {
-            'statusCode': 500,
-            'body': json.dumps('Failed to assume role.')
-        }
+        return None, (500, 'Failed to assume role.')
+    return credentials, None
+
+def get_q_user_credentials():
+    """Returns the cached credentials of the Q user, or the status code and message of the failure."""
+    def load_q_user_credentials():
+        credentials, failure = authenticate_q_user()
+        # failures expire at once, the next invocation authenticates again
+        return (credentials, failure), get_expiration_timestamp(credentials)
+    cache_key = ('q-user', os.environ.get('UserCredentialsSecret'), IAM_ROLE)
+    return CREDENTIALS_CACHE.get(cache_key, load_q_user_credentials)
+
+def process_batch(event, context):
+    logger.info(f"Received event: {json.dumps(event)}")
+    records = event.get('Records', [])
+    all_message_ids = [record['messageId'] for record in records]
+
+    with span('Authenticate'):
+        credentials, failure = get_q_user_credentials()
+    if failure:
+        return batch_response(all_message_ids, *failure)
     # Create Amazon Q client
     qclient = get_qclient(credentials)
     
@@ -298,126 +430,76 @@ def lambda_handler(event, context):
     table_name = os.environ.get('TABLE_NAME')
     table_name_results = os.environ.get('PromptEvalResultsTable')
 
-          
-    for record in event['Records']:
-        questions = []
-        answers = []
-        answer_text_list = []
-        ground_truth = []  # Assuming you have ground truth data
-        contexts = []
-        context_list = []
-
+    pending_items = []
+    failed_message_ids = []
+    for record in records:
         try:
-            message = json.loads(record['body'])
-            # Process the message (the original DynamoDB event)
-            print(f"Processing DynamoDB event: {message}")
-            
-            new_image = message
-            item_id = new_image['id']['S']
-            prompt_input = new_image['prompt']['S']
-            # Check if 'Response' attribute already exists
-            if 'Response' in new_image:
-                logger.info(f"Item with id {item_id} already processed. Skipping.")
-                continue
-            # Process the prompt and get the answer
-
-            retry_delay = 60
-            i = 1
-            for i in range(20):  # Retries
-                try:
-                    answer = process_prompt(prompt_input, None, None, qclient)
-                    print(f"Q prompt exec successfully! after {i} retries..")
-                    break  # If successful, break the loop
-                except Exception as e:
-                    logger.error(f"Error processing record: {e} . Trying again.. retry = {i} .")
-                    retry_delay += random.uniform(0,10)
-                    time.sleep(retry_delay)  # Wait before retrying
-                    retry_delay *= 2  # Exponential backoff
-                    
-                    
-                    
-            #answer = process_prompt(prompt_input, None, None, qclient)
-            
-            # Collect data for formatting
-            questions.append(prompt_input)
-            logger.info(questions)
-
-            # Get the answer and append
-            answer_text_list: list[str] = get_answers_from_q(answer)
-            answers.extend(answer_text_list)  # Extend the answers list
-            logger.info(answers)
-
-            # Get contexts and append
-            context_list = extract_text_snippets_from_sources_attributes(answer)
-            contexts.extend(context_list)  # Extend the contexts list
-            logger.info(contexts)
-            
-            # If ground truth is available, retrieve it; else, use placeholder
-            if 'ground_truth' in new_image:
-                ground_truth_value = new_image['ground_truth']['S']
-            else:
-                logger.warning(f"No ground truth found for item id {item_id}. Skipping this item.")
-                ground_truth_value = ''
-            
-            ground_truth.append(ground_truth_value)
-            logger.info(ground_truth)
-
-            
+            item = parse_record(record)
+            if item is not None:
+                pending_items.append(item)
         except Exception as e:
             logger.error(f"Error processing record: {e}")
-            continue
-
-        # Verify that all lists have the same length
-        if not (len(questions) == len(answers) == len(ground_truth) == len(contexts)):
-            logger.error("Mismatch in lengths of data lists.")
-           
-            return {
-                'statusCode': 500,
-                'body': json.dumps('Mismatch in lengths of data lists.')
-            }
-
-        # After processing all records, create the evaluation dataset
+            failed_message_ids.append(record['messageId'])
+    try:
+        pending_items = skip_evaluated_items(pending_items, dynamodbRes, table_name_results)
+    except Exception as e:
+        # evaluating an unchanged prompt again only costs time
+        logger.error(f"Error looking up the evaluated items: {e}")
+
+    # Process the prompts and get the answers
+    deadline = Deadline(context)
+    with span('RetrieveAnswers'):
+        answered_items, fetch_failed_message_ids, out_of_time_items = fetch_answers(pending_items, qclient,
+                                                                                    RetryPolicy(deadline))
+    failed_message_ids.extend(fetch_failed_message_ids)
+    if not deadline.has_time_for(EVALUATION_TIME_BUDGET_SECONDS):
+        logger.warning("Not enough time left to evaluate the batch, handing the messages back to the queue.")
+        out_of_time_items.extend(answered_items)
+        answered_items = []
+    failed_message_ids.extend(release_messages(out_of_time_items))
+    if not answered_items:
+        return batch_response(failed_message_ids)
+
+    questions = [item['prompt'] for item in answered_items]
+    answers = [get_answers_from_q(item['answer'])[0] for item in answered_items]
+    contexts = [extract_text_snippets_from_sources_attributes(item['answer'])[0] for item in answered_items]
+    ground_truth = [item['ground_truth'] for item in answered_items]
+
+    # Score every answered prompt of the batch in a single evaluation
+    try:
+        # the ragas stack is only loaded once there is something to score
+        from ragas_evaluation import RagasUtils, create_evaluation_dataset, get_evaluation_metrics
         evaluation_dataset = create_evaluation_dataset(questions, answers, ground_truth, contexts)
         logger.info(f"Evaluation Dataset: {evaluation_dataset}")
 
         # Initialize RagasUtils with environment variables
         bedrock_embedding_model_id = os.environ.get('BedrockEmbeddingModelId')
         bedrock_llm_model_id = os.environ.get('BedrockTextModelId')
-        ragas_utils = RagasUtils(BEDROCK_REGION, bedrock_embedding_model_id, bedrock_llm_model_id)
+        ragas_utils = RagasUtils(BEDROCK_REGION, bedrock_embedding_model_id, bedrock_llm_model_id,
+                                 get_default_client("bedrock-runtime"), get_bedrock_rate_limiter())
         # Define metrics
-        metrics = [answer_relevancy,
-                faithfulness,
-                context_recall,
-                context_precision]
+        metrics = get_evaluation_metrics()
 
         # Configure metrics
         ragas_utils.configure_metrics_to_use_bedrock(metrics)
         # Evaluate the dataset
-        
-        evaluation_results = ragas_utils.evaluate_dataset(evaluation_dataset, metrics)
+        with span('RagasEvaluate'):
+            evaluation_results = ragas_utils.evaluate_dataset(evaluation_dataset, metrics, deadline)
         evaluations_results_json = evaluation_results.to_pandas().to_json(orient="records")
         logger.info(f"Evaluation Results: {evaluations_results_json}")
-
-        # Update the item in DynamoDB with the response        
         data = json.loads(evaluations_results_json)
-        
-        item = { 
-            'id': f"{item_id}", 
-            'question': f"{data[0]['question']}",
-            'answer': f"{data[0]['answer']}",
-            'ground_truth': f"{data[0]['ground_truth']}",
-            'contexts': f"{data[0]['contexts']}",           
-            'answer_relevancy': f"{data[0]['answer_relevancy']}",
-            'truthfulness': f"{data[0]['faithfulness']}",
-            'context_recall': f"{data[0]['context_recall']}",
-            'context_precision': f"{data[0]['context_precision']}"
-        }
-
-        table = dynamodbRes.Table(table_name_results)
-        table.put_item(Item=item)
-
-        
-    return {
-        'statusCode': 200,
-        'body': json.dumps('Successfully processed the DynamoDB stream.')
-    }
\ No newline at end of file
+    except Exception as e:
+        logger.error(f"Error evaluating the batch: {e}")
+        failed_message_ids.extend(item['message_id'] for item in answered_items)
+        return batch_response(failed_message_ids)
+
+    # Update the items in DynamoDB with the responses, 25 per BatchWriteItem call
+    with span('WriteResults'), BufferedBatchWriter(dynamodbRes, table_name_results) as writer:
+        for item, row in zip(answered_items, data):
+            writer.put(create_result_item(item['item_id'], row, item['fingerprint']), tag=item['message_id'])
+    failed_message_ids.extend(writer.failed_tags)
+    if RESULTS_LOCATION:
+        with span('WriteParquetResults'):
+            write_parquet_results(answered_items, data, context)
+
+    return batch_response(failed_message_ids)
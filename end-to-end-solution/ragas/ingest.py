@@ -0,0 +1,258 @@
+import csv
+import os
+import logging
+import functools
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+
+import boto3
+
+from batch_writer import BufferedBatchWriter
+from fingerprint import MAX_BATCH_GET_SIZE, compute_fingerprint, get_metric_config, get_result_fingerprints
+
+# Initialize logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+INGEST_MAX_WORKERS = int(os.environ.get('IngestMaxWorkers', '4'))
+# files smaller than this are never split, planning the chunks costs a read of the whole file
+INGEST_MIN_CHUNK_BYTES = int(os.environ.get('IngestMinChunkBytes', str(1024 * 1024)))
+READ_BLOCK_BYTES = 64 * 1024
+# a line longer than this is a broken file, not a prompt
+MAX_LINE_BYTES = 4 * 1024 * 1024
+ID_START = 100
+ID_STEP = 100
+RESULTS_TABLE = os.environ.get('PromptEvalResultsTable')
+AMAZON_Q_APP_ID = os.environ.get('AMAZON_Q_APP_ID')
+# evaluates every prompt again, whether it changed or not
+FORCE_REEVALUATION = os.environ.get('ForceReevaluation', 'false').lower() == 'true'
+
+
+class PromptDialect(csv.Dialect):
+    """category|prompt|ground_truth, fields holding a pipe, a quote or a newline are quoted with double quotes."""
+    delimiter = '|'
+    quotechar = '"'
+    doublequote = True
+    skipinitialspace = False
+    lineterminator = '\n'
+    quoting = csv.QUOTE_MINIMAL
+
+
+@dataclass(frozen=True)
+class Chunk:
+    start: int
+    # exclusive, always the end of a record
+    end: int
+    # index of the first record of the chunk in the file, the prompt ids are derived from it
+    first_record: int
+
+
+@dataclass(frozen=True)
+class ChangeDetection:
+    """
+    Prompts whose fingerprint matches the one of their result in results_table_name are not written again, so they are
+    not evaluated again. force, or a category of invalidated_categories, writes and evaluates them anyway.
+    """
+    results_table_name: Optional[str]
+    q_app_id: Optional[str]
+    metric_config: dict
+    force: bool = False
+    invalidated_categories: frozenset = frozenset()
+    # changes on every ingestion, so a forced prompt always makes it to the table stream
+    ingestion_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+    def is_forced(self, category):
+        return self.force or category in self.invalidated_categories
+
+
+@dataclass
+class IngestSummary:
+    records: int = 0
+    written_items: int = 0
+    calls: int = 0
+    skipped_records: int = 0
+    unchanged_items: int = 0
+    failed_items: int = 0
+
+    def add(self, other):
+        self.records += other.records
+        self.written_items += other.written_items
+        self.calls += other.calls
+        self.skipped_records += other.skipped_records
+        self.unchanged_items += other.unchanged_items
+        self.failed_items += other.failed_items
+
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client():
+    return boto3.client('s3')
+
+
+def create_dynamodb_resource():
+    # boto3 resources are not thread safe, every chunk gets its own
+    return boto3.session.Session().resource('dynamodb')
+
+
+def iter_lines(blocks):
+    """Splits a stream of byte blocks in lines, line endings included, holding at most one line in memory."""
+    pending = b''
+    for block in blocks:
+        pending += block
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+        if len(pending) > MAX_LINE_BYTES:
+            raise Exception(f"Line longer than {MAX_LINE_BYTES} bytes")
+    if pending:
+        yield pending
+
+
+def iter_records(blocks, encoding='utf-8'):
+    """Yields (end_offset, fields) of every csv record, end_offset being relative to the first block."""
+    offset = 0
+
+    def decoded_lines():
+        nonlocal offset
+        line_encoding = encoding
+        for line in iter_lines(blocks):
+            offset += len(line)
+            yield line.decode(line_encoding)
+            line_encoding = 'utf-8'
+
+    # the reader stops at the end of the line completing a record, so offset is the end of that record
+    for fields in csv.reader(decoded_lines(), dialect=PromptDialect):
+        yield offset, fields
+
+
+def plan_chunks(blocks, chunk_bytes):
+    """Splits the file in chunks of about chunk_bytes ending on record boundaries, quoted newlines included."""
+    chunks = []
+    start, first_record, records, end = 0, 0, 0, 0
+    for end, _ in iter_records(blocks):
+        records += 1
+        if end - start >= chunk_bytes:
+            chunks.append(Chunk(start, end, first_record))
+            start, first_record = end, records
+    if records > first_record:
+        chunks.append(Chunk(start, end, first_record))
+    return chunks
+
+
+def create_prompt_item(record_index, fields, change_detection):
+    if len(fields) != 3:
+        return None
+    category, prompt, ground_truth = fields
+    # blank records still count, so the ids only depend on the position of the prompt in the file
+    return {
+        "id": f"{category}_{ID_START + ID_STEP * record_index}",
+        "prompt": prompt,
+        "ground_truth": ground_truth,
+        "fingerprint": compute_fingerprint(prompt, ground_truth, change_detection.q_app_id,
+                                           change_detection.metric_config),
+        "force_evaluation": change_detection.is_forced(category),
+        "ingestion_id": change_detection.ingestion_id
+    }
+
+
+def write_changed_items(items, writer, dynamodb_resource, change_detection, summary):
+    checked_ids = [item['id'] for item in items if not item['force_evaluation']]
+    result_fingerprints = {}
+    if change_detection.results_table_name and checked_ids:
+        result_fingerprints = get_result_fingerprints(dynamodb_resource, change_detection.results_table_name,
+                                                      checked_ids)
+    for item in items:
+        if not item['force_evaluation'] and result_fingerprints.get(item['id']) == item['fingerprint']:
+            summary.unchanged_items += 1
+            continue
+        writer.put(item, tag=item['id'])
+
+
+def ingest_chunk(bucket, key, chunk, table_name, change_detection):
+    body = get_s3_client().get_object(Bucket=bucket, Key=key, Range=f"bytes={chunk.start}-{chunk.end - 1}")['Body']
+    # only the first chunk can start with the byte order mark of an Excel export
+    encoding = 'utf-8-sig' if chunk.start == 0 else 'utf-8'
+    summary = IngestSummary()
+    dynamodb_resource = create_dynamodb_resource()
+    items = []
+    with BufferedBatchWriter(dynamodb_resource, table_name) as writer:
+        for record_index, (_, fields) in enumerate(iter_records(body.iter_chunks(READ_BLOCK_BYTES), encoding),
+                                                   start=chunk.first_record):
+            summary.records += 1
+            item = create_prompt_item(record_index, fields, change_detection)
+            if item is None:
+                if fields:
+                    logger.warning(f"Skipping record {record_index} of {key} with {len(fields)} fields")
+                summary.skipped_records += 1
+                continue
+            items.append(item)
+            # the results are looked up 100 at a time, one BatchGetItem call
+            if len(items) == MAX_BATCH_GET_SIZE:
+                write_changed_items(items, writer, dynamodb_resource, change_detection, summary)
+                items = []
+        write_changed_items(items, writer, dynamodb_resource, change_detection, summary)
+    summary.written_items = writer.written_items
+    summary.calls = writer.calls
+    summary.failed_items = len(writer.failed_tags)
+    return summary
+
+
+def get_change_detection(metadata):
+    """
+    The upload can force the evaluation with S3 object metadata:
+        aws s3 cp prompt.csv s3://<bucket>/ --metadata force-reevaluation=true
+        aws s3 cp prompt.csv s3://<bucket>/ --metadata invalidate-categories=pricing,limits
+    """
+    force = FORCE_REEVALUATION or metadata.get('force-reevaluation', '').lower() == 'true'
+    invalidated_categories = frozenset(category.strip() for category in
+                                       metadata.get('invalidate-categories', '').split(',') if category.strip())
+    return ChangeDetection(RESULTS_TABLE, AMAZON_Q_APP_ID, get_metric_config(), force, invalidated_categories)
+
+
+def ingest_object(bucket, key, table_name, max_workers, min_chunk_bytes, change_detection=None):
+    """
+    Streams the csv object into the prompts table with a constant memory footprint, skipping the unchanged prompts.
+
+    Objects larger than min_chunk_bytes are split in byte ranges, one per worker, every worker streams and writes its
+    range. The planning pass only parses the file, the writes, the slow part, run in parallel.
+    """
+    head = get_s3_client().head_object(Bucket=bucket, Key=key)
+    size = head['ContentLength']
+    if change_detection is None:
+        change_detection = get_change_detection(head.get('Metadata', {}))
+    if size == 0:
+        return IngestSummary()
+    chunk_bytes = max(min_chunk_bytes, -(-size // max_workers))
+    if size <= chunk_bytes:
+        chunks = [Chunk(0, size, 0)]
+    else:
+        body = get_s3_client().get_object(Bucket=bucket, Key=key)['Body']
+        chunks = plan_chunks(body.iter_chunks(READ_BLOCK_BYTES), chunk_bytes)
+
+    summary = IngestSummary()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as executor:
+        for chunk_summary in executor.map(
+                lambda chunk: ingest_chunk(bucket, key, chunk, table_name, change_detection), chunks):
+            summary.add(chunk_summary)
+    return summary
+
+
+# Populate the prompts table from the uploaded csv file, the table stream then queues every prompt for evaluation
+def lambda_handler(event, context):
+    table_name = os.environ['DYNAMODB_TABLE']
+    for record in event['Records']:
+        bucket = record['s3']['bucket']['name']
+        key = record['s3']['object']['key']
+
+        if not key.lower().endswith('.csv'):
+            print(f'Invalid file type: {key}')
+            continue
+
+        summary = ingest_object(bucket, key, table_name, INGEST_MAX_WORKERS, INGEST_MIN_CHUNK_BYTES)
+        logger.info(f"Wrote {summary.written_items} prompts of {key} in {summary.calls} BatchWriteItem calls, "
+                    f"{summary.unchanged_items} unchanged, skipped {summary.skipped_records} records")
+        if summary.failed_items:
+            # the S3 event is retried, prompts already written are simply overwritten
+            raise Exception(f"Failed to write {summary.failed_items} prompts of {key}")
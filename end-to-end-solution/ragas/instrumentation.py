@@ -0,0 +1,218 @@
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from rate_limiter import is_throttling_error
+
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "Throttling", "RequestLimitExceeded",
+                          "ProvisionedThroughputExceededException"}
+
+
+class LatencyHistogram:
+    """Log-scale buckets, each about 19% wider than the previous one, so percentiles stay within 19% at any scale."""
+
+    BUCKETS_PER_DOUBLING = 4
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+
+    def _bucket(self, millis):
+        return math.ceil(math.log2(millis) * self.BUCKETS_PER_DOUBLING) if millis > 1 else 0
+
+    def _upper_bound(self, bucket):
+        return 2 ** (bucket / self.BUCKETS_PER_DOUBLING)
+
+    def add(self, millis):
+        bucket = self._bucket(millis)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+
+    def percentile(self, percent):
+        if not self.total:
+            return 0.0
+        rank = math.ceil(self.total * percent / 100)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return self._upper_bound(bucket)
+        return self._upper_bound(max(self.counts))
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.total_millis = 0.0
+        self.max_millis = 0.0
+        self.histogram = LatencyHistogram()
+
+    def to_dict(self):
+        return {"count": self.count,
+                "errors": self.errors,
+                "throttles": self.throttles,
+                "retries": self.retries,
+                "total_millis": round(self.total_millis, 3),
+                "p50_millis": min(self.histogram.percentile(50), self.max_millis),
+                "p95_millis": min(self.histogram.percentile(95), self.max_millis),
+                "p99_millis": min(self.histogram.percentile(99), self.max_millis),
+                "max_millis": round(self.max_millis, 3)}
+
+
+class Instrumentation:
+    """
+    Same stages as the evaluation lambda of AmazonQEvaluationLambda: durations, errors, throttles and retries are
+    aggregated in memory and `flush` writes one summary per stage and dimensions to the sink.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration_millis, error=False, throttles=0, retries=0, **dimensions):
+        key = (stage, tuple(sorted(dimensions.items())))
+        with self._lock:
+            stats = self._stages.get(key)
+            if stats is None:
+                stats = self._stages[key] = StageStats()
+            stats.count += 1
+            stats.errors += int(error)
+            stats.throttles += throttles
+            stats.retries += retries
+            stats.total_millis += duration_millis
+            stats.max_millis = max(stats.max_millis, duration_millis)
+            stats.histogram.add(duration_millis)
+
+    # the span yields its counters, the code it wraps adds the throttles and retries it went through
+    @contextmanager
+    def span(self, stage, **dimensions):
+        counters = {"throttles": 0, "retries": 0}
+        start = self._clock()
+        try:
+            yield counters
+        except Exception as e:
+            self.record(stage, (self._clock() - start) * 1000, error=True,
+                        throttles=counters["throttles"] + int(is_throttling_error(e)), retries=counters["retries"],
+                        **dimensions)
+            raise e
+        self.record(stage, (self._clock() - start) * 1000, throttles=counters["throttles"],
+                    retries=counters["retries"], **dimensions)
+
+    def snapshot(self):
+        with self._lock:
+            return [{"stage": stage, "dimensions": dict(dimensions), **stats.to_dict()}
+                    for (stage, dimensions), stats in sorted(self._stages.items())]
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def flush(self, sink):
+        stages = self.snapshot()
+        self.reset()
+        if stages:
+            sink.write(stages)
+        return stages
+
+
+def get_event_loop():
+    try:
+        return asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        return loop
+
+
+class EmfSink:
+    """One embedded metrics event per stage, with the stage and its dimensions as CloudWatch dimensions."""
+
+    def __init__(self, namespace, dimensions):
+        self.namespace = namespace
+        self.dimensions = dimensions
+
+    def write(self, stages):
+        from aws_embedded_metrics.logger.metrics_logger_factory import create_metrics_logger
+
+        for stage in stages:
+            metrics = create_metrics_logger()
+            metrics.set_namespace(self.namespace)
+            metrics.set_dimensions({**self.dimensions, "Stage": stage["stage"], **stage["dimensions"]})
+            for name in ("count", "errors", "throttles", "retries"):
+                metrics.put_metric(name.capitalize(), stage[name], "Count")
+            for name in ("p50", "p95", "p99", "max"):
+                metrics.put_metric(f"Latency{name.capitalize()}", stage[f"{name}_millis"], "Milliseconds")
+            get_event_loop().run_until_complete(metrics.flush())
+
+
+class JsonLinesSink:
+    """Appends the stages of every flush as a JSON line, for local runs."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, stages):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"timestamp": time.time(), "stages": stages}) + "\n")
+
+
+def get_sink(json_location, namespace, dimensions):
+    return JsonLinesSink(json_location) if json_location else EmfSink(namespace, dimensions)
+
+
+# boto3 client events, every AWS call is a span named after its service and operation
+def _on_before_call(event_name, params, context, **kwargs):
+    context["instrumentation_start"] = time.perf_counter()
+    # judge and embeddings models are both invoked with InvokeModel
+    if "modelId" in params:
+        context["instrumentation_dimensions"] = {"ModelId": params["modelId"]}
+
+
+def _on_after_call(event_name, parsed, context, http_response=None, **kwargs):
+    start = context.pop("instrumentation_start", None)
+    if start is None:
+        return
+    error_code = parsed.get("Error", {}).get("Code")
+    status_code = getattr(http_response, "status_code", 200)
+    instrumentation.record(event_name.split(".", 1)[1],
+                           (time.perf_counter() - start) * 1000,
+                           error=error_code is not None or status_code >= 300,
+                           throttles=int(error_code in THROTTLING_ERROR_CODES),
+                           retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+                           **context.pop("instrumentation_dimensions", {}))
+
+
+def _on_after_call_error(event_name, context, **kwargs):
+    start = context.pop("instrumentation_start", None)
+    if start is not None:
+        instrumentation.record(event_name.split(".", 1)[1], (time.perf_counter() - start) * 1000, error=True,
+                               **context.pop("instrumentation_dimensions", {}))
+
+
+def instrument_client(client):
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is None:
+        return client
+    events.register("before-parameter-build", _on_before_call)
+    events.register("after-call", _on_after_call)
+    events.register("after-call-error", _on_after_call_error)
+    return client
+
+
+# Shared by all invocations served by the same lambda container, flushed once per SQS batch
+instrumentation = Instrumentation()
+
+
+def span(stage, **dimensions):
+    return instrumentation.span(stage, **dimensions)
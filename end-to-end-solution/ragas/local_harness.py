@@ -0,0 +1,174 @@
+"""
+Runs index.lambda_handler locally against stubbed Amazon Q, Bedrock and DynamoDB to compare SQS batch sizes.
+
+    python local_harness.py --prompts 50 --batch-sizes 1 10 25 --q-latency-ms 300 --eval-latency-ms 500
+    python local_harness.py --prompts 20 --batch-sizes 10 --failing-prompts 3 14
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import jwt
+from datasets import Dataset
+from ragas.evaluation import Result
+
+import index
+import ragas_evaluation
+
+HARNESS_ENVIRONMENT = {"BedrockEmbeddingModelId": "amazon.titan-embed-text-v1",
+                       "BedrockTextModelId": "anthropic.claude-v2",
+                       "PromptEvalResultsTable": "harness-results"}
+
+
+class StubCounters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.q_calls = 0
+        self.evaluate_calls = 0
+        self.put_items = 0
+        self.batch_write_calls = 0
+
+    def increment(self, name, value=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + value)
+
+
+class StubDefaultClient:
+    """Secrets Manager, Cognito, SSO OIDC and STS clients of the lambda execution role."""
+
+    def get_secret_value(self, SecretId):
+        return {"SecretString": json.dumps({"username": "harness-user", "password": "harness-password"})}
+
+    def admin_initiate_auth(self, **kwargs):
+        return {"AuthenticationResult": {"IdToken": "id-token"}}
+
+    def create_token_with_iam(self, **kwargs):
+        return {"idToken": jwt.encode({"sts:identity_context": "harness-context"}, "harness-key", algorithm="HS256")}
+
+    def assume_role(self, **kwargs):
+        return {"Credentials": {"AccessKeyId": "HARNESSKEY", "SecretAccessKey": "secret", "SessionToken": "token",
+                                "Expiration": datetime.now(timezone.utc) + timedelta(hours=1)}}
+
+
+class StubQClient:
+    def __init__(self, counters, latency_seconds, failing_prompts):
+        self.counters = counters
+        self.latency_seconds = latency_seconds
+        self.failing_prompts = failing_prompts
+
+    def chat_sync(self, applicationId, userMessage, **kwargs):
+        self.counters.increment("q_calls")
+        threading.Event().wait(self.latency_seconds)
+        if userMessage in self.failing_prompts:
+            raise Exception(f"stubbed Q failure for {userMessage}")
+        return {"systemMessage": f"answer to {userMessage}",
+                "sourceAttributions": [{"snippet": f"snippet about {userMessage}"}]}
+
+
+class StubDynamoResource:
+    # the handler instruments the client of every resource, the stub has none
+    meta = SimpleNamespace(client=None)
+
+    def __init__(self, counters):
+        self.counters = counters
+
+    def batch_write_item(self, RequestItems):
+        self.counters.increment("batch_write_calls")
+        for requests in RequestItems.values():
+            self.counters.increment("put_items", len(requests))
+        return {"UnprocessedItems": {}}
+
+    def batch_get_item(self, RequestItems):
+        # no prompt of the harness was evaluated before
+        return {"Responses": {table_name: [] for table_name in RequestItems}}
+
+
+class StubSession:
+    def __init__(self, counters, q_latency_seconds, failing_prompts):
+        self.counters = counters
+        self.q_latency_seconds = q_latency_seconds
+        self.failing_prompts = failing_prompts
+
+    def client(self, service_name, **kwargs):
+        return StubQClient(self.counters, self.q_latency_seconds, self.failing_prompts)
+
+    def resource(self, service_name, **kwargs):
+        return StubDynamoResource(self.counters)
+
+
+def create_stub_evaluate(counters, eval_latency_seconds):
+    # stands in for the Bedrock judge calls, rows are scored MAX_WORKERS_COUNT at a time
+    def stub_evaluate(dataset, metrics, run_config):
+        counters.increment("evaluate_calls")
+        rounds = -(-len(dataset) // run_config.max_workers)
+        threading.Event().wait(rounds * eval_latency_seconds)
+        scores = {metric.name: [0.5] * len(dataset) for metric in metrics}
+        return Result(scores=Dataset.from_dict(scores), dataset=dataset)
+    return stub_evaluate
+
+
+def create_sqs_event(first_prompt, batch_size):
+    records = []
+    for i in range(first_prompt, first_prompt + batch_size):
+        body = {"id": {"S": f"item-{i}"}, "prompt": {"S": f"question {i}"}, "ground_truth": {"S": f"truth {i}"}}
+        records.append({"messageId": f"message-{i}", "body": json.dumps(body)})
+    return {"Records": records}
+
+
+def run(prompts, batch_size, q_latency_seconds, eval_latency_seconds, failing_prompts=()):
+    counters = StubCounters()
+    failing_prompts = {f"question {i}" for i in failing_prompts}
+    index.get_default_client.cache_clear()
+    index.CREDENTIALS_CACHE.clear()
+    index._sessions.clear()
+    index._clients.clear()
+    failed_messages = []
+    with patch.dict(os.environ, HARNESS_ENVIRONMENT), \
+            patch.object(index, "AMAZON_Q_APP_ID", "harness-application"), \
+            patch.object(index, "INSTRUMENTATION_LOCATION", os.devnull), \
+            patch.object(index.boto3, "client", lambda *args, **kwargs: StubDefaultClient()), \
+            patch.object(index.boto3, "Session", lambda **kwargs: StubSession(counters, q_latency_seconds, failing_prompts)), \
+            patch.object(ragas_evaluation, "evaluate", create_stub_evaluate(counters, eval_latency_seconds)):
+        start = time.monotonic()
+        invocations = 0
+        for first_prompt in range(0, prompts, batch_size):
+            response = index.lambda_handler(create_sqs_event(first_prompt, min(batch_size, prompts - first_prompt)),
+                                            None)
+            failed_messages.extend(failure["itemIdentifier"] for failure in response["batchItemFailures"])
+            invocations += 1
+        wall_seconds = time.monotonic() - start
+
+    return {"batch_size": batch_size,
+            "invocations": invocations,
+            "q_calls": counters.q_calls,
+            "evaluate_calls": counters.evaluate_calls,
+            "put_items": counters.put_items,
+            "batch_write_calls": counters.batch_write_calls,
+            "failed_messages": failed_messages,
+            "wall_seconds": round(wall_seconds, 2),
+            "prompts_per_invocation": round(prompts / invocations, 1),
+            "prompts_per_minute": round(prompts / wall_seconds * 60, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=50)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 25])
+    parser.add_argument("--q-latency-ms", type=float, default=300)
+    parser.add_argument("--eval-latency-ms", type=float, default=500)
+    parser.add_argument("--failing-prompts", type=int, nargs="*", default=[],
+                        help="Indexes of the prompts the stubbed Q application fails to answer")
+    args = parser.parse_args()
+
+    for batch_size in args.batch_sizes:
+        print(json.dumps(run(args.prompts, batch_size, args.q_latency_ms / 1000, args.eval_latency_ms / 1000,
+                             args.failing_prompts)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+The ragas, langchain and datasets stacks take seconds to import, index.py only loads this module once the
+batch is authenticated and answered, so invalid events and auth failures return without paying for them.
+"""
+import nest_asyncio
+from langchain_aws import BedrockEmbeddings, ChatBedrock
+from ragas.evaluation import Result
+from ragas import evaluate, RunConfig
+from ragas.llms import LangchainLLMWrapper
+from ragas.metrics.base import Metric
+from ragas.metrics import (AnswerRelevancy, Faithfulness, ContextRecall, ContextPrecision)  # Import necessary metrics
+from datasets import Dataset
+from langchain_core.embeddings import Embeddings
+from rate_limiter import estimate_tokens, is_throttling_error
+from typing import List
+
+# Expected size of a judge answer, corrected with the actual usage once the answer arrives
+ESTIMATED_OUTPUT_TOKENS = 256
+
+# Formatting functions using Dataset.from_dict
+def create_evaluation_dataset(questions: List[str],
+                              answers: List[str],
+                              ground_truth: List[str],
+                              contexts: List[List[str]]) -> Dataset:
+
+    testcases = {
+        'question': questions,
+        'answer': answers,
+        'ground_truth': ground_truth,
+        'contexts': contexts,
+    }
+    return Dataset.from_dict(testcases)
+
+
+def get_total_tokens(result):
+    usage = (result.llm_output or {}).get('usage') or {}
+    return usage.get('total_tokens')
+
+# Waits for the rate limiter before every judge call, and slows it down when Bedrock throttles
+class RateLimitedLLMWrapper(LangchainLLMWrapper):
+    def __init__(self, langchain_llm, rate_limiter):
+        super().__init__(langchain_llm)
+        self.rate_limiter = rate_limiter
+
+    def _estimate_tokens(self, prompt, n):
+        return (estimate_tokens(prompt.to_string()) + ESTIMATED_OUTPUT_TOKENS) * n
+
+    def generate_text(self, prompt, n=1, temperature=None, stop=None, callbacks=None):
+        estimated_tokens = self._estimate_tokens(prompt, n)
+        window = self.rate_limiter.acquire(requests=n, tokens=estimated_tokens)
+        try:
+            result = super().generate_text(prompt, n, temperature, stop, callbacks)
+        except Exception as e:
+            if is_throttling_error(e):
+                self.rate_limiter.on_throttle()
+            raise e
+        self.rate_limiter.on_success()
+        total_tokens = get_total_tokens(result)
+        if total_tokens is not None:
+            self.rate_limiter.settle_tokens(estimated_tokens, total_tokens, window)
+        return result
+
+    async def agenerate_text(self, prompt, n=1, temperature=None, stop=None, callbacks=None):
+        estimated_tokens = self._estimate_tokens(prompt, n)
+        window = await self.rate_limiter.acquire_async(requests=n, tokens=estimated_tokens)
+        try:
+            result = await super().agenerate_text(prompt, n, temperature, stop, callbacks)
+        except Exception as e:
+            if is_throttling_error(e):
+                self.rate_limiter.on_throttle()
+            raise e
+        self.rate_limiter.on_success()
+        total_tokens = get_total_tokens(result)
+        if total_tokens is not None:
+            await self.rate_limiter.settle_tokens_async(estimated_tokens, total_tokens, window)
+        return result
+
+class RateLimitedEmbeddings(Embeddings):
+    def __init__(self, embeddings, rate_limiter):
+        self.embeddings = embeddings
+        self.rate_limiter = rate_limiter
+
+    def _embed(self, embed, texts):
+        self.rate_limiter.acquire(requests=len(texts), tokens=sum(estimate_tokens(text) for text in texts))
+        try:
+            result = embed()
+        except Exception as e:
+            if is_throttling_error(e):
+                self.rate_limiter.on_throttle()
+            raise e
+        self.rate_limiter.on_success()
+        return result
+
+    def embed_documents(self, texts):
+        return self._embed(lambda: self.embeddings.embed_documents(texts), texts)
+
+    def embed_query(self, text):
+        return self._embed(lambda: self.embeddings.embed_query(text), [text])
+
+class RagasUtils:
+    MAX_WORKERS_COUNT = 4
+    def __init__(self, region: str, bedrock_embedding_model_id: str, bedrock_llm_model_id: str,
+                 bedrock_client, rate_limiter):
+        self.region = region
+        self.bedrock_embedding_model_id = bedrock_embedding_model_id
+        self.bedrock_llm_model_id = bedrock_llm_model_id
+        self.bedrock_client = bedrock_client
+        self.rate_limiter = rate_limiter
+    
+    def _get_bedrock_embeddings(self):
+        return RateLimitedEmbeddings(BedrockEmbeddings(
+            client=self.bedrock_client,
+            model_id=self.bedrock_embedding_model_id,
+            region_name=self.region), self.rate_limiter)
+    
+    def _get_bedrock_llm_model_wrapper(self):
+        bedrock_model = ChatBedrock(
+            client=self.bedrock_client,
+            region_name=self.region,
+            endpoint_url=f"https://bedrock-runtime.{self.region}.amazonaws.com",
+            model_id=self.bedrock_llm_model_id)
+        return RateLimitedLLMWrapper(bedrock_model, self.rate_limiter)
+
+    def configure_metrics_to_use_bedrock(self, metrics):
+        bedrock_llm_wrapper = self._get_bedrock_llm_model_wrapper()
+        bedrock_embeddings = self._get_bedrock_embeddings()
+        for m in metrics:
+            setattr(m, 'llm', bedrock_llm_wrapper)
+            setattr(m, 'embeddings', bedrock_embeddings)
+    def evaluate_dataset(self, evaluation_dataset:Dataset, metrics:List[Metric], deadline=None) -> Result:
+        nest_asyncio.apply()
+
+        # no need to wait before the evaluation, the Bedrock calls are paced by the rate limiter
+        # and no row may run past the time the invocation has left
+        timeout = 600
+        if deadline is not None:
+            timeout = max(1, int(min(timeout, deadline.remaining_seconds())))
+        runconfig = RunConfig(max_workers=self.MAX_WORKERS_COUNT, max_retries=8, max_wait=30, timeout=timeout)
+
+        evaluation_results = evaluate(
+            evaluation_dataset,
+            metrics=metrics,
+            run_config=runconfig,
+        )
+        return evaluation_results
+
+
+def get_evaluation_metrics():
+    # new instances on every call, configure_metrics_to_use_bedrock never touches the ragas module-level metrics
+    return [AnswerRelevancy(),
+            Faithfulness(),
+            ContextRecall(),
+            ContextPrecision()]
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger()
+
+THROTTLING_MARKERS = ("ThrottlingException", "TooManyRequestsException", "Too many requests", "Rate exceeded")
+
+
+# Bedrock errors reach us wrapped by langchain, so match on the error text
+def is_throttling_error(error):
+    return any(marker in str(error) for marker in THROTTLING_MARKERS)
+
+
+# Rough prompt size, Bedrock models average about 4 characters per token
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst_seconds, clock):
+        self.max_rate_per_second = rate_per_minute / 60
+        self.rate_per_second = self.max_rate_per_second
+        self.capacity = max(1.0, self.max_rate_per_second * burst_seconds)
+        self.available = self.capacity
+        self._clock = clock
+        self._last_refill = clock()
+
+    def refill(self):
+        now = self._clock()
+        self.available = min(self.capacity, self.available + (now - self._last_refill) * self.rate_per_second)
+        self._last_refill = now
+
+    # Seconds until amount can be taken, requests bigger than the bucket wait for a full bucket and go into debt
+    def wait_time(self, amount):
+        needed = min(amount, self.capacity)
+        if self.available >= needed:
+            return 0.0
+        return (needed - self.available) / self.rate_per_second
+
+    def take(self, amount):
+        self.available -= amount
+
+
+class InMemoryCounterStore:
+    """Stand-in for the shared counter store, counts within a single process."""
+
+    def __init__(self):
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def increment(self, key, requests, tokens, expires_at):
+        with self._lock:
+            counter_requests, counter_tokens = self._counters.get(key, (0, 0))
+            self._counters[key] = (counter_requests + requests, counter_tokens + tokens)
+            return self._counters[key]
+
+
+class DynamoDBCounterStore:
+    """Per-minute request and token counters shared by every Lambda, expired windows are removed by the table TTL."""
+
+    def __init__(self, table_name, dynamodb_client):
+        self.table_name = table_name
+        self.dynamodb_client = dynamodb_client
+
+    def increment(self, key, requests, tokens, expires_at):
+        response = self.dynamodb_client.update_item(
+            TableName=self.table_name,
+            Key={'id': {'S': key}},
+            UpdateExpression='ADD requests :requests, tokens :tokens SET expires_at = if_not_exists(expires_at, :expires_at)',
+            ExpressionAttributeValues={
+                ':requests': {'N': str(requests)},
+                ':tokens': {'N': str(tokens)},
+                ':expires_at': {'N': str(int(expires_at))}
+            },
+            ReturnValues='UPDATED_NEW'
+        )
+        attributes = response['Attributes']
+        return int(attributes['requests']['N']), int(attributes['tokens']['N'])
+
+
+class BedrockRateLimiter:
+    """
+    Token buckets over Bedrock requests and tokens per minute, shared by every ragas worker of the process.
+
+    With a counter store, every Lambda also claims its requests and tokens in a shared one minute window, so the
+    concurrent Lambdas together stay under the same limits. Throttles halve the rate, successes slowly restore it.
+    """
+    WINDOW_SECONDS = 60
+
+    def __init__(self, requests_per_minute, tokens_per_minute, counter_store=None, name='bedrock',
+                 burst_seconds=10, min_rate_fraction=0.1, backoff_factor=0.5, recovery_step=0.05,
+                 clock=time.monotonic, wall_clock=time.time, sleep=time.sleep):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.counter_store = counter_store
+        self.name = name
+        self.min_rate_fraction = min_rate_fraction
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+        self.rate_fraction = 1.0
+        self.requests = TokenBucket(requests_per_minute, burst_seconds, clock)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds, clock)
+        self._wall_clock = wall_clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def _set_rate_fraction(self, rate_fraction):
+        self.requests.refill()
+        self.tokens.refill()
+        self.rate_fraction = rate_fraction
+        self.requests.rate_per_second = self.requests.max_rate_per_second * rate_fraction
+        self.tokens.rate_per_second = self.tokens.max_rate_per_second * rate_fraction
+
+    def _get_window_key(self, window):
+        return f"{self.name}-{window}", (window + 2) * self.WINDOW_SECONDS
+
+    # Claims requests and tokens in the shared window, returns the seconds until the next window when it is full
+    def _claim_shared_window(self, requests, tokens):
+        now = self._wall_clock()
+        window = math.floor(now / self.WINDOW_SECONDS)
+        key, expires_at = self._get_window_key(window)
+        window_requests, window_tokens = self.counter_store.increment(key, requests, tokens, expires_at)
+        if window_requests <= self.requests_per_minute * self.rate_fraction \
+                and window_tokens <= self.tokens_per_minute * self.rate_fraction:
+            return 0.0, window
+        # the claim is undone, requests that are never sent must not fill the window of the other callers
+        self.counter_store.increment(key, -requests, -tokens, expires_at)
+        return (window + 1) * self.WINDOW_SECONDS - now, None
+
+    # Returns the wait like try_acquire and the shared window the claim went to, if any
+    def _try_acquire(self, requests, tokens):
+        with self._lock:
+            self.requests.refill()
+            self.tokens.refill()
+            wait = max(self.requests.wait_time(requests), self.tokens.wait_time(tokens))
+            if wait > 0:
+                return wait, None
+            self.requests.take(requests)
+            self.tokens.take(tokens)
+        if self.counter_store is None:
+            return 0.0, None
+        wait, window = self._claim_shared_window(requests, tokens)
+        if wait > 0:
+            # give the local tokens back, they are taken again once the next window opens
+            with self._lock:
+                self.requests.take(-requests)
+                self.tokens.take(-tokens)
+        return wait, window
+
+    # The shared counter is a DynamoDB round trip, it runs in a worker thread so the other ragas jobs keep going
+    async def _run_shared(self, function, *args):
+        if self.counter_store is None:
+            return function(*args)
+        return await asyncio.to_thread(function, *args)
+
+    def try_acquire(self, requests=1, tokens=0):
+        """Takes the requests and tokens and returns 0 when allowed, else the seconds to wait before trying again."""
+        return self._try_acquire(requests, tokens)[0]
+
+    def acquire(self, requests=1, tokens=0):
+        """Waits for the requests and tokens, returns the shared window to settle the tokens in."""
+        wait, window = self._try_acquire(requests, tokens)
+        while wait > 0:
+            self._sleep(wait)
+            wait, window = self._try_acquire(requests, tokens)
+        return window
+
+    async def acquire_async(self, requests=1, tokens=0):
+        wait, window = await self._run_shared(self._try_acquire, requests, tokens)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait, window = await self._run_shared(self._try_acquire, requests, tokens)
+        return window
+
+    # Corrects the estimated token count once the actual usage is known, in the local bucket and the shared window
+    def settle_tokens(self, estimated_tokens, actual_tokens, window=None):
+        delta = actual_tokens - estimated_tokens
+        with self._lock:
+            self.tokens.take(delta)
+        if self.counter_store is None or window is None or delta == 0:
+            return
+        current_window = math.floor(self._wall_clock() / self.WINDOW_SECONDS)
+        if window != current_window:
+            if delta < 0:
+                # the over-estimate only held a window that is already closed
+                return
+            # the extra tokens were used now, they count in the current window
+            window = current_window
+        key, expires_at = self._get_window_key(window)
+        self.counter_store.increment(key, 0, delta, expires_at)
+
+    async def settle_tokens_async(self, estimated_tokens, actual_tokens, window=None):
+        await self._run_shared(self.settle_tokens, estimated_tokens, actual_tokens, window)
+
+    def on_throttle(self):
+        with self._lock:
+            self._set_rate_fraction(max(self.min_rate_fraction, self.rate_fraction * self.backoff_factor))
+            logger.warning(f"Bedrock throttled, lowering the rate to {self.rate_fraction:.0%} of the limits")
+
+    def on_success(self):
+        if self.rate_fraction >= 1.0:
+            return
+        with self._lock:
+            self._set_rate_fraction(min(1.0, self.rate_fraction + self.recovery_step))
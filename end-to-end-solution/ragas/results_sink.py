@@ -0,0 +1,122 @@
+import io
+import logging
+import math
+from urllib.parse import quote, unquote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from fingerprint import EVALUATION_METRICS
+
+logger = logging.getLogger()
+
+# hive style prefixes, application_id=.../run_id=.../category=..., readable by athena and pyarrow datasets too
+PARTITION_COLUMNS = ('application_id', 'run_id', 'category')
+TEXT_COLUMNS = ['id', 'question', 'answer', 'ground_truth']
+RESULTS_SCHEMA = pa.schema([(column, pa.string()) for column in TEXT_COLUMNS]
+                           + [('contexts', pa.list_(pa.string()))]
+                           + [(metric, pa.float64()) for metric in EVALUATION_METRICS])
+# prompts not written by an ingestion, e.g. added from the UI, have no ingestion id
+DEFAULT_RUN_ID = 'unassigned'
+DEFAULT_CATEGORY = 'uncategorized'
+
+
+def split_s3_location(location):
+    bucket, _, prefix = location[len('s3://'):].partition('/')
+    return bucket, prefix.strip('/')
+
+
+# ingest.py writes the prompt ids as <category>_<number>
+def get_category(item_id):
+    category, separator, _ = item_id.rpartition('_')
+    return category if separator and category else DEFAULT_CATEGORY
+
+
+def get_partition_prefix(prefix, application_id, run_id, category):
+    partitions = zip(PARTITION_COLUMNS, (application_id, run_id, category))
+    return '/'.join(([prefix] if prefix else []) + [f"{column}={quote(str(value), safe='')}"
+                                                     for column, value in partitions])
+
+
+def to_score(value):
+    # ragas reports the failed metrics as NaN, they are stored as nulls
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return float(value)
+
+
+def create_result_row(item, row):
+    return {
+        'id': item['item_id'],
+        'question': row['question'],
+        'answer': row['answer'],
+        'ground_truth': row['ground_truth'],
+        'contexts': list(row['contexts'] or []),
+        **{metric: to_score(row.get(metric)) for metric in EVALUATION_METRICS}
+    }
+
+
+def write_results(s3_client, location, application_id, items, rows, part_name):
+    """
+    Writes the scored rows of the items as parquet files with float score columns and dictionary encoded text, one per
+    ingestion run and category. Every invocation writes its own part_name, so batches of the same run add up.
+    """
+    bucket, prefix = split_s3_location(location)
+    partitions = {}
+    for item, row in zip(items, rows):
+        partition = (item.get('run_id') or DEFAULT_RUN_ID, get_category(item['item_id']))
+        partitions.setdefault(partition, []).append(create_result_row(item, row))
+    keys = []
+    for (run_id, category), result_rows in partitions.items():
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist(result_rows, schema=RESULTS_SCHEMA), buffer, compression='zstd',
+                       use_dictionary=TEXT_COLUMNS)
+        key = f"{get_partition_prefix(prefix, application_id, run_id, category)}/{part_name}"
+        s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        keys.append(key)
+    logger.info(f"Wrote {len(rows)} results in {len(keys)} parquet files under {location}")
+    return keys
+
+
+def get_partitions(key):
+    partitions = {}
+    for segment in key.split('/')[:-1]:
+        column, separator, value = segment.partition('=')
+        if separator and column in PARTITION_COLUMNS:
+            partitions[column] = unquote(value)
+    return partitions
+
+
+def read_results(s3_client, location, columns=None, filters=None):
+    """
+    Reads only the columns asked for, the partition columns included, of the files whose partitions are in the filters,
+    e.g. {'run_id': ['3c5e...'], 'category': ['billing']}.
+    """
+    filters = filters or {}
+    for column in filters:
+        if column not in PARTITION_COLUMNS:
+            raise ValueError(f"Invalid filter {column}, the results are partitioned by {PARTITION_COLUMNS}")
+    data_columns = None if columns is None else [column for column in columns if column not in PARTITION_COLUMNS]
+    bucket, prefix = split_s3_location(location)
+
+    tables = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/" if prefix else ''):
+        for item in page.get('Contents', []):
+            partitions = get_partitions(item['Key'])
+            if not item['Key'].endswith('.parquet') or \
+                    any(partitions.get(column) not in values for column, values in filters.items()):
+                continue
+            body = s3_client.get_object(Bucket=bucket, Key=item['Key'])['Body'].read()
+            table = pq.read_table(io.BytesIO(body), columns=data_columns,
+                                  read_dictionary=[column for column in TEXT_COLUMNS
+                                                   if data_columns is None or column in data_columns])
+            for column in PARTITION_COLUMNS:
+                if column in partitions and (columns is None or column in columns):
+                    values = pa.array([partitions[column]] * table.num_rows, pa.string()).dictionary_encode()
+                    table = table.append_column(column, values)
+            tables.append(table)
+    if not tables:
+        return pa.table({column: pa.array([], pa.string()) for column in columns or []})
+    results = pa.concat_tables(tables, promote_options='permissive')
+    return results.select(columns) if columns else results
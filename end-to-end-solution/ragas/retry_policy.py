@@ -0,0 +1,84 @@
+import logging
+import math
+import random
+import time
+
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionClosedError, EndpointConnectionError, ReadTimeoutError
+
+logger = logging.getLogger()
+
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException", "TooManyRequestsException", "Throttling", "RequestLimitExceeded",
+    "ServiceUnavailableException", "InternalServerException", "ModelTimeoutException", "RequestTimeout",
+    "ModelNotReadyException",
+}
+RETRYABLE_EXCEPTIONS = (ConnectionClosedError, EndpointConnectionError, ReadTimeoutError)
+
+
+# botocore retries throttles and transient errors itself, pacing the client with a token bucket
+def get_adaptive_retry_config(max_pool_connections=10, max_attempts=5):
+    return Config(max_pool_connections=max_pool_connections,
+                  retries={"mode": "adaptive", "max_attempts": max_attempts})
+
+
+def is_retryable_error(error):
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+    if isinstance(error, RETRYABLE_EXCEPTIONS):
+        return True
+    # Bedrock errors reach us wrapped by langchain, so match on the error text
+    return any(code in str(error) for code in RETRYABLE_ERROR_CODES)
+
+
+class DeadlineExceeded(Exception):
+    """Raised instead of sleeping past the time the invocation has left."""
+
+
+class Deadline:
+    def __init__(self, context=None, safety_margin_seconds=30, clock=time.monotonic):
+        self.safety_margin_seconds = safety_margin_seconds
+        self._clock = clock
+        self._expires_at = math.inf
+        if context is not None:
+            self._expires_at = clock() + context.get_remaining_time_in_millis() / 1000
+
+    # Seconds left before the safety margin, infinite outside of Lambda
+    def remaining_seconds(self):
+        return self._expires_at - self.safety_margin_seconds - self._clock()
+
+    def has_time_for(self, seconds):
+        return self.remaining_seconds() > seconds
+
+
+class RetryPolicy:
+    """Retries throttling and transient errors with full-jitter exponential backoff, never past the deadline."""
+
+    def __init__(self, deadline, max_attempts=8, base_delay_seconds=2, max_delay_seconds=60,
+                 sleep=time.sleep, random_uniform=random.uniform):
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._sleep = sleep
+        self._random_uniform = random_uniform
+
+    def get_delay(self, attempt):
+        return self._random_uniform(0, min(self.max_delay_seconds, self.base_delay_seconds * 2 ** attempt))
+
+    def call(self, fn, *args, **kwargs):
+        attempt = 0
+        while True:
+            if not self.deadline.has_time_for(0):
+                raise DeadlineExceeded("No time left in this invocation")
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if not is_retryable_error(e) or attempt >= self.max_attempts:
+                    raise e
+                delay = self.get_delay(attempt - 1)
+                if not self.deadline.has_time_for(delay):
+                    raise DeadlineExceeded(f"Not enough time left to retry after: {e}") from e
+                logger.warning(f"Retryable error: {e} . Retrying in {delay:.1f}s, attempt {attempt} .")
+                self._sleep(delay)
@@ -0,0 +1,11 @@
+class FakeClock:
+    """Clock the tests move by hand, its sleep advances the time instead of waiting."""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
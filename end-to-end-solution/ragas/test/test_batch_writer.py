@@ -0,0 +1,126 @@
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+from batch_writer import BufferedBatchWriter
+from .fakes import FakeClock
+
+AWS_ENVIRONMENT = {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                   "AWS_SECRET_ACCESS_KEY": "testing"}
+
+
+def count_calls(client, operation_name):
+    calls = []
+    client.meta.events.register(f"before-call.dynamodb.{operation_name}", lambda **kwargs: calls.append(1))
+    return calls
+
+
+def create_prompts_table(dynamodb):
+    dynamodb.create_table(TableName="prompts",
+                          KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+                          AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+                          BillingMode="PAY_PER_REQUEST")
+
+
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestBufferedBatchWriterWithMoto(unittest.TestCase):
+
+    @mock_aws
+    def test_items_are_written_in_batches_of_25(self):
+        dynamodb = boto3.resource("dynamodb")
+        create_prompts_table(dynamodb)
+        batch_calls = count_calls(dynamodb.meta.client, "BatchWriteItem")
+
+        with BufferedBatchWriter(dynamodb, "prompts") as writer:
+            for i in range(60):
+                writer.put({"id": f"item-{i}", "answer": f"answer {i}"})
+
+        self.assertEqual(len(batch_calls), 3)
+        self.assertEqual(writer.written_items, 60)
+        self.assertEqual(dynamodb.Table("prompts").get_item(Key={"id": "item-59"})["Item"]["answer"], "answer 59")
+
+
+class TestBufferedBatchWriter(unittest.TestCase):
+
+    def test_unprocessed_items_are_resent_with_backoff(self):
+        clock = FakeClock()
+        dynamodb = MagicMock()
+        dynamodb.batch_write_item.side_effect = [
+            {"UnprocessedItems": {"results": [{"PutRequest": {"Item": {"id": "b"}}}]}},
+            {"UnprocessedItems": {}}]
+        writer = BufferedBatchWriter(dynamodb, "results", sleep=clock.sleep, clock=clock,
+                                     random_uniform=lambda low, high: high)
+
+        with writer:
+            writer.put({"id": "a"}, tag="message-a")
+            writer.put({"id": "b"}, tag="message-b")
+
+        self.assertEqual(writer.calls, 2)
+        self.assertEqual(writer.written_items, 2)
+        self.assertEqual(writer.failed_tags, [])
+        self.assertEqual(dynamodb.batch_write_item.call_args.kwargs["RequestItems"],
+                         {"results": [{"PutRequest": {"Item": {"id": "b"}}}]})
+        self.assertAlmostEqual(clock.now, 0.1)
+
+    def test_items_still_unprocessed_after_max_attempts_are_reported(self):
+        dynamodb = MagicMock()
+        dynamodb.batch_write_item.return_value = {
+            "UnprocessedItems": {"results": [{"PutRequest": {"Item": {"id": "b"}}}]}}
+        writer = BufferedBatchWriter(dynamodb, "results", max_attempts=3, sleep=lambda seconds: None)
+
+        with writer:
+            writer.put({"id": "a"}, tag="message-a")
+            writer.put({"id": "b"}, tag="message-b")
+
+        self.assertEqual(writer.calls, 3)
+        self.assertEqual(writer.failed_tags, ["message-b"])
+
+    def test_non_retryable_errors_fail_the_batch(self):
+        dynamodb = MagicMock()
+        dynamodb.batch_write_item.side_effect = ClientError(
+            {"Error": {"Code": "ValidationException", "Message": "invalid item"}}, "BatchWriteItem")
+        with BufferedBatchWriter(dynamodb, "results", sleep=lambda seconds: None) as writer:
+            writer.put({"id": "a"}, tag="message-a")
+
+        self.assertEqual(writer.calls, 1)
+        self.assertEqual(writer.failed_tags, ["message-a"])
+
+    def test_buffer_is_flushed_on_time(self):
+        clock = FakeClock()
+        dynamodb = MagicMock()
+        dynamodb.batch_write_item.return_value = {}
+        writer = BufferedBatchWriter(dynamodb, "results", flush_interval_seconds=5, clock=clock)
+
+        writer.put({"id": "a"})
+        clock.now = 6
+        writer.put({"id": "b"})
+        self.assertEqual(writer.calls, 1)
+        self.assertEqual(writer.written_items, 2)
+
+    def test_duplicate_keys_keep_the_last_item(self):
+        dynamodb = MagicMock()
+        dynamodb.batch_write_item.return_value = {}
+        with BufferedBatchWriter(dynamodb, "results") as writer:
+            writer.put({"id": "a", "answer": "first"})
+            writer.put({"id": "a", "answer": "second"})
+
+        self.assertEqual(dynamodb.batch_write_item.call_args.kwargs["RequestItems"],
+                         {"results": [{"PutRequest": {"Item": {"id": "a", "answer": "second"}}}]})
+
+    def test_every_tag_of_a_duplicate_key_is_reported_on_failure(self):
+        dynamodb = MagicMock()
+        dynamodb.batch_write_item.side_effect = ClientError(
+            {"Error": {"Code": "ValidationException", "Message": "invalid item"}}, "BatchWriteItem")
+        with BufferedBatchWriter(dynamodb, "results", sleep=lambda seconds: None) as writer:
+            writer.put({"id": "a", "answer": "first"}, tag="message-1")
+            writer.put({"id": "b"}, tag="message-2")
+            writer.put({"id": "a", "answer": "second"}, tag="message-3")
+
+        self.assertEqual(dynamodb.batch_write_item.call_args.kwargs["RequestItems"]["results"],
+                         [{"PutRequest": {"Item": {"id": "a", "answer": "second"}}},
+                          {"PutRequest": {"Item": {"id": "b"}}}])
+        self.assertEqual(sorted(writer.failed_tags), ["message-1", "message-2", "message-3"])
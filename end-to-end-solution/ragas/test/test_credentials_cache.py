@@ -0,0 +1,68 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import index
+from credentials_cache import CredentialsCache
+from .fakes import FakeClock
+
+
+def create_credentials(access_key_id, expires_in_seconds=3600):
+    return {"AccessKeyId": access_key_id, "SecretAccessKey": "secret", "SessionToken": "token",
+            "Expiration": datetime.now(timezone.utc) + timedelta(seconds=expires_in_seconds)}
+
+
+class TestCredentialsCache(unittest.TestCase):
+
+    def test_value_is_reused_until_the_refresh_margin(self):
+        clock = FakeClock(1000.0)
+        credentials_cache = CredentialsCache(refresh_margin_seconds=300, clock=clock)
+        loaded_values = []
+
+        def loader():
+            loaded_values.append(f"credentials{len(loaded_values)}")
+            return loaded_values[-1], clock.now + 3600
+
+        self.assertEqual(credentials_cache.get("key", loader), "credentials0")
+        clock.now += 3000
+        self.assertEqual(credentials_cache.get("key", loader), "credentials0")
+        clock.now += 301
+        self.assertEqual(credentials_cache.get("key", loader), "credentials1")
+
+
+class TestQUserClients(unittest.TestCase):
+
+    def setUp(self):
+        index.CREDENTIALS_CACHE.clear()
+        index._sessions.clear()
+        index._clients.clear()
+
+    tearDown = setUp
+
+    def test_warm_invocations_reuse_the_q_and_dynamodb_clients(self):
+        # every assume_role call returns new credentials
+        assumed_credentials = [create_credentials("first-key"), create_credentials("second-key")]
+        session_factory = MagicMock(side_effect=lambda **kwargs: MagicMock(
+            client=MagicMock(side_effect=lambda *args, **kwargs: MagicMock()),
+            resource=MagicMock(side_effect=lambda *args, **kwargs: MagicMock())))
+        authentications = [(credentials, None) for credentials in assumed_credentials]
+        with patch("index.authenticate_q_user", side_effect=authentications), \
+                patch.object(index.boto3, "Session", session_factory):
+            clients = []
+            for _ in range(2):
+                credentials, failure = index.get_q_user_credentials()
+                clients.append((index.get_qclient(credentials), *index.get_DynamodbCli(credentials)))
+
+        self.assertIs(clients[0][0], clients[1][0])
+        self.assertIs(clients[0][1], clients[1][1])
+        self.assertIs(clients[0][2], clients[1][2])
+        session_factory.assert_called_once()
+
+    def test_failed_authentication_is_not_cached(self):
+        with patch("index.authenticate_q_user", side_effect=[(None, (401, "Authentication failed.")),
+                                                             (create_credentials("key"), None)]):
+            self.assertEqual(index.get_q_user_credentials(), (None, (401, "Authentication failed.")))
+            credentials, failure = index.get_q_user_credentials()
+
+        self.assertEqual(credentials["AccessKeyId"], "key")
+        self.assertIsNone(failure)
@@ -0,0 +1,116 @@
+import json
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+import boto3
+from moto import mock_aws
+
+import index
+from fingerprint import compute_fingerprint, get_metric_config, get_result_fingerprints, has_valid_scores
+
+AWS_ENVIRONMENT = {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                   "AWS_SECRET_ACCESS_KEY": "testing"}
+METRIC_CONFIG = {"metrics": ["faithfulness"], "llm_model_id": "anthropic.claude-v2"}
+SCORES = {"answer_relevancy": 0.9, "faithfulness": 1.0, "context_recall": 0.5, "context_precision": 0.75}
+
+
+def create_result_row(**scores):
+    return {"question": "question", "answer": "answer", "ground_truth": "truth", "contexts": ["snippet"],
+            **SCORES, **scores}
+
+
+def create_sqs_record(item_id, prompt, force_evaluation=None):
+    body = {"id": {"S": item_id}, "prompt": {"S": prompt}, "ground_truth": {"S": "truth"}}
+    if force_evaluation is not None:
+        body["force_evaluation"] = {"BOOL": force_evaluation}
+    return {"messageId": f"message-{item_id}", "body": json.dumps(body)}
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_fingerprint_changes_with_every_input(self):
+        fingerprint = compute_fingerprint("prompt", "truth", "q-app", METRIC_CONFIG)
+
+        self.assertEqual(fingerprint, compute_fingerprint("prompt", "truth", "q-app", dict(METRIC_CONFIG)))
+        self.assertNotEqual(fingerprint, compute_fingerprint("prompt!", "truth", "q-app", METRIC_CONFIG))
+        self.assertNotEqual(fingerprint, compute_fingerprint("prompt", "truth!", "q-app", METRIC_CONFIG))
+        self.assertNotEqual(fingerprint, compute_fingerprint("prompt", "truth", "other-app", METRIC_CONFIG))
+        self.assertNotEqual(fingerprint, compute_fingerprint("prompt", "truth", "q-app",
+                                                             {**METRIC_CONFIG, "llm_model_id": "other-model"}))
+
+    def test_metric_config_follows_the_model_ids(self):
+        with patch.dict(os.environ, {"BedrockTextModelId": "model-a", "BedrockEmbeddingModelId": "embeddings"}):
+            config_a = get_metric_config()
+        with patch.dict(os.environ, {"BedrockTextModelId": "model-b", "BedrockEmbeddingModelId": "embeddings"}):
+            config_b = get_metric_config()
+        self.assertNotEqual(config_a, config_b)
+
+    def test_missing_or_nan_scores_are_not_valid(self):
+        self.assertTrue(has_valid_scores(SCORES))
+        self.assertFalse(has_valid_scores({**SCORES, "faithfulness": None}))
+        self.assertFalse(has_valid_scores({**SCORES, "context_recall": float("nan")}))
+
+    @patch.dict(os.environ, AWS_ENVIRONMENT)
+    @mock_aws
+    def test_result_fingerprints_are_read_100_keys_per_call(self):
+        dynamodb = boto3.resource("dynamodb")
+        table = dynamodb.create_table(TableName="results",
+                                      KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+                                      AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+                                      BillingMode="PAY_PER_REQUEST")
+        with table.batch_writer() as writer:
+            for i in range(250):
+                writer.put_item(Item={"id": f"item-{i}", "fingerprint": f"fingerprint-{i}"})
+            # a result stored before fingerprints existed
+            writer.put_item(Item={"id": "legacy", "answer": "answer"})
+        calls = []
+        dynamodb.meta.client.meta.events.register("before-call.dynamodb.BatchGetItem",
+                                                  lambda **kwargs: calls.append(1))
+
+        fingerprints = get_result_fingerprints(dynamodb, "results", [f"item-{i}" for i in range(260)] + ["legacy"])
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(fingerprints), 250)
+        self.assertEqual(fingerprints["item-249"], "fingerprint-249")
+
+    def test_unprocessed_keys_are_read_again(self):
+        dynamodb = MagicMock()
+        dynamodb.batch_get_item.side_effect = [
+            {"Responses": {"results": [{"id": "a", "fingerprint": "fa"}]},
+             "UnprocessedKeys": {"results": {"Keys": [{"id": "b"}], "ProjectionExpression": "id, fingerprint"}}},
+            {"Responses": {"results": [{"id": "b", "fingerprint": "fb"}]}}]
+
+        fingerprints = get_result_fingerprints(dynamodb, "results", ["a", "b"], sleep=lambda seconds: None)
+
+        self.assertEqual(fingerprints, {"a": "fa", "b": "fb"})
+        self.assertEqual(dynamodb.batch_get_item.call_args.kwargs["RequestItems"]["results"]["Keys"], [{"id": "b"}])
+
+
+class TestIncrementalEvaluation(unittest.TestCase):
+
+    def test_items_with_an_up_to_date_result_are_skipped(self):
+        items = [index.parse_record(create_sqs_record("unchanged", "question 1")),
+                 index.parse_record(create_sqs_record("changed", "question 2 edited")),
+                 index.parse_record(create_sqs_record("forced", "question 3", force_evaluation=True)),
+                 index.parse_record(create_sqs_record("new", "question 4"))]
+        stale_fingerprint = index.parse_record(create_sqs_record("changed", "question 2"))["fingerprint"]
+        dynamodb = MagicMock()
+        dynamodb.batch_get_item.return_value = {"Responses": {"results": [
+            {"id": "unchanged", "fingerprint": items[0]["fingerprint"]},
+            {"id": "changed", "fingerprint": stale_fingerprint}]}}
+
+        pending_items = index.skip_evaluated_items(items, dynamodb, "results")
+
+        self.assertEqual([item["item_id"] for item in pending_items], ["changed", "forced", "new"])
+        # forced items are not even looked up
+        keys = dynamodb.batch_get_item.call_args.kwargs["RequestItems"]["results"]["Keys"]
+        self.assertEqual(keys, [{"id": "unchanged"}, {"id": "changed"}, {"id": "new"}])
+
+    def test_only_complete_results_store_the_fingerprint(self):
+        complete = index.create_result_item("item", create_result_row(), "fingerprint")
+        incomplete = index.create_result_item("item", create_result_row(faithfulness=None), "fingerprint")
+
+        self.assertEqual(complete["fingerprint"], "fingerprint")
+        self.assertEqual(complete["truthfulness"], "1.0")
+        self.assertNotIn("fingerprint", incomplete)
@@ -0,0 +1,19 @@
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+RAGAS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+HEAVY_MODULES = ["ragas", "langchain_aws", "langchain_core", "datasets", "jwt"]
+
+
+class TestIndexImports(unittest.TestCase):
+
+    def test_index_loads_the_ragas_stack_lazily(self):
+        script = ("import json, sys\n"
+                  "import index\n"
+                  "print(json.dumps([name for name in json.loads(sys.argv[1]) if name in sys.modules]))\n")
+        output = subprocess.run([sys.executable, "-c", script, json.dumps(HEAVY_MODULES)], cwd=RAGAS_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        self.assertEqual(json.loads(output), [])
@@ -0,0 +1,339 @@
+import functools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import boto3
+import yaml
+from botocore.client import BaseClient
+from botocore.response import StreamingBody
+from moto import mock_aws
+
+import ingest
+from batch_writer import BufferedBatchWriter
+
+AWS_ENVIRONMENT = {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                   "AWS_SECRET_ACCESS_KEY": "testing", "DYNAMODB_TABLE": "prompts"}
+RAGAS_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXEC_PROMPTS_TEMPLATE = os.path.join(os.path.dirname(RAGAS_DIRECTORY), "nested-stacks", "exec-prompts.yaml")
+
+QUOTED_CSV = (b'\xef\xbb\xbfpricing|"Is it billed per user | per month?"|"Per user, per month."\n'
+              b'\n'
+              b'limits|"What does the ""Upload files"" feature accept?"|"Files of up to 10 MB,\nin chat."\r\n'
+              b'broken|only two fields\n'
+              b'apps|Which tier runs Q Apps?|Pro')
+
+
+def split_blocks(data, block_size):
+    return [data[start:start + block_size] for start in range(0, len(data), block_size)]
+
+
+def generate_prompts(path, records):
+    with open(path, "w") as file:
+        for i in range(records):
+            file.write(f"category{i % 7}|question {i}|truth {i}\n")
+
+
+def count_api_calls():
+    calls = []
+    make_api_call = BaseClient._make_api_call
+
+    def counting_make_api_call(client, operation_name, api_params):
+        calls.append(operation_name)
+        return make_api_call(client, operation_name, api_params)
+
+    return calls, patch.object(BaseClient, "_make_api_call", counting_make_api_call)
+
+
+class RangeReader:
+    def __init__(self, path, start, end):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start
+
+    def read(self, amt=None):
+        amt = self._remaining if amt is None else min(amt, self._remaining)
+        data = self._file.read(amt)
+        self._remaining -= len(data)
+        return data
+
+
+class FileS3Client:
+    """Serves a local file as the S3 object, so the object is never in memory."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": os.path.getsize(self.path)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        start, end = 0, os.path.getsize(self.path)
+        if Range:
+            first, last = Range.removeprefix("bytes=").split("-")
+            start, end = int(first), int(last) + 1
+        return {"Body": StreamingBody(RangeReader(self.path, start, end), end - start)}
+
+
+class DiscardingDynamoResource:
+    """Unlike a MagicMock, it does not keep the arguments of every call."""
+
+    def batch_write_item(self, RequestItems):
+        return {}
+
+
+def measure_ingest_peak_rss(path):
+    """Ingests the file against stubbed S3 and DynamoDB and prints the peak RSS, run in a fresh interpreter."""
+    import resource
+
+    with patch("ingest.get_s3_client", return_value=FileS3Client(path)), \
+            patch("ingest.create_dynamodb_resource", return_value=DiscardingDynamoResource()):
+        summary = ingest.ingest_object("bucket", "prompt.csv", "prompts", max_workers=4,
+                                       min_chunk_bytes=1024 * 1024)
+    print(json.dumps({"peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                      "written_items": summary.written_items}))
+
+
+def run_in_subprocess(path):
+    code = ("import sys; sys.path[:0] = [sys.argv[1], sys.argv[2]]; import test_ingest; "
+            "test_ingest.measure_ingest_peak_rss(sys.argv[3])")
+    output = subprocess.run([sys.executable, "-c", code, RAGAS_DIRECTORY, os.path.join(RAGAS_DIRECTORY, "test"), path],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class TestParsing(unittest.TestCase):
+
+    def test_quoted_pipes_quotes_and_newlines_are_parsed(self):
+        records = [fields for _, fields in ingest.iter_records(split_blocks(QUOTED_CSV, 7), "utf-8-sig")]
+
+        self.assertEqual(records[0], ["pricing", "Is it billed per user | per month?", "Per user, per month."])
+        self.assertEqual(records[1], [])
+        self.assertEqual(records[2], ["limits", 'What does the "Upload files" feature accept?',
+                                      "Files of up to 10 MB,\nin chat."])
+        self.assertEqual(records[4], ["apps", "Which tier runs Q Apps?", "Pro"])
+        self.assertEqual(len(records), 5)
+
+    def test_record_offsets_end_on_record_boundaries(self):
+        offsets = [end for end, _ in ingest.iter_records(split_blocks(QUOTED_CSV, 5))]
+
+        self.assertEqual(offsets[-1], len(QUOTED_CSV))
+        self.assertTrue(QUOTED_CSV[:offsets[2]].endswith(b'in chat."\r\n'))
+
+    def test_chunks_split_on_record_boundaries_only(self):
+        chunks = ingest.plan_chunks(split_blocks(QUOTED_CSV, 3), chunk_bytes=60)
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(chunks[0].start, 0)
+        self.assertEqual(chunks[-1].end, len(QUOTED_CSV))
+        records = []
+        for chunk, next_chunk in zip(chunks, chunks[1:] + [None]):
+            if next_chunk:
+                self.assertEqual(chunk.end, next_chunk.start)
+            chunk_records = [fields for _, fields in ingest.iter_records([QUOTED_CSV[chunk.start:chunk.end]])]
+            self.assertEqual(chunk.first_record, len(records))
+            records.extend(chunk_records)
+        self.assertEqual(records[2][2], "Files of up to 10 MB,\nin chat.")
+        self.assertEqual(len(records), 5)
+
+    def test_overlong_line_raises_exception(self):
+        with patch("ingest.MAX_LINE_BYTES", 10):
+            with self.assertRaises(Exception):
+                list(ingest.iter_lines([b"a" * 8, b"b" * 8]))
+
+
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestIngestWithMoto(unittest.TestCase):
+
+    def setUp(self):
+        ingest.get_s3_client.cache_clear()
+        self.addCleanup(ingest.get_s3_client.cache_clear)
+
+    def create_bucket_and_table(self, body):
+        s3 = ingest.get_s3_client()
+        s3.create_bucket(Bucket="prompts-bucket")
+        s3.put_object(Bucket="prompts-bucket", Key="prompt.csv", Body=body)
+        dynamodb = boto3.resource("dynamodb")
+        dynamodb.create_table(TableName="prompts",
+                              KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+                              AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+                              BillingMode="PAY_PER_REQUEST")
+        return dynamodb.Table("prompts")
+
+    @mock_aws
+    def test_ingesting_50k_prompts_takes_2000_calls(self):
+        rows = [f"category{i % 7}|question {i}|truth {i}" for i in range(50_000)]
+        table = self.create_bucket_and_table("\n".join(rows).encode())
+        calls, counting = count_api_calls()
+
+        with counting, patch("ingest.INGEST_MIN_CHUNK_BYTES", 16 * 1024 * 1024):
+            ingest.lambda_handler({"Records": [{"s3": {"bucket": {"name": "prompts-bucket"},
+                                                       "object": {"key": "prompt.csv"}}}]}, None)
+
+        self.assertEqual(calls.count("BatchWriteItem"), 2000)
+        self.assertEqual(calls.count("PutItem"), 0)
+        self.assertEqual(table.get_item(Key={"id": "category3_4990000"})["Item"]["prompt"], "question 49899")
+
+    @mock_aws
+    def test_chunked_ingestion_writes_the_same_items(self):
+        table = self.create_bucket_and_table(QUOTED_CSV[:3] + (QUOTED_CSV[3:] + b"\n") * 20)
+
+        summary = ingest.ingest_object("prompts-bucket", "prompt.csv", "prompts", max_workers=4,
+                                       min_chunk_bytes=500)
+
+        self.assertEqual(summary.records, 100)
+        self.assertEqual(summary.written_items, 60)
+        self.assertEqual(summary.skipped_records, 40)
+        items = {item["id"]: item for item in table.scan()["Items"]}
+        self.assertEqual(len(items), 60)
+        # the ids follow the record position whichever chunk the record landed in
+        self.assertEqual(items["limits_9800"]["ground_truth"], "Files of up to 10 MB,\nin chat.")
+        self.assertEqual(items["pricing_100"]["prompt"], "Is it billed per user | per month?")
+        self.assertEqual(items["apps_10000"]["prompt"], "Which tier runs Q Apps?")
+
+    @mock_aws
+    def test_failed_writes_fail_the_invocation(self):
+        self.create_bucket_and_table(QUOTED_CSV)
+        dynamodb = MagicMock()
+        dynamodb.batch_write_item.return_value = {
+            "UnprocessedItems": {"prompts": [{"PutRequest": {"Item": {"id": "apps_500"}}}]}}
+
+        writer_without_backoff = functools.partial(BufferedBatchWriter, sleep=lambda seconds: None)
+        with patch("ingest.create_dynamodb_resource", return_value=dynamodb), \
+                patch("ingest.BufferedBatchWriter", writer_without_backoff), self.assertRaises(Exception):
+            ingest.lambda_handler({"Records": [{"s3": {"bucket": {"name": "prompts-bucket"},
+                                                       "object": {"key": "prompt.csv"}}}]}, None)
+
+
+def generate_rows(records, changed=()):
+    return "\n".join(f"category{i % 5}|question {i}{' edited' if i in changed else ''}|truth {i}"
+                     for i in range(records)).encode()
+
+
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestIncrementalIngestWithMoto(unittest.TestCase):
+
+    def setUp(self):
+        ingest.get_s3_client.cache_clear()
+        self.addCleanup(ingest.get_s3_client.cache_clear)
+
+    def create_tables(self):
+        dynamodb = boto3.resource("dynamodb")
+        for table_name in ("prompts", "results"):
+            dynamodb.create_table(TableName=table_name,
+                                  KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+                                  AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+                                  BillingMode="PAY_PER_REQUEST")
+        ingest.get_s3_client().create_bucket(Bucket="prompts-bucket")
+        return dynamodb
+
+    def upload_and_ingest(self, body, metadata=None):
+        ingest.get_s3_client().put_object(Bucket="prompts-bucket", Key="prompt.csv", Body=body,
+                                          Metadata=metadata or {})
+        with patch("ingest.RESULTS_TABLE", "results"), patch("ingest.AMAZON_Q_APP_ID", "q-app"):
+            return ingest.ingest_object("prompts-bucket", "prompt.csv", "prompts", max_workers=4,
+                                        min_chunk_bytes=16 * 1024 * 1024)
+
+    def evaluate_all_prompts(self, dynamodb):
+        # what the ragas Lambda stores once the prompts are scored
+        with dynamodb.Table("results").batch_writer() as results:
+            for item in dynamodb.Table("prompts").scan()["Items"]:
+                results.put_item(Item={"id": item["id"], "fingerprint": item["fingerprint"]})
+
+    @mock_aws
+    def test_reupload_with_2_percent_changed_rows_writes_2_percent_of_the_prompts(self):
+        dynamodb = self.create_tables()
+        full_run = self.upload_and_ingest(generate_rows(1000))
+        self.evaluate_all_prompts(dynamodb)
+        calls, counting = count_api_calls()
+
+        with counting:
+            incremental_run = self.upload_and_ingest(generate_rows(1000, changed=range(0, 1000, 50)))
+
+        self.assertEqual(full_run.written_items, 1000)
+        self.assertEqual(incremental_run.written_items, 20)
+        self.assertEqual(incremental_run.unchanged_items, 980)
+        self.assertEqual(calls.count("BatchWriteItem"), 1)
+        self.assertEqual(calls.count("BatchGetItem"), 10)
+        self.assertEqual(dynamodb.Table("prompts").get_item(Key={"id": "category0_5100"})["Item"]["prompt"],
+                         "question 50 edited")
+
+    @mock_aws
+    def test_force_and_invalidated_categories_write_unchanged_prompts(self):
+        dynamodb = self.create_tables()
+        self.upload_and_ingest(generate_rows(100))
+        self.evaluate_all_prompts(dynamodb)
+        first_ingestion_id = dynamodb.Table("prompts").get_item(Key={"id": "category1_200"})["Item"]["ingestion_id"]
+
+        unchanged_run = self.upload_and_ingest(generate_rows(100))
+        invalidated_run = self.upload_and_ingest(generate_rows(100),
+                                                 {"invalidate-categories": "category1, category3"})
+        forced_run = self.upload_and_ingest(generate_rows(100), {"force-reevaluation": "true"})
+
+        self.assertEqual(unchanged_run.written_items, 0)
+        self.assertEqual(invalidated_run.written_items, 40)
+        self.assertEqual(forced_run.written_items, 100)
+        item = dynamodb.Table("prompts").get_item(Key={"id": "category1_200"})["Item"]
+        self.assertTrue(item["force_evaluation"])
+        # a new ingestion id makes the rewrite of an identical prompt reach the table stream
+        self.assertNotEqual(item["ingestion_id"], first_ingestion_id)
+
+
+class CloudFormationLoader(yaml.SafeLoader):
+    """Loads the intrinsic functions, !Ref, !Sub..., as plain values."""
+
+
+def construct_intrinsic_function(loader, tag_suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        return loader.construct_scalar(node)
+    if isinstance(node, yaml.SequenceNode):
+        return loader.construct_sequence(node)
+    return loader.construct_mapping(node)
+
+
+CloudFormationLoader.add_multi_constructor("!", construct_intrinsic_function)
+
+
+class TestPromptsStream(unittest.TestCase):
+
+    def setUp(self):
+        with open(EXEC_PROMPTS_TEMPLATE) as template:
+            self.resources = yaml.load(template, Loader=CloudFormationLoader)["Resources"]
+
+    def test_rewritten_prompts_reach_the_queue(self):
+        # ingest.py writes changed and forced prompts again under the same id, a MODIFY event
+        stream_filter = self.resources["DynamoDBStreamToSQSMapping"]["Properties"]["FilterCriteria"]["Filters"][0]
+        self.assertEqual(sorted(json.loads(stream_filter["Pattern"])["eventName"]), ["INSERT", "MODIFY"])
+
+        forwarder = {}
+        with patch.dict(os.environ, {"SQS_QUEUE_URL": "queue-url"}), patch("boto3.client") as sqs_client:
+            exec(self.resources["DynamoDBToSQSFunction"]["Properties"]["Code"]["ZipFile"], forwarder)
+            forwarder["lambda_handler"]({"Records": [{"eventName": event_name,
+                                                      "dynamodb": {"NewImage": {"id": {"S": event_name}}}}
+                                                     for event_name in ("INSERT", "MODIFY", "REMOVE")]}, None)
+
+        self.assertEqual([json.loads(call[1]["MessageBody"])["id"]["S"]
+                          for call in sqs_client.return_value.send_message.call_args_list], ["INSERT", "MODIFY"])
+
+
+class TestIngestMemory(unittest.TestCase):
+
+    def test_peak_rss_does_not_depend_on_file_size(self):
+        with tempfile.TemporaryDirectory() as directory:
+            small_path = os.path.join(directory, "small.csv")
+            large_path = os.path.join(directory, "large.csv")
+            generate_prompts(small_path, 50_000)
+            generate_prompts(large_path, 500_000)
+            file_growth_kb = (os.path.getsize(large_path) - os.path.getsize(small_path)) // 1024
+
+            small = run_in_subprocess(small_path)
+            large = run_in_subprocess(large_path)
+
+        self.assertEqual(small["written_items"], 50_000)
+        self.assertEqual(large["written_items"], 500_000)
+        # the file grows by about 13 MB, reading it whole would grow the peak RSS by several times that
+        self.assertLess(large["peak_rss_kb"] - small["peak_rss_kb"], file_growth_kb // 4)
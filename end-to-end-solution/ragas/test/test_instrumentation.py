@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+import index
+from batch_writer import BufferedBatchWriter
+from instrumentation import Instrumentation, instrument_client, instrumentation
+from retry_policy import Deadline, RetryPolicy
+
+AWS_ENVIRONMENT = {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                   "AWS_SECRET_ACCESS_KEY": "testing"}
+THROTTLING_ERROR = ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "chat_sync")
+
+
+def get_stage(stages, name):
+    return next(stage for stage in stages if stage["stage"] == name)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        instrumentation.reset()
+
+    def test_spans_count_errors_throttles_and_retries(self):
+        local_instrumentation = Instrumentation()
+        with local_instrumentation.span("QuestionAnswer") as counters:
+            counters["retries"] += 2
+        with self.assertRaises(ClientError):
+            with local_instrumentation.span("QuestionAnswer"):
+                raise THROTTLING_ERROR
+
+        stage = get_stage(local_instrumentation.snapshot(), "QuestionAnswer")
+        self.assertEqual((stage["count"], stage["errors"], stage["throttles"], stage["retries"]), (2, 1, 1, 2))
+
+    def test_question_answer_reports_the_retries_of_the_q_call(self):
+        qclient = MagicMock()
+        qclient.chat_sync.side_effect = [THROTTLING_ERROR, THROTTLING_ERROR, {"systemMessage": "Q is an AWS service"}]
+        retry_policy = RetryPolicy(Deadline(), sleep=lambda seconds: None)
+
+        index.get_answer_with_retries("what is Q?", qclient, retry_policy)
+
+        stage = get_stage(instrumentation.snapshot(), "QuestionAnswer")
+        self.assertEqual((stage["count"], stage["errors"], stage["throttles"], stage["retries"]), (1, 0, 2, 2))
+
+    @mock_aws
+    @patch.dict(os.environ, AWS_ENVIRONMENT)
+    def test_batch_writer_flushes_and_their_calls_are_recorded(self):
+        dynamodb = boto3.resource("dynamodb")
+        dynamodb.create_table(TableName="results", KeySchema=[{"AttributeName": "id", "KeyType": "HASH"}],
+                              AttributeDefinitions=[{"AttributeName": "id", "AttributeType": "S"}],
+                              BillingMode="PAY_PER_REQUEST")
+        instrument_client(dynamodb.meta.client)
+
+        with BufferedBatchWriter(dynamodb, "results") as writer:
+            for i in range(30):
+                writer.put({"id": f"item-{i}"})
+
+        stages = instrumentation.snapshot()
+        flush_stage = get_stage(stages, "BatchWriterFlush")
+        self.assertEqual((flush_stage["count"], flush_stage["retries"]), (2, 0))
+        self.assertEqual(flush_stage["dimensions"], {"Table": "results"})
+        self.assertEqual(get_stage(stages, "dynamodb.BatchWriteItem")["count"], 2)
+
+    def test_every_sqs_batch_is_flushed_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            location = os.path.join(directory, "stages.jsonl")
+            with patch("index.INSTRUMENTATION_LOCATION", location), \
+                    patch("index.authenticate_q_user", return_value=(None, (401, "Authentication failed."))):
+                response = index.lambda_handler({"Records": [{"messageId": "message1"}]}, None)
+                index.lambda_handler({"Records": [{"messageId": "message2"}]}, None)
+            with open(location) as f:
+                flushes = [json.loads(line) for line in f]
+
+        self.assertEqual(response["batchItemFailures"], [{"itemIdentifier": "message1"}])
+        self.assertEqual(len(flushes), 2)
+        self.assertEqual([stage["stage"] for stage in flushes[1]["stages"]], ["Authenticate", "Invocation"])
+        self.assertEqual(get_stage(flushes[1]["stages"], "Invocation")["count"], 1)
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import unittest
+
+from rate_limiter import BedrockRateLimiter, InMemoryCounterStore, is_throttling_error
+from .fakes import FakeClock
+
+
+def create_rate_limiter(clock, requests_per_minute=60, tokens_per_minute=6000, counter_store=None):
+    return BedrockRateLimiter(requests_per_minute, tokens_per_minute, counter_store,
+                              clock=clock, wall_clock=clock, sleep=clock.sleep)
+
+
+class TestBedrockRateLimiter(unittest.TestCase):
+    def test_requests_start_immediately_up_to_the_burst(self):
+        clock = FakeClock()
+        rate_limiter = create_rate_limiter(clock)
+
+        for _ in range(10):
+            self.assertEqual(rate_limiter.try_acquire(requests=1, tokens=10), 0.0)
+        self.assertAlmostEqual(rate_limiter.try_acquire(requests=1, tokens=10), 1.0)
+
+        rate_limiter.acquire(requests=1, tokens=10)
+        self.assertAlmostEqual(clock.now, 1.0)
+
+    def test_token_limit_paces_large_prompts(self):
+        clock = FakeClock()
+        rate_limiter = create_rate_limiter(clock)
+
+        # 6000 tokens per minute is 100 tokens per second with a 1000 tokens burst
+        rate_limiter.acquire(requests=1, tokens=800)
+        rate_limiter.acquire(requests=1, tokens=800)
+        self.assertAlmostEqual(clock.now, 6.0)
+
+        # prompts larger than the burst wait for a full bucket
+        rate_limiter.acquire(requests=1, tokens=3000)
+        self.assertAlmostEqual(clock.now, 16.0)
+        self.assertGreater(rate_limiter.try_acquire(requests=1, tokens=100), 20.0)
+
+    def test_throttles_lower_the_rate_and_successes_restore_it(self):
+        clock = FakeClock()
+        rate_limiter = create_rate_limiter(clock)
+
+        rate_limiter.on_throttle()
+        rate_limiter.on_throttle()
+        self.assertAlmostEqual(rate_limiter.rate_fraction, 0.25)
+        self.assertAlmostEqual(rate_limiter.requests.rate_per_second, 0.25)
+        for _ in range(10):
+            rate_limiter.on_throttle()
+        self.assertAlmostEqual(rate_limiter.rate_fraction, rate_limiter.min_rate_fraction)
+
+        for _ in range(100):
+            rate_limiter.on_success()
+        self.assertEqual(rate_limiter.rate_fraction, 1.0)
+
+    def test_settled_usage_corrects_the_token_estimate(self):
+        clock = FakeClock()
+        rate_limiter = create_rate_limiter(clock)
+
+        rate_limiter.acquire(requests=1, tokens=100)
+        rate_limiter.settle_tokens(estimated_tokens=100, actual_tokens=1000)
+        self.assertAlmostEqual(rate_limiter.try_acquire(requests=1, tokens=100), 1.0)
+
+    def test_concurrent_lambdas_share_the_window_limits(self):
+        clock = FakeClock(now=120.0)
+        counter_store = InMemoryCounterStore()
+        first_lambda = create_rate_limiter(clock, requests_per_minute=12, counter_store=counter_store)
+        second_lambda = create_rate_limiter(clock, requests_per_minute=12, counter_store=counter_store)
+
+        # both lambdas have a local burst of 2 requests, the window allows 12 requests in total
+        granted = 0
+        while clock.now < 150.0:
+            for rate_limiter in (first_lambda, second_lambda):
+                if rate_limiter.try_acquire(requests=1, tokens=1) == 0.0:
+                    granted += 1
+            clock.now += 1.0
+        self.assertEqual(granted, 12)
+        self.assertAlmostEqual(first_lambda.try_acquire(requests=1, tokens=1), 30.0)
+
+        clock.now = 180.0
+        self.assertEqual(second_lambda.try_acquire(requests=1, tokens=1), 0.0)
+
+    def test_denied_claims_do_not_use_up_the_window(self):
+        clock = FakeClock(now=120.0)
+        counter_store = InMemoryCounterStore()
+        # other lambdas already used 5500 of the 6000 tokens of the window
+        counter_store.increment("bedrock-2", 0, 5500, expires_at=240)
+        large_prompts_lambda = create_rate_limiter(clock, counter_store=counter_store)
+        small_prompts_lambda = create_rate_limiter(clock, counter_store=counter_store)
+
+        for _ in range(5):
+            self.assertAlmostEqual(large_prompts_lambda.try_acquire(requests=1, tokens=800), 60.0)
+
+        self.assertEqual(small_prompts_lambda.try_acquire(requests=1, tokens=400), 0.0)
+        self.assertEqual(counter_store.increment("bedrock-2", 0, 0, expires_at=240), (1, 5900))
+
+    def test_async_acquire_waits_without_blocking(self):
+        clock = FakeClock()
+        rate_limiter = create_rate_limiter(clock, requests_per_minute=600)
+        rate_limiter.try_acquire(requests=100, tokens=0)
+
+        async def acquire():
+            clock.now += 0.1
+            await rate_limiter.acquire_async(requests=1, tokens=0)
+
+        asyncio.run(acquire())
+        self.assertAlmostEqual(rate_limiter.requests.available, 0.0)
+
+    def test_settled_usage_corrects_the_shared_window(self):
+        clock = FakeClock(now=120.0)
+        counter_store = InMemoryCounterStore()
+        rate_limiter = create_rate_limiter(clock, counter_store=counter_store)
+
+        window = rate_limiter.acquire(requests=1, tokens=500)
+        rate_limiter.settle_tokens(estimated_tokens=500, actual_tokens=200, window=window)
+        self.assertEqual(counter_store.increment("bedrock-2", 0, 0, expires_at=240), (1, 200))
+
+        # once the window closed an over-estimate is left alone, an under-estimate counts in the current window
+        window = rate_limiter.acquire(requests=1, tokens=500)
+        clock.now = 180.0
+        rate_limiter.settle_tokens(estimated_tokens=500, actual_tokens=100, window=window)
+        rate_limiter.settle_tokens(estimated_tokens=100, actual_tokens=400, window=window)
+        self.assertEqual(counter_store.increment("bedrock-2", 0, 0, expires_at=240), (2, 700))
+        self.assertEqual(counter_store.increment("bedrock-3", 0, 0, expires_at=300), (0, 300))
+
+    def test_async_acquire_claims_the_shared_window_off_the_event_loop(self):
+        claim_threads = []
+
+        class ThreadRecordingCounterStore(InMemoryCounterStore):
+            def increment(self, key, requests, tokens, expires_at):
+                claim_threads.append(threading.get_ident())
+                return super().increment(key, requests, tokens, expires_at)
+
+        clock = FakeClock(now=120.0)
+        rate_limiter = create_rate_limiter(clock, counter_store=ThreadRecordingCounterStore())
+
+        async def acquire_and_settle():
+            window = await rate_limiter.acquire_async(requests=1, tokens=100)
+            await rate_limiter.settle_tokens_async(estimated_tokens=100, actual_tokens=50, window=window)
+            return threading.get_ident()
+
+        event_loop_thread = asyncio.run(acquire_and_settle())
+        self.assertEqual(len(claim_threads), 2)
+        self.assertNotIn(event_loop_thread, claim_threads)
+
+    def test_throttling_errors_are_recognized(self):
+        self.assertTrue(is_throttling_error(ValueError("Error raised by bedrock service: ThrottlingException")))
+        self.assertFalse(is_throttling_error(ValueError("ValidationException: bad prompt")))
@@ -0,0 +1,64 @@
+import os
+import unittest
+from unittest.mock import patch
+
+import boto3
+import pyarrow as pa
+from moto import mock_aws
+
+from results_sink import get_category, read_results, write_results
+
+AWS_ENVIRONMENT = {"AWS_DEFAULT_REGION": "us-east-1", "AWS_ACCESS_KEY_ID": "testing",
+                   "AWS_SECRET_ACCESS_KEY": "testing"}
+LOCATION = "s3://ragas-bucket/q-evaluation-results"
+
+
+def create_batch(item_ids, run_id="ingestion1"):
+    items = [{"item_id": item_id, "run_id": run_id} for item_id in item_ids]
+    rows = [{"question": f"question {i}", "answer": "Q is an AWS service", "ground_truth": "Q is an AWS service",
+             "contexts": ["Q is an AWS service"], "answer_relevancy": 0.9, "faithfulness": float("nan"),
+             "context_recall": 1.0, "context_precision": 0.5} for i in range(len(item_ids))]
+    return items, rows
+
+
+@mock_aws
+@patch.dict(os.environ, AWS_ENVIRONMENT)
+class TestResultsSink(unittest.TestCase):
+
+    def setUp(self):
+        self.s3_client = boto3.client("s3")
+        self.s3_client.create_bucket(Bucket="ragas-bucket")
+
+    def test_results_are_partitioned_by_application_run_and_category(self):
+        items, rows = create_batch(["billing_100", "index_200", "billing_300"])
+
+        keys = write_results(self.s3_client, LOCATION, "app1", items, rows, "part-request1.parquet")
+
+        self.assertEqual(keys, ["q-evaluation-results/application_id=app1/run_id=ingestion1/category=billing/"
+                                + "part-request1.parquet",
+                                "q-evaluation-results/application_id=app1/run_id=ingestion1/category=index/"
+                                + "part-request1.parquet"])
+        results = read_results(self.s3_client, LOCATION)
+        self.assertEqual(results.num_rows, 3)
+        self.assertEqual(results.schema.field("context_recall").type, pa.float64())
+        self.assertTrue(pa.types.is_dictionary(results.schema.field("answer").type))
+        self.assertEqual(results.column("faithfulness").null_count, 3)
+
+    def test_batches_of_a_run_add_up_and_only_requested_columns_are_read(self):
+        write_results(self.s3_client, LOCATION, "app1", *create_batch(["billing_100", "index_200"]), "part-a.parquet")
+        write_results(self.s3_client, LOCATION, "app1", *create_batch(["billing_300"]), "part-b.parquet")
+        write_results(self.s3_client, LOCATION, "app1", *create_batch(["billing_100"], "ingestion2"),
+                      "part-c.parquet")
+
+        results = read_results(self.s3_client, LOCATION, columns=["id", "context_precision"],
+                               filters={"run_id": ["ingestion1"], "category": ["billing"]})
+
+        self.assertEqual(results.column_names, ["id", "context_precision"])
+        self.assertEqual(sorted(results.column("id").to_pylist()), ["billing_100", "billing_300"])
+        with self.assertRaises(ValueError):
+            read_results(self.s3_client, LOCATION, filters={"answer": ["Q is an AWS service"]})
+
+    def test_category_comes_from_the_prompt_id(self):
+        self.assertEqual(get_category("subscription_100"), "subscription")
+        self.assertEqual(get_category("file_size_200"), "file_size")
+        self.assertEqual(get_category("42"), "uncategorized")
@@ -0,0 +1,88 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
+import index
+from retry_policy import Deadline, DeadlineExceeded, RetryPolicy, is_retryable_error
+from .fakes import FakeClock
+
+THROTTLING_ERROR = ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "chat_sync")
+VALIDATION_ERROR = ClientError({"Error": {"Code": "ValidationException", "Message": "bad request"}}, "chat_sync")
+
+
+class FakeContext:
+    def __init__(self, clock, timeout_seconds):
+        self.clock = clock
+        self.expires_at = clock() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self.expires_at - self.clock()) * 1000)
+
+
+def create_retry_policy(clock, timeout_seconds, **kwargs):
+    deadline = Deadline(FakeContext(clock, timeout_seconds), safety_margin_seconds=30, clock=clock)
+    # the largest delay of every attempt, so the tests are deterministic
+    return RetryPolicy(deadline, sleep=clock.sleep, random_uniform=lambda low, high: high, **kwargs)
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_throttling_errors_are_retried_with_exponential_backoff(self):
+        clock = FakeClock()
+        fn = MagicMock(side_effect=[THROTTLING_ERROR, THROTTLING_ERROR, THROTTLING_ERROR, "answer"])
+
+        result = create_retry_policy(clock, 900).call(fn, "prompt")
+
+        self.assertEqual(result, "answer")
+        self.assertEqual(fn.call_count, 4)
+        self.assertEqual(clock.now, 2 + 4 + 8)
+
+    def test_non_retryable_errors_are_raised_immediately(self):
+        clock = FakeClock()
+        fn = MagicMock(side_effect=VALIDATION_ERROR)
+
+        with self.assertRaises(ClientError):
+            create_retry_policy(clock, 900).call(fn)
+        self.assertEqual(fn.call_count, 1)
+        self.assertEqual(clock.now, 0)
+
+    def test_retries_never_sleep_past_the_deadline(self):
+        clock = FakeClock()
+        fn = MagicMock(side_effect=THROTTLING_ERROR)
+
+        with self.assertRaises(DeadlineExceeded):
+            create_retry_policy(clock, 120, max_attempts=20, max_delay_seconds=60).call(fn)
+        # 120s timeout minus the 30s safety margin leaves 90s for 2 + 4 + 8 + 16 + 32 seconds of backoff
+        self.assertEqual(clock.now, 62)
+        self.assertLessEqual(clock.now, 90)
+
+    def test_attempts_are_bounded(self):
+        clock = FakeClock()
+        fn = MagicMock(side_effect=THROTTLING_ERROR)
+
+        with self.assertRaises(ClientError):
+            create_retry_policy(clock, 900, max_attempts=3).call(fn)
+        self.assertEqual(fn.call_count, 3)
+
+    def test_transient_errors_are_recognized(self):
+        self.assertTrue(is_retryable_error(THROTTLING_ERROR))
+        self.assertTrue(is_retryable_error(ValueError("Error raised by bedrock service: ModelTimeoutException")))
+        self.assertFalse(is_retryable_error(VALIDATION_ERROR))
+        self.assertFalse(is_retryable_error(KeyError("systemMessage")))
+
+    def test_deadline_without_context_never_expires(self):
+        self.assertTrue(Deadline(None).has_time_for(10_000))
+
+
+class TestReleaseMessages(unittest.TestCase):
+    @patch("index.get_default_client")
+    def test_out_of_time_messages_are_handed_back_to_the_queue(self, get_default_client_mock):
+        sqs_client = get_default_client_mock.return_value
+        items = [{"message_id": "message-1", "item_id": "item-1", "receipt_handle": "handle-1",
+                  "event_source_arn": "arn:aws:sqs:us-east-1:111111111111:DynamoDBEventsQueue"}]
+
+        self.assertEqual(index.release_messages(items), ["message-1"])
+        sqs_client.change_message_visibility.assert_called_once_with(
+            QueueUrl="https://sqs.us-east-1.amazonaws.com/111111111111/DynamoDBEventsQueue",
+            ReceiptHandle="handle-1",
+            VisibilityTimeout=index.RELEASE_VISIBILITY_TIMEOUT_SECONDS)